@@ -1,14 +1,44 @@
-from flask import Flask, render_template, redirect, url_for, request, flash, session, jsonify
+from flask import Flask, render_template, redirect, url_for, request, flash, session, jsonify, make_response, Response, send_file, abort, g, has_request_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.security import generate_password_hash, check_password_hash, safe_join
+from werkzeug.wsgi import ClosingIterator
 from datetime import datetime, timedelta, date
 import os
 import json
-from sqlalchemy.exc import OperationalError
+import time
+import uuid
+import threading
+import socket
+import hashlib
+import io
+import zipfile
+import zlib
+import gzip
+import shutil
+import mimetypes
+import random
+import cProfile
+import pstats
+import tracemalloc
+import glob
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from collections import OrderedDict, namedtuple
+from functools import wraps
+from sqlalchemy import text, inspect, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.schema import CreateTable
+from sqlalchemy.exc import OperationalError, IntegrityError
 from dotenv import load_dotenv
 import sys
 import logging
+import click
+
+try:
+    import brotli  # Opcional: variantes .br de los archivos estáticos
+except ImportError:
+    brotli = None
 
 # Configurar logging detallado
 logging.basicConfig(
@@ -58,6 +88,297 @@ login_manager.login_view = 'login'
 def health():
     return {'status': 'ok'}, 200
 
+# =========================
+# ARCHIVOS ESTÁTICOS (huellas y compresión)
+# =========================
+
+# `flask --app app assets` copia cada .css/.js de static/ a static/dist/ con el
+# hash del contenido en el nombre, más variantes .gz y .br ya comprimidas.
+ASSETS_DIR = os.path.join(app.static_folder, 'dist')
+ASSETS_EXTENSIONES = ('.css', '.js')
+ASSETS_CACHE_SEGUNDOS = 365 * 24 * 3600
+
+_manifiesto_assets = None
+
+
+def construir_assets():
+    """Genera static/dist/ y su manifest.json; devuelve el manifiesto {original: con_huella}"""
+    if os.path.isdir(ASSETS_DIR):
+        shutil.rmtree(ASSETS_DIR)
+    manifiesto = {}
+    for raiz, carpetas, archivos in os.walk(app.static_folder):
+        carpetas[:] = [c for c in carpetas if os.path.join(raiz, c) != ASSETS_DIR]
+        for nombre in sorted(archivos):
+            if not nombre.endswith(ASSETS_EXTENSIONES):
+                continue
+            origen = os.path.join(raiz, nombre)
+            relativo = os.path.relpath(origen, app.static_folder).replace(os.sep, '/')
+            with open(origen, 'rb') as archivo:
+                contenido = archivo.read()
+            base, extension = os.path.splitext(relativo)
+            destino = f"{base}.{hashlib.sha256(contenido).hexdigest()[:12]}{extension}"
+            ruta = os.path.join(ASSETS_DIR, destino)
+            os.makedirs(os.path.dirname(ruta), exist_ok=True)
+            with open(ruta, 'wb') as archivo:
+                archivo.write(contenido)
+            with open(ruta + '.gz', 'wb') as archivo:
+                archivo.write(gzip.compress(contenido, compresslevel=9, mtime=0))
+            if brotli is not None:
+                with open(ruta + '.br', 'wb') as archivo:
+                    archivo.write(brotli.compress(contenido, quality=11))
+            manifiesto[relativo] = destino
+    with open(os.path.join(ASSETS_DIR, 'manifest.json'), 'w') as archivo:
+        json.dump(manifiesto, archivo, indent=2, sort_keys=True)
+    return manifiesto
+
+
+def _cargar_manifiesto_assets():
+    global _manifiesto_assets
+    if _manifiesto_assets is None:
+        try:
+            with open(os.path.join(ASSETS_DIR, 'manifest.json')) as archivo:
+                _manifiesto_assets = json.load(archivo)
+        except (OSError, ValueError):
+            _manifiesto_assets = {}
+    return _manifiesto_assets
+
+
+def asset_url(nombre):
+    """
+    URL del archivo estático con huella si ya se construyó (caché inmutable);
+    si no (desarrollo, o sin `flask assets`), la ruta normal de static.
+    """
+    if not app.debug:
+        destino = _cargar_manifiesto_assets().get(nombre)
+        if destino:
+            return url_for('servir_asset', nombre=destino)
+    return url_for('static', filename=nombre)
+
+
+@app.context_processor
+def inyectar_asset_url():
+    # En templates: <link rel="stylesheet" href="{{ asset_url('css/styles.css') }}">
+    return {'asset_url': asset_url}
+
+
+@app.route('/static/dist/<path:nombre>')
+def servir_asset(nombre):
+    """
+    RAZÓN: El nombre cambia con el contenido, así que el navegador puede
+    guardarlo un año sin revalidar. Se entrega la variante brotli o gzip
+    precomprimida según Accept-Encoding.
+    """
+    ruta = safe_join(ASSETS_DIR, nombre)
+    if ruta is None or not os.path.isfile(ruta):
+        abort(404)
+
+    mimetype = mimetypes.guess_type(ruta)[0] or 'application/octet-stream'
+    sufijos = {'br': '.br', 'gzip': '.gz'}
+    codificacion = codificacion_preferida([c for c, sufijo in sufijos.items() if os.path.isfile(ruta + sufijo)])
+    if codificacion:
+        respuesta = send_file(ruta + sufijos[codificacion], mimetype=mimetype, max_age=ASSETS_CACHE_SEGUNDOS,
+                              etag=f"{os.path.basename(nombre)}-{codificacion}")
+        respuesta.headers['Content-Encoding'] = codificacion
+    else:
+        respuesta = send_file(ruta, mimetype=mimetype, max_age=ASSETS_CACHE_SEGUNDOS,
+                              etag=os.path.basename(nombre))
+    respuesta.vary.add('Accept-Encoding')
+    respuesta.cache_control.immutable = True
+    return respuesta
+
+
+@app.cli.command("assets")
+def comando_assets():
+    """Construye static/dist/ (huellas + gzip/brotli) para producción."""
+    manifiesto = construir_assets()
+    print(f"✅ {len(manifiesto)} archivos estáticos en {ASSETS_DIR}"
+          f"{'' if brotli is not None else ' (sin brotli: instalar Brotli)'}")
+
+
+# =========================
+# COMPRESIÓN Y GET CONDICIONAL
+# =========================
+
+# Respuestas más pequeñas no se comprimen (el encabezado cuesta más que lo que se ahorra)
+COMPRESION_MIN_BYTES = int(os.environ.get('COMPRESION_MIN_BYTES', 500))
+COMPRESION_TIPOS = ('text/html', 'text/css', 'text/plain', 'text/csv', 'application/json',
+                    'application/javascript', 'text/javascript', 'image/svg+xml')
+
+
+def sin_compresion(f):
+    """
+    Excluye una vista de la compresión y del ETag automático (descargas en
+    streaming o respuestas que se envían por partes).
+    """
+    f.sin_compresion = True
+    return f
+
+
+def codificacion_preferida(disponibles):
+    """
+    La codificación de `disponibles` con mayor q en Accept-Encoding, o None.
+    q=0 significa "no aceptable" (p. ej. `br;q=0, gzip`); con q iguales gana
+    la primera de `disponibles`. Cuenta el comodín `*` igual que werkzeug.
+    """
+    mejor, calidad_mejor = None, 0
+    for codificacion in disponibles:
+        calidad = request.accept_encodings[codificacion]
+        if calidad > calidad_mejor:
+            mejor, calidad_mejor = codificacion, calidad
+    return mejor
+
+
+@app.after_request
+def comprimir_y_etag(respuesta):
+    """
+    RAZÓN: El Wi-Fi del local es lento y las vistas de cocina/domicilios se
+    consultan cada pocos segundos. A los GET se les calcula un ETag débil
+    sobre el cuerpo y si el cliente ya lo tiene se responde 304 sin cuerpo;
+    lo demás se comprime con brotli o gzip según Accept-Encoding.
+    """
+    vista = app.view_functions.get(request.endpoint)
+    if (getattr(vista, 'sin_compresion', False)
+            or respuesta.direct_passthrough or respuesta.is_streamed
+            or respuesta.status_code != 200
+            or 'Content-Encoding' in respuesta.headers):
+        return respuesta
+
+    if request.method in ('GET', 'HEAD'):
+        if not respuesta.get_etag()[0]:
+            respuesta.add_etag(weak=True)
+        respuesta.make_conditional(request)
+        if respuesta.status_code == 304:
+            return respuesta
+
+    if respuesta.mimetype not in COMPRESION_TIPOS:
+        return respuesta
+    respuesta.vary.add('Accept-Encoding')
+    cuerpo = respuesta.get_data()
+    if len(cuerpo) < COMPRESION_MIN_BYTES:
+        return respuesta
+
+    codificacion = codificacion_preferida(('br', 'gzip') if brotli is not None else ('gzip',))
+    if codificacion == 'br':
+        respuesta.set_data(brotli.compress(cuerpo, quality=5))
+        respuesta.headers['Content-Encoding'] = 'br'
+    elif codificacion == 'gzip':
+        respuesta.set_data(gzip.compress(cuerpo, compresslevel=6))
+        respuesta.headers['Content-Encoding'] = 'gzip'
+    return respuesta
+
+
+# =========================
+# GRABACIÓN DE TRÁFICO (opcional)
+# =========================
+
+# Con GRABAR_TRAFICO=1 cada worker escribe una línea JSON por solicitud (ver reproducir_trafico.py)
+GRABAR_TRAFICO = os.environ.get('GRABAR_TRAFICO') == '1'
+TRAFICO_DIR = os.environ.get('TRAFICO_DIR', os.path.join(app.instance_path, 'trafico'))
+TRAFICO_MAX_BYTES = int(os.environ.get('TRAFICO_MAX_MB', 50)) * 1024 * 1024
+TRAFICO_DIAS = int(os.environ.get('TRAFICO_DIAS', 7))  # Días de trazas que se conservan
+# Campos que se guardan enmascarados (datos de clientes) y que no se guardan nunca
+CAMPOS_SENSIBLES = ('cliente', 'telefono', 'direccion', 'documento', 'nit', 'email', 'referencias', 'notas')
+CAMPOS_OMITIDOS = ('username', 'password', 'idempotency_key')
+
+
+def anonimizar_campos(campos):
+    """Copia de los campos de query/formulario sin claves ni datos personales"""
+    resultado = {}
+    for nombre, valor in campos.items():
+        if any(omitido in nombre for omitido in CAMPOS_OMITIDOS):
+            continue
+        resultado[nombre] = '***' if valor and any(s in nombre for s in CAMPOS_SENSIBLES) else valor
+    return resultado
+
+
+class GrabadorTrafico:
+    """
+    RAZÓN: Middleware WSGI que guarda una traza por solicitud (ruta, parámetros
+    anonimizados, rol, código y duración hasta cerrar la respuesta) en archivos
+    JSONL por día y por worker, rotados por tamaño. Así los benchmarks pueden
+    reproducir un día real en lugar de una mezcla inventada.
+    La traza la arma el after_request de Flask (que conoce la ruta y el usuario);
+    el middleware solo le agrega el tiempo y la escribe.
+    """
+
+    def __init__(self, wsgi_app, carpeta, max_bytes, dias):
+        self.wsgi_app = wsgi_app
+        self.carpeta = carpeta
+        self.max_bytes = max_bytes
+        self.dias = dias
+        self.candado = threading.Lock()
+        self.archivo = None
+        self.dia = None
+
+    def __call__(self, environ, start_response):
+        momento, inicio = time.time(), time.perf_counter()
+        estado = {}
+
+        def start(status, headers, exc_info=None):
+            estado['codigo'] = int(status.split(' ', 1)[0])
+            return start_response(status, headers, exc_info)
+
+        return ClosingIterator(self.wsgi_app(environ, start), lambda: self.registrar(
+            environ, estado.get('codigo'), momento, time.perf_counter() - inicio))
+
+    def registrar(self, environ, codigo, momento, duracion):
+        traza = environ.get('restaurante.traza')
+        if traza is None:  # Estáticos, 404 sin ruta o errores sin respuesta
+            return
+        traza.update(t=round(momento, 3), ms=round(duracion * 1000, 2), estado=codigo)
+        linea = json.dumps(traza, ensure_ascii=False) + '\n'
+        try:
+            with self.candado:
+                archivo = self._archivo_actual()
+                archivo.write(linea)
+                archivo.flush()
+        except OSError as e:
+            logger.warning(f"No se pudo guardar la traza de tráfico: {e}")
+
+    def _archivo_actual(self):
+        dia = datetime.now().strftime('%Y%m%d')
+        if self.archivo is not None and self.dia == dia and self.archivo.tell() < self.max_bytes:
+            return self.archivo
+        if self.archivo is not None:
+            self.archivo.close()
+        os.makedirs(self.carpeta, exist_ok=True)
+        if self.dia != dia:
+            self._borrar_antiguos()
+        self.dia = dia
+        parte = 0
+        while True:
+            ruta = os.path.join(self.carpeta, f"trafico_{dia}_{os.getpid()}_{parte:03d}.jsonl")
+            if not os.path.exists(ruta) or os.path.getsize(ruta) < self.max_bytes:
+                break
+            parte += 1
+        self.archivo = open(ruta, 'a', encoding='utf-8')
+        return self.archivo
+
+    def _borrar_antiguos(self):
+        limite = (datetime.now() - timedelta(days=self.dias)).strftime('%Y%m%d')
+        for nombre in os.listdir(self.carpeta):
+            if nombre.startswith('trafico_') and nombre[8:16] < limite:
+                os.remove(os.path.join(self.carpeta, nombre))
+
+
+if GRABAR_TRAFICO:
+    @app.after_request
+    def preparar_traza(respuesta):
+        """Deja en el environ lo que el GrabadorTrafico escribe al cerrar la respuesta"""
+        if request.endpoint and request.endpoint not in ('static', 'servir_asset'):
+            request.environ['restaurante.traza'] = {
+                'metodo': request.method,
+                'ruta': request.path,
+                'endpoint': request.endpoint,
+                'args': anonimizar_campos(request.args),
+                'form': anonimizar_campos(request.form) if request.method == 'POST' else {},
+                'rol': current_user.rol if current_user.is_authenticated else None,
+            }
+        return respuesta
+
+    app.wsgi_app = GrabadorTrafico(app.wsgi_app, TRAFICO_DIR, TRAFICO_MAX_BYTES, TRAFICO_DIAS)
+
+
 # =========================
 # MODELOS
 # =========================
@@ -89,12 +410,24 @@ class Sesion(db.Model):
     total = db.Column(db.Float, default=0)  # NUEVO CAMPO para guardar el total
     activa = db.Column(db.Boolean, default=True)
     
+    # Totales acumulados de los pedidos (se actualizan en cada pedido/pago, ver recalcular_totales_sesion)
+    subtotal = db.Column(db.Float, default=0)
+    pagado = db.Column(db.Float, default=0)
+    pendiente = db.Column(db.Float, default=0)
+    
     mesa = db.relationship('Mesa', backref='sesiones')
     pedidos = db.relationship('Pedido', backref='sesion', lazy='select')
 
+    # Una sola sesión activa por mesa (índice único parcial en SQLite y Postgres)
+    __table_args__ = (
+        db.Index('uq_sesion_activa_por_mesa', 'mesa_id', unique=True,
+                 sqlite_where=text('activa = 1'),
+                 postgresql_where=text('activa = true')),
+    )
+
 class Pedido(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    fecha = db.Column(db.DateTime, default=datetime.now)
+    fecha = db.Column(db.DateTime, default=datetime.now, index=True)
     mesa_id = db.Column(db.Integer, db.ForeignKey('mesa.id'), nullable=False)
     sesion_id = db.Column(db.Integer, db.ForeignKey('sesion.id'), nullable=True)
     mesero_id = db.Column(db.Integer, db.ForeignKey('usuario.id'), nullable=False)
@@ -104,6 +437,8 @@ class Pedido(db.Model):
     notas = db.Column(db.Text)
     estado = db.Column(db.String(20), default='pendiente')  # pendiente, preparando, listo, entregado
     pagado = db.Column(db.Boolean, default=False)
+    # Factura que cobró este pedido cuando la cuenta se divide por pedidos (NULL si se facturó la sesión completa)
+    factura_id = db.Column(db.Integer, db.ForeignKey('factura.id'), nullable=True)
     # Timestamp cuando se actualizó el estado por última vez
     estado_actualizado = db.Column(db.DateTime, default=datetime.now)
     
@@ -135,9 +470,75 @@ class ItemMenu(db.Model):
 
 
 
+# =========================
+# CACHÉ DE USUARIOS (load_user)
+# =========================
+
+# Segundos que un worker reutiliza el usuario cargado antes de volver a la BD
+USUARIO_CACHE_TTL = int(os.environ.get('USUARIO_CACHE_TTL', 60))
+USUARIO_CACHE_MAX = 256
+
+
+class UsuarioSesion(UserMixin):
+    """
+    RAZÓN: Copia liviana y desconectada de la sesión de SQLAlchemy del usuario
+    autenticado. Solo lleva lo que usan las vistas (id, username, nombre, rol),
+    así que se puede compartir entre solicitudes del mismo worker.
+    """
+    __slots__ = ('id', 'username', 'nombre', 'rol')
+
+    def __init__(self, id, username, nombre, rol):
+        self.id = id
+        self.username = username
+        self.nombre = nombre
+        self.rol = rol
+
+
+_usuarios_cache = OrderedDict()  # user_id -> (expira, UsuarioSesion)
+_usuarios_cache_lock = threading.Lock()
+
+
+def invalidar_usuario_cache(user_id=None):
+    """
+    Saca un usuario (o todos) de la caché de este worker. Los demás workers
+    lo ven a más tardar en USUARIO_CACHE_TTL segundos.
+    """
+    with _usuarios_cache_lock:
+        if user_id is None:
+            _usuarios_cache.clear()
+        else:
+            _usuarios_cache.pop(int(user_id), None)
+
+
 @login_manager.user_loader
 def load_user(user_id):
-    return Usuario.query.get(int(user_id))
+    """
+    RAZÓN: Flask-Login llama esto en cada solicitud autenticada (incluido el
+    polling de cocina y meseros cada 5 s). Se sirve desde una caché LRU con TTL
+    por worker para no consultar la tabla usuario en cada una.
+    """
+    user_id = int(user_id)
+    ahora = time.monotonic()
+    with _usuarios_cache_lock:
+        entrada = _usuarios_cache.get(user_id)
+        if entrada and entrada[0] > ahora:
+            _usuarios_cache.move_to_end(user_id)
+            return entrada[1]
+
+    fila = db.session.query(Usuario.id, Usuario.username, Usuario.nombre, Usuario.rol).filter(
+        Usuario.id == user_id
+    ).first()
+    if fila is None:
+        invalidar_usuario_cache(user_id)
+        return None
+
+    usuario = UsuarioSesion(*fila)
+    with _usuarios_cache_lock:
+        _usuarios_cache[user_id] = (ahora + USUARIO_CACHE_TTL, usuario)
+        _usuarios_cache.move_to_end(user_id)
+        while len(_usuarios_cache) > USUARIO_CACHE_MAX:
+            _usuarios_cache.popitem(last=False)
+    return usuario
 
 # Modelo para Factura (agregar con los otros modelos)
 class Factura(db.Model):
@@ -149,7 +550,7 @@ class Factura(db.Model):
     propina = db.Column(db.Float, default=0)
     total = db.Column(db.Float, default=0)
     metodo_pago = db.Column(db.String(50), default='efectivo')
-    desglose_pago = db.Column(db.Text)
+    desglose_pago = db.Column(db.Text)  # OBSOLETO: el desglose ahora vive en la tabla Pago
     cliente_nombre = db.Column(db.String(200))
     cliente_documento = db.Column(db.String(50))
     notas = db.Column(db.Text)
@@ -161,7 +562,77 @@ class Factura(db.Model):
     saldo_pendiente = db.Column(db.Float, default=0)  # Si pagó parcialmente
     fecha_emision = db.Column(db.DateTime, default=datetime.now)
     
+    # Cuenta dividida: "1/3", "2/3"... (NULL si la factura cubre toda la sesión)
+    division = db.Column(db.String(20), nullable=True)
+    
     sesion = db.relationship('Sesion', backref='facturas')
+    pedidos = db.relationship('Pedido', backref='factura', foreign_keys='Pedido.factura_id', lazy='select')
+
+class Pago(db.Model):
+    """
+    RAZÓN: Libro de pagos recibidos. Cada cobro al facturar (uno por método si es
+    mixto) y cada abono de cuentas por cobrar queda como una fila, así el cierre
+    de caja y los reportes por método son un GROUP BY sobre un índice en lugar
+    de leer y decodificar el JSON de cada factura.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    factura_id = db.Column(db.Integer, db.ForeignKey('factura.id'), nullable=False, index=True)
+    metodo = db.Column(db.String(50), nullable=False)  # efectivo, tarjeta, transferencia
+    monto = db.Column(db.Float, nullable=False)
+    tipo = db.Column(db.String(20), default='pago')  # pago (al facturar), abono (cuentas por cobrar)
+    fecha = db.Column(db.DateTime, default=datetime.now, nullable=False)
+    usuario_id = db.Column(db.Integer, db.ForeignKey('usuario.id'), nullable=True)
+    
+    factura = db.relationship('Factura', backref=db.backref('pagos', lazy='select', cascade='all, delete-orphan'))
+    
+    __table_args__ = (
+        db.Index('ix_pago_fecha_metodo', 'fecha', 'metodo'),
+    )
+
+class CierreCaja(db.Model):
+    """
+    RAZÓN: Cierre de caja congelado de un día de negocio (03:00 → 03:00) o de un turno.
+    Se calcula con unas pocas consultas agregadas y se guarda; los reportes
+    posteriores leen estas cifras en lugar de volver a recorrer facturas y gastos.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    fecha_negocio = db.Column(db.Date, nullable=False, index=True)
+    turno = db.Column(db.String(50), default='dia')  # 'dia' o 'HH:MM-HH:MM'
+    inicio = db.Column(db.DateTime, nullable=False)
+    fin = db.Column(db.DateTime, nullable=False)
+    
+    # Dinero recibido por método (libro de pagos)
+    total_efectivo = db.Column(db.Float, default=0)
+    total_tarjeta = db.Column(db.Float, default=0)
+    total_transferencia = db.Column(db.Float, default=0)
+    total_otros = db.Column(db.Float, default=0)
+    total_recibido = db.Column(db.Float, default=0)
+    
+    # Facturación del período
+    num_facturas = db.Column(db.Integer, default=0)
+    total_facturado = db.Column(db.Float, default=0)
+    propinas = db.Column(db.Float, default=0)
+    costos_domicilio = db.Column(db.Float, default=0)
+    
+    # Salidas
+    consumo_interno = db.Column(db.Float, default=0)  # Costo para el dueño
+    gastos_total = db.Column(db.Float, default=0)
+    gastos_efectivo = db.Column(db.Float, default=0)  # Gastos pagados en efectivo desde la caja
+    
+    # Arqueo
+    efectivo_esperado = db.Column(db.Float, default=0)  # total_efectivo - gastos_efectivo
+    efectivo_contado = db.Column(db.Float, nullable=True)
+    diferencia = db.Column(db.Float, nullable=True)  # contado - esperado
+    
+    usuario_id = db.Column(db.Integer, db.ForeignKey('usuario.id'), nullable=True)
+    fecha_cierre = db.Column(db.DateTime, default=datetime.now)
+    notas = db.Column(db.Text)
+    
+    usuario = db.relationship('Usuario', backref='cierres_caja')
+    
+    __table_args__ = (
+        db.UniqueConstraint('fecha_negocio', 'turno', name='uq_cierre_caja_fecha_turno'),
+    )
 
 # Modelo para configuración del restaurante (agregar con los otros modelos)
 class ConfiguracionRestaurante(db.Model):
@@ -177,6 +648,8 @@ class ConfiguracionRestaurante(db.Model):
     rango_facturacion = db.Column(db.String(100))
     iva_porcentaje = db.Column(db.Float, default=19.0)
     logo_url = db.Column(db.String(500))
+    # Se incrementa en cada cambio; los workers la comparan con su copia en caché
+    version = db.Column(db.Integer, default=1)
 
 class Presupuesto(db.Model):
     """
@@ -368,7 +841,7 @@ class Domicilio(db.Model):
     # =================================================================
     # INFORMACIÓN DEL PEDIDO (fechas y tiempos)
     # =================================================================
-    fecha_pedido = db.Column(db.DateTime, default=datetime.now, nullable=False)
+    fecha_pedido = db.Column(db.DateTime, default=datetime.now, nullable=False, index=True)
     fecha_entrega_estimada = db.Column(db.DateTime)                  # Opcional
     fecha_entrega_real = db.Column(db.DateTime)                      # Cuando se entrega
     
@@ -588,1893 +1061,5179 @@ class ZonaDelivery(db.Model):
         return []
 
 # =========================
-# RUTAS
+# IDEMPOTENCIA (POST que mueven dinero)
 # =========================
-# ==========================================
-# ACTUALIZAR RUTA DE FACTURAR SESIÓN
-# ==========================================
 
-# REEMPLAZA tu ruta actual de facturar_sesion con esta versión mejorada:
+# Cuánto tiempo se guarda la respuesta de una clave antes de poder eliminarla
+IDEMPOTENCIA_TTL = timedelta(hours=int(os.environ.get('IDEMPOTENCIA_TTL_HORAS', 24)))
+# Cuánto espera un reintento a que termine la solicitud original que sigue en proceso
+IDEMPOTENCIA_ESPERA_SEGUNDOS = 10
 
-@app.route("/facturar_sesion/<int:sesion_id>", methods=["GET", "POST"])
-@login_required
-def facturar_sesion(sesion_id):
+
+class ClaveIdempotencia(db.Model):
     """
-    Generar factura para una sesión - AHORA CON ESTADO DE PAGO
+    RAZÓN: Evitar facturas, abonos o gastos duplicados por doble toque o reintentos.
+    Cada formulario envía una clave única; la primera solicitud con esa clave
+    ejecuta la transacción y guarda su respuesta, los reintentos reciben la misma
+    respuesta sin volver a ejecutar nada.
     """
-    sesion = Sesion.query.get_or_404(sesion_id)
-    config = ConfiguracionRestaurante.query.first()
-    
-    if not config:
-        config = ConfiguracionRestaurante()
-        db.session.add(config)
-        db.session.commit()
-    
-    if request.method == "POST":
-        # Obtener datos del formulario
-        metodo_pago = request.form.get("metodo_pago", "efectivo")
-        propina = request.form.get("propina", 0, type=float)
-        cliente_nombre = request.form.get("cliente_nombre", "")
-        cliente_documento = request.form.get("cliente_documento", "")
-        notas = request.form.get("notas", "")
-        
-        # NUEVOS CAMPOS
-        estado_pago = request.form.get("estado_pago", "pagada")
-        fecha_vencimiento_str = request.form.get("fecha_vencimiento")
-        
-        # Desglose de pago para método mixto
-        desglose_pago = None
-        if metodo_pago == "mixto":
-            desglose_pago = {
-                "efectivo": request.form.get("efectivo", 0, type=float),
-                "tarjeta": request.form.get("tarjeta", 0, type=float),
-                "transferencia": request.form.get("transferencia", 0, type=float)
-            }
-        
-        # Calcular totales (usar agregación en DB para eficiencia)
-        subtotal = db.session.query(db.func.coalesce(db.func.sum(Pedido.cantidad * Pedido.precio_unitario), 0)).filter(Pedido.sesion_id == sesion.id).scalar() or 0
-        iva = 0  # Sin IVA
-        total = subtotal + propina
+    id = db.Column(db.Integer, primary_key=True)
+    clave = db.Column(db.String(100), unique=True, nullable=False)
+    endpoint = db.Column(db.String(100), nullable=False)
+    usuario_id = db.Column(db.Integer, db.ForeignKey('usuario.id'), nullable=True)
+    estado = db.Column(db.String(20), default='en_proceso')  # en_proceso, completada
+    codigo_respuesta = db.Column(db.Integer)
+    ubicacion = db.Column(db.String(500))  # Header Location de la respuesta (redirects)
+    tipo_contenido = db.Column(db.String(100))
+    cuerpo = db.Column(db.Text)
+    fecha_creacion = db.Column(db.DateTime, default=datetime.now)
+    expira = db.Column(db.DateTime, nullable=False, index=True)
 
-        # Generar número consecutivo
-        ultima_factura = Factura.query.order_by(Factura.id.desc()).first()
-        if ultima_factura:
-            ultimo_num = int(ultima_factura.numero_consecutivo.split('-')[1])
-            nuevo_num = ultimo_num + 1
-        else:
-            nuevo_num = 1
-        
-        numero_consecutivo = f"FACT-{nuevo_num:06d}"
-        
-        # Convertir fecha de vencimiento
-        fecha_vencimiento = None
-        if fecha_vencimiento_str and estado_pago == 'pendiente':
-            fecha_vencimiento = datetime.strptime(fecha_vencimiento_str, '%Y-%m-%d').date()
-        
-        # Fecha de pago real
-        fecha_pago_real = datetime.now() if estado_pago == 'pagada' else None
-        
-        # Saldo pendiente
-        saldo_pendiente = total if estado_pago == 'pendiente' else 0
-        
-        # Crear factura
-        factura = Factura(
-            numero_consecutivo=numero_consecutivo,
-            sesion_id=sesion_id,
-            subtotal=subtotal,
-            iva=iva,
-            propina=propina,
-            total=total,
-            metodo_pago=metodo_pago,
-            desglose_pago=json.dumps(desglose_pago) if desglose_pago else None,
-            cliente_nombre=cliente_nombre,
-            cliente_documento=cliente_documento,
-            notas=notas,
-            estado_pago=estado_pago,
-            fecha_vencimiento=fecha_vencimiento,
-            fecha_pago_real=fecha_pago_real,
-            saldo_pendiente=saldo_pendiente
-        )
-        
-        # Actualizar sesión
-        sesion.total = total
-        sesion.activa = False
-        sesion.fecha_fin = datetime.now()
-        
-        # Marcar todos los pedidos como pagados (actualización en bloque)
-        db.session.query(Pedido).filter(Pedido.sesion_id == sesion.id).update({"pagado": True, "estado": "entregado"}, synchronize_session=False)
-        
-        db.session.add(factura)
-        db.session.commit()
-        
-        flash(f'Factura {numero_consecutivo} generada exitosamente', 'success')
-        return redirect(url_for('ver_factura', factura_id=factura.id))
-    
-    # GET: Calcular totales para mostrar en el formulario (usar agregación en DB)
-    subtotal = db.session.query(db.func.coalesce(db.func.sum(Pedido.cantidad * Pedido.precio_unitario), 0)).filter(Pedido.sesion_id == sesion.id).scalar() or 0
-    iva = 0  # Sin IVA
-    
-    # ============================================
-    # SOLUCIÓN: PASAR datetime AL TEMPLATE
-    # ============================================
-    return render_template("facturar_sesion.html", 
-                         sesion=sesion, 
-                         config=config,
-                         subtotal=subtotal,
-                         iva=iva,
-                         datetime=datetime)  # ← ESTA LÍNEA ES CLAVE
 
-# =================================================================
-# REEMPLAZAR LA RUTA ver_factura EN app.py (línea ~620)
-# =================================================================
+def generar_clave_idempotencia():
+    """Clave nueva para cada formulario renderizado"""
+    return uuid.uuid4().hex
 
-@app.route("/factura/<int:factura_id>")
-@login_required
-def ver_factura(factura_id):
-    """Ver una factura generada - OPTIMIZADA PARA IMPRESORAS TÉRMICAS"""
-    factura = Factura.query.get_or_404(factura_id)
-    config = ConfiguracionRestaurante.query.first()
-    
-    # Crear configuración por defecto si no existe
-    if not config:
-        config = ConfiguracionRestaurante()
-        db.session.add(config)
-        db.session.commit()
-    
-    # Parsear desglose de pago si existe
-    desglose = None
-    if factura.desglose_pago:
-        try:
-            desglose = json.loads(factura.desglose_pago)
-        except:
-            desglose = None
-    
-    return render_template("ver_factura.html", 
-                         factura=factura, 
-                         config=config,
-                         desglose=desglose)
 
-@app.route("/facturas")
-@login_required
-def lista_facturas():
-    """Listar todas las facturas"""
-    fecha_param = request.args.get('fecha')
-    
-    if fecha_param:
-        try:
-            fecha_obj = datetime.strptime(fecha_param, '%Y-%m-%d').date()
-            facturas = Factura.query.filter(
-                db.func.date(Factura.fecha_emision) == fecha_obj
-            ).order_by(Factura.fecha_emision.desc()).all()
-        except ValueError:
-            flash('Fecha inválida', 'error')
-            facturas = Factura.query.order_by(Factura.fecha_emision.desc()).limit(50).all()
-    else:
-        # Últimas 50 facturas
-        facturas = Factura.query.order_by(Factura.fecha_emision.desc()).limit(50).all()
-    
-    return render_template("lista_facturas.html", facturas=facturas)
+@app.context_processor
+def inyectar_clave_idempotencia():
+    # En templates: <input type="hidden" name="idempotency_key" value="{{ idempotency_key() }}">
+    return {'idempotency_key': generar_clave_idempotencia}
 
-# ==========================================
-# RUTAS PARA CONSUMO INTERNO (ADMIN)
-# ==========================================
-@app.route('/consumo_interno')
-@login_required
-def lista_consumos_internos():
-    if getattr(current_user, 'rol', None) != 'admin':
-        flash('No tienes permisos para ver consumos internos', 'error')
-        return redirect(url_for('dashboard'))
 
-    fecha = request.args.get('fecha')
-    fecha_inicio = request.args.get('fecha_inicio')
-    fecha_fin = request.args.get('fecha_fin')
+def _respuesta_guardada(registro):
+    """Reconstruye la respuesta original a partir del registro guardado"""
+    respuesta = Response(registro.cuerpo or '',
+                         status=registro.codigo_respuesta,
+                         content_type=registro.tipo_contenido or 'text/html; charset=utf-8')
+    if registro.ubicacion:
+        respuesta.headers['Location'] = registro.ubicacion
+    return respuesta
 
-    query = ConsumoInterno.query
 
-    # Si se especifica `fecha`, interpretamos el día como [fecha 03:00, fecha+1 03:00)
-    if fecha:
+def idempotente(vista):
+    """
+    Decorador para rutas POST que mueven dinero.
+    La clave viene del campo de formulario `idempotency_key` o del header
+    `Idempotency-Key`. Sin clave la ruta se comporta como antes.
+    """
+    @wraps(vista)
+    def envoltura(*args, **kwargs):
+        clave = request.form.get('idempotency_key') or request.headers.get('Idempotency-Key')
+        if request.method != 'POST' or not clave:
+            return vista(*args, **kwargs)
+
+        ahora = datetime.now()
+        usuario_id = current_user.id if current_user.is_authenticated else None
+
+        # Reservar la clave. La restricción UNIQUE decide quién llega primero.
         try:
-            d = datetime.strptime(fecha, '%Y-%m-%d').date()
-            start = datetime(d.year, d.month, d.day, 3, 0, 0)
-            end = start + timedelta(days=1)
-            query = query.filter(ConsumoInterno.fecha >= start, ConsumoInterno.fecha < end)
-        except ValueError:
-            flash('Fecha inválida', 'error')
-    else:
-        # Si se usa rango, aplicamos cierre diario a las 03:00: fecha_inicio comienza a las 03:00; fecha_fin termina el día siguiente a las 03:00 (exclusivo)
-        if fecha_inicio:
-            try:
-                fi_date = datetime.strptime(fecha_inicio, '%Y-%m-%d').date()
-                start = datetime(fi_date.year, fi_date.month, fi_date.day, 3, 0, 0)
-                query = query.filter(ConsumoInterno.fecha >= start)
-            except ValueError:
-                flash('Fecha inicio inválida', 'error')
-        if fecha_fin:
-            try:
-                ff_date = datetime.strptime(fecha_fin, '%Y-%m-%d').date()
-                end = datetime(ff_date.year, ff_date.month, ff_date.day, 3, 0, 0) + timedelta(days=1)
-                query = query.filter(ConsumoInterno.fecha < end)
-            except ValueError:
-                flash('Fecha fin inválida', 'error')
+            ClaveIdempotencia.query.filter(ClaveIdempotencia.expira < ahora).delete(synchronize_session=False)
+            db.session.add(ClaveIdempotencia(
+                clave=clave,
+                endpoint=request.endpoint,
+                usuario_id=usuario_id,
+                expira=ahora + IDEMPOTENCIA_TTL
+            ))
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            return _responder_reintento(clave)
 
-    try:
-        consumos = query.order_by(ConsumoInterno.fecha.desc()).limit(200).all()
-        total_costo = sum(c.costo * c.cantidad for c in consumos)
-    except OperationalError:
-        # Tabla aún no creada; instrucciones para el desarrollador
-        flash("La tabla 'consumo_interno' no existe. Ejecuta `python update_database.py` para crearla.", 'error')
-        return redirect(url_for('dashboard'))
+        try:
+            respuesta = make_response(vista(*args, **kwargs))
+        except Exception:
+            # La transacción no se completó: liberar la clave para permitir reintentar
+            db.session.rollback()
+            ClaveIdempotencia.query.filter_by(clave=clave).delete(synchronize_session=False)
+            db.session.commit()
+            raise
+
+        registro = ClaveIdempotencia.query.filter_by(clave=clave).first()
+        if registro:
+            registro.estado = 'completada'
+            registro.codigo_respuesta = respuesta.status_code
+            registro.ubicacion = respuesta.headers.get('Location')
+            registro.tipo_contenido = respuesta.content_type
+            if not respuesta.direct_passthrough:
+                registro.cuerpo = respuesta.get_data(as_text=True)
+            db.session.commit()
+        return respuesta
+
+    return envoltura
+
+
+def _responder_reintento(clave):
+    """Espera a que la solicitud original termine y devuelve su misma respuesta"""
+    limite = time.monotonic() + IDEMPOTENCIA_ESPERA_SEGUNDOS
+    while True:
+        registro = ClaveIdempotencia.query.filter_by(clave=clave).first()
+        if registro is None:
+            # La original falló y liberó la clave
+            return jsonify({'error': 'La solicitud original falló, intenta de nuevo'}), 409
+        if registro.endpoint != request.endpoint:
+            return jsonify({'error': 'Clave de idempotencia usada en otra operación'}), 422
+        if registro.estado == 'completada':
+            logger.info(f"Reintento con clave {clave} en {registro.endpoint}: se devuelve la respuesta original")
+            if registro.ubicacion:
+                flash('Esta operación ya había sido registrada', 'info')
+            return _respuesta_guardada(registro)
+        if time.monotonic() >= limite:
+            return jsonify({'error': 'La solicitud original sigue en proceso'}), 409
+        db.session.rollback()  # Terminar la transacción para ver el estado más reciente
+        time.sleep(0.2)
 
-    return render_template('consumo_interno/lista_consumos.html', consumos=consumos, total_costo=total_costo)
+# =========================
+# BLOQUEO DE MESAS (concurrencia)
+# =========================
 
+def bloquear_mesa(mesa_id):
+    """
+    RAZÓN: Serializar las operaciones sobre una mesa (abrir sesión, agregar
+    pedidos, facturar) para que dos meseros no creen dos sesiones activas ni se
+    facture una sesión mientras se insertan pedidos.
+    En Postgres usa SELECT ... FOR UPDATE sobre la fila de la mesa. SQLite no
+    soporta FOR UPDATE, así que se hace una escritura vacía que toma el candado
+    de escritura de la base hasta el commit.
+    El candado dura hasta el próximo commit/rollback de la sesión.
+    """
+    if db.engine.dialect.name == 'sqlite':
+        db.session.execute(text("UPDATE mesa SET id = id WHERE id = :id"), {'id': mesa_id})
+        return db.session.get(Mesa, mesa_id)
+    return Mesa.query.filter_by(id=mesa_id).with_for_update().first()
 
-@app.route('/consumo_interno/nuevo', methods=['GET', 'POST'])
-@login_required
-def nuevo_consumo_interno():
-    if getattr(current_user, 'rol', None) != 'admin':
-        flash('No tienes permisos para crear consumos internos', 'error')
-        return redirect(url_for('dashboard'))
 
-    items = ItemMenu.query.order_by(ItemMenu.nombre).all()
-    users = Usuario.query.order_by(Usuario.nombre).all()
+def bloquear_factura(factura_id):
+    """
+    Igual que bloquear_mesa pero para una factura: serializa los abonos
+    simultáneos para que no lean el mismo saldo. Devuelve la factura recargada.
+    """
+    if db.engine.dialect.name == 'sqlite':
+        db.session.execute(text("UPDATE factura SET id = id WHERE id = :id"), {'id': factura_id})
+        return Factura.query.filter_by(id=factura_id).populate_existing().first()
+    return Factura.query.filter_by(id=factura_id).with_for_update().populate_existing().first()
 
-    if request.method == 'POST':
-        item_id = request.form.get('item_id', type=int)
-        usuario_id = request.form.get('usuario_id', type=int)
-        cantidad = request.form.get('cantidad', 1, type=int)
-        costo = request.form.get('costo', 0.0, type=float)
-        notas = request.form.get('notas')
 
-        if not item_id or not usuario_id or cantidad <= 0:
-            flash('Item, usuario o cantidad inválida', 'error')
-            return redirect(url_for('nuevo_consumo_interno'))
+def obtener_o_crear_sesion_activa(mesa_id):
+    """Devuelve la sesión activa de la mesa (creándola si no existe) con la mesa bloqueada"""
+    bloquear_mesa(mesa_id)
+    sesion_activa = Sesion.query.filter_by(
+        mesa_id=mesa_id,
+        activa=True
+    ).populate_existing().first()
 
-        # Verificar que el usuario seleccionado exista
-        usuario = Usuario.query.get(usuario_id)
-        if not usuario:
-            flash('Usuario seleccionado no existe', 'error')
-            return redirect(url_for('nuevo_consumo_interno'))
+    if not sesion_activa:
+        sesion_activa = Sesion(mesa_id=mesa_id)
+        db.session.add(sesion_activa)
+        db.session.flush()  # Para obtener el ID
 
-        consumo = ConsumoInterno(item_id=item_id, cantidad=cantidad, costo=costo, usuario_id=usuario_id, notas=notas)
-        db.session.add(consumo)
-        db.session.commit()
-        flash('Consumo interno registrado', 'success')
-        return redirect(url_for('lista_consumos_internos'))
+    return sesion_activa
 
-    return render_template('consumo_interno/nuevo_consumo.html', items=items, users=users) 
 
+# =========================
+# TOTALES ACUMULADOS DE SESIÓN
+# =========================
 
-@app.route('/consumo_interno/<int:consumo_id>/eliminar', methods=['POST'])
-@login_required
-def eliminar_consumo_interno(consumo_id):
-    if getattr(current_user, 'rol', None) != 'admin':
-        flash('No tienes permisos para eliminar consumos internos', 'error')
-        return redirect(url_for('dashboard'))
+def sumar_a_totales_sesion(sesion_id, subtotal=0, pagado=0):
+    """
+    RAZÓN: Mantener Sesion.subtotal/pagado/pendiente al día sin volver a sumar
+    todos los pedidos. Se hace con un UPDATE relativo dentro de la misma
+    transacción que modifica el pedido.
+    """
+    Sesion.query.filter_by(id=sesion_id).update({
+        Sesion.subtotal: db.func.coalesce(Sesion.subtotal, 0) + subtotal,
+        Sesion.pagado: db.func.coalesce(Sesion.pagado, 0) + pagado,
+        Sesion.pendiente: db.func.coalesce(Sesion.pendiente, 0) + subtotal - pagado
+    }, synchronize_session=False)
 
-    consumo = ConsumoInterno.query.get_or_404(consumo_id)
-    try:
-        db.session.delete(consumo)
-        db.session.commit()
-        flash('Consumo interno eliminado', 'success')
-    except Exception:
-        db.session.rollback()
-        flash('Error al eliminar consumo interno', 'error')
 
-    return redirect(url_for('lista_consumos_internos'))
+def recalcular_totales_sesion(sesion_ids=None):
+    """
+    Recalcula los totales acumulados desde los pedidos en un solo UPDATE.
+    Se usa tras actualizaciones en bloque de pedidos y para reparar
+    inconsistencias. Sin sesion_ids recalcula todas las sesiones.
+    """
+    monto = Pedido.cantidad * Pedido.precio_unitario
+    subtotal = db.select(db.func.coalesce(db.func.sum(monto), 0)).where(
+        Pedido.sesion_id == Sesion.id
+    ).scalar_subquery()
+    pagado = db.select(db.func.coalesce(db.func.sum(monto), 0)).where(
+        Pedido.sesion_id == Sesion.id,
+        Pedido.pagado == True
+    ).scalar_subquery()
+
+    consulta = db.update(Sesion).values(subtotal=subtotal, pagado=pagado, pendiente=subtotal - pagado)
+    if sesion_ids is not None:
+        if not sesion_ids:
+            return
+        consulta = consulta.where(Sesion.id.in_(sesion_ids))
+    db.session.execute(consulta, execution_options={'synchronize_session': False})
+
+
+def agregar_columnas_faltantes(tabla, columnas):
+    """
+    Agrega a una tabla existente las columnas que aún no tiene
+    (db.create_all() no modifica tablas ya creadas).
+    columnas: {nombre: tipo SQL}. Devuelve la lista de columnas agregadas.
+    """
+    existentes = {c['name'] for c in inspect(db.engine).get_columns(tabla)}
+    faltantes = [nombre for nombre in columnas if nombre not in existentes]
+    if faltantes:
+        with db.engine.begin() as conn:
+            for nombre in faltantes:
+                conn.execute(text(f"ALTER TABLE {tabla} ADD COLUMN {nombre} {columnas[nombre]}"))
+        logger.info(f"Columnas {', '.join(faltantes)} agregadas a {tabla}")
+    return faltantes
 
 
-@app.route('/factura/<int:factura_id>/editar', methods=['GET', 'POST'])
-@login_required
-def editar_factura(factura_id):
-    factura = Factura.query.get_or_404(factura_id)
-    if getattr(current_user, 'rol', None) != 'admin':
-        flash('No tienes permisos para editar facturas', 'error')
-        return redirect(url_for('ver_factura', factura_id=factura_id))
+# =========================
+# CONFIGURACIÓN EN CACHÉ
+# =========================
 
-    config = ConfiguracionRestaurante.query.first()
+CAMPOS_CONFIGURACION = ('nombre', 'nit', 'direccion', 'ciudad', 'telefono', 'email', 'regimen',
+                        'resolucion_dian', 'rango_facturacion', 'iva_porcentaje', 'logo_url')
+# Copia inmutable de la configuración que se comparte entre solicitudes del worker
+ConfiguracionCache = namedtuple('ConfiguracionCache', ('version',) + CAMPOS_CONFIGURACION)
+# Cada cuánto un worker compara su copia con la versión guardada en la BD
+CONFIG_REVISION_SEGUNDOS = int(os.environ.get('CONFIG_REVISION_SEGUNDOS', 30))
 
-    if request.method == 'POST':
-        metodo_pago = request.form.get('metodo_pago', factura.metodo_pago)
-        propina = request.form.get('propina', factura.propina, type=float)
-        cliente_nombre = request.form.get('cliente_nombre', factura.cliente_nombre)
-        cliente_documento = request.form.get('cliente_documento', factura.cliente_documento)
-        notas = request.form.get('notas', factura.notas)
-        estado_pago = request.form.get('estado_pago', factura.estado_pago)
-        fecha_vencimiento_str = request.form.get('fecha_vencimiento')
+_config_cache = {'config': None, 'revisada': 0.0}
+_config_cache_lock = threading.Lock()
 
-        desglose_pago = None
-        if metodo_pago == 'mixto':
-            desglose_pago = {
-                'efectivo': request.form.get('efectivo', 0, type=float),
-                'tarjeta': request.form.get('tarjeta', 0, type=float),
-                'transferencia': request.form.get('transferencia', 0, type=float)
-            }
 
-        # Recalcular subtotal desde la sesión asociada
-        subtotal = db.session.query(db.func.coalesce(db.func.sum(Pedido.cantidad * Pedido.precio_unitario), 0)).filter(Pedido.sesion_id == factura.sesion_id).scalar() or 0
-        iva = factura.iva if factura.iva is not None else 0
-        total = subtotal + propina + (iva or 0)
+def recargar_configuracion():
+    """
+    Lee la configuración de la BD y reemplaza la copia en caché. Si todavía no
+    hay fila usa los valores por defecto del modelo (sin insertar nada).
+    """
+    config = ConfiguracionRestaurante.query.order_by(ConfiguracionRestaurante.id).first()
+    if config:
+        valores = {campo: getattr(config, campo) for campo in CAMPOS_CONFIGURACION}
+        version = config.version or 0
+    else:
+        columnas = ConfiguracionRestaurante.__table__.c
+        valores = {campo: columnas[campo].default.arg if columnas[campo].default is not None else None
+                   for campo in CAMPOS_CONFIGURACION}
+        version = 0
+    cache = ConfiguracionCache(version=version, **valores)
+    with _config_cache_lock:
+        _config_cache['config'] = cache
+        _config_cache['revisada'] = time.monotonic()
+    return cache
+
+
+def obtener_configuracion():
+    """
+    RAZÓN: Facturar, ver e imprimir facturas necesitan los datos del restaurante
+    en cada solicitud. Se sirven desde una copia por worker; cada
+    CONFIG_REVISION_SEGUNDOS se compara solo la columna version y se recarga
+    únicamente si alguien guardó cambios.
+    """
+    with _config_cache_lock:
+        cache = _config_cache['config']
+        vigente = cache is not None and time.monotonic() - _config_cache['revisada'] < CONFIG_REVISION_SEGUNDOS
+    if vigente:
+        return cache
+    if cache is not None:
+        version = db.session.query(ConfiguracionRestaurante.version).order_by(
+            ConfiguracionRestaurante.id
+        ).limit(1).scalar()
+        if (version or 0) == cache.version:
+            with _config_cache_lock:
+                _config_cache['revisada'] = time.monotonic()
+            return cache
+    return recargar_configuracion()
 
-        # Actualizar campos
-        factura.metodo_pago = metodo_pago
-        factura.propina = propina
-        factura.cliente_nombre = cliente_nombre
-        factura.cliente_documento = cliente_documento
-        factura.notas = notas
-        factura.estado_pago = estado_pago
-        factura.desglose_pago = json.dumps(desglose_pago) if desglose_pago else None
-        factura.subtotal = subtotal
-        factura.total = total
+# =========================
+# MIGRACIONES VERSIONADAS
+# =========================
 
-        # Fecha vencimiento
-        if fecha_vencimiento_str:
-            try:
-                factura.fecha_vencimiento = datetime.strptime(fecha_vencimiento_str, '%Y-%m-%d').date()
-            except Exception:
-                factura.fecha_vencimiento = None
-        else:
-            factura.fecha_vencimiento = None
+# Tamaño de lote por defecto para los rellenos de datos (filas por transacción)
+MIGRACION_LOTE = int(os.environ.get('MIGRACION_LOTE', 5000))
 
-        # Ajustes según estado de pago
-        if estado_pago == 'pagada':
-            factura.fecha_pago_real = datetime.now()
-            factura.saldo_pendiente = 0
-        elif estado_pago == 'pendiente':
-            factura.fecha_pago_real = None
-            factura.saldo_pendiente = total
-        db.session.commit()
-        flash(f'Factura {factura.numero_consecutivo} actualizada', 'success')
-        return redirect(url_for('ver_factura', factura_id=factura.id))
 
-    # GET
-    desglose = json.loads(factura.desglose_pago) if factura.desglose_pago else None
-    return render_template('editar_factura.html', factura=factura, config=config, desglose=desglose)
+class VersionEsquema(db.Model):
+    """
+    RAZÓN: Registro de las migraciones aplicadas. Una fila por versión; mientras
+    aplicada_en es NULL la migración está a medias y cursor guarda el último id
+    procesado por su relleno, para retomarla sin repetir lotes.
+    """
+    __tablename__ = 'version_esquema'
+    version = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    nombre = db.Column(db.String(200), nullable=False)
+    cursor = db.Column(db.Integer, default=0)
+    iniciada_en = db.Column(db.DateTime, default=datetime.now)
+    aplicada_en = db.Column(db.DateTime, nullable=True)
 
 
-@app.route('/factura/<int:factura_id>/eliminar', methods=['POST'])
-@login_required
-def eliminar_factura(factura_id):
+MIGRACIONES = {}
+
+
+def migracion(version, nombre):
+    """Registra una función como la migración número `version`"""
+    def decorador(f):
+        if version in MIGRACIONES:
+            raise ValueError(f"Migración {version} duplicada")
+        MIGRACIONES[version] = (nombre, f)
+        return f
+    return decorador
+
+
+def rellenar_por_lotes(registro, tabla, accion, lote=None):
     """
-    RAZÓN: Eliminar facturas y revertir los cambios asociados.
-    Funciona tanto para facturas de sesiones como de domicilios.
-    Al eliminar, la factura desaparece de los reportes de ingresos automáticamente.
+    RAZÓN: Los rellenos sobre tablas grandes (pedido) se hacen por rangos de id
+    en transacciones cortas, para no bloquear la tabla en producción.
+    accion(desde, hasta) procesa las filas con desde < id <= hasta; el cursor se
+    guarda en la misma transacción que el lote, así que un corte se retoma
+    exactamente donde quedó.
     """
-    factura = Factura.query.get_or_404(factura_id)
-    
-    # Solo admin puede eliminar facturas
-    if getattr(current_user, 'rol', None) != 'admin':
-        flash('No tienes permisos para eliminar facturas', 'error')
-        return redirect(url_for('ver_factura', factura_id=factura_id))
+    lote = lote or MIGRACION_LOTE
+    maximo = db.session.execute(text(f"SELECT MAX(id) FROM {tabla}")).scalar() or 0
+    desde = registro.cursor or 0
+    while desde < maximo:
+        hasta = min(desde + lote, maximo)
+        accion(desde, hasta)
+        registro.cursor = hasta
+        db.session.commit()
+        logger.info(f"  {tabla}: {hasta}/{maximo} ({hasta * 100 // maximo}%)")
+        desde = hasta
 
-    numero_factura = factura.numero_consecutivo
-    monto = factura.total
-    
-    try:
-        # ============================================
-        # CASO 1: FACTURA DE SESIÓN (MESA)
-        # ============================================
-        if factura.sesion_id:
-            sesion = factura.sesion
-            if sesion:
-                # Reactivar la sesión
-                sesion.activa = True
-                sesion.fecha_fin = None
-                sesion.total = 0
-                
-                # Revertir estado de los pedidos
-                db.session.query(Pedido).filter(
-                    Pedido.sesion_id == sesion.id
-                ).update({
-                    "pagado": False,
-                    "estado": "pendiente"
-                }, synchronize_session=False)
-        
-        # ============================================
-        # CASO 2: FACTURA DE DOMICILIO
-        # ============================================
-        else:
-            # Buscar domicilio asociado a esta factura
-            domicilio = Domicilio.query.filter_by(factura_id=factura_id).first()
-            if domicilio:
-                # Desasociar la factura del domicilio
-                domicilio.factura_id = None
-                domicilio.pagado = False
-                # El domicilio queda en su estado actual (entregado)
-                # pero sin factura asociada, permitiendo re-facturar
-        
-        # ============================================
-        # ELIMINAR LA FACTURA
-        # ============================================
-        db.session.delete(factura)
+
+def aplicar_migraciones(lote=None):
+    """
+    Aplica en orden las migraciones pendientes y devuelve cuántas se aplicaron.
+    Funciona igual en SQLite y Postgres (todo pasa por SQLAlchemy).
+    """
+    VersionEsquema.__table__.create(db.engine, checkfirst=True)
+    aplicadas = {v for (v,) in db.session.query(VersionEsquema.version).filter(
+        VersionEsquema.aplicada_en.isnot(None)
+    )}
+    total = 0
+    for version in sorted(MIGRACIONES):
+        if version in aplicadas:
+            continue
+        nombre, funcion = MIGRACIONES[version]
+        registro = db.session.get(VersionEsquema, version)
+        if registro is None:
+            registro = VersionEsquema(version=version, nombre=nombre, cursor=0)
+            db.session.add(registro)
+            db.session.commit()
+        elif registro.cursor:
+            logger.info(f"Retomando migración {version} desde id {registro.cursor}")
+        logger.info(f"Aplicando migración {version}: {nombre}")
+        funcion(registro, lote)
+        registro.aplicada_en = datetime.now()
         db.session.commit()
-        
-        flash(f'✓ Factura {numero_factura} eliminada exitosamente (${monto:,.0f})', 'success')
-        flash('La factura ha sido eliminada de los reportes de ingresos', 'info')
-        
-    except Exception as e:
-        db.session.rollback()
-        flash(f'❌ Error al eliminar la factura: {str(e)}', 'error')
-        return redirect(url_for('ver_factura', factura_id=factura_id))
-    
-    # Redirigir a la lista de facturas
-    return redirect(url_for('lista_facturas'))
+        total += 1
+    return total
+
+
+def estado_migraciones():
+    """[(version, nombre, estado)] con estado 'aplicada', 'a medias' o 'pendiente'"""
+    VersionEsquema.__table__.create(db.engine, checkfirst=True)
+    registros = {r.version: r for r in VersionEsquema.query.all()}
+    estado = []
+    for version in sorted(MIGRACIONES):
+        registro = registros.get(version)
+        if registro is None:
+            estado.append((version, MIGRACIONES[version][0], 'pendiente'))
+        elif registro.aplicada_en is None:
+            estado.append((version, MIGRACIONES[version][0], f'a medias (id {registro.cursor})'))
+        else:
+            estado.append((version, MIGRACIONES[version][0], 'aplicada'))
+    return estado
 
-# ==========================================
-# RUTAS PARA CUENTAS POR COBRAR
-# ==========================================
 
-@app.route("/cuentas_por_cobrar")
-@login_required
-def cuentas_por_cobrar():
+# Las migraciones reemplazan a update_database.py, migracion_domicilios.py y
+# migrate_factura.py. Nunca cambiar una ya publicada: agregar una nueva.
+
+@migracion(1, 'pedido: precio_unitario y estado_actualizado')
+def migracion_pedido_estado_actualizado(registro, lote):
+    agregar_columnas_faltantes('pedido', {
+        'precio_unitario': 'FLOAT DEFAULT 0',
+        'estado_actualizado': 'TIMESTAMP'
+    })
+    rellenar_por_lotes(registro, 'pedido', lambda desde, hasta: db.session.execute(text(
+        "UPDATE pedido SET estado_actualizado = fecha "
+        "WHERE id > :desde AND id <= :hasta AND estado = 'listo' AND estado_actualizado IS NULL"
+    ), {'desde': desde, 'hasta': hasta}), lote)
+
+
+@migracion(2, 'item_domicilio: estado_cocina')
+def migracion_item_domicilio_estado_cocina(registro, lote):
+    agregar_columnas_faltantes('item_domicilio', {'estado_cocina': "VARCHAR(20) DEFAULT 'pendiente'"})
+    # Los items anteriores a la columna ya salieron de cocina
+    rellenar_por_lotes(registro, 'item_domicilio', lambda desde, hasta: db.session.execute(text(
+        "UPDATE item_domicilio SET estado_cocina = 'listo' "
+        "WHERE id > :desde AND id <= :hasta AND (estado_cocina IS NULL OR estado_cocina = '')"
+    ), {'desde': desde, 'hasta': hasta}), lote)
+
+
+@migracion(3, 'factura: fecha_emision y sesion_id opcional')
+def migracion_factura_fecha_emision(registro, lote):
+    agregar_columnas_faltantes('factura', {'fecha_emision': 'TIMESTAMP'})
+    rellenar_por_lotes(registro, 'factura', lambda desde, hasta: db.session.execute(text(
+        "UPDATE factura SET fecha_emision = COALESCE(fecha_pago_real, CURRENT_TIMESTAMP) "
+        "WHERE id > :desde AND id <= :hasta AND fecha_emision IS NULL"
+    ), {'desde': desde, 'hasta': hasta}), lote)
+
+    # En SQLite quitar el NOT NULL de sesion_id exige reconstruir la tabla: lo hace la migración 10
+    if db.engine.dialect.name != 'sqlite' and not _sesion_id_factura_opcional():
+        with db.engine.begin() as conn:
+            conn.execute(text("ALTER TABLE factura ALTER COLUMN sesion_id DROP NOT NULL"))
+
+
+def _sesion_id_factura_opcional():
+    columna = next(c for c in inspect(db.engine).get_columns('factura') if c['name'] == 'sesion_id')
+    return columna['nullable']
+
+
+@migracion(4, 'sesion: totales acumulados')
+def migracion_totales_sesion(registro, lote):
+    agregar_columnas_faltantes('sesion', {
+        'subtotal': 'FLOAT DEFAULT 0',
+        'pagado': 'FLOAT DEFAULT 0',
+        'pendiente': 'FLOAT DEFAULT 0'
+    })
+    rellenar_por_lotes(registro, 'sesion', lambda desde, hasta: recalcular_totales_sesion(
+        [i for (i,) in db.session.query(Sesion.id).filter(Sesion.id > desde, Sesion.id <= hasta)]
+    ), lote)
+
+
+@migracion(5, 'división de cuentas: pedido.factura_id y factura.division')
+def migracion_columnas_division(registro, lote):
+    agregar_columnas_faltantes('pedido', {'factura_id': 'INTEGER REFERENCES factura(id)'})
+    agregar_columnas_faltantes('factura', {'division': 'VARCHAR(20)'})
+
+
+@migracion(6, 'sesion: índice único de sesión activa por mesa')
+def crear_indice_sesion_activa(registro=None, lote=None):
     """
-    RAZÓN: Vista principal de deudas de clientes.
-    Muestra facturas pendientes de cobro y vencidas.
+    Crea el índice único parcial de sesiones activas en bases existentes
+    (db.create_all() no agrega índices a tablas que ya existen).
     """
-    # Obtener filtros
-    estado = request.args.get('estado', 'todos')  # todos, pendiente, vencida, pagada
-    
-    # Query base
-    query = Factura.query
-    
-    # Aplicar filtros
-    if estado != 'todos':
-        query = query.filter(Factura.estado_pago == estado)
-    
-    # Ordenar por fecha de vencimiento
-    facturas = query.order_by(Factura.fecha_vencimiento).all()
-    
-    # Actualizar estados de facturas vencidas automáticamente
-    from datetime import date
-    hoy = date.today()
-    
-    for factura in facturas:
-        if factura.estado_pago == 'pendiente' and factura.fecha_vencimiento and factura.fecha_vencimiento < hoy:
-            factura.estado_pago = 'vencida'
-    
+    for indice in Sesion.__table__.indexes:
+        if indice.name == 'uq_sesion_activa_por_mesa':
+            try:
+                indice.create(db.engine, checkfirst=True)
+            except Exception as e:
+                logger.warning(f"No se pudo crear {indice.name} (¿mesas con varias sesiones activas?): {e}")
+
+
+@migracion(7, 'libro de pagos desde desglose_pago')
+def migracion_libro_pagos(registro, lote):
+    # Ya avanza por lotes y solo toma facturas sin filas en Pago, así que se retoma solo
+    migrar_desglose_a_pagos(lote or 500)
+
+
+@migracion(8, 'configuracion_restaurante: version para la caché')
+def migracion_version_configuracion(registro, lote):
+    agregar_columnas_faltantes('configuracion_restaurante', {'version': 'INTEGER DEFAULT 1'})
+
+
+@migracion(9, 'índices por fecha en pedido y domicilio (analítica de ventas)')
+def crear_indices_fecha_ventas(registro=None, lote=None):
+    nombres = ('ix_pedido_fecha', 'ix_domicilio_fecha_pedido', 'ix_pedido_archivo_fecha')
+    for tabla in (Pedido.__table__, Domicilio.__table__, TABLAS_ARCHIVO[Pedido]):
+        for indice in tabla.indexes:
+            if indice.name in nombres:
+                indice.create(db.engine, checkfirst=True)
+
+
+def _referencias_rotas_a_factura(conn):
+    """Filas de otras tablas que apuntan a una factura inexistente (PRAGMA foreign_key_check)"""
+    return sum(1 for fila in conn.exec_driver_sql("PRAGMA foreign_key_check") if fila[2] == 'factura')
+
+
+@migracion(10, 'factura: sesion_id opcional también en SQLite (reconstruir tabla)')
+def migracion_factura_sesion_opcional(registro, lote):
+    """
+    RAZÓN: Las facturas de domicilio no tienen sesión. La migración 3 solo podía
+    quitar el NOT NULL en Postgres; en SQLite hay que reconstruir la tabla.
+    1. Se crea factura_nueva con la definición del modelo y se copian las filas
+       por lotes de id (transacciones cortas; el cursor permite retomar).
+    2. En una sola transacción BEGIN IMMEDIATE (los demás escritores esperan) se
+       copian las filas nuevas o modificadas desde el paso 1, se borran las
+       eliminadas, se reemplaza factura y se recrean sus índices.
+    Las llaves foráneas se desactivan durante el cambio para que DROP TABLE no
+    toque pedido/pago/domicilio, y se verifican con foreign_key_check antes del
+    COMMIT. Si algo falla la transacción se revierte y la versión queda pendiente.
+    """
+    if _sesion_id_factura_opcional():
+        if inspect(db.engine).has_table('factura_nueva'):
+            with db.engine.begin() as conn:
+                conn.execute(text("DROP TABLE factura_nueva"))
+        return
+    if db.engine.dialect.name != 'sqlite':
+        with db.engine.begin() as conn:
+            conn.execute(text("ALTER TABLE factura ALTER COLUMN sesion_id DROP NOT NULL"))
+        return
+
+    existentes = [c['name'] for c in inspect(db.engine).get_columns('factura')]
+    sobrantes = set(existentes) - set(Factura.__table__.columns.keys())
+    if sobrantes:
+        raise RuntimeError(f"factura tiene columnas que el modelo no conoce ({', '.join(sorted(sobrantes))}); "
+                           f"revisarlas antes de reconstruir la tabla")
+    columnas = ', '.join(existentes)
+
+    if not inspect(db.engine).has_table('factura_nueva'):
+        # Misma definición del modelo (sesion_id opcional); los índices se recrean al final
+        ddl = str(CreateTable(Factura.__table__).compile(db.engine)).replace(
+            'CREATE TABLE factura ', 'CREATE TABLE factura_nueva ', 1)
+        with db.engine.begin() as conn:
+            conn.execute(text(ddl))
+    rellenar_por_lotes(registro, 'factura', lambda desde, hasta: db.session.execute(text(
+        f"INSERT OR REPLACE INTO factura_nueva ({columnas}) SELECT {columnas} FROM factura "
+        f"WHERE id > :desde AND id <= :hasta"
+    ), {'desde': desde, 'hasta': hasta}), lote)
     db.session.commit()
-    
-    # Calcular totales
-    total_pendiente = sum(f.saldo_pendiente or f.total for f in facturas if f.estado_pago == 'pendiente')
-    total_vencido = sum(f.saldo_pendiente or f.total for f in facturas if f.estado_pago == 'vencida')
-    total_general = total_pendiente + total_vencido
-    
-    # Agrupar por cliente
-    facturas_por_cliente = {}
-    for factura in facturas:
-        if factura.estado_pago in ['pendiente', 'vencida'] and factura.cliente_nombre:
-            cliente = factura.cliente_nombre
-            if cliente not in facturas_por_cliente:
-                facturas_por_cliente[cliente] = {
-                    'cliente': cliente,
-                    'total': 0,
-                    'cantidad': 0
-                }
-            facturas_por_cliente[cliente]['total'] += (factura.saldo_pendiente or factura.total)
-            facturas_por_cliente[cliente]['cantidad'] += 1
-    
-    # ============================================
-    # SOLUCIÓN: AGREGAR datetime AL RETURN
-    # ============================================
-    return render_template("cuentas/cuentas_por_cobrar.html",
-                         facturas=facturas,
-                         total_pendiente=total_pendiente,
-                         total_vencido=total_vencido,
-                         total_general=total_general,
-                         facturas_por_cliente=facturas_por_cliente.values(),
-                         estado_filtro=estado,
-                         datetime=datetime)  # ← AGREGAR ESTA LÍNEA
-                         
 
-@app.route("/marcar_factura_pagada/<int:factura_id>", methods=["POST"])
-@login_required
-def marcar_factura_pagada(factura_id):
+    with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        indices = [sql for (sql,) in conn.execute(text(
+            "SELECT sql FROM sqlite_master WHERE type = 'index' AND tbl_name = 'factura' AND sql IS NOT NULL"))]
+        llaves = conn.exec_driver_sql("PRAGMA foreign_keys").scalar()
+        conn.exec_driver_sql("PRAGMA foreign_keys = OFF")
+        try:
+            conn.exec_driver_sql("BEGIN IMMEDIATE")
+            try:
+                rotas_antes = _referencias_rotas_a_factura(conn)
+                conn.exec_driver_sql(
+                    f"INSERT OR REPLACE INTO factura_nueva ({columnas}) "
+                    f"SELECT {columnas} FROM factura EXCEPT SELECT {columnas} FROM factura_nueva")
+                conn.exec_driver_sql("DELETE FROM factura_nueva WHERE id NOT IN (SELECT id FROM factura)")
+                conn.exec_driver_sql("DROP TABLE factura")
+                conn.exec_driver_sql("ALTER TABLE factura_nueva RENAME TO factura")
+                for sql in indices:
+                    conn.exec_driver_sql(sql)
+                if _referencias_rotas_a_factura(conn) > rotas_antes:
+                    raise RuntimeError("foreign_key_check encontró referencias rotas tras reconstruir factura")
+                conn.exec_driver_sql("COMMIT")
+            except Exception:
+                conn.exec_driver_sql("ROLLBACK")
+                raise
+        finally:
+            conn.exec_driver_sql(f"PRAGMA foreign_keys = {'ON' if llaves else 'OFF'}")
+    logger.info("factura reconstruida: sesion_id ya admite NULL")
+
+
+@migracion(11, 'trabajo_impresion: factura_id (cajón solo en la primera impresión)')
+def migracion_trabajo_impresion_factura(registro, lote):
+    agregar_columnas_faltantes('trabajo_impresion', {'factura_id': 'INTEGER'})
+    for indice in TrabajoImpresion.__table__.indexes:
+        if indice.name == 'ix_trabajo_impresion_factura_id':
+            indice.create(db.engine, checkfirst=True)
+
+# =========================
+# PERFILADOR DE SOLICITUDES (opcional)
+# =========================
+
+# Con PERFILADOR=1 se perfilan las solicitudes de un admin que envíe el header
+# X-Perfilar: 1 y una fracción PERFILADOR_MUESTREO (0 a 1) de las demás. Sin
+# PERFILADOR no se registra ningún hook: el costo apagado es cero.
+PERFILADOR = os.environ.get('PERFILADOR') == '1'
+PERFILADOR_MUESTREO = float(os.environ.get('PERFILADOR_MUESTREO', 0))
+# Endpoints a muestrear separados por comas (vacío = todos); el header funciona en cualquiera
+PERFILADOR_ENDPOINTS = {e.strip() for e in os.environ.get('PERFILADOR_ENDPOINTS', '').split(',') if e.strip()}
+PERFILADOR_MAX = int(os.environ.get('PERFILADOR_MAX', 50))  # Se conservan los más lentos
+PERFILADOR_LINEAS = 40  # Funciones del reporte de cProfile
+PERFILADOR_MAX_CONSULTAS = 2000  # Consultas que se guardan por perfil (el conteo y el tiempo son de todas)
+ENDPOINTS_SIN_PERFIL = ('static', 'servir_asset', 'lista_perfiles', 'ver_perfil', 'borrar_perfiles')
+
+# cProfile no admite dos perfiles activos a la vez: uno por worker, el resto pasa sin perfilar
+_candado_perfil = threading.Lock()
+
+
+class PerfilSolicitud(db.Model):
+    """Perfil de una solicitud: reporte de cProfile y consultas SQL ejecutadas"""
+    __tablename__ = 'perfil_solicitud'
+    id = db.Column(db.Integer, primary_key=True)
+    fecha = db.Column(db.DateTime, default=datetime.now, nullable=False)
+    metodo = db.Column(db.String(10), nullable=False)
+    ruta = db.Column(db.String(500), nullable=False)
+    endpoint = db.Column(db.String(100))
+    estado = db.Column(db.Integer)
+    duracion_ms = db.Column(db.Float, nullable=False, index=True)
+    num_consultas = db.Column(db.Integer, default=0)
+    consultas_ms = db.Column(db.Float, default=0)
+    consultas = db.Column(db.Text)  # JSON [[sql, ms], ...] en orden de ejecución
+    perfil = db.Column(db.Text)
+    forzado = db.Column(db.Boolean, default=False)  # Pedido con el header (no por muestreo)
+    usuario_id = db.Column(db.Integer)
+
+    def lista_consultas(self):
+        return json.loads(self.consultas or '[]')
+
+    def consultas_repetidas(self):
+        """[(sql, veces, ms)] de las sentencias que se ejecutaron más de una vez (N+1)"""
+        grupos = OrderedDict()
+        for sql, ms in self.lista_consultas():
+            veces, total = grupos.get(sql, (0, 0))
+            grupos[sql] = (veces + 1, total + ms)
+        repetidas = [(sql, veces, round(ms, 2)) for sql, (veces, ms) in grupos.items() if veces > 1]
+        return sorted(repetidas, key=lambda r: -r[1])
+
+
+def modo_perfil():
+    """'forzado', 'muestreo' o None según el header, el rol y la tasa de muestreo"""
+    if request.endpoint is None or request.endpoint in ENDPOINTS_SIN_PERFIL:
+        return None
+    if (request.headers.get('X-Perfilar') == '1'
+            and current_user.is_authenticated and current_user.rol == 'admin'):
+        return 'forzado'
+    if (PERFILADOR_MUESTREO
+            and (not PERFILADOR_ENDPOINTS or request.endpoint in PERFILADOR_ENDPOINTS)
+            and random.random() < PERFILADOR_MUESTREO):
+        return 'muestreo'
+    return None
+
+
+def guardar_perfil(perfil, consultas, duracion, estado, forzado):
     """
-    RAZÓN: Marca una factura como pagada cuando el cliente paga.
+    Guarda el perfil en su propia transacción (no toca la sesión de la vista)
+    y recorta la tabla a los PERFILADOR_MAX más lentos.
     """
-    factura = Factura.query.get_or_404(factura_id)
-    
-    monto_pago = request.form.get('monto_pago', type=float)
-    
-    if not monto_pago:
-        monto_pago = factura.saldo_pendiente or factura.total
-    
-    # Calcular saldo pendiente
-    saldo_actual = factura.saldo_pendiente or factura.total
-    nuevo_saldo = saldo_actual - monto_pago
-    
-    if nuevo_saldo <= 0:
-        # Pago completo
-        factura.estado_pago = 'pagada'
-        factura.saldo_pendiente = 0
-        factura.fecha_pago_real = datetime.now()
-        flash(f'Factura {factura.numero_consecutivo} marcada como pagada completamente', 'success')
-    else:
-        # Pago parcial
-        factura.saldo_pendiente = nuevo_saldo
-        flash(f'Pago parcial registrado. Saldo pendiente: ${nuevo_saldo:,.2f}', 'success')
-    
+    salida = io.StringIO()
+    pstats.Stats(perfil, stream=salida).strip_dirs().sort_stats('cumulative').print_stats(PERFILADOR_LINEAS)
+    tabla = PerfilSolicitud.__table__
+    conservar = (db.select(tabla.c.id).order_by(tabla.c.duracion_ms.desc())
+                 .limit(PERFILADOR_MAX).scalar_subquery())
+    with db.engine.begin() as conn:
+        resultado = conn.execute(tabla.insert().values(
+            fecha=datetime.now(),
+            metodo=request.method,
+            ruta=request.full_path.rstrip('?')[:500],
+            endpoint=request.endpoint,
+            estado=estado,
+            duracion_ms=round(duracion * 1000, 2),
+            num_consultas=len(consultas),
+            consultas_ms=round(sum(ms for _, ms in consultas), 2),
+            consultas=json.dumps(consultas[:PERFILADOR_MAX_CONSULTAS], ensure_ascii=False),
+            perfil=salida.getvalue(),
+            forzado=forzado,
+            usuario_id=current_user.id if current_user.is_authenticated else None,
+        ))
+        conn.execute(tabla.delete().where(tabla.c.id.not_in(conservar)))
+    return resultado.inserted_primary_key[0]
+
+
+if PERFILADOR:
+    @event.listens_for(Engine, 'before_cursor_execute')
+    def marcar_consulta(conn, cursor, sql, parametros, contexto, executemany):
+        if has_request_context() and 'perfil_consultas' in g:
+            g.perfil_inicio_consulta = time.perf_counter()
+
+    @event.listens_for(Engine, 'after_cursor_execute')
+    def anotar_consulta(conn, cursor, sql, parametros, contexto, executemany):
+        if has_request_context() and 'perfil_consultas' in g:
+            ms = (time.perf_counter() - g.perfil_inicio_consulta) * 1000
+            g.perfil_consultas.append([sql, round(ms, 2)])
+
+    @app.before_request
+    def iniciar_perfil():
+        modo = modo_perfil()
+        if modo is None or not _candado_perfil.acquire(blocking=False):
+            return
+        g.perfil_forzado = modo == 'forzado'
+        g.perfil_consultas = []
+        g.perfil_inicio = time.perf_counter()
+        g.perfil = cProfile.Profile()
+        g.perfil.enable()
+
+    @app.after_request
+    def terminar_perfil(respuesta):
+        """
+        RAZÓN: Registrado después de comprimir_y_etag, corre antes que él: el
+        perfil mide la vista y no la compresión.
+        """
+        perfil = g.get('perfil')
+        if perfil is None:
+            return respuesta
+        perfil.disable()
+        duracion = time.perf_counter() - g.perfil_inicio
+        consultas = g.pop('perfil_consultas')
+        try:
+            perfil_id = guardar_perfil(perfil, consultas, duracion, respuesta.status_code, g.perfil_forzado)
+            if g.perfil_forzado:
+                respuesta.headers['X-Perfil'] = url_for('ver_perfil', perfil_id=perfil_id)
+        except Exception as e:
+            logger.warning(f"No se pudo guardar el perfil de {request.path}: {e}")
+        return respuesta
+
+    @app.teardown_request
+    def liberar_perfil(exc):
+        """Libera el candado también si la vista lanzó una excepción (after_request no corre)"""
+        perfil = g.pop('perfil', None)
+        g.pop('perfil_consultas', None)
+        if perfil is not None:
+            perfil.disable()
+            _candado_perfil.release()
+
+
+@app.route("/admin/perfiles")
+@login_required
+def lista_perfiles():
+    """Perfiles guardados, del más lento al más rápido"""
+    if current_user.rol != 'admin':
+        flash('Solo los administradores pueden ver los perfiles', 'error')
+        return redirect(url_for('dashboard'))
+    perfiles = (PerfilSolicitud.query
+                .options(db.defer(PerfilSolicitud.perfil), db.defer(PerfilSolicitud.consultas))
+                .order_by(PerfilSolicitud.duracion_ms.desc()).all())
+    return render_template("admin/perfiles.html", perfiles=perfiles, activo=PERFILADOR,
+                           muestreo=PERFILADOR_MUESTREO, endpoints=sorted(PERFILADOR_ENDPOINTS))
+
+
+@app.route("/admin/perfiles/<int:perfil_id>")
+@login_required
+def ver_perfil(perfil_id):
+    if current_user.rol != 'admin':
+        flash('Solo los administradores pueden ver los perfiles', 'error')
+        return redirect(url_for('dashboard'))
+    perfil = PerfilSolicitud.query.get_or_404(perfil_id)
+    return render_template("admin/perfil.html", perfil=perfil)
+
+
+@app.route("/admin/perfiles/borrar", methods=["POST"])
+@login_required
+def borrar_perfiles():
+    if current_user.rol != 'admin':
+        flash('Solo los administradores pueden borrar los perfiles', 'error')
+        return redirect(url_for('dashboard'))
+    PerfilSolicitud.query.delete()
     db.session.commit()
-    
-    return redirect(request.referrer or url_for('cuentas_por_cobrar'))
+    flash('Perfiles borrados', 'success')
+    return redirect(url_for('lista_perfiles'))
+
+
+# =========================
+# MEMORIA POR WORKER (opcional)
+# =========================
 
+# Con MEMORIA=1 cada worker activa tracemalloc y anota por ruta el pico de
+# memoria asignada durante la solicitud y lo que seguía asignado al terminar
+# (incluye el cuerpo de la respuesta y los ciclos que el gc aún no recogió).
+# Los workers guardan sus cifras en MEMORIA_DIR y /admin/memoria las junta.
+MEMORIA = os.environ.get('MEMORIA') == '1'
+MEMORIA_DIR = os.environ.get('MEMORIA_DIR', os.path.join(app.instance_path, 'memoria'))
+MEMORIA_FRAMES = int(os.environ.get('MEMORIA_FRAMES', 1))  # Más frames = diffs más claros pero más costo
+MEMORIA_GUARDAR_CADA = 50  # Solicitudes entre escrituras del archivo del worker
+MEMORIA_CALENTAMIENTO = 200  # Solicitudes antes de fijar la RSS base (cachés, imports perezosos)
+# Crecimiento que se tolera por worker antes de reciclarlo (para calcular max_requests)
+MEMORIA_CRECIMIENTO_MAX_MB = int(os.environ.get('MEMORIA_CRECIMIENTO_MAX_MB', 150))
+ENDPOINTS_SIN_MEDIR = ('static', 'servir_asset', 'ver_memoria', 'pedir_snapshot_memoria')
+
+
+def rss_actual():
+    """Memoria residente del proceso en bytes (/proc en Linux; si no, el máximo de getrusage)"""
+    try:
+        with open('/proc/self/statm') as archivo:
+            return int(archivo.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
 
 
+def recomendar_max_requests(bytes_por_solicitud):
+    """max_requests para que un worker crezca como mucho MEMORIA_CRECIMIENTO_MAX_MB (None si no crece)"""
+    if not bytes_por_solicitud or bytes_por_solicitud <= 0:
+        return None
+    maximo = int(MEMORIA_CRECIMIENTO_MAX_MB * 1024 * 1024 / bytes_por_solicitud)
+    return min(max(maximo, 500), 100000)
 
-@app.route("/configuracion_restaurante", methods=["GET", "POST"])
+
+class MedidorMemoria:
+    """
+    RAZÓN: Cifras de memoria de un worker. tracemalloc es global al proceso:
+    con workers sync (los del Procfile) cada pico es de una sola solicitud;
+    con --threads los picos de solicitudes simultáneas se mezclan.
+    Los snapshots se piden escribiendo un archivo en MEMORIA_DIR que cada
+    worker revisa (como mucho una vez por segundo), así el diff cubre a todos
+    los workers y no solo al que atendió el clic.
+    """
+
+    def __init__(self, carpeta):
+        self.carpeta = carpeta
+        self.pid = os.getpid()
+        self.inicio = datetime.now()
+        self.candado = threading.Lock()
+        self.solicitudes = 0
+        self.rss_inicial = rss_actual()
+        self.rss_base = None
+        self.rutas = {}
+        self.snapshot = None
+        self.snapshot_momento = 0
+        self.diferencias = []
+        self.diferencias_desde = None
+        self.ultima_revision = 0
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(MEMORIA_FRAMES)
+
+    def iniciar(self):
+        tracemalloc.reset_peak()
+        return tracemalloc.get_traced_memory()[0]
+
+    def registrar(self, endpoint, antes):
+        actual, pico = tracemalloc.get_traced_memory()
+        with self.candado:
+            datos = self.rutas.setdefault(endpoint, {'solicitudes': 0, 'pico_total': 0, 'pico_max': 0, 'retenido': 0})
+            datos['solicitudes'] += 1
+            datos['pico_total'] += pico - antes
+            datos['pico_max'] = max(datos['pico_max'], pico - antes)
+            datos['retenido'] += actual - antes
+            self.solicitudes += 1
+            if self.solicitudes == MEMORIA_CALENTAMIENTO:
+                self.rss_base = rss_actual()
+            guardar = self.solicitudes % MEMORIA_GUARDAR_CADA == 0
+        if guardar:
+            self.guardar()
+
+    def revisar_pedido(self, forzar=False):
+        """Toma un snapshot si se pidió uno después del último (ver pedir_snapshot_memoria)"""
+        ahora = time.time()
+        if not forzar and ahora - self.ultima_revision < 1:
+            return
+        self.ultima_revision = ahora
+        try:
+            pedido = os.path.getmtime(os.path.join(self.carpeta, 'pedido_snapshot'))
+        except OSError:
+            return
+        if pedido > self.snapshot_momento:
+            self.tomar_snapshot()
+
+    def tomar_snapshot(self):
+        """Nuevo snapshot del heap; si había uno, guarda las líneas que más crecieron desde entonces"""
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+        ))
+        with self.candado:
+            if self.snapshot is not None:
+                self.diferencias = [{
+                    'linea': str(diferencia.traceback[0]),
+                    'kb': round(diferencia.size_diff / 1024, 1),
+                    'bloques': diferencia.count_diff,
+                    'total_kb': round(diferencia.size / 1024, 1),
+                } for diferencia in snapshot.compare_to(self.snapshot, 'lineno')[:25]]
+                self.diferencias_desde = datetime.fromtimestamp(self.snapshot_momento).isoformat(timespec='seconds')
+            self.snapshot = snapshot
+            self.snapshot_momento = time.time()
+        self.guardar()
+
+    def resumen(self):
+        rss = rss_actual()
+        con_base = self.solicitudes - MEMORIA_CALENTAMIENTO
+        por_solicitud = (rss - self.rss_base) / con_base if self.rss_base and con_base > 0 else None
+        return {
+            'pid': self.pid,
+            'inicio': self.inicio.isoformat(timespec='seconds'),
+            'actualizado': datetime.now().isoformat(timespec='seconds'),
+            'solicitudes': self.solicitudes,
+            'rss_inicial': self.rss_inicial,
+            'rss_base': self.rss_base,
+            'rss': rss,
+            'rastreado': tracemalloc.get_traced_memory()[0],
+            'bytes_por_solicitud': por_solicitud,
+            'max_requests': recomendar_max_requests(por_solicitud),
+            'rutas': self.rutas,
+            'snapshot': (datetime.fromtimestamp(self.snapshot_momento).isoformat(timespec='seconds')
+                         if self.snapshot else None),
+            'diferencias_desde': self.diferencias_desde,
+            'diferencias': self.diferencias,
+        }
+
+    def guardar(self):
+        with self.candado:
+            resumen = self.resumen()
+        try:
+            os.makedirs(self.carpeta, exist_ok=True)
+            ruta = os.path.join(self.carpeta, f'memoria_{self.pid}.json')
+            with open(ruta + '.tmp', 'w', encoding='utf-8') as archivo:
+                json.dump(resumen, archivo)
+            os.replace(ruta + '.tmp', ruta)
+        except OSError as e:
+            logger.warning(f"No se pudieron guardar las cifras de memoria: {e}")
+
+
+_medidor = None
+
+
+def medidor_memoria():
+    """El medidor de este worker (se crea en el primer request, ya después del fork de gunicorn)"""
+    global _medidor
+    if _medidor is None or _medidor.pid != os.getpid():
+        _medidor = MedidorMemoria(MEMORIA_DIR)
+    return _medidor
+
+
+def leer_medidas_memoria(horas=24):
+    """Cifras de todos los workers actualizadas en las últimas `horas`"""
+    workers = []
+    limite = time.time() - horas * 3600
+    for ruta in glob.glob(os.path.join(MEMORIA_DIR, 'memoria_*.json')):
+        try:
+            if os.path.getmtime(ruta) < limite:
+                continue
+            with open(ruta, encoding='utf-8') as archivo:
+                workers.append(json.load(archivo))
+        except (OSError, ValueError):
+            continue
+    return sorted(workers, key=lambda w: w['pid'])
+
+
+def rutas_con_mas_memoria(workers, limite=15):
+    """Rutas ordenadas por pico máximo, sumando las cifras de todos los workers"""
+    rutas = {}
+    for worker in workers:
+        for endpoint, datos in worker['rutas'].items():
+            total = rutas.setdefault(endpoint, {'endpoint': endpoint, 'solicitudes': 0, 'pico_total': 0,
+                                                'pico_max': 0, 'retenido': 0})
+            total['solicitudes'] += datos['solicitudes']
+            total['pico_total'] += datos['pico_total']
+            total['pico_max'] = max(total['pico_max'], datos['pico_max'])
+            total['retenido'] += datos['retenido']
+    for total in rutas.values():
+        total['pico_promedio'] = total['pico_total'] / total['solicitudes']
+        total['retenido_promedio'] = total['retenido'] / total['solicitudes']
+    return sorted(rutas.values(), key=lambda r: -r['pico_max'])[:limite]
+
+
+if MEMORIA:
+    @app.before_request
+    def iniciar_medicion_memoria():
+        if request.endpoint is None or request.endpoint in ENDPOINTS_SIN_MEDIR:
+            return
+        medidor = medidor_memoria()
+        medidor.revisar_pedido()
+        g.memoria_antes = medidor.iniciar()
+
+    @app.teardown_request
+    def terminar_medicion_memoria(exc):
+        antes = g.pop('memoria_antes', None)
+        if antes is not None:
+            # Cerrar la sesión antes de medir (Flask-SQLAlchemy la cierra igual al terminar):
+            # si no, "retenido" incluiría todos los objetos cargados por la vista
+            db.session.remove()
+            medidor_memoria().registrar(request.endpoint, antes)
+
+
+@app.route("/admin/memoria")
 @login_required
-def configuracion_restaurante():
-    """Configurar datos del restaurante"""
+def ver_memoria():
+    """Memoria de los workers, rutas que más asignan y diff del último snapshot"""
     if current_user.rol != 'admin':
-        flash('Solo los administradores pueden modificar la configuración', 'error')
+        flash('Solo los administradores pueden ver la memoria de los workers', 'error')
         return redirect(url_for('dashboard'))
-    
-    config = ConfiguracionRestaurante.query.first()
-    
-    if not config:
-        config = ConfiguracionRestaurante()
-        db.session.add(config)
-        db.session.commit()
-    
-    if request.method == "POST":
-        config.nombre = request.form.get("nombre")
-        config.nit = request.form.get("nit")
-        config.direccion = request.form.get("direccion")
-        config.ciudad = request.form.get("ciudad")
-        config.telefono = request.form.get("telefono")
-        config.email = request.form.get("email", "")
-        config.regimen = request.form.get("regimen")
-        config.resolucion_dian = request.form.get("resolucion_dian", "")
-        config.rango_facturacion = request.form.get("rango_facturacion", "")
-        config.iva_porcentaje = request.form.get("iva_porcentaje", 19.0, type=float)
-        config.logo_url = request.form.get("logo_url", "")
-        
+    if MEMORIA:
+        medidor = medidor_memoria()
+        medidor.revisar_pedido(forzar=True)
+        medidor.guardar()
+    workers = leer_medidas_memoria()
+    return render_template("admin/memoria.html", activo=MEMORIA, workers=workers,
+                           rutas=rutas_con_mas_memoria(workers), pid_actual=os.getpid(),
+                           calentamiento=MEMORIA_CALENTAMIENTO, crecimiento_max_mb=MEMORIA_CRECIMIENTO_MAX_MB)
+
+
+@app.route("/admin/memoria/snapshot", methods=["POST"])
+@login_required
+def pedir_snapshot_memoria():
+    """
+    Pide a todos los workers un snapshot del heap. El primero sirve de base;
+    los siguientes muestran qué líneas crecieron desde el anterior.
+    """
+    if current_user.rol != 'admin':
+        flash('Solo los administradores pueden tomar snapshots de memoria', 'error')
+        return redirect(url_for('dashboard'))
+    if not MEMORIA:
+        flash('La medición de memoria está apagada (MEMORIA=1)', 'error')
+        return redirect(url_for('ver_memoria'))
+    os.makedirs(MEMORIA_DIR, exist_ok=True)
+    with open(os.path.join(MEMORIA_DIR, 'pedido_snapshot'), 'w') as archivo:
+        archivo.write(datetime.now().isoformat())
+    medidor_memoria().revisar_pedido(forzar=True)
+    flash('Snapshot pedido: cada worker lo toma en su próxima solicitud', 'success')
+    return redirect(url_for('ver_memoria'))
+
+
+@app.cli.command("memoria")
+def comando_memoria():
+    """Crecimiento medido por worker y el max_requests recomendado para gunicorn."""
+    workers = leer_medidas_memoria()
+    if not workers:
+        print(f"❌ No hay cifras en {MEMORIA_DIR} (arrancar los workers con MEMORIA=1)")
+        return
+    recomendados = []
+    for worker in workers:
+        por_solicitud = worker['bytes_por_solicitud']
+        print(f"  worker {worker['pid']}: {worker['solicitudes']:,} solicitudes, "
+              f"RSS {worker['rss'] / 1048576:.0f} MB, "
+              + (f"{por_solicitud / 1024:.1f} KB/solicitud" if por_solicitud is not None else "sin base aún"))
+        if worker['max_requests']:
+            recomendados.append(worker['max_requests'])
+    if not recomendados:
+        print("✅ Sin crecimiento medible: no hace falta reciclar workers")
+        return
+    max_requests = min(recomendados)
+    recomendacion = {'max_requests': max_requests, 'max_requests_jitter': max_requests // 10,
+                     'fecha': datetime.now().isoformat(timespec='seconds')}
+    with open(os.path.join(MEMORIA_DIR, 'recomendacion.json'), 'w', encoding='utf-8') as archivo:
+        json.dump(recomendacion, archivo)
+    print(f"✅ max_requests={max_requests} max_requests_jitter={max_requests // 10} "
+          f"(tope de {MEMORIA_CRECIMIENTO_MAX_MB} MB por worker); lo toma gunicorn.conf.py al reiniciar")
+
+# =========================
+# RUTAS
+# =========================
+# ==========================================
+# ACTUALIZAR RUTA DE FACTURAR SESIÓN
+# ==========================================
+
+# REEMPLAZA tu ruta actual de facturar_sesion con esta versión mejorada:
+
+def registrar_pagos_factura(factura, desglose=None, fecha=None):
+    """
+    Registra en el libro de pagos el cobro de una factura pagada:
+    una fila por método del desglose (pago mixto) o una sola por el total.
+    """
+    fecha = fecha or datetime.now()
+    usuario_id = current_user.id if current_user and current_user.is_authenticated else None
+    if desglose:
+        for metodo, monto in desglose.items():
+            if monto:
+                db.session.add(Pago(factura=factura, metodo=metodo, monto=monto, fecha=fecha, usuario_id=usuario_id))
+    elif factura.total:
+        db.session.add(Pago(factura=factura, metodo=factura.metodo_pago or 'efectivo',
+                            monto=factura.total, fecha=fecha, usuario_id=usuario_id))
+
+
+def error_desglose(desglose, total):
+    """
+    Mensaje de error si el desglose de un pago mixto no cuadra con el total a
+    cobrar (o trae montos negativos); None si está bien.
+    """
+    if any((monto or 0) < 0 for monto in desglose.values()):
+        return 'Los montos del pago mixto no pueden ser negativos'
+    suma = sum(monto or 0 for monto in desglose.values())
+    if abs(suma - (total or 0)) > 0.01:
+        return f'El pago mixto suma ${suma:,.0f} pero el total a cobrar es ${total or 0:,.0f}'
+    return None
+
+
+def desglose_de_pagos(factura_id, sin_abonos=False):
+    """
+    Total pagado por método para una factura: {'efectivo': 20000, 'tarjeta': 15000}.
+    Con sin_abonos=True solo cuenta el cobro al facturar.
+    """
+    consulta = db.session.query(Pago.metodo, db.func.sum(Pago.monto)).filter(Pago.factura_id == factura_id)
+    if sin_abonos:
+        consulta = consulta.filter(Pago.tipo != 'abono')
+    filas = consulta.group_by(Pago.metodo).all()
+    return {metodo: float(total) for metodo, total in filas}
+
+
+def totales_por_metodo(inicio, fin):
+    """Dinero recibido por método de pago en [inicio, fin) con un solo GROUP BY"""
+    P = historico(Pago, inicio)
+    filas = db.session.query(P.metodo, db.func.sum(P.monto)).filter(
+        P.fecha >= inicio,
+        P.fecha < fin
+    ).group_by(P.metodo).order_by(P.metodo).all()
+    return {metodo: float(total) for metodo, total in filas}
+
+
+def migrar_desglose_a_pagos(lote=500):
+    """
+    Llena el libro de pagos para facturas antiguas que aún no tienen filas en Pago,
+    leyendo el JSON de desglose_pago. Procesa por lotes y es seguro de repetir.
+    """
+    migradas = 0
+    ultimo_id = 0
+    while True:
+        facturas = Factura.query.filter(
+            Factura.id > ultimo_id,
+            ~db.exists().where(Pago.factura_id == Factura.id)
+        ).order_by(Factura.id).limit(lote).all()
+        if not facturas:
+            break
+        for factura in facturas:
+            ultimo_id = factura.id
+            if factura.estado_pago == 'pagada':
+                desglose = None
+                if factura.desglose_pago:
+                    try:
+                        desglose = json.loads(factura.desglose_pago)
+                    except ValueError:
+                        desglose = None
+                fecha = factura.fecha_pago_real or factura.fecha_emision
+                if desglose:
+                    for metodo, monto in desglose.items():
+                        if monto:
+                            db.session.add(Pago(factura_id=factura.id, metodo=metodo, monto=monto, fecha=fecha))
+                elif factura.total:
+                    db.session.add(Pago(factura_id=factura.id, metodo=factura.metodo_pago or 'efectivo',
+                                        monto=factura.total, fecha=fecha))
+            elif factura.saldo_pendiente and factura.total and factura.saldo_pendiente < factura.total:
+                # Abonos parciales de antes del libro de pagos: una sola fila con lo abonado
+                db.session.add(Pago(factura_id=factura.id, metodo='efectivo', tipo='abono',
+                                    monto=factura.total - factura.saldo_pendiente,
+                                    fecha=factura.fecha_emision))
         db.session.commit()
-        flash('Configuración actualizada exitosamente', 'success')
-        return redirect(url_for('configuracion_restaurante'))
-    
-    return render_template("configuracion_restaurante.html", config=config, now=datetime.now())
+        migradas += len(facturas)
+    if migradas:
+        logger.info(f"Libro de pagos: {migradas} facturas antiguas revisadas")
 
-# Actualizar la función init_db() para incluir la configuración inicial
-def init_db_facturacion():
-    """Agregar esto dentro de tu función init_db() existente"""
-    # Crear configuración del restaurante si no existe
-    if ConfiguracionRestaurante.query.count() == 0:
-        config = ConfiguracionRestaurante(
-            nombre='Mi Restaurante',
-            nit='900.000.000-0',
-            direccion='Calle 123 #45-67',
-            ciudad='Zarzal, Valle del Cauca',
-            telefono='(+57) 300 000 0000',
-            regimen='Régimen Simplificado'
+
+# Llave del advisory lock de Postgres que serializa la numeración de facturas
+LLAVE_NUMERACION_FACTURAS = 270001
+
+
+def bloquear_numeracion_facturas():
+    """
+    RAZÓN: El consecutivo sale de la última factura, y el candado de la mesa solo
+    serializa una mesa: dos mesas (o un domicilio) facturadas a la vez leerían el
+    mismo número. Se toma un candado global hasta el commit/rollback: en Postgres
+    un advisory lock de transacción; en SQLite una escritura vacía que toma el
+    candado de escritura de la base, igual que bloquear_mesa.
+    """
+    if db.engine.dialect.name == 'sqlite':
+        db.session.execute(text("UPDATE factura SET id = id WHERE 0 = 1"))
+    else:
+        db.session.execute(text("SELECT pg_advisory_xact_lock(:llave)"), {'llave': LLAVE_NUMERACION_FACTURAS})
+
+
+def siguiente_numero_factura():
+    """
+    Número siguiente al de la última factura emitida (FACT-000123 → 124).
+    Bloquea la numeración hasta el commit, así que los números que se reserven
+    (dividir_sesion usa numero + i) no los toma otra transacción.
+    """
+    bloquear_numeracion_facturas()
+    ultima_factura = Factura.query.order_by(Factura.id.desc()).first()
+    if ultima_factura:
+        return int(ultima_factura.numero_consecutivo.split('-')[1]) + 1
+    return 1
+
+
+def repartir_monto(monto, pesos):
+    """
+    Reparte un monto proporcionalmente a los pesos, redondeando a centavos.
+    La última parte absorbe el residuo para que la suma sea exacta.
+    """
+    total_pesos = sum(pesos)
+    partes = []
+    for peso in pesos[:-1]:
+        partes.append(round(monto * peso / total_pesos, 2) if total_pesos else 0)
+    partes.append(round(monto - sum(partes), 2))
+    return partes
+
+
+def dividir_sesion(sesion, divisiones, metodo_pago='efectivo', propina=0, cliente_nombre='', notas=''):
+    """
+    RAZÓN: Dividir la cuenta de una mesa en varias facturas en una sola transacción.
+    divisiones es una lista donde cada elemento es:
+      - {'pedido_ids': [...]}  → la factura cobra esos pedidos (subtotal con una agregación)
+      - {'monto': 12000}       → la factura cobra ese monto (partes iguales o montos libres)
+    Todas las divisiones deben ser del mismo tipo y cubrir exactamente la sesión.
+    La propina se reparte proporcionalmente al subtotal de cada factura.
+    No hace commit; lanza ValueError si la división no es válida.
+    """
+    if len(divisiones) < 2:
+        raise ValueError('La cuenta debe dividirse en al menos 2 partes')
+
+    monto_pedido = Pedido.cantidad * Pedido.precio_unitario
+    subtotal_sesion = db.session.query(
+        db.func.coalesce(db.func.sum(monto_pedido), 0)
+    ).filter(Pedido.sesion_id == sesion.id).scalar() or 0
+
+    por_pedidos = all('pedido_ids' in d for d in divisiones)
+    if por_pedidos:
+        ids_sesion = {pid for (pid,) in db.session.query(Pedido.id).filter(Pedido.sesion_id == sesion.id)}
+        ids_asignados = [pid for d in divisiones for pid in d['pedido_ids']]
+        if len(ids_asignados) != len(set(ids_asignados)) or set(ids_asignados) != ids_sesion:
+            raise ValueError('Cada pedido de la mesa debe quedar en exactamente una cuenta')
+        if any(not d['pedido_ids'] for d in divisiones):
+            raise ValueError('Hay cuentas sin pedidos asignados')
+        subtotales = [
+            db.session.query(db.func.coalesce(db.func.sum(monto_pedido), 0)).filter(
+                Pedido.sesion_id == sesion.id,
+                Pedido.id.in_(d['pedido_ids'])
+            ).scalar() or 0
+            for d in divisiones
+        ]
+    elif all('monto' in d for d in divisiones):
+        subtotales = [round(float(d['monto']), 2) for d in divisiones]
+        if any(m <= 0 for m in subtotales):
+            raise ValueError('Todos los montos deben ser mayores a cero')
+        if abs(sum(subtotales) - subtotal_sesion) > 0.01:
+            raise ValueError(f'Los montos suman ${sum(subtotales):,.0f} pero la cuenta es de ${subtotal_sesion:,.0f}')
+    else:
+        raise ValueError('No se pueden mezclar divisiones por pedidos y por montos')
+
+    propinas = repartir_monto(propina, subtotales)
+    ahora = datetime.now()
+    numero = siguiente_numero_factura()
+    facturas = []
+
+    for i, (division, subtotal, propina_parte) in enumerate(zip(divisiones, subtotales, propinas)):
+        factura = Factura(
+            numero_consecutivo=f"FACT-{numero + i:06d}",
+            sesion_id=sesion.id,
+            subtotal=subtotal,
+            iva=0,
+            propina=propina_parte,
+            total=subtotal + propina_parte,
+            metodo_pago=metodo_pago,
+            cliente_nombre=cliente_nombre,
+            cliente_documento='',
+            notas=notas,
+            estado_pago='pagada',
+            fecha_pago_real=ahora,
+            saldo_pendiente=0,
+            division=f"{i + 1}/{len(divisiones)}"
         )
-        db.session.add(config)
-        db.session.commit()
+        db.session.add(factura)
+        db.session.flush()
+
+        if por_pedidos:
+            db.session.query(Pedido).filter(
+                Pedido.id.in_(division['pedido_ids'])
+            ).update({"factura_id": factura.id}, synchronize_session=False)
+        registrar_pagos_factura(factura, fecha=ahora)
+        facturas.append(factura)
+
+    # Cerrar la sesión igual que facturar_sesion
+    sesion.total = subtotal_sesion + propina
+    sesion.activa = False
+    sesion.fecha_fin = ahora
+    sesion.subtotal = subtotal_sesion
+    sesion.pagado = subtotal_sesion
+    sesion.pendiente = 0
+    db.session.query(Pedido).filter(Pedido.sesion_id == sesion.id).update(
+        {"pagado": True, "estado": "entregado"}, synchronize_session=False
+    )
+    return facturas
 
-        
-@app.route("/", methods=["GET", "POST"])
-def login():
-    if current_user.is_authenticated:
-        return redirect(url_for('dashboard'))
+
+@app.route("/dividir_cuenta/<int:sesion_id>", methods=["GET", "POST"])
+@login_required
+@idempotente
+def dividir_cuenta(sesion_id):
+    """
+    RAZÓN: Cobrar una mesa grande en varias facturas (por pedidos, partes iguales o montos)
+    sin cálculos manuales ni facturar pedido por pedido.
+    """
+    sesion = Sesion.query.get_or_404(sesion_id)
+    pedidos = Pedido.query.filter_by(sesion_id=sesion.id).order_by(Pedido.fecha).all()
     
     if request.method == "POST":
-        username = request.form.get("username")
-        password = request.form.get("password")
+        bloquear_mesa(sesion.mesa_id)
+        db.session.refresh(sesion)
         
-        usuario = Usuario.query.filter_by(username=username).first()
+        factura_existente = Factura.query.filter_by(sesion_id=sesion.id).first()
+        if factura_existente:
+            db.session.rollback()
+            flash(f'Esta sesión ya fue facturada ({factura_existente.numero_consecutivo})', 'error')
+            return redirect(url_for('ver_factura', factura_id=factura_existente.id))
         
-        if usuario and usuario.check_password(password):
-            login_user(usuario)
-            flash(f'Bienvenido, {usuario.nombre}!', 'success')
-            return redirect(url_for('dashboard'))
-        else:
-            flash('Usuario o contraseña incorrectos', 'error')
+        modo = request.form.get("modo", "iguales")
+        metodo_pago = request.form.get("metodo_pago", "efectivo")
+        propina = request.form.get("propina", 0, type=float)
+        cliente_nombre = request.form.get("cliente_nombre", "")
+        notas = request.form.get("notas", "")
+        
+        try:
+            if modo == "pedidos":
+                # Cada pedido trae el número de cuenta al que pertenece: cuenta_<pedido_id>
+                grupos = {}
+                for pedido in Pedido.query.filter_by(sesion_id=sesion.id):
+                    cuenta = request.form.get(f"cuenta_{pedido.id}", type=int)
+                    if not cuenta:
+                        raise ValueError(f'Falta asignar cuenta a "{pedido.producto}"')
+                    grupos.setdefault(cuenta, []).append(pedido.id)
+                divisiones = [{'pedido_ids': grupos[c]} for c in sorted(grupos)]
+            elif modo == "montos":
+                montos = [m for m in request.form.getlist("monto", type=float) if m]
+                divisiones = [{'monto': m} for m in montos]
+            else:
+                partes = request.form.get("partes", 2, type=int)
+                subtotal = sesion.subtotal or 0
+                divisiones = [{'monto': m} for m in repartir_monto(subtotal, [1] * max(partes, 1))]
+            
+            facturas = dividir_sesion(sesion, divisiones,
+                                      metodo_pago=metodo_pago,
+                                      propina=propina,
+                                      cliente_nombre=cliente_nombre,
+                                      notas=notas)
+            db.session.commit()
+        except ValueError as e:
+            db.session.rollback()
+            flash(str(e), 'error')
+            return redirect(url_for('dividir_cuenta', sesion_id=sesion_id))
+        
+        numeros = ', '.join(f.numero_consecutivo for f in facturas)
+        flash(f'Cuenta dividida en {len(facturas)} facturas: {numeros}', 'success')
+        return redirect(url_for('ver_factura', factura_id=facturas[0].id))
     
-    return render_template("login.html")
-
-@app.route("/logout")
-@login_required
-def logout():
-    logout_user()
-    flash('Sesión cerrada exitosamente', 'success')
-    return redirect(url_for('login'))
+    return render_template("dividir_cuenta.html",
+                         sesion=sesion,
+                         pedidos=pedidos,
+                         subtotal=sesion.subtotal or 0)
 
-@app.route("/dashboard")
+@app.route("/facturar_sesion/<int:sesion_id>", methods=["GET", "POST"])
 @login_required
-def dashboard():
-    if current_user.rol == 'cocina':
-        return redirect(url_for('cocina'))
-    
-    mesas = Mesa.query.filter_by(activa=True).order_by(Mesa.numero).all()
-    
-    # Obtener solo sesiones activas de hoy
-    hoy = datetime.now().date()
-    sesiones_activas = Sesion.query.filter(
-        Sesion.activa == True,
-        db.func.date(Sesion.fecha_inicio) == hoy
-    ).all()
+@idempotente
+def facturar_sesion(sesion_id):
+    """
+    Generar factura para una sesión - AHORA CON ESTADO DE PAGO
+    """
+    sesion = Sesion.query.get_or_404(sesion_id)
+    config = obtener_configuracion()
     
-    # Agrupar por mesa con información de la sesión activa
-    info_mesas = {}
-    for mesa in mesas:
-        # Buscar sesión activa de esta mesa
-        sesion_activa = next((s for s in sesiones_activas if s.mesa_id == mesa.id), None)
+    if request.method == "POST":
+        # Bloquear la mesa: ningún pedido nuevo entra a la sesión mientras se factura
+        bloquear_mesa(sesion.mesa_id)
+        db.session.refresh(sesion)
         
-        if sesion_activa:
-            # Obtener pedidos de la sesión activa
-            pedidos = Pedido.query.filter_by(sesion_id=sesion_activa.id).all()
-            
-            info_mesas[mesa.id] = {
-                'mesa': mesa,
-                'sesion': sesion_activa,
-                'pedidos': pedidos,
-                'tiene_pendientes': any(not p.pagado for p in pedidos),
-                'todos_entregados': all(p.estado == 'entregado' for p in pedidos),
-                'total_pedidos': len(pedidos),
-                'hora_inicio': sesion_activa.fecha_inicio.strftime('%H:%M')
-            }
-        else:
-            info_mesas[mesa.id] = {
-                'mesa': mesa,
-                'sesion': None,
-                'pedidos': [],
-                'tiene_pendientes': False,
-                'todos_entregados': False,
-                'total_pedidos': 0,
-                'hora_inicio': None
+        factura_existente = Factura.query.filter_by(sesion_id=sesion.id).first()
+        if factura_existente:
+            db.session.rollback()
+            flash(f'Esta sesión ya fue facturada ({factura_existente.numero_consecutivo})', 'error')
+            return redirect(url_for('ver_factura', factura_id=factura_existente.id))
+        
+        # Obtener datos del formulario
+        metodo_pago = request.form.get("metodo_pago", "efectivo")
+        propina = request.form.get("propina", 0, type=float)
+        cliente_nombre = request.form.get("cliente_nombre", "")
+        cliente_documento = request.form.get("cliente_documento", "")
+        notas = request.form.get("notas", "")
+        
+        # NUEVOS CAMPOS
+        estado_pago = request.form.get("estado_pago", "pagada")
+        fecha_vencimiento_str = request.form.get("fecha_vencimiento")
+        
+        # Desglose de pago para método mixto
+        desglose_pago = None
+        if metodo_pago == "mixto":
+            desglose_pago = {
+                "efectivo": request.form.get("efectivo", 0, type=float),
+                "tarjeta": request.form.get("tarjeta", 0, type=float),
+                "transferencia": request.form.get("transferencia", 0, type=float)
             }
-    
-    return render_template("dashboard.html", 
-                         mesas=mesas, 
-                         info_mesas=info_mesas,
-                         now=datetime.now())
+        
+        # Calcular totales (usar agregación en DB para eficiencia)
+        subtotal = db.session.query(db.func.coalesce(db.func.sum(Pedido.cantidad * Pedido.precio_unitario), 0)).filter(Pedido.sesion_id == sesion.id).scalar() or 0
+        iva = 0  # Sin IVA
+        total = subtotal + propina
 
-@app.route("/nuevo_pedido/<int:mesa_id>", methods=["GET", "POST"])
-@login_required
-def nuevo_pedido(mesa_id):
-    mesa = Mesa.query.get_or_404(mesa_id)
-    
-    if request.method == "POST":
-        producto = request.form.get("producto")
-        cantidad = request.form.get("cantidad", 1, type=int)
-        precio_unitario = request.form.get("precio_unitario", 0, type=float)
-        notas = request.form.get("notas", "")
+        # El libro de pagos debe sumar exactamente el total cobrado
+        if desglose_pago is not None and estado_pago == 'pagada':
+            error = error_desglose(desglose_pago, total)
+            if error:
+                db.session.rollback()
+                flash(error, 'error')
+                return redirect(url_for('facturar_sesion', sesion_id=sesion_id))
+
+        # Generar número consecutivo
+        numero_consecutivo = f"FACT-{siguiente_numero_factura():06d}"
         
-        # Buscar o crear sesión activa para esta mesa
-        sesion_activa = Sesion.query.filter_by(
-            mesa_id=mesa_id,
-            activa=True
-        ).first()
+        # Convertir fecha de vencimiento
+        fecha_vencimiento = None
+        if fecha_vencimiento_str and estado_pago == 'pendiente':
+            fecha_vencimiento = datetime.strptime(fecha_vencimiento_str, '%Y-%m-%d').date()
         
-        if not sesion_activa:
-            # Crear nueva sesión
-            sesion_activa = Sesion(mesa_id=mesa_id)
-            db.session.add(sesion_activa)
-            db.session.flush()  # Para obtener el ID
+        # Fecha de pago real
+        fecha_pago_real = datetime.now() if estado_pago == 'pagada' else None
         
-        pedido = Pedido(
-            mesa_id=mesa_id,
-            sesion_id=sesion_activa.id,
-            mesero_id=current_user.id,
-            producto=producto,
-            cantidad=cantidad,
-            precio_unitario=precio_unitario,
-            notas=notas
+        # Saldo pendiente
+        saldo_pendiente = total if estado_pago == 'pendiente' else 0
+        
+        # Crear factura
+        factura = Factura(
+            numero_consecutivo=numero_consecutivo,
+            sesion_id=sesion_id,
+            subtotal=subtotal,
+            iva=iva,
+            propina=propina,
+            total=total,
+            metodo_pago=metodo_pago,
+            cliente_nombre=cliente_nombre,
+            cliente_documento=cliente_documento,
+            notas=notas,
+            estado_pago=estado_pago,
+            fecha_vencimiento=fecha_vencimiento,
+            fecha_pago_real=fecha_pago_real,
+            saldo_pendiente=saldo_pendiente
         )
         
-        db.session.add(pedido)
+        # Libro de pagos (una fila por método si es mixto)
+        if estado_pago == 'pagada':
+            registrar_pagos_factura(factura, desglose_pago, fecha=fecha_pago_real)
+        
+        # Actualizar sesión
+        sesion.total = total
+        sesion.activa = False
+        sesion.fecha_fin = datetime.now()
+        sesion.subtotal = subtotal
+        sesion.pagado = subtotal
+        sesion.pendiente = 0
+        
+        # Marcar todos los pedidos como pagados (actualización en bloque)
+        db.session.query(Pedido).filter(Pedido.sesion_id == sesion.id).update({"pagado": True, "estado": "entregado"}, synchronize_session=False)
+        
+        db.session.add(factura)
         db.session.commit()
         
-        total = precio_unitario * cantidad
-        flash(f'Pedido agregado: {cantidad}x {producto} = ${total:.2f}', 'success')
-        return redirect(url_for('ver_mesa', mesa_id=mesa_id))
+        flash(f'Factura {numero_consecutivo} generada exitosamente', 'success')
+        return redirect(url_for('ver_factura', factura_id=factura.id))
     
-    # Obtener todos los items del menú disponibles, agrupados por categoría
-    items_menu = ItemMenu.query.filter_by(disponible=True).order_by(
-        ItemMenu.categoria_id, ItemMenu.orden
-    ).all()
+    # GET: Calcular totales para mostrar en el formulario (usar agregación en DB)
+    subtotal = db.session.query(db.func.coalesce(db.func.sum(Pedido.cantidad * Pedido.precio_unitario), 0)).filter(Pedido.sesion_id == sesion.id).scalar() or 0
+    iva = 0  # Sin IVA
     
-    return render_template("nuevo_pedido.html", mesa=mesa, items_menu=items_menu)
+    # ============================================
+    # SOLUCIÓN: PASAR datetime AL TEMPLATE
+    # ============================================
+    return render_template("facturar_sesion.html", 
+                         sesion=sesion, 
+                         config=config,
+                         subtotal=subtotal,
+                         iva=iva,
+                         datetime=datetime)  # ← ESTA LÍNEA ES CLAVE
 
-@app.route("/mesa/<int:mesa_id>")
+# =================================================================
+# REEMPLAZAR LA RUTA ver_factura EN app.py (línea ~620)
+# =================================================================
+
+@app.route("/factura/<int:factura_id>")
 @login_required
-def ver_mesa(mesa_id):
-    mesa = Mesa.query.get_or_404(mesa_id)
-    
-    # Obtener sesión activa
-    sesion_activa = Sesion.query.filter_by(
-        mesa_id=mesa_id,
-        activa=True
-    ).first()
-    
-    # Obtener pedidos de la sesión activa y calcular totales
-    pedidos_actuales = []
-    totales_sesion_activa = {
-        'total_general': 0,
-        'total_pagado': 0,
-        'total_pendiente': 0
-    }
-    
-    if sesion_activa:
-        pedidos_actuales = Pedido.query.filter_by(
-            sesion_id=sesion_activa.id
-        ).order_by(Pedido.fecha.desc()).all()
-        
-        # Calcular totales
-        for pedido in pedidos_actuales:
-            subtotal = pedido.cantidad * pedido.precio_unitario
-            totales_sesion_activa['total_general'] += subtotal
-            
-            if pedido.pagado:
-                totales_sesion_activa['total_pagado'] += subtotal
-            else:
-                totales_sesion_activa['total_pendiente'] += subtotal
+def ver_factura(factura_id):
+    """Ver una factura generada - OPTIMIZADA PARA IMPRESORAS TÉRMICAS"""
+    factura = Factura.query.get_or_404(factura_id)
+    config = obtener_configuracion()
     
-    # Obtener sesiones anteriores de hoy con sus totales calculados
-    hoy = datetime.now().date()
-    sesiones_anteriores = Sesion.query.filter(
-        Sesion.mesa_id == mesa_id,
-        Sesion.activa == False,
-        db.func.date(Sesion.fecha_inicio) == hoy
-    ).order_by(Sesion.fecha_inicio.desc()).all()
-    
-    # Calcular totales para cada sesión anterior
-    sesiones_con_totales = []
-    for sesion in sesiones_anteriores:
-        total_sesion = 0
-        total_pagado_sesion = 0
-        total_pendiente_sesion = 0
-        
-        for pedido in sesion.pedidos:
-            subtotal = pedido.cantidad * pedido.precio_unitario
-            total_sesion += subtotal
-            
-            if pedido.pagado:
-                total_pagado_sesion += subtotal
-            else:
-                total_pendiente_sesion += subtotal
-        
-        sesiones_con_totales.append({
-            'sesion': sesion,
-            'total_general': total_sesion,
-            'total_pagado': total_pagado_sesion,
-            'total_pendiente': total_pendiente_sesion
-        })
+    # Desglose de pago mixto desde el libro de pagos
+    desglose = desglose_de_pagos(factura.id) if factura.metodo_pago == 'mixto' else None
+    abonos = [p for p in factura.pagos if p.tipo == 'abono']
     
-    return render_template("ver_mesa.html", 
-                         mesa=mesa, 
-                         pedidos=pedidos_actuales,
-                         sesion_activa=sesion_activa,
-                         totales_sesion_activa=totales_sesion_activa,
-                         sesiones_anteriores=sesiones_con_totales,
-                         current_user=current_user)
+    return render_template("ver_factura.html", 
+                         factura=factura, 
+                         abonos=abonos,
+                         config=config,
+                         desglose=desglose)
 
-@app.route("/cocina")
+@app.route("/facturas")
 @login_required
-def cocina():
-    hoy = datetime.now().date()
+def lista_facturas():
+    """Listar todas las facturas"""
+    fecha_param = request.args.get('fecha')
     
-    pedidos_pendientes = Pedido.query.filter(
-        db.func.date(Pedido.fecha) == hoy,
-        Pedido.estado.in_(['pendiente', 'preparando'])
-    ).order_by(Pedido.fecha).all()
+    if fecha_param:
+        try:
+            fecha_obj = datetime.strptime(fecha_param, '%Y-%m-%d').date()
+            facturas = Factura.query.filter(
+                db.func.date(Factura.fecha_emision) == fecha_obj
+            ).order_by(Factura.fecha_emision.desc()).all()
+        except ValueError:
+            flash('Fecha inválida', 'error')
+            facturas = Factura.query.order_by(Factura.fecha_emision.desc()).limit(50).all()
+    else:
+        # Últimas 50 facturas
+        facturas = Factura.query.order_by(Factura.fecha_emision.desc()).limit(50).all()
     
-    return render_template(
-        "cocina.html",
-        pedidos=pedidos_pendientes,
-        now=datetime.now()
-    )
+    return render_template("lista_facturas.html", facturas=facturas)
 
-@app.route("/api/cocina/pedidos")
+# ==========================================
+# RUTAS PARA CONSUMO INTERNO (ADMIN)
+# ==========================================
+@app.route('/consumo_interno')
 @login_required
-def api_cocina_pedidos():
-    hoy = datetime.now().date()
-    
-    pedidos = Pedido.query.filter(
-        db.func.date(Pedido.fecha) == hoy,
-        Pedido.estado.in_(['pendiente', 'preparando'])
-    ).order_by(Pedido.fecha).all()
-    
-    data = []
-    for p in pedidos:
-        data.append({
-            "id": p.id,
-            "mesa": p.mesa.numero,
-            "producto": p.producto,
-            "cantidad": p.cantidad,
-            "notas": p.notas or "",
-            "estado": p.estado,
-            "fecha": p.fecha.isoformat()
-        })
-    
-    return jsonify(data)
+def lista_consumos_internos():
+    if getattr(current_user, 'rol', None) != 'admin':
+        flash('No tienes permisos para ver consumos internos', 'error')
+        return redirect(url_for('dashboard'))
 
+    fecha = request.args.get('fecha')
+    fecha_inicio = request.args.get('fecha_inicio')
+    fecha_fin = request.args.get('fecha_fin')
 
-@app.route("/actualizar_estado/<int:pedido_id>/<estado>")
-@login_required
-def actualizar_estado(pedido_id, estado):
-    pedido = Pedido.query.get_or_404(pedido_id)
-    estados_validos = ['pendiente', 'preparando', 'listo', 'entregado']
-    
-    if estado in estados_validos:
-        pedido.estado = estado
+    query = ConsumoInterno.query
+
+    # Si se especifica `fecha`, interpretamos el día como [fecha 03:00, fecha+1 03:00)
+    if fecha:
         try:
-            pedido.estado_actualizado = datetime.now()
-        except Exception:
-            # En caso de que la columna no exista en DB todavía
-            pass
-        db.session.commit()
-        flash(f'Estado actualizado a: {estado}', 'success')
-        # Si se marcó como 'listo' y quien lo marcó NO es mesero, creamos una notificación para meseros
-        if estado == 'listo' and getattr(current_user, 'rol', None) != 'mesero':
-            # No necesitamos guardar una entidad de notificación; el JS de meseros hará polling por pedidos 'listo' recientes
-            pass
-    
-    return redirect(request.referrer or url_for('dashboard'))
+            d = datetime.strptime(fecha, '%Y-%m-%d').date()
+            start = datetime(d.year, d.month, d.day, 3, 0, 0)
+            end = start + timedelta(days=1)
+            query = query.filter(ConsumoInterno.fecha >= start, ConsumoInterno.fecha < end)
+        except ValueError:
+            flash('Fecha inválida', 'error')
+    else:
+        # Si se usa rango, aplicamos cierre diario a las 03:00: fecha_inicio comienza a las 03:00; fecha_fin termina el día siguiente a las 03:00 (exclusivo)
+        if fecha_inicio:
+            try:
+                fi_date = datetime.strptime(fecha_inicio, '%Y-%m-%d').date()
+                start = datetime(fi_date.year, fi_date.month, fi_date.day, 3, 0, 0)
+                query = query.filter(ConsumoInterno.fecha >= start)
+            except ValueError:
+                flash('Fecha inicio inválida', 'error')
+        if fecha_fin:
+            try:
+                ff_date = datetime.strptime(fecha_fin, '%Y-%m-%d').date()
+                end = datetime(ff_date.year, ff_date.month, ff_date.day, 3, 0, 0) + timedelta(days=1)
+                query = query.filter(ConsumoInterno.fecha < end)
+            except ValueError:
+                flash('Fecha fin inválida', 'error')
 
-@app.route("/marcar_pagado/<int:pedido_id>")
+    try:
+        consumos = query.order_by(ConsumoInterno.fecha.desc()).limit(200).all()
+        total_costo = sum(c.costo * c.cantidad for c in consumos)
+    except OperationalError:
+        # Tabla aún no creada; instrucciones para el desarrollador
+        flash("La tabla 'consumo_interno' no existe. Ejecuta `flask --app app migrate` para crearla.", 'error')
+        return redirect(url_for('dashboard'))
+
+    return render_template('consumo_interno/lista_consumos.html', consumos=consumos, total_costo=total_costo)
+
+
+@app.route('/consumo_interno/nuevo', methods=['GET', 'POST'])
 @login_required
-def marcar_pagado(pedido_id):
-    pedido = Pedido.query.get_or_404(pedido_id)
-    pedido.pagado = True
-    db.session.commit()
-    flash('Pedido marcado como pagado', 'success')
-    return redirect(request.referrer or url_for('dashboard'))
+def nuevo_consumo_interno():
+    if getattr(current_user, 'rol', None) != 'admin':
+        flash('No tienes permisos para crear consumos internos', 'error')
+        return redirect(url_for('dashboard'))
 
+    items = ItemMenu.query.order_by(ItemMenu.nombre).all()
+    users = Usuario.query.order_by(Usuario.nombre).all()
 
-@app.route('/notificaciones/pendientes')
+    if request.method == 'POST':
+        item_id = request.form.get('item_id', type=int)
+        usuario_id = request.form.get('usuario_id', type=int)
+        cantidad = request.form.get('cantidad', 1, type=int)
+        costo = request.form.get('costo', 0.0, type=float)
+        notas = request.form.get('notas')
+
+        if not item_id or not usuario_id or cantidad <= 0:
+            flash('Item, usuario o cantidad inválida', 'error')
+            return redirect(url_for('nuevo_consumo_interno'))
+
+        # Verificar que el usuario seleccionado exista
+        usuario = Usuario.query.get(usuario_id)
+        if not usuario:
+            flash('Usuario seleccionado no existe', 'error')
+            return redirect(url_for('nuevo_consumo_interno'))
+
+        consumo = ConsumoInterno(item_id=item_id, cantidad=cantidad, costo=costo, usuario_id=usuario_id, notas=notas)
+        db.session.add(consumo)
+        db.session.commit()
+        flash('Consumo interno registrado', 'success')
+        return redirect(url_for('lista_consumos_internos'))
+
+    return render_template('consumo_interno/nuevo_consumo.html', items=items, users=users) 
+
+
+@app.route('/consumo_interno/<int:consumo_id>/eliminar', methods=['POST'])
 @login_required
-def notificaciones_pendientes():
-    """Endpoint que devuelve pedidos marcados como 'listo' desde un timestamp 'since'.
-    Parámetros: since (ISO 8601 string). Solo accesible a usuarios con rol 'mesero'."""
-    if getattr(current_user, 'rol', None) != 'mesero':
-        return jsonify([])
+def eliminar_consumo_interno(consumo_id):
+    if getattr(current_user, 'rol', None) != 'admin':
+        flash('No tienes permisos para eliminar consumos internos', 'error')
+        return redirect(url_for('dashboard'))
 
-    since = request.args.get('since')
+    consumo = ConsumoInterno.query.get_or_404(consumo_id)
     try:
-        since_dt = datetime.fromisoformat(since) if since else (datetime.now() - timedelta(seconds=10))
+        db.session.delete(consumo)
+        db.session.commit()
+        flash('Consumo interno eliminado', 'success')
     except Exception:
-        since_dt = datetime.now() - timedelta(seconds=10)
+        db.session.rollback()
+        flash('Error al eliminar consumo interno', 'error')
 
-    pedidos = Pedido.query.filter(
-        Pedido.estado == 'listo',
-        Pedido.estado_actualizado > since_dt
-    ).order_by(Pedido.estado_actualizado.asc()).all()
+    return redirect(url_for('lista_consumos_internos'))
 
-    data = []
-    for p in pedidos:
-        data.append({
-            'id': p.id,
-            'mesa': p.mesa.numero if p.mesa else None,
-            'producto': p.producto,
-            'cantidad': p.cantidad,
-            'estado_actualizado': p.estado_actualizado.isoformat() if p.estado_actualizado else None
-        })
 
-    return jsonify(data)
+@app.route('/factura/<int:factura_id>/editar', methods=['GET', 'POST'])
+@login_required
+def editar_factura(factura_id):
+    factura = Factura.query.get_or_404(factura_id)
+    if getattr(current_user, 'rol', None) != 'admin':
+        flash('No tienes permisos para editar facturas', 'error')
+        return redirect(url_for('ver_factura', factura_id=factura_id))
 
-@app.route("/pagar_mesa/<int:mesa_id>")
+    config = obtener_configuracion()
+
+    if request.method == 'POST':
+        metodo_pago = request.form.get('metodo_pago', factura.metodo_pago)
+        propina = request.form.get('propina', factura.propina, type=float)
+        cliente_nombre = request.form.get('cliente_nombre', factura.cliente_nombre)
+        cliente_documento = request.form.get('cliente_documento', factura.cliente_documento)
+        notas = request.form.get('notas', factura.notas)
+        estado_pago = request.form.get('estado_pago', factura.estado_pago)
+        fecha_vencimiento_str = request.form.get('fecha_vencimiento')
+
+        desglose_pago = None
+        if metodo_pago == 'mixto':
+            desglose_pago = {
+                'efectivo': request.form.get('efectivo', 0, type=float),
+                'tarjeta': request.form.get('tarjeta', 0, type=float),
+                'transferencia': request.form.get('transferencia', 0, type=float)
+            }
+
+        # Recalcular subtotal desde la sesión asociada (o desde sus pedidos si es una cuenta dividida)
+        if factura.division:
+            subtotal = db.session.query(db.func.coalesce(db.func.sum(Pedido.cantidad * Pedido.precio_unitario), 0)).filter(Pedido.factura_id == factura.id).scalar() or factura.subtotal
+        else:
+            subtotal = db.session.query(db.func.coalesce(db.func.sum(Pedido.cantidad * Pedido.precio_unitario), 0)).filter(Pedido.sesion_id == factura.sesion_id).scalar() or 0
+        iva = factura.iva if factura.iva is not None else 0
+        total = subtotal + propina + (iva or 0)
+
+        # Lo abonado en cuentas por cobrar se conserva; el cobro al facturar cubre el resto
+        abonado = sum(p.monto for p in factura.pagos if p.tipo == 'abono')
+        cobrado = {}
+        for pago in factura.pagos:
+            if pago.tipo != 'abono':
+                cobrado[pago.metodo] = cobrado.get(pago.metodo, 0) + pago.monto
+        if estado_pago == 'pagada' and desglose_pago is not None:
+            error = error_desglose(desglose_pago, total - abonado)
+            if error:
+                flash(error, 'error')
+                return redirect(url_for('editar_factura', factura_id=factura.id))
+
+        # ¿Cambió algo que afecte el dinero recibido? Entonces se rehacen los cobros al facturar
+        cambio_pago = (
+            metodo_pago != factura.metodo_pago
+            or estado_pago != factura.estado_pago
+            or abs(total - (factura.total or 0)) > 0.01
+            or (metodo_pago == 'mixto' and {k: v for k, v in desglose_pago.items() if v} != cobrado)
+        )
+        
+        # Actualizar campos
+        factura.metodo_pago = metodo_pago
+        factura.propina = propina
+        factura.cliente_nombre = cliente_nombre
+        factura.cliente_documento = cliente_documento
+        factura.notas = notas
+        factura.estado_pago = estado_pago
+        factura.desglose_pago = None
+        factura.subtotal = subtotal
+        factura.total = total
+
+        # Fecha vencimiento
+        if fecha_vencimiento_str:
+            try:
+                factura.fecha_vencimiento = datetime.strptime(fecha_vencimiento_str, '%Y-%m-%d').date()
+            except Exception:
+                factura.fecha_vencimiento = None
+        else:
+            factura.fecha_vencimiento = None
+
+        if cambio_pago:
+            # Solo se reescriben las filas del cobro al facturar (tipo 'pago'); los abonos
+            # son dinero recibido y se conservan. Se mantiene la fecha del cobro original
+            # para no mover dinero entre cierres de caja.
+            cobros = [p for p in factura.pagos if p.tipo != 'abono']
+            fecha_cobro = min((p.fecha for p in cobros), default=None)
+            for pago in cobros:
+                factura.pagos.remove(pago)
+            if estado_pago == 'pagada' and total - abonado > 0.01:
+                if desglose_pago is not None:
+                    registrar_pagos_factura(factura, {k: v for k, v in desglose_pago.items() if v}, fecha=fecha_cobro)
+                else:
+                    db.session.add(Pago(factura=factura, metodo=metodo_pago or 'efectivo', monto=total - abonado,
+                                        fecha=fecha_cobro or datetime.now(), usuario_id=current_user.id))
+
+        # Saldo y fecha de pago a partir del libro de pagos
+        if estado_pago == 'pagada':
+            factura.fecha_pago_real = factura.fecha_pago_real or datetime.now()
+            factura.saldo_pendiente = 0
+        else:
+            factura.fecha_pago_real = None
+            recibido = sum(p.monto for p in factura.pagos)
+            factura.saldo_pendiente = max(round(total - recibido, 2), 0)
+        db.session.commit()
+        flash(f'Factura {factura.numero_consecutivo} actualizada', 'success')
+        return redirect(url_for('ver_factura', factura_id=factura.id))
+
+    # GET
+    desglose = desglose_de_pagos(factura.id, sin_abonos=True) if factura.metodo_pago == 'mixto' else None
+    return render_template('editar_factura.html', factura=factura, config=config, desglose=desglose)
+
+
+@app.route('/factura/<int:factura_id>/eliminar', methods=['POST'])
 @login_required
-def pagar_mesa(mesa_id):
-    hoy = datetime.now().date()
-    pedidos = Pedido.query.filter(
-        Pedido.mesa_id == mesa_id,
-        db.func.date(Pedido.fecha) == hoy,
-        Pedido.pagado == False
-    ).all()
-    
-    for pedido in pedidos:
-        pedido.pagado = True
+def eliminar_factura(factura_id):
+    """
+    RAZÓN: Eliminar facturas y revertir los cambios asociados.
+    Funciona tanto para facturas de sesiones como de domicilios.
+    Al eliminar, la factura desaparece de los reportes de ingresos automáticamente.
+    """
+    factura = Factura.query.get_or_404(factura_id)
     
-    db.session.commit()
-    flash(f'Todos los pedidos de la mesa {mesa_id} marcados como pagados', 'success')
-    return redirect(url_for('dashboard'))
+    # Solo admin puede eliminar facturas
+    if getattr(current_user, 'rol', None) != 'admin':
+        flash('No tienes permisos para eliminar facturas', 'error')
+        return redirect(url_for('ver_factura', factura_id=factura_id))
 
-@app.route("/historial")
-@login_required
-def historial():
-    # Obtener fecha del parámetro o usar fecha actual
-    fecha_param = request.args.get('fecha')
-    fecha_seleccionada = None
-    sesiones_por_dia = {}
-    totales_por_dia = {}
+    numero_factura = factura.numero_consecutivo
+    monto = factura.total
     
-    if fecha_param:
-        try:
-            fecha_seleccionada = datetime.strptime(fecha_param, '%Y-%m-%d').date()
-            # Obtener sesiones de la fecha seleccionada
-            sesiones = Sesion.query.filter(
-                db.func.date(Sesion.fecha_inicio) == fecha_seleccionada
-            ).order_by(Sesion.fecha_inicio.desc()).all()
-            
-            if sesiones:
-                fecha_str = fecha_seleccionada.strftime('%Y-%m-%d')
-                sesiones_por_dia[fecha_str] = sesiones
+    try:
+        # ============================================
+        # CASO 1: FACTURA DE SESIÓN (MESA)
+        # ============================================
+        if factura.sesion_id:
+            sesion = factura.sesion
+            if sesion:
+                bloquear_mesa(sesion.mesa_id)
+                otra_activa = Sesion.query.filter(
+                    Sesion.mesa_id == sesion.mesa_id,
+                    Sesion.activa == True,
+                    Sesion.id != sesion.id
+                ).first()
+                if otra_activa:
+                    db.session.rollback()
+                    flash(f'❌ La mesa {sesion.mesa.numero} ya tiene otra sesión activa; ciérrala antes de eliminar esta factura', 'error')
+                    return redirect(url_for('ver_factura', factura_id=factura_id))
                 
-                # Calcular totales para esa fecha
-                total_general = sum(s.total or 0 for s in sesiones if not s.activa)
-                total_facturado = sum(s.total or 0 for s in sesiones if not s.activa and s.facturas)
-                total_sin_facturar = sum(s.total or 0 for s in sesiones if not s.activa and not s.facturas)
-                sesiones_activas = sum(1 for s in sesiones if s.activa)
-                sesiones_cerradas = sum(1 for s in sesiones if not s.activa)
+                # Reactivar la sesión
+                sesion.activa = True
+                sesion.fecha_fin = None
+                sesion.total = 0
+                sesion.pagado = 0
+                sesion.pendiente = sesion.subtotal
                 
-                totales_por_dia[fecha_str] = {
-                    'total_general': total_general,
-                    'total_facturado': total_facturado,
-                    'total_sin_facturar': total_sin_facturar,
-                    'sesiones_activas': sesiones_activas,
-                    'sesiones_cerradas': sesiones_cerradas
-                }
-        except ValueError:
-            flash('Fecha inválida', 'error')
-            fecha_seleccionada = None
-    
-    # Si no hay fecha seleccionada, mostrar últimos 7 días
-    if not fecha_param:
-        sesiones = Sesion.query.order_by(Sesion.fecha_inicio.desc()).limit(100).all()
+                # Revertir estado de los pedidos
+                db.session.query(Pedido).filter(
+                    Pedido.sesion_id == sesion.id
+                ).update({
+                    "pagado": False,
+                    "estado": "pendiente",
+                    "factura_id": None
+                }, synchronize_session=False)
+                
+                # Cuenta dividida: las demás facturas de la división también se eliminan
+                if factura.division:
+                    hermanas = Factura.query.filter(
+                        Factura.sesion_id == sesion.id,
+                        Factura.id != factura.id
+                    ).all()
+                    for hermana in hermanas:
+                        monto += hermana.total
+                        db.session.delete(hermana)
+                    if hermanas:
+                        flash(f'Se eliminaron también las otras {len(hermanas)} facturas de la cuenta dividida', 'info')
         
-        for sesion in sesiones:
-            fecha_str = sesion.fecha_inicio.strftime('%Y-%m-%d')
-            if fecha_str not in sesiones_por_dia:
-                sesiones_por_dia[fecha_str] = []
-            sesiones_por_dia[fecha_str].append(sesion)
+        # ============================================
+        # CASO 2: FACTURA DE DOMICILIO
+        # ============================================
+        else:
+            # Buscar domicilio asociado a esta factura
+            domicilio = Domicilio.query.filter_by(factura_id=factura_id).first()
+            if domicilio:
+                # Desasociar la factura del domicilio
+                domicilio.factura_id = None
+                domicilio.pagado = False
+                # El domicilio queda en su estado actual (entregado)
+                # pero sin factura asociada, permitiendo re-facturar
         
-        # Limitar a los últimos 7 días
-        sesiones_por_dia = dict(list(sesiones_por_dia.items())[:7])
+        # ============================================
+        # ELIMINAR LA FACTURA
+        # ============================================
+        db.session.delete(factura)
+        db.session.commit()
         
-        # Calcular totales para cada día
-        for fecha_str, sesiones_dia in sesiones_por_dia.items():
-            total_general = sum(s.total or 0 for s in sesiones_dia if not s.activa)
-            total_facturado = sum(s.total or 0 for s in sesiones_dia if not s.activa and s.facturas)
-            total_sin_facturar = sum(s.total or 0 for s in sesiones_dia if not s.activa and not s.facturas)
-            sesiones_activas = sum(1 for s in sesiones_dia if s.activa)
-            sesiones_cerradas = sum(1 for s in sesiones_dia if not s.activa)
-            
-            totales_por_dia[fecha_str] = {
-                'total_general': total_general,
-                'total_facturado': total_facturado,
-                'total_sin_facturar': total_sin_facturar,
-                'sesiones_activas': sesiones_activas,
-                'sesiones_cerradas': sesiones_cerradas
-            }
+        flash(f'✓ Factura {numero_factura} eliminada exitosamente (${monto:,.0f})', 'success')
+        flash('La factura ha sido eliminada de los reportes de ingresos', 'info')
+        
+    except Exception as e:
+        db.session.rollback()
+        flash(f'❌ Error al eliminar la factura: {str(e)}', 'error')
+        return redirect(url_for('ver_factura', factura_id=factura_id))
     
-    return render_template("historial.html", 
-                         sesiones_por_dia=sesiones_por_dia,
-                         totales_por_dia=totales_por_dia,
-                         fecha_seleccionada=fecha_seleccionada,
-                         now=datetime.now())
+    # Redirigir a la lista de facturas
+    return redirect(url_for('lista_facturas'))
 
-@app.route("/administrar_mesas", methods=["GET", "POST"])
+# ==========================================
+# RUTAS PARA CUENTAS POR COBRAR
+# ==========================================
+
+@app.route("/cuentas_por_cobrar")
 @login_required
-def administrar_mesas():
+def cuentas_por_cobrar():
+    """
+    RAZÓN: Vista principal de deudas de clientes.
+    Muestra facturas pendientes de cobro y vencidas.
+    """
+    # Obtener filtros
+    estado = request.args.get('estado', 'todos')  # todos, pendiente, vencida, pagada
+    
+    # Query base
+    query = Factura.query
+    
+    # Aplicar filtros
+    if estado != 'todos':
+        query = query.filter(Factura.estado_pago == estado)
+    
+    # Ordenar por fecha de vencimiento
+    facturas = query.order_by(Factura.fecha_vencimiento).all()
+    
+    # Actualizar estados de facturas vencidas automáticamente
+    from datetime import date
+    hoy = date.today()
+    
+    for factura in facturas:
+        if factura.estado_pago == 'pendiente' and factura.fecha_vencimiento and factura.fecha_vencimiento < hoy:
+            factura.estado_pago = 'vencida'
+    
+    db.session.commit()
+    
+    # Calcular totales
+    total_pendiente = sum(f.saldo_pendiente or f.total for f in facturas if f.estado_pago == 'pendiente')
+    total_vencido = sum(f.saldo_pendiente or f.total for f in facturas if f.estado_pago == 'vencida')
+    total_general = total_pendiente + total_vencido
+    
+    # Agrupar por cliente
+    facturas_por_cliente = {}
+    for factura in facturas:
+        if factura.estado_pago in ['pendiente', 'vencida'] and factura.cliente_nombre:
+            cliente = factura.cliente_nombre
+            if cliente not in facturas_por_cliente:
+                facturas_por_cliente[cliente] = {
+                    'cliente': cliente,
+                    'total': 0,
+                    'cantidad': 0
+                }
+            facturas_por_cliente[cliente]['total'] += (factura.saldo_pendiente or factura.total)
+            facturas_por_cliente[cliente]['cantidad'] += 1
+    
+    # ============================================
+    # SOLUCIÓN: AGREGAR datetime AL RETURN
+    # ============================================
+    return render_template("cuentas/cuentas_por_cobrar.html",
+                         facturas=facturas,
+                         total_pendiente=total_pendiente,
+                         total_vencido=total_vencido,
+                         total_general=total_general,
+                         facturas_por_cliente=facturas_por_cliente.values(),
+                         estado_filtro=estado,
+                         datetime=datetime)  # ← AGREGAR ESTA LÍNEA
+                         
+
+@app.route("/marcar_factura_pagada/<int:factura_id>", methods=["POST"])
+@login_required
+@idempotente
+def marcar_factura_pagada(factura_id):
+    """
+    RAZÓN: Marca una factura como pagada cuando el cliente paga.
+    """
+    # Bloquear la factura para que dos abonos simultáneos no lean el mismo saldo
+    factura = bloquear_factura(factura_id)
+    if factura is None:
+        abort(404)
+    volver = request.referrer or url_for('cuentas_por_cobrar')
+    
+    if factura.estado_pago == 'pagada':
+        db.session.rollback()
+        flash(f'La factura {factura.numero_consecutivo} ya está pagada', 'error')
+        return redirect(volver)
+    
+    monto_pago = request.form.get('monto_pago', type=float)
+    metodo_pago = request.form.get('metodo_pago', 'efectivo')
+    
+    # Saldo pendiente (None en facturas viejas: se debe el total; 0 es 0)
+    saldo_actual = factura.total if factura.saldo_pendiente is None else factura.saldo_pendiente
+    saldo_actual = saldo_actual or 0
+    
+    if monto_pago is None:
+        monto_pago = saldo_actual
+    if monto_pago <= 0 or monto_pago > saldo_actual + 0.01:
+        db.session.rollback()
+        flash(f'El abono debe ser mayor a $0 y no superar el saldo de ${saldo_actual:,.2f}', 'error')
+        return redirect(volver)
+    monto_pago = min(monto_pago, saldo_actual)
+    nuevo_saldo = saldo_actual - monto_pago
+    
+    # Registrar el abono en el libro de pagos
+    db.session.add(Pago(
+        factura_id=factura.id,
+        metodo=metodo_pago,
+        monto=monto_pago,
+        tipo='abono',
+        usuario_id=current_user.id
+    ))
+    
+    if nuevo_saldo <= 0.01:
+        # Pago completo
+        factura.estado_pago = 'pagada'
+        factura.saldo_pendiente = 0
+        factura.fecha_pago_real = datetime.now()
+        flash(f'Factura {factura.numero_consecutivo} marcada como pagada completamente', 'success')
+    else:
+        # Pago parcial
+        factura.saldo_pendiente = nuevo_saldo
+        flash(f'Pago parcial registrado. Saldo pendiente: ${nuevo_saldo:,.2f}', 'success')
+    
+    db.session.commit()
+    
+    return redirect(request.referrer or url_for('cuentas_por_cobrar'))
+
+
+
+
+@app.route("/configuracion_restaurante", methods=["GET", "POST"])
+@login_required
+def configuracion_restaurante():
+    """Configurar datos del restaurante"""
     if current_user.rol != 'admin':
-        flash('Solo los administradores pueden gestionar mesas', 'error')
+        flash('Solo los administradores pueden modificar la configuración', 'error')
         return redirect(url_for('dashboard'))
     
     if request.method == "POST":
-        accion = request.form.get("accion")
-        
-        if accion == "agregar":
-            numero = request.form.get("numero", type=int)
-            capacidad = request.form.get("capacidad", type=int, default=4)
-            
-            if Mesa.query.filter_by(numero=numero).first():
-                flash(f'La mesa {numero} ya existe', 'error')
-            else:
-                mesa = Mesa(numero=numero, capacidad=capacidad)
-                db.session.add(mesa)
-                db.session.commit()
-                flash(f'Mesa {numero} agregada exitosamente', 'success')
-        
-        elif accion == "eliminar":
-            mesa_id = request.form.get("mesa_id", type=int)
-            mesa = Mesa.query.get(mesa_id)
-            if mesa:
-                # Verificar si tiene pedidos
-                if Pedido.query.filter_by(mesa_id=mesa_id).first():
-                    flash(f'No se puede eliminar la mesa {mesa.numero} porque tiene pedidos asociados', 'error')
-                else:
-                    db.session.delete(mesa)
-                    db.session.commit()
-                    flash(f'Mesa {mesa.numero} eliminada exitosamente', 'success')
-        
-        elif accion == "toggle":
-            mesa_id = request.form.get("mesa_id", type=int)
-            mesa = Mesa.query.get(mesa_id)
-            if mesa:
-                mesa.activa = not mesa.activa
-                db.session.commit()
-                estado = "activada" if mesa.activa else "desactivada"
-                flash(f'Mesa {mesa.numero} {estado}', 'success')
+        config = ConfiguracionRestaurante.query.order_by(ConfiguracionRestaurante.id).first()
+        if not config:
+            config = ConfiguracionRestaurante()
+            db.session.add(config)
+        config.nombre = request.form.get("nombre")
+        config.nit = request.form.get("nit")
+        config.direccion = request.form.get("direccion")
+        config.ciudad = request.form.get("ciudad")
+        config.telefono = request.form.get("telefono")
+        config.email = request.form.get("email", "")
+        config.regimen = request.form.get("regimen")
+        config.resolucion_dian = request.form.get("resolucion_dian", "")
+        config.rango_facturacion = request.form.get("rango_facturacion", "")
+        config.iva_porcentaje = request.form.get("iva_porcentaje", 19.0, type=float)
+        config.logo_url = request.form.get("logo_url", "")
+        # Avisar a los demás workers que su copia en caché quedó vieja
+        config.version = (config.version or 0) + 1
         
-        return redirect(url_for('administrar_mesas'))
+        db.session.commit()
+        recargar_configuracion()
+        flash('Configuración actualizada exitosamente', 'success')
+        return redirect(url_for('configuracion_restaurante'))
+    
+    return render_template("configuracion_restaurante.html", config=obtener_configuracion(), now=datetime.now())
+
+# Actualizar la función init_db() para incluir la configuración inicial
+def init_db_facturacion():
+    """Agregar esto dentro de tu función init_db() existente"""
+    # Crear configuración del restaurante si no existe
+    if ConfiguracionRestaurante.query.count() == 0:
+        config = ConfiguracionRestaurante(
+            nombre='Mi Restaurante',
+            nit='900.000.000-0',
+            direccion='Calle 123 #45-67',
+            ciudad='Zarzal, Valle del Cauca',
+            telefono='(+57) 300 000 0000',
+            regimen='Régimen Simplificado'
+        )
+        db.session.add(config)
+        db.session.commit()
+
+        
+@app.route("/", methods=["GET", "POST"])
+def login():
+    if current_user.is_authenticated:
+        return redirect(url_for('dashboard'))
+    
+    if request.method == "POST":
+        username = request.form.get("username")
+        password = request.form.get("password")
+        
+        usuario = Usuario.query.filter_by(username=username).first()
+        
+        if usuario and usuario.check_password(password):
+            login_user(usuario)
+            flash(f'Bienvenido, {usuario.nombre}!', 'success')
+            return redirect(url_for('dashboard'))
+        else:
+            flash('Usuario o contraseña incorrectos', 'error')
+    
+    return render_template("login.html")
+
+@app.route("/logout")
+@login_required
+def logout():
+    logout_user()
+    flash('Sesión cerrada exitosamente', 'success')
+    return redirect(url_for('login'))
+
+@app.route("/dashboard")
+@login_required
+def dashboard():
+    if current_user.rol == 'cocina':
+        return redirect(url_for('cocina'))
+    
+    mesas = Mesa.query.filter_by(activa=True).order_by(Mesa.numero).all()
+    
+    # Obtener solo sesiones activas de hoy
+    hoy = datetime.now().date()
+    sesiones_activas = Sesion.query.filter(
+        Sesion.activa == True,
+        db.func.date(Sesion.fecha_inicio) == hoy
+    ).all()
+    
+    # Agrupar por mesa con información de la sesión activa
+    info_mesas = {}
+    for mesa in mesas:
+        # Buscar sesión activa de esta mesa
+        sesion_activa = next((s for s in sesiones_activas if s.mesa_id == mesa.id), None)
+        
+        if sesion_activa:
+            # Obtener pedidos de la sesión activa
+            pedidos = Pedido.query.filter_by(sesion_id=sesion_activa.id).all()
+            
+            info_mesas[mesa.id] = {
+                'mesa': mesa,
+                'sesion': sesion_activa,
+                'pedidos': pedidos,
+                'tiene_pendientes': any(not p.pagado for p in pedidos),
+                'todos_entregados': all(p.estado == 'entregado' for p in pedidos),
+                'total_pedidos': len(pedidos),
+                'hora_inicio': sesion_activa.fecha_inicio.strftime('%H:%M')
+            }
+        else:
+            info_mesas[mesa.id] = {
+                'mesa': mesa,
+                'sesion': None,
+                'pedidos': [],
+                'tiene_pendientes': False,
+                'todos_entregados': False,
+                'total_pedidos': 0,
+                'hora_inicio': None
+            }
+    
+    return render_template("dashboard.html", 
+                         mesas=mesas, 
+                         info_mesas=info_mesas,
+                         now=datetime.now())
+
+@app.route("/nuevo_pedido/<int:mesa_id>", methods=["GET", "POST"])
+@login_required
+def nuevo_pedido(mesa_id):
+    mesa = Mesa.query.get_or_404(mesa_id)
+    
+    if request.method == "POST":
+        producto = request.form.get("producto")
+        cantidad = request.form.get("cantidad", 1, type=int)
+        precio_unitario = request.form.get("precio_unitario", 0, type=float)
+        notas = request.form.get("notas", "")
+        
+        # Buscar o crear sesión activa para esta mesa (con la mesa bloqueada)
+        sesion_activa = obtener_o_crear_sesion_activa(mesa_id)
+        
+        pedido = Pedido(
+            mesa_id=mesa_id,
+            sesion_id=sesion_activa.id,
+            mesero_id=current_user.id,
+            producto=producto,
+            cantidad=cantidad,
+            precio_unitario=precio_unitario,
+            notas=notas
+        )
+        
+        db.session.add(pedido)
+        
+        total = precio_unitario * cantidad
+        sumar_a_totales_sesion(sesion_activa.id, subtotal=total)
+        if IMPRIMIR_COMANDAS:
+            encolar_impresion('cocina', escpos_comanda(f"MESA {mesa.numero}", [(cantidad, producto, notas)],
+                                                       current_user.nombre), f"Comanda mesa {mesa.numero}")
+        db.session.commit()
+        
+        flash(f'Pedido agregado: {cantidad}x {producto} = ${total:.2f}', 'success')
+        return redirect(url_for('ver_mesa', mesa_id=mesa_id))
+    
+    # Obtener todos los items del menú disponibles, agrupados por categoría
+    items_menu = ItemMenu.query.filter_by(disponible=True).order_by(
+        ItemMenu.categoria_id, ItemMenu.orden
+    ).all()
+    
+    return render_template("nuevo_pedido.html", mesa=mesa, items_menu=items_menu)
+
+@app.route("/mesa/<int:mesa_id>")
+@login_required
+def ver_mesa(mesa_id):
+    mesa = Mesa.query.get_or_404(mesa_id)
+    
+    # Obtener sesión activa
+    sesion_activa = Sesion.query.filter_by(
+        mesa_id=mesa_id,
+        activa=True
+    ).first()
+    
+    # Obtener pedidos de la sesión activa (los totales vienen acumulados en la sesión)
+    pedidos_actuales = []
+    totales_sesion_activa = {
+        'total_general': 0,
+        'total_pagado': 0,
+        'total_pendiente': 0
+    }
+    
+    if sesion_activa:
+        pedidos_actuales = Pedido.query.filter_by(
+            sesion_id=sesion_activa.id
+        ).order_by(Pedido.fecha.desc()).all()
+        
+        totales_sesion_activa = {
+            'total_general': sesion_activa.subtotal or 0,
+            'total_pagado': sesion_activa.pagado or 0,
+            'total_pendiente': sesion_activa.pendiente or 0
+        }
+    
+    # Obtener sesiones anteriores de hoy (pedidos cargados en una sola consulta para el template)
+    hoy = datetime.now().date()
+    sesiones_anteriores = Sesion.query.filter(
+        Sesion.mesa_id == mesa_id,
+        Sesion.activa == False,
+        db.func.date(Sesion.fecha_inicio) == hoy
+    ).options(db.selectinload(Sesion.pedidos)).order_by(Sesion.fecha_inicio.desc()).all()
+    
+    sesiones_con_totales = [{
+        'sesion': sesion,
+        'total_general': sesion.subtotal or 0,
+        'total_pagado': sesion.pagado or 0,
+        'total_pendiente': sesion.pendiente or 0
+    } for sesion in sesiones_anteriores]
+    
+    return render_template("ver_mesa.html", 
+                         mesa=mesa, 
+                         pedidos=pedidos_actuales,
+                         sesion_activa=sesion_activa,
+                         totales_sesion_activa=totales_sesion_activa,
+                         sesiones_anteriores=sesiones_con_totales,
+                         current_user=current_user)
+
+@app.route("/cocina")
+@login_required
+def cocina():
+    hoy = datetime.now().date()
+    
+    pedidos_pendientes = Pedido.query.filter(
+        db.func.date(Pedido.fecha) == hoy,
+        Pedido.estado.in_(['pendiente', 'preparando'])
+    ).order_by(Pedido.fecha).all()
+    
+    return render_template(
+        "cocina.html",
+        pedidos=pedidos_pendientes,
+        now=datetime.now()
+    )
+
+@app.route("/api/cocina/pedidos")
+@login_required
+def api_cocina_pedidos():
+    hoy = datetime.now().date()
+    
+    pedidos = Pedido.query.filter(
+        db.func.date(Pedido.fecha) == hoy,
+        Pedido.estado.in_(['pendiente', 'preparando'])
+    ).order_by(Pedido.fecha).all()
+    
+    data = []
+    for p in pedidos:
+        data.append({
+            "id": p.id,
+            "mesa": p.mesa.numero,
+            "producto": p.producto,
+            "cantidad": p.cantidad,
+            "notas": p.notas or "",
+            "estado": p.estado,
+            "fecha": p.fecha.isoformat()
+        })
+    
+    return jsonify(data)
+
+
+@app.route("/actualizar_estado/<int:pedido_id>/<estado>")
+@login_required
+def actualizar_estado(pedido_id, estado):
+    pedido = Pedido.query.get_or_404(pedido_id)
+    estados_validos = ['pendiente', 'preparando', 'listo', 'entregado']
+    
+    if estado in estados_validos:
+        pedido.estado = estado
+        try:
+            pedido.estado_actualizado = datetime.now()
+        except Exception:
+            # En caso de que la columna no exista en DB todavía
+            pass
+        db.session.commit()
+        flash(f'Estado actualizado a: {estado}', 'success')
+        # Si se marcó como 'listo' y quien lo marcó NO es mesero, creamos una notificación para meseros
+        if estado == 'listo' and getattr(current_user, 'rol', None) != 'mesero':
+            # No necesitamos guardar una entidad de notificación; el JS de meseros hará polling por pedidos 'listo' recientes
+            pass
+    
+    return redirect(request.referrer or url_for('dashboard'))
+
+@app.route("/marcar_pagado/<int:pedido_id>")
+@login_required
+def marcar_pagado(pedido_id):
+    pedido = Pedido.query.get_or_404(pedido_id)
+    # Cambio condicional: con un doble toque solo una solicitud voltea la bandera
+    # y solo esa suma el monto a los totales de la sesión
+    volteado = Pedido.query.filter(Pedido.id == pedido_id, Pedido.pagado == False).update(
+        {Pedido.pagado: True}, synchronize_session=False
+    )
+    if volteado == 1 and pedido.sesion_id:
+        sumar_a_totales_sesion(pedido.sesion_id, pagado=pedido.total)
+    db.session.commit()
+    flash('Pedido marcado como pagado', 'success')
+    return redirect(request.referrer or url_for('dashboard'))
+
+
+@app.route('/notificaciones/pendientes')
+@login_required
+def notificaciones_pendientes():
+    """Endpoint que devuelve pedidos marcados como 'listo' desde un timestamp 'since'.
+    Parámetros: since (ISO 8601 string). Solo accesible a usuarios con rol 'mesero'."""
+    if getattr(current_user, 'rol', None) != 'mesero':
+        return jsonify([])
+
+    since = request.args.get('since')
+    try:
+        since_dt = datetime.fromisoformat(since) if since else (datetime.now() - timedelta(seconds=10))
+    except Exception:
+        since_dt = datetime.now() - timedelta(seconds=10)
+
+    pedidos = Pedido.query.filter(
+        Pedido.estado == 'listo',
+        Pedido.estado_actualizado > since_dt
+    ).order_by(Pedido.estado_actualizado.asc()).all()
+
+    data = []
+    for p in pedidos:
+        data.append({
+            'id': p.id,
+            'mesa': p.mesa.numero if p.mesa else None,
+            'producto': p.producto,
+            'cantidad': p.cantidad,
+            'estado_actualizado': p.estado_actualizado.isoformat() if p.estado_actualizado else None
+        })
+
+    return jsonify(data)
+
+@app.route("/pagar_mesa/<int:mesa_id>")
+@login_required
+def pagar_mesa(mesa_id):
+    hoy = datetime.now().date()
+    pedidos = Pedido.query.filter(
+        Pedido.mesa_id == mesa_id,
+        db.func.date(Pedido.fecha) == hoy,
+        Pedido.pagado == False
+    ).all()
+    
+    for pedido in pedidos:
+        pedido.pagado = True
+    
+    db.session.flush()
+    recalcular_totales_sesion({p.sesion_id for p in pedidos if p.sesion_id})
+    db.session.commit()
+    flash(f'Todos los pedidos de la mesa {mesa_id} marcados como pagados', 'success')
+    return redirect(url_for('dashboard'))
+
+@app.route("/historial")
+@login_required
+def historial():
+    # Obtener fecha del parámetro o usar fecha actual
+    fecha_param = request.args.get('fecha')
+    fecha_seleccionada = None
+    sesiones_por_dia = {}
+    totales_por_dia = {}
+    
+    if fecha_param:
+        try:
+            fecha_seleccionada = datetime.strptime(fecha_param, '%Y-%m-%d').date()
+            # Obtener sesiones de la fecha seleccionada
+            sesiones = Sesion.query.filter(
+                db.func.date(Sesion.fecha_inicio) == fecha_seleccionada
+            ).order_by(Sesion.fecha_inicio.desc()).all()
+            
+            if sesiones:
+                fecha_str = fecha_seleccionada.strftime('%Y-%m-%d')
+                sesiones_por_dia[fecha_str] = sesiones
+                
+                # Calcular totales para esa fecha
+                total_general = sum(s.total or 0 for s in sesiones if not s.activa)
+                total_facturado = sum(s.total or 0 for s in sesiones if not s.activa and s.facturas)
+                total_sin_facturar = sum(s.total or 0 for s in sesiones if not s.activa and not s.facturas)
+                sesiones_activas = sum(1 for s in sesiones if s.activa)
+                sesiones_cerradas = sum(1 for s in sesiones if not s.activa)
+                
+                totales_por_dia[fecha_str] = {
+                    'total_general': total_general,
+                    'total_facturado': total_facturado,
+                    'total_sin_facturar': total_sin_facturar,
+                    'sesiones_activas': sesiones_activas,
+                    'sesiones_cerradas': sesiones_cerradas
+                }
+        except ValueError:
+            flash('Fecha inválida', 'error')
+            fecha_seleccionada = None
+    
+    # Si no hay fecha seleccionada, mostrar últimos 7 días
+    if not fecha_param:
+        sesiones = Sesion.query.order_by(Sesion.fecha_inicio.desc()).limit(100).all()
+        
+        for sesion in sesiones:
+            fecha_str = sesion.fecha_inicio.strftime('%Y-%m-%d')
+            if fecha_str not in sesiones_por_dia:
+                sesiones_por_dia[fecha_str] = []
+            sesiones_por_dia[fecha_str].append(sesion)
+        
+        # Limitar a los últimos 7 días
+        sesiones_por_dia = dict(list(sesiones_por_dia.items())[:7])
+        
+        # Calcular totales para cada día
+        for fecha_str, sesiones_dia in sesiones_por_dia.items():
+            total_general = sum(s.total or 0 for s in sesiones_dia if not s.activa)
+            total_facturado = sum(s.total or 0 for s in sesiones_dia if not s.activa and s.facturas)
+            total_sin_facturar = sum(s.total or 0 for s in sesiones_dia if not s.activa and not s.facturas)
+            sesiones_activas = sum(1 for s in sesiones_dia if s.activa)
+            sesiones_cerradas = sum(1 for s in sesiones_dia if not s.activa)
+            
+            totales_por_dia[fecha_str] = {
+                'total_general': total_general,
+                'total_facturado': total_facturado,
+                'total_sin_facturar': total_sin_facturar,
+                'sesiones_activas': sesiones_activas,
+                'sesiones_cerradas': sesiones_cerradas
+            }
+    
+    return render_template("historial.html", 
+                         sesiones_por_dia=sesiones_por_dia,
+                         totales_por_dia=totales_por_dia,
+                         fecha_seleccionada=fecha_seleccionada,
+                         now=datetime.now())
+
+@app.route("/administrar_mesas", methods=["GET", "POST"])
+@login_required
+def administrar_mesas():
+    if current_user.rol != 'admin':
+        flash('Solo los administradores pueden gestionar mesas', 'error')
+        return redirect(url_for('dashboard'))
+    
+    if request.method == "POST":
+        accion = request.form.get("accion")
+        
+        if accion == "agregar":
+            numero = request.form.get("numero", type=int)
+            capacidad = request.form.get("capacidad", type=int, default=4)
+            
+            if Mesa.query.filter_by(numero=numero).first():
+                flash(f'La mesa {numero} ya existe', 'error')
+            else:
+                mesa = Mesa(numero=numero, capacidad=capacidad)
+                db.session.add(mesa)
+                db.session.commit()
+                flash(f'Mesa {numero} agregada exitosamente', 'success')
+        
+        elif accion == "eliminar":
+            mesa_id = request.form.get("mesa_id", type=int)
+            mesa = Mesa.query.get(mesa_id)
+            if mesa:
+                # Verificar si tiene pedidos
+                if Pedido.query.filter_by(mesa_id=mesa_id).first():
+                    flash(f'No se puede eliminar la mesa {mesa.numero} porque tiene pedidos asociados', 'error')
+                else:
+                    db.session.delete(mesa)
+                    db.session.commit()
+                    flash(f'Mesa {mesa.numero} eliminada exitosamente', 'success')
+        
+        elif accion == "toggle":
+            mesa_id = request.form.get("mesa_id", type=int)
+            mesa = Mesa.query.get(mesa_id)
+            if mesa:
+                mesa.activa = not mesa.activa
+                db.session.commit()
+                estado = "activada" if mesa.activa else "desactivada"
+                flash(f'Mesa {mesa.numero} {estado}', 'success')
+        
+        return redirect(url_for('administrar_mesas'))
     
     mesas = Mesa.query.order_by(Mesa.numero).all()
     return render_template("administrar_mesas.html", mesas=mesas)
 
-@app.route("/administrar_usuarios", methods=["GET", "POST"])
+@app.route("/administrar_usuarios", methods=["GET", "POST"])
+@login_required
+def administrar_usuarios():
+    if current_user.rol != 'admin':
+        flash('Solo los administradores pueden gestionar usuarios', 'error')
+        return redirect(url_for('dashboard'))
+    
+    if request.method == "POST":
+        username = request.form.get("username")
+        password = request.form.get("password")
+        nombre = request.form.get("nombre")
+        rol = request.form.get("rol", "mesero")
+        
+        if Usuario.query.filter_by(username=username).first():
+            flash(f'El usuario {username} ya existe', 'error')
+        else:
+            usuario = Usuario(username=username, nombre=nombre, rol=rol)
+            usuario.set_password(password)
+            db.session.add(usuario)
+            db.session.commit()
+            invalidar_usuario_cache(usuario.id)
+            flash(f'Usuario {username} creado exitosamente', 'success')
+        
+        return redirect(url_for('administrar_usuarios'))
+    
+    usuarios = Usuario.query.order_by(Usuario.nombre).all()
+    return render_template("administrar_usuarios.html", usuarios=usuarios)
+
+
+@app.route("/api/cocina/verificar_nuevos")
+@login_required
+def verificar_nuevos_pedidos():
+    """
+    RAZÓN: Endpoint ligero para verificar nuevos pedidos sin recargar toda la página
+    """
+    hoy = datetime.now().date()
+    
+    # Solo pedidos pendientes y preparando
+    pedidos = Pedido.query.filter(
+        db.func.date(Pedido.fecha) == hoy,
+        Pedido.estado.in_(['pendiente', 'preparando'])
+    ).all()
+    
+    # Devolver solo los IDs y timestamps
+    data = {
+        'pedidos': [
+            {
+                'id': p.id,
+                'mesa': p.mesa.numero,
+                'producto': p.producto,
+                'cantidad': p.cantidad,
+                'estado': p.estado,
+                'timestamp': p.fecha.timestamp()
+            }
+            for p in pedidos
+        ],
+        'total': len(pedidos),
+        'pendientes': len([p for p in pedidos if p.estado == 'pendiente']),
+        'preparando': len([p for p in pedidos if p.estado == 'preparando'])
+    }
+    
+    return jsonify(data)
+
+@app.route("/eliminar_usuario/<int:user_id>", methods=["POST", "GET"])
+@login_required
+def eliminar_usuario(user_id):
+    if current_user.rol != 'admin':
+        flash('Solo los administradores pueden eliminar usuarios', 'error')
+        return redirect(url_for('dashboard'))
+    
+    if user_id == current_user.id:
+        flash('No puedes eliminar tu propio usuario', 'error')
+        return redirect(url_for('administrar_usuarios'))
+    
+    usuario = Usuario.query.get_or_404(user_id)
+    nombre = usuario.nombre
+    db.session.delete(usuario)
+    db.session.commit()
+    invalidar_usuario_cache(user_id)
+    flash(f'Usuario {nombre} eliminado', 'success')
+    return redirect(url_for('administrar_usuarios'))
+
+@app.route("/liberar_mesa/<int:mesa_id>")
+@login_required
+def liberar_mesa(mesa_id):
+    """Cierra la sesión activa de una mesa"""
+    bloquear_mesa(mesa_id)
+    sesion_activa = Sesion.query.filter_by(
+        mesa_id=mesa_id,
+        activa=True
+    ).populate_existing().first()
+    
+    if sesion_activa:
+        # Marcar todos los pedidos como entregados y pagados
+        for pedido in sesion_activa.pedidos:
+            pedido.pagado = True
+            pedido.estado = 'entregado'
+        
+        # Cerrar sesión
+        sesion_activa.activa = False
+        sesion_activa.fecha_fin = datetime.now()
+        sesion_activa.pagado = sesion_activa.subtotal
+        sesion_activa.pendiente = 0
+        
+        db.session.commit()
+        flash(f'Mesa {mesa_id} liberada exitosamente', 'success')
+    else:
+        flash('No hay sesión activa para esta mesa', 'error')
+    
+    return redirect(url_for('dashboard'))
+
+@app.route("/historial/<fecha>")
+@login_required
+def historial_fecha(fecha):
+    """Ver historial de una fecha específica"""
+    try:
+        fecha_obj = datetime.strptime(fecha, '%Y-%m-%d').date()
+    except ValueError:
+        flash('Fecha inválida', 'error')
+        return redirect(url_for('historial'))
+    
+    pedidos = Pedido.query.filter(
+        db.func.date(Pedido.fecha) == fecha_obj
+    ).order_by(Pedido.fecha.desc()).all()
+    
+    pedidos_por_dia = {fecha: pedidos}
+    
+    return render_template("historial.html", 
+                         pedidos_por_dia=pedidos_por_dia,
+                         fecha_seleccionada=fecha_obj)
+
+# =========================
+# RUTAS DEL MENÚ PÚBLICO
+# =========================
+
+@app.route("/menu")
+def menu_publico():
+    """Menú público accesible sin login"""
+    categorias = CategoriaMenu.query.filter_by(activa=True).order_by(CategoriaMenu.orden).all()
+    return render_template("menu_publico.html", categorias=categorias)
+
+@app.route("/administrar_menu")
+@login_required
+def administrar_menu():
+    """Panel de administración del menú"""
+    if current_user.rol != 'admin':
+        flash('Solo los administradores pueden gestionar el menú', 'error')
+        return redirect(url_for('dashboard'))
+    
+    categorias = CategoriaMenu.query.order_by(CategoriaMenu.orden).all()
+    items = ItemMenu.query.order_by(ItemMenu.categoria_id, ItemMenu.orden).all()
+    
+    return render_template("administrar_menu.html", categorias=categorias, items=items)
+
+@app.route("/agregar_categoria", methods=["POST"])
+@login_required
+def agregar_categoria():
+    if current_user.rol != 'admin':
+        flash('Solo los administradores pueden agregar categorías', 'error')
+        return redirect(url_for('dashboard'))
+    
+    nombre = request.form.get("nombre")
+    orden = request.form.get("orden", 0, type=int)
+    
+    categoria = CategoriaMenu(nombre=nombre, orden=orden)
+    db.session.add(categoria)
+    db.session.commit()
+    
+    flash(f'Categoría "{nombre}" agregada exitosamente', 'success')
+    return redirect(url_for('administrar_menu'))
+
+@app.route("/agregar_item", methods=["POST"])
+@login_required
+def agregar_item():
+    if current_user.rol != 'admin':
+        flash('Solo los administradores pueden agregar items', 'error')
+        return redirect(url_for('dashboard'))
+    
+    nombre = request.form.get("nombre")
+    descripcion = request.form.get("descripcion", "")
+    precio = request.form.get("precio", type=float)
+    categoria_id = request.form.get("categoria_id", type=int)
+    imagen_url = request.form.get("imagen_url", "")
+    orden = request.form.get("orden", 0, type=int)
+    
+    item = ItemMenu(
+        nombre=nombre,
+        descripcion=descripcion,
+        precio=precio,
+        categoria_id=categoria_id,
+        imagen_url=imagen_url,
+        orden=orden
+    )
+    
+    db.session.add(item)
+    db.session.commit()
+    
+    flash(f'Platillo "{nombre}" agregado exitosamente', 'success')
+    return redirect(url_for('administrar_menu'))
+
+@app.route("/editar_item/<int:item_id>", methods=["POST"])
+@login_required
+def editar_item(item_id):
+    if current_user.rol != 'admin':
+        flash('Solo los administradores pueden editar items', 'error')
+        return redirect(url_for('dashboard'))
+    
+    item = ItemMenu.query.get_or_404(item_id)
+    
+    item.nombre = request.form.get("nombre")
+    item.descripcion = request.form.get("descripcion", "")
+    item.precio = request.form.get("precio", type=float)
+    item.categoria_id = request.form.get("categoria_id", type=int)
+    item.imagen_url = request.form.get("imagen_url", "")
+    item.orden = request.form.get("orden", 0, type=int)
+    
+    db.session.commit()
+    
+    flash(f'Platillo "{item.nombre}" actualizado', 'success')
+    return redirect(url_for('administrar_menu'))
+
+@app.route("/toggle_item/<int:item_id>")
+@login_required
+def toggle_item(item_id):
+    if current_user.rol != 'admin':
+        flash('Solo los administradores pueden modificar items', 'error')
+        return redirect(url_for('dashboard'))
+    
+    item = ItemMenu.query.get_or_404(item_id)
+    item.disponible = not item.disponible
+    db.session.commit()
+    
+    estado = "disponible" if item.disponible else "no disponible"
+    flash(f'"{item.nombre}" marcado como {estado}', 'success')
+    return redirect(url_for('administrar_menu'))
+
+@app.route("/eliminar_item/<int:item_id>", methods=["POST"])
+@login_required
+def eliminar_item(item_id):
+    if current_user.rol != 'admin':
+        flash('Solo los administradores pueden eliminar items', 'error')
+        return redirect(url_for('dashboard'))
+    
+    item = ItemMenu.query.get_or_404(item_id)
+    nombre = item.nombre
+    db.session.delete(item)
+    db.session.commit()
+    
+    flash(f'"{nombre}" eliminado del menú', 'success')
+    return redirect(url_for('administrar_menu'))
+
+@app.route("/eliminar_categoria/<int:categoria_id>", methods=["POST"])
+@login_required
+def eliminar_categoria(categoria_id):
+    if current_user.rol != 'admin':
+        flash('Solo los administradores pueden eliminar categorías', 'error')
+        return redirect(url_for('dashboard'))
+    
+    categoria = CategoriaMenu.query.get_or_404(categoria_id)
+    
+    if categoria.items:
+        flash(f'No se puede eliminar "{categoria.nombre}" porque tiene platillos asociados', 'error')
+    else:
+        nombre = categoria.nombre
+        db.session.delete(categoria)
+        db.session.commit()
+        flash(f'Categoría "{nombre}" eliminada', 'success')
+    
+    return redirect(url_for('administrar_menu'))
+
+# ==========================================
+# RUTAS PARA GESTIÓN DE GASTOS
+# ==========================================
+
+@app.route("/gastos")
+@login_required
+def lista_gastos():
+    """
+    RAZÓN: Vista principal de gastos con filtros por fecha y categoría.
+    Permite búsqueda rápida y visualización de totales.
+    """
+    # Obtener parámetros de filtro
+    fecha_inicio = request.args.get('fecha_inicio')
+    fecha_fin = request.args.get('fecha_fin')
+    categoria_id = request.args.get('categoria_id', type=int)
+    
+    # Query base
+    query = Gasto.query
+    
+    # Aplicar filtros
+    if fecha_inicio:
+        try:
+            # Empezamos el día a las 03:00 (cierre a partir de las 03:00)
+            fecha_inicio_obj = datetime.strptime(fecha_inicio, '%Y-%m-%d').replace(hour=3, minute=0, second=0)
+            query = query.filter(Gasto.fecha >= fecha_inicio_obj)
+        except ValueError:
+            flash('Fecha de inicio inválida', 'error')
+    
+    if fecha_fin:
+        try:
+            # La fecha de fin será el inicio del día siguiente a las 03:00 (end-exclusive)
+            fecha_fin_obj = datetime.strptime(fecha_fin, '%Y-%m-%d').replace(hour=3, minute=0, second=0) + timedelta(days=1)
+            query = query.filter(Gasto.fecha < fecha_fin_obj)
+        except ValueError:
+            flash('Fecha de fin inválida', 'error')
+    
+    if categoria_id:
+        query = query.filter(Gasto.categoria_id == categoria_id)
+    
+    # Obtener gastos ordenados por fecha descendente
+    gastos = query.order_by(Gasto.fecha.desc()).all()
+    
+    # Calcular totales
+    total_gastos = sum(g.monto for g in gastos)
+    
+    # Totales por categoría (para el dashboard)
+    totales_por_categoria = db.session.query(
+        CategoriaGasto.nombre,
+        CategoriaGasto.color,
+        db.func.sum(Gasto.monto).label('total')
+    ).join(Gasto).group_by(CategoriaGasto.id).all()
+    
+    # Obtener todas las categorías para el filtro
+    categorias = CategoriaGasto.query.filter_by(activa=True).order_by(CategoriaGasto.nombre).all()
+    
+    return render_template("gastos/lista_gastos.html",
+                         gastos=gastos,
+                         total_gastos=total_gastos,
+                         totales_por_categoria=totales_por_categoria,
+                         categorias=categorias,
+                         fecha_inicio=fecha_inicio,
+                         fecha_fin=fecha_fin,
+                         categoria_id=categoria_id)
+
+
+# ==========================================
+# ACTUALIZAR RUTA DE NUEVO GASTO
+# ==========================================
+
+# REEMPLAZA tu ruta actual de nuevo_gasto con esta versión mejorada:
+
+@app.route("/gasto/nuevo", methods=["GET", "POST"])
+@login_required
+@idempotente
+def nuevo_gasto():
+    """
+    RAZÓN: Formulario para registrar un nuevo gasto.
+    Ahora incluye estado de pago y fecha de vencimiento.
+    """
+    if current_user.rol == 'cocina':
+        flash('No tienes permisos para registrar gastos', 'error')
+        return redirect(url_for('dashboard'))
+    
+    if request.method == "POST":
+        try:
+            # Obtener datos del formulario
+            fecha_str = request.form.get("fecha")
+            concepto = request.form.get("concepto")
+            monto = request.form.get("monto", type=float)
+            categoria_id = request.form.get("categoria_id", type=int)
+            proveedor_id = request.form.get("proveedor_id", type=int) or None
+            metodo_pago = request.form.get("metodo_pago", "efectivo")
+            numero_factura = request.form.get("numero_factura", "")
+            notas = request.form.get("notas", "")
+            
+            # NUEVOS CAMPOS
+            estado_pago = request.form.get("estado_pago", "pagado")
+            fecha_vencimiento_str = request.form.get("fecha_vencimiento")
+            
+            # Validaciones básicas
+            if not concepto or monto <= 0:
+                flash('Debes completar todos los campos requeridos', 'error')
+                return redirect(url_for('nuevo_gasto'))
+            
+            # Convertir fecha
+            if fecha_str:
+                fecha = datetime.strptime(fecha_str, '%Y-%m-%dT%H:%M')
+            else:
+                fecha = datetime.now()
+            
+            # Convertir fecha de vencimiento
+            fecha_vencimiento = None
+            if fecha_vencimiento_str and estado_pago == 'pendiente':
+                fecha_vencimiento = datetime.strptime(fecha_vencimiento_str, '%Y-%m-%d').date()
+            
+            # Si está pagado, la fecha de pago es ahora
+            fecha_pago_real = datetime.now() if estado_pago == 'pagado' else None
+            
+            # Crear gasto
+            gasto = Gasto(
+                fecha=fecha,
+                concepto=concepto,
+                monto=monto,
+                categoria_id=categoria_id,
+                proveedor_id=proveedor_id,
+                usuario_id=current_user.id,
+                metodo_pago=metodo_pago,
+                numero_factura=numero_factura,
+                notas=notas,
+                estado_pago=estado_pago,
+                fecha_vencimiento=fecha_vencimiento,
+                fecha_pago_real=fecha_pago_real
+            )
+            
+            db.session.add(gasto)
+            db.session.commit()
+            
+            # Verificar si se excedió el presupuesto
+            verificar_presupuesto(categoria_id)
+            
+            flash(f'Gasto de ${monto:,.2f} registrado exitosamente', 'success')
+            return redirect(url_for('lista_gastos'))
+            
+        except Exception as e:
+            db.session.rollback()
+            flash(f'Error al registrar el gasto: {str(e)}', 'error')
+            return redirect(url_for('nuevo_gasto'))
+    
+    # GET: Mostrar formulario
+    categorias = CategoriaGasto.query.filter_by(activa=True).order_by(CategoriaGasto.nombre).all()
+    proveedores = Proveedor.query.filter_by(activo=True).order_by(Proveedor.nombre).all()
+    
+    return render_template("gastos/nuevo_gasto.html",
+                         categorias=categorias,
+                         proveedores=proveedores,
+                         now=datetime.now())
+
+
+# Función auxiliar para verificar presupuestos
+def verificar_presupuesto(categoria_id):
+    """
+    RAZÓN: Verifica si se excedió el presupuesto de una categoría
+    y genera alertas en flash messages.
+    """
+    from datetime import datetime
+    mes_actual = datetime.now().month
+    anio_actual = datetime.now().year
+    
+    presupuesto = Presupuesto.query.filter_by(
+        categoria_id=categoria_id,
+        mes=mes_actual,
+        anio=anio_actual,
+        activo=True
+    ).first()
+    
+    if presupuesto:
+        porcentaje = presupuesto.porcentaje_usado
+        categoria = presupuesto.categoria.nombre
+        
+        if porcentaje >= 100:
+            flash(f'⚠️ ALERTA: Presupuesto de "{categoria}" EXCEDIDO ({porcentaje:.1f}%)', 'error')
+        elif porcentaje >= presupuesto.alerta_porcentaje:
+            flash(f'⚠️ Advertencia: Presupuesto de "{categoria}" al {porcentaje:.1f}%', 'error')
+
+
+
+@app.route("/gasto/editar/<int:gasto_id>", methods=["GET", "POST"])
+@login_required
+def editar_gasto(gasto_id):
+    """
+    RAZÓN: Permite corregir errores en gastos registrados.
+    Solo admin puede editar gastos de otros usuarios.
+    """
+    gasto = Gasto.query.get_or_404(gasto_id)
+    
+    # Verificar permisos
+    if current_user.rol != 'admin' and gasto.usuario_id != current_user.id:
+        flash('No tienes permisos para editar este gasto', 'error')
+        return redirect(url_for('lista_gastos'))
+    
+    if request.method == "POST":
+        try:
+            fecha_str = request.form.get("fecha")
+            gasto.concepto = request.form.get("concepto")
+            gasto.monto = request.form.get("monto", type=float)
+            gasto.categoria_id = request.form.get("categoria_id", type=int)
+            gasto.proveedor_id = request.form.get("proveedor_id", type=int) or None
+            gasto.metodo_pago = request.form.get("metodo_pago")
+            gasto.numero_factura = request.form.get("numero_factura", "")
+            gasto.notas = request.form.get("notas", "")
+            
+            if fecha_str:
+                gasto.fecha = datetime.strptime(fecha_str, '%Y-%m-%dT%H:%M')
+            
+            db.session.commit()
+            flash('Gasto actualizado exitosamente', 'success')
+            return redirect(url_for('lista_gastos'))
+            
+        except Exception as e:
+            db.session.rollback()
+            flash(f'Error al actualizar: {str(e)}', 'error')
+    
+    categorias = CategoriaGasto.query.filter_by(activa=True).order_by(CategoriaGasto.nombre).all()
+    proveedores = Proveedor.query.filter_by(activo=True).order_by(Proveedor.nombre).all()
+    
+    return render_template("gastos/editar_gasto.html",
+                         gasto=gasto,
+                         categorias=categorias,
+                         proveedores=proveedores)
+
+
+@app.route("/gasto/eliminar/<int:gasto_id>", methods=["POST"])
 @login_required
-def administrar_usuarios():
+def eliminar_gasto(gasto_id):
+    """
+    RAZÓN: Solo admin puede eliminar gastos para mantener integridad.
+    Se elimina permanentemente (no soft delete).
+    """
     if current_user.rol != 'admin':
-        flash('Solo los administradores pueden gestionar usuarios', 'error')
-        return redirect(url_for('dashboard'))
+        flash('Solo administradores pueden eliminar gastos', 'error')
+        return redirect(url_for('lista_gastos'))
     
-    if request.method == "POST":
-        username = request.form.get("username")
-        password = request.form.get("password")
-        nombre = request.form.get("nombre")
-        rol = request.form.get("rol", "mesero")
-        
-        if Usuario.query.filter_by(username=username).first():
-            flash(f'El usuario {username} ya existe', 'error')
-        else:
-            usuario = Usuario(username=username, nombre=nombre, rol=rol)
-            usuario.set_password(password)
-            db.session.add(usuario)
-            db.session.commit()
-            flash(f'Usuario {username} creado exitosamente', 'success')
-        
-        return redirect(url_for('administrar_usuarios'))
+    gasto = Gasto.query.get_or_404(gasto_id)
+    monto = gasto.monto
+    concepto = gasto.concepto
     
-    usuarios = Usuario.query.order_by(Usuario.nombre).all()
-    return render_template("administrar_usuarios.html", usuarios=usuarios)
+    db.session.delete(gasto)
+    db.session.commit()
+    
+    flash(f'Gasto eliminado: {concepto} (${monto:,.2f})', 'success')
+    return redirect(url_for('lista_gastos'))
 
+# ==========================================
+# RUTAS PARA CUENTAS POR PAGAR
+# ==========================================
 
-@app.route("/api/cocina/verificar_nuevos")
+@app.route("/cuentas_por_pagar")
 @login_required
-def verificar_nuevos_pedidos():
+def cuentas_por_pagar():
     """
-    RAZÓN: Endpoint ligero para verificar nuevos pedidos sin recargar toda la página
+    RAZÓN: Vista principal de deudas con proveedores.
+    Muestra gastos pendientes de pago y vencidos.
     """
-    hoy = datetime.now().date()
+    # Obtener filtros
+    estado = request.args.get('estado', 'todos')
+    proveedor_id = request.args.get('proveedor_id', type=int)
     
-    # Solo pedidos pendientes y preparando
-    pedidos = Pedido.query.filter(
-        db.func.date(Pedido.fecha) == hoy,
-        Pedido.estado.in_(['pendiente', 'preparando'])
-    ).all()
+    # Query base
+    query = Gasto.query
     
-    # Devolver solo los IDs y timestamps
-    data = {
-        'pedidos': [
-            {
-                'id': p.id,
-                'mesa': p.mesa.numero,
-                'producto': p.producto,
-                'cantidad': p.cantidad,
-                'estado': p.estado,
-                'timestamp': p.fecha.timestamp()
-            }
-            for p in pedidos
-        ],
-        'total': len(pedidos),
-        'pendientes': len([p for p in pedidos if p.estado == 'pendiente']),
-        'preparando': len([p for p in pedidos if p.estado == 'preparando'])
-    }
+    # Aplicar filtros
+    if estado != 'todos':
+        query = query.filter(Gasto.estado_pago == estado)
     
-    return jsonify(data)
-
-@app.route("/eliminar_usuario/<int:user_id>", methods=["POST", "GET"])
-@login_required
-def eliminar_usuario(user_id):
-    if current_user.rol != 'admin':
-        flash('Solo los administradores pueden eliminar usuarios', 'error')
-        return redirect(url_for('dashboard'))
+    if proveedor_id:
+        query = query.filter(Gasto.proveedor_id == proveedor_id)
     
-    if user_id == current_user.id:
-        flash('No puedes eliminar tu propio usuario', 'error')
-        return redirect(url_for('administrar_usuarios'))
+    # Ordenar por fecha de vencimiento
+    gastos = query.order_by(Gasto.fecha_vencimiento).all()
+    
+    # Actualizar estados de gastos vencidos automáticamente
+    from datetime import date
+    hoy = date.today()
+    
+    for gasto in gastos:
+        if gasto.estado_pago == 'pendiente' and gasto.fecha_vencimiento and gasto.fecha_vencimiento < hoy:
+            gasto.estado_pago = 'vencido'
     
-    usuario = Usuario.query.get_or_404(user_id)
-    nombre = usuario.nombre
-    db.session.delete(usuario)
     db.session.commit()
-    flash(f'Usuario {nombre} eliminado', 'success')
-    return redirect(url_for('administrar_usuarios'))
+    
+    # Calcular totales
+    total_pendiente = sum(g.monto for g in gastos if g.estado_pago == 'pendiente')
+    total_vencido = sum(g.monto for g in gastos if g.estado_pago == 'vencido')
+    total_general = total_pendiente + total_vencido
+    
+    # Agrupar por proveedor
+    gastos_por_proveedor = {}
+    for gasto in gastos:
+        if gasto.estado_pago in ['pendiente', 'vencido']:
+            if gasto.proveedor:
+                prov_id = gasto.proveedor.id
+                if prov_id not in gastos_por_proveedor:
+                    gastos_por_proveedor[prov_id] = {
+                        'proveedor': gasto.proveedor,
+                        'total': 0,
+                        'cantidad': 0
+                    }
+                gastos_por_proveedor[prov_id]['total'] += gasto.monto
+                gastos_por_proveedor[prov_id]['cantidad'] += 1
+    
+    # Obtener proveedores para filtro
+    proveedores = Proveedor.query.filter_by(activo=True).order_by(Proveedor.nombre).all()
+    
+    # ============================================
+    # SOLUCIÓN: AGREGAR datetime AL RETURN
+    # ============================================
+    return render_template("cuentas/cuentas_por_pagar.html",
+                         gastos=gastos,
+                         total_pendiente=total_pendiente,
+                         total_vencido=total_vencido,
+                         total_general=total_general,
+                         gastos_por_proveedor=gastos_por_proveedor.values(),
+                         proveedores=proveedores,
+                         estado_filtro=estado,
+                         proveedor_filtro=proveedor_id,
+                         datetime=datetime)  # ← AGREGAR ESTA LÍNEA
 
-@app.route("/liberar_mesa/<int:mesa_id>")
+
+@app.route("/marcar_gasto_pagado/<int:gasto_id>", methods=["POST"])
 @login_required
-def liberar_mesa(mesa_id):
-    """Cierra la sesión activa de una mesa"""
-    sesion_activa = Sesion.query.filter_by(
-        mesa_id=mesa_id,
-        activa=True
-    ).first()
+def marcar_gasto_pagado(gasto_id):
+    """
+    RAZÓN: Marca un gasto como pagado cuando realmente se paga.
+    """
+    if current_user.rol not in ['admin', 'mesero']:
+        flash('No tienes permisos para esta acción', 'error')
+        return redirect(url_for('cuentas_por_pagar'))
     
-    if sesion_activa:
-        # Marcar todos los pedidos como entregados y pagados
-        for pedido in sesion_activa.pedidos:
-            pedido.pagado = True
-            pedido.estado = 'entregado'
-        
-        # Cerrar sesión
-        sesion_activa.activa = False
-        sesion_activa.fecha_fin = datetime.now()
-        
-        db.session.commit()
-        flash(f'Mesa {mesa_id} liberada exitosamente', 'success')
-    else:
-        flash('No hay sesión activa para esta mesa', 'error')
+    gasto = Gasto.query.get_or_404(gasto_id)
     
-    return redirect(url_for('dashboard'))
+    gasto.estado_pago = 'pagado'
+    gasto.fecha_pago_real = datetime.now()
+    
+    db.session.commit()
+    
+    flash(f'Gasto marcado como pagado: {gasto.concepto}', 'success')
+    return redirect(request.referrer or url_for('cuentas_por_pagar'))
 
-@app.route("/historial/<fecha>")
+
+@app.route("/gasto/editar_vencimiento/<int:gasto_id>", methods=["POST"])
 @login_required
-def historial_fecha(fecha):
-    """Ver historial de una fecha específica"""
-    try:
-        fecha_obj = datetime.strptime(fecha, '%Y-%m-%d').date()
-    except ValueError:
-        flash('Fecha inválida', 'error')
-        return redirect(url_for('historial'))
+def editar_vencimiento_gasto(gasto_id):
+    """
+    RAZÓN: Permite cambiar la fecha de vencimiento de un gasto pendiente.
+    """
+    if current_user.rol != 'admin':
+        flash('Solo administradores pueden modificar vencimientos', 'error')
+        return redirect(url_for('cuentas_por_pagar'))
     
-    pedidos = Pedido.query.filter(
-        db.func.date(Pedido.fecha) == fecha_obj
-    ).order_by(Pedido.fecha.desc()).all()
+    gasto = Gasto.query.get_or_404(gasto_id)
     
-    pedidos_por_dia = {fecha: pedidos}
+    nueva_fecha = request.form.get('fecha_vencimiento')
+    if nueva_fecha:
+        gasto.fecha_vencimiento = datetime.strptime(nueva_fecha, '%Y-%m-%d').date()
+        db.session.commit()
+        flash('Fecha de vencimiento actualizada', 'success')
     
-    return render_template("historial.html", 
-                         pedidos_por_dia=pedidos_por_dia,
-                         fecha_seleccionada=fecha_obj)
+    return redirect(url_for('cuentas_por_pagar'))
 
-# =========================
-# RUTAS DEL MENÚ PÚBLICO
-# =========================
 
-@app.route("/menu")
-def menu_publico():
-    """Menú público accesible sin login"""
-    categorias = CategoriaMenu.query.filter_by(activa=True).order_by(CategoriaMenu.orden).all()
-    return render_template("menu_publico.html", categorias=categorias)
 
-@app.route("/administrar_menu")
+
+# ==========================================
+# RUTAS PARA PROVEEDORES
+# ==========================================
+
+@app.route("/proveedores")
+@login_required
+def lista_proveedores():
+    """RAZÓN: Gestionar base de datos de proveedores"""
+    proveedores = Proveedor.query.order_by(Proveedor.nombre).all()
+    return render_template("gastos/lista_proveedores.html", proveedores=proveedores)
+
+
+@app.route("/proveedor/nuevo", methods=["GET", "POST"])
+@login_required
+def nuevo_proveedor():
+    """RAZÓN: Agregar nuevos proveedores al sistema"""
+    if request.method == "POST":
+        proveedor = Proveedor(
+            nombre=request.form.get("nombre"),
+            nit=request.form.get("nit", ""),
+            telefono=request.form.get("telefono", ""),
+            email=request.form.get("email", ""),
+            direccion=request.form.get("direccion", ""),
+            notas=request.form.get("notas", "")
+        )
+        
+        db.session.add(proveedor)
+        db.session.commit()
+        
+        flash(f'Proveedor {proveedor.nombre} agregado', 'success')
+        return redirect(url_for('lista_proveedores'))
+    
+    return render_template("gastos/nuevo_proveedor.html")
+
+
+@app.route("/proveedor/editar/<int:proveedor_id>", methods=["GET", "POST"])
 @login_required
-def administrar_menu():
-    """Panel de administración del menú"""
-    if current_user.rol != 'admin':
-        flash('Solo los administradores pueden gestionar el menú', 'error')
-        return redirect(url_for('dashboard'))
+def editar_proveedor(proveedor_id):
+    """RAZÓN: Actualizar información de proveedores"""
+    proveedor = Proveedor.query.get_or_404(proveedor_id)
     
-    categorias = CategoriaMenu.query.order_by(CategoriaMenu.orden).all()
-    items = ItemMenu.query.order_by(ItemMenu.categoria_id, ItemMenu.orden).all()
+    if request.method == "POST":
+        proveedor.nombre = request.form.get("nombre")
+        proveedor.nit = request.form.get("nit", "")
+        proveedor.telefono = request.form.get("telefono", "")
+        proveedor.email = request.form.get("email", "")
+        proveedor.direccion = request.form.get("direccion", "")
+        proveedor.notas = request.form.get("notas", "")
+        
+        db.session.commit()
+        flash('Proveedor actualizado', 'success')
+        return redirect(url_for('lista_proveedores'))
     
-    return render_template("administrar_menu.html", categorias=categorias, items=items)
+    return render_template("gastos/editar_proveedor.html", proveedor=proveedor)
 
-@app.route("/agregar_categoria", methods=["POST"])
+
+@app.route("/proveedor/toggle/<int:proveedor_id>")
 @login_required
-def agregar_categoria():
+def toggle_proveedor(proveedor_id):
+    """RAZÓN: Activar/desactivar proveedores sin eliminarlos"""
     if current_user.rol != 'admin':
-        flash('Solo los administradores pueden agregar categorías', 'error')
-        return redirect(url_for('dashboard'))
-    
-    nombre = request.form.get("nombre")
-    orden = request.form.get("orden", 0, type=int)
+        flash('Solo administradores pueden modificar proveedores', 'error')
+        return redirect(url_for('lista_proveedores'))
     
-    categoria = CategoriaMenu(nombre=nombre, orden=orden)
-    db.session.add(categoria)
+    proveedor = Proveedor.query.get_or_404(proveedor_id)
+    proveedor.activo = not proveedor.activo
     db.session.commit()
     
-    flash(f'Categoría "{nombre}" agregada exitosamente', 'success')
-    return redirect(url_for('administrar_menu'))
+    estado = "activado" if proveedor.activo else "desactivado"
+    flash(f'Proveedor {proveedor.nombre} {estado}', 'success')
+    return redirect(url_for('lista_proveedores'))
 
-@app.route("/agregar_item", methods=["POST"])
+
+# ==========================================
+# REPORTES FINANCIEROS
+# ==========================================
+
+@app.route("/reportes/financiero")
 @login_required
-def agregar_item():
-    if current_user.rol != 'admin':
-        flash('Solo los administradores pueden agregar items', 'error')
-        return redirect(url_for('dashboard'))
-    
-    nombre = request.form.get("nombre")
-    descripcion = request.form.get("descripcion", "")
-    precio = request.form.get("precio", type=float)
-    categoria_id = request.form.get("categoria_id", type=int)
-    imagen_url = request.form.get("imagen_url", "")
-    orden = request.form.get("orden", 0, type=int)
+def reporte_financiero():
+    """
+    RAZÓN: Vista consolidada de ingresos vs gastos.
+    El reporte más importante para tomar decisiones.
+    """
+    # Obtener rango de fechas (por defecto, mes actual)
+    fecha_inicio = request.args.get('fecha_inicio')
+    fecha_fin = request.args.get('fecha_fin')
     
-    item = ItemMenu(
-        nombre=nombre,
-        descripcion=descripcion,
-        precio=precio,
-        categoria_id=categoria_id,
-        imagen_url=imagen_url,
-        orden=orden
-    )
+    if not fecha_inicio:
+        # Primer día del mes actual
+        hoy = datetime.now()
+        fecha_inicio = hoy.replace(day=1).strftime('%Y-%m-%d')
     
-    db.session.add(item)
-    db.session.commit()
+    if not fecha_fin:
+        # Hoy
+        fecha_fin = datetime.now().strftime('%Y-%m-%d')
     
-    flash(f'Platillo "{nombre}" agregado exitosamente', 'success')
-    return redirect(url_for('administrar_menu'))
+    # Convertir a objetos datetime
+    # IMPORTANTE: Definimos el inicio del día a las 03:00 (cierre a partir de las 03:00)
+    fecha_inicio_obj = datetime.strptime(fecha_inicio, '%Y-%m-%d').replace(hour=3, minute=0, second=0)
+    # Fecha fin es el inicio del día siguiente a las 03:00 (end-exclusive)
+    fecha_fin_obj = datetime.strptime(fecha_fin, '%Y-%m-%d').replace(hour=3, minute=0, second=0) + timedelta(days=1)
 
-@app.route("/editar_item/<int:item_id>", methods=["POST"])
-@login_required
-def editar_item(item_id):
-    if current_user.rol != 'admin':
-        flash('Solo los administradores pueden editar items', 'error')
-        return redirect(url_for('dashboard'))
+    # Facturas del período, incluidas las archivadas si el rango llega hasta ellas
+    F = historico(Factura, fecha_inicio_obj)
     
-    item = ItemMenu.query.get_or_404(item_id)
+    # INGRESOS: Sumar facturas del período (end-exclusive: >= inicio, < fin)
+    ingresos = db.session.query(
+        db.func.sum(F.total)
+    ).filter(
+        F.fecha_emision >= fecha_inicio_obj,
+        F.fecha_emision < fecha_fin_obj
+    ).scalar() or 0
     
-    item.nombre = request.form.get("nombre")
-    item.descripcion = request.form.get("descripcion", "")
-    item.precio = request.form.get("precio", type=float)
-    item.categoria_id = request.form.get("categoria_id", type=int)
-    item.imagen_url = request.form.get("imagen_url", "")
-    item.orden = request.form.get("orden", 0, type=int)
+    # GASTOS: Sumar gastos del período (end-exclusive)
+    gastos_total = db.session.query(
+        db.func.sum(Gasto.monto)
+    ).filter(
+        Gasto.fecha >= fecha_inicio_obj,
+        Gasto.fecha < fecha_fin_obj
+    ).scalar() or 0
     
-    db.session.commit()
+    # Dinero recibido por método de pago (libro de pagos)
+    ingresos_por_metodo = totales_por_metodo(fecha_inicio_obj, fecha_fin_obj)
     
-    flash(f'Platillo "{item.nombre}" actualizado', 'success')
-    return redirect(url_for('administrar_menu'))
-
-@app.route("/toggle_item/<int:item_id>")
-@login_required
-def toggle_item(item_id):
-    if current_user.rol != 'admin':
-        flash('Solo los administradores pueden modificar items', 'error')
-        return redirect(url_for('dashboard'))
+    # UTILIDAD = INGRESOS - GASTOS
+    utilidad = ingresos - gastos_total
+    margen = (utilidad / ingresos * 100) if ingresos > 0 else 0
     
-    item = ItemMenu.query.get_or_404(item_id)
-    item.disponible = not item.disponible
-    db.session.commit()
+    # Gastos por categoría - CONVERTIR A LISTA DE TUPLAS
+    gastos_por_categoria_raw = db.session.query(
+        CategoriaGasto.nombre,
+        CategoriaGasto.color,
+        db.func.sum(Gasto.monto).label('total'),
+        db.func.count(Gasto.id).label('cantidad')
+    ).join(Gasto).filter(
+        Gasto.fecha >= fecha_inicio_obj,
+        Gasto.fecha < fecha_fin_obj
+    ).group_by(CategoriaGasto.id).order_by(db.desc('total')).all()
     
-    estado = "disponible" if item.disponible else "no disponible"
-    flash(f'"{item.nombre}" marcado como {estado}', 'success')
-    return redirect(url_for('administrar_menu'))
-
-@app.route("/eliminar_item/<int:item_id>", methods=["POST"])
-@login_required
-def eliminar_item(item_id):
-    if current_user.rol != 'admin':
-        flash('Solo los administradores pueden eliminar items', 'error')
-        return redirect(url_for('dashboard'))
+    # SOLUCIÓN: Convertir Row objects a lista de listas para JSON
+    gastos_por_categoria = []
+    gastos_por_categoria_tabla = []
     
-    item = ItemMenu.query.get_or_404(item_id)
-    nombre = item.nombre
-    db.session.delete(item)
-    db.session.commit()
+    for row in gastos_por_categoria_raw:
+        # Para el gráfico (formato JSON)
+        gastos_por_categoria.append([
+            row[0],  # nombre
+            row[1],  # color
+            float(row[2])  # total
+        ])
+        
+        # Para la tabla HTML (objeto completo)
+        gastos_por_categoria_tabla.append({
+            'nombre': row[0],
+            'color': row[1],
+            'total': float(row[2]),
+            'cantidad': row[3]
+        })
     
-    flash(f'"{nombre}" eliminado del menú', 'success')
-    return redirect(url_for('administrar_menu'))
-
-@app.route("/eliminar_categoria/<int:categoria_id>", methods=["POST"])
-@login_required
-def eliminar_categoria(categoria_id):
-    if current_user.rol != 'admin':
-        flash('Solo los administradores pueden eliminar categorías', 'error')
-        return redirect(url_for('dashboard'))
+    # Evolución diaria de ingresos y gastos (para gráfico)
+    # Cada "día" va desde 03:00 del día hasta 03:00 del día siguiente
+    dias_rango = (fecha_fin_obj - fecha_inicio_obj).days
+    evolucion_diaria = []
     
-    categoria = CategoriaMenu.query.get_or_404(categoria_id)
+    # Días con cierre de caja congelado: se leen del cierre en vez de recalcular
+    # (solo cierres hechos después de terminar el día; uno anticipado no incluye lo vendido después)
+    cierres = {c.fecha_negocio: c for c in CierreCaja.query.filter(
+        CierreCaja.turno == 'dia',
+        CierreCaja.fecha_negocio >= fecha_inicio_obj.date(),
+        CierreCaja.fecha_negocio < fecha_fin_obj.date(),
+        CierreCaja.fecha_cierre >= CierreCaja.fin
+    )}
     
-    if categoria.items:
-        flash(f'No se puede eliminar "{categoria.nombre}" porque tiene platillos asociados', 'error')
-    else:
-        nombre = categoria.nombre
-        db.session.delete(categoria)
-        db.session.commit()
-        flash(f'Categoría "{nombre}" eliminada', 'success')
+    for i in range(dias_rango):
+        dia_inicio = fecha_inicio_obj + timedelta(days=i)
+        dia_fin = dia_inicio + timedelta(days=1)
+        
+        cierre = cierres.get(dia_inicio.date())
+        if cierre:
+            evolucion_diaria.append({
+                'fecha': dia_inicio.strftime('%Y-%m-%d'),
+                'ingresos': float(cierre.total_facturado),
+                'gastos': float(cierre.gastos_total),
+                'utilidad': float(cierre.total_facturado - cierre.gastos_total)
+            })
+            continue
+        
+        ingresos_dia = db.session.query(
+            db.func.sum(F.total)
+        ).filter(
+            F.fecha_emision >= dia_inicio,
+            F.fecha_emision < dia_fin
+        ).scalar() or 0
+        
+        gastos_dia = db.session.query(
+            db.func.sum(Gasto.monto)
+        ).filter(
+            Gasto.fecha >= dia_inicio,
+            Gasto.fecha < dia_fin
+        ).scalar() or 0
+        
+        evolucion_diaria.append({
+            'fecha': dia_inicio.strftime('%Y-%m-%d'),
+            'ingresos': float(ingresos_dia),
+            'gastos': float(gastos_dia),
+            'utilidad': float(ingresos_dia - gastos_dia)
+        })
     
-    return redirect(url_for('administrar_menu'))
+    return render_template("reportes/financiero.html",
+                         fecha_inicio=fecha_inicio,
+                         fecha_fin=fecha_fin,
+                         ingresos=float(ingresos),
+                         gastos_total=float(gastos_total),
+                         utilidad=float(utilidad),
+                         margen=float(margen),
+                         gastos_por_categoria=gastos_por_categoria,  # Para JSON/gráficos
+                         gastos_por_categoria_tabla=gastos_por_categoria_tabla,  # Para tabla HTML
+                         evolucion_diaria=evolucion_diaria,
+                         ingresos_por_metodo=ingresos_por_metodo,
+                         now=datetime.now())
+# ==========================================
+# CIERRE DE CAJA
+# ==========================================
+
+def dia_negocio_actual():
+    """El día de negocio cambia a las 03:00: a las 01:30 aún es el día anterior"""
+    ahora = datetime.now()
+    return (ahora - timedelta(hours=3)).date()
+
+
+def rango_cierre(fecha_negocio, hora_inicio=None, hora_fin=None):
+    """
+    Rango [inicio, fin) de un cierre. Sin horas es el día completo (03:00 → 03:00);
+    con horas es un turno dentro del día (horas antes de las 03:00 pertenecen a la madrugada siguiente).
+    """
+    base = datetime(fecha_negocio.year, fecha_negocio.month, fecha_negocio.day)
+    if not hora_inicio or not hora_fin:
+        inicio = base.replace(hour=3)
+        return inicio, inicio + timedelta(days=1)
+    
+    def a_fecha(hora):
+        h = datetime.strptime(hora, '%H:%M')
+        momento = base.replace(hour=h.hour, minute=h.minute)
+        return momento + timedelta(days=1) if h.hour < 3 else momento
+    
+    inicio, fin = a_fecha(hora_inicio), a_fecha(hora_fin)
+    if fin <= inicio:
+        raise ValueError('La hora de fin del turno debe ser posterior a la de inicio')
+    return inicio, fin
+
+
+def calcular_cierre_caja(inicio, fin):
+    """
+    RAZÓN: Cifras del cierre con consultas agregadas (sin cargar filas):
+    1. Dinero recibido por método (libro de pagos)
+    2. Facturas: cantidad, total y propinas
+    3. Costos de domicilio facturados
+    4. Costo de consumo interno
+    5. Gastos totales y gastos pagados en efectivo
+    """
+    por_metodo = totales_por_metodo(inicio, fin)
+    # Días anteriores al último archivo también leen las tablas *_archivo
+    F, D = historico(Factura, inicio), historico(Domicilio, inicio)
+    
+    num_facturas, total_facturado, propinas = db.session.query(
+        db.func.count(F.id),
+        db.func.coalesce(db.func.sum(F.total), 0),
+        db.func.coalesce(db.func.sum(F.propina), 0)
+    ).filter(
+        F.fecha_emision >= inicio,
+        F.fecha_emision < fin
+    ).one()
+    
+    costos_domicilio = db.session.query(
+        db.func.coalesce(db.func.sum(D.costo_domicilio), 0)
+    ).join(F, D.factura_id == F.id).filter(
+        F.fecha_emision >= inicio,
+        F.fecha_emision < fin
+    ).scalar()
+    
+    consumo_interno = db.session.query(
+        db.func.coalesce(db.func.sum(ConsumoInterno.costo * ConsumoInterno.cantidad), 0)
+    ).filter(
+        ConsumoInterno.fecha >= inicio,
+        ConsumoInterno.fecha < fin
+    ).scalar()
+    
+    # Gastos del período (por fecha del gasto) y salidas de caja en efectivo (por fecha de pago)
+    fecha_pago = db.func.coalesce(Gasto.fecha_pago_real, Gasto.fecha)
+    gastos_total, gastos_efectivo = db.session.query(
+        db.func.coalesce(db.func.sum(db.case(
+            ((Gasto.fecha >= inicio) & (Gasto.fecha < fin), Gasto.monto), else_=0
+        )), 0),
+        db.func.coalesce(db.func.sum(db.case(
+            ((Gasto.metodo_pago == 'efectivo') & (Gasto.estado_pago == 'pagado')
+             & (fecha_pago >= inicio) & (fecha_pago < fin), Gasto.monto), else_=0
+        )), 0)
+    ).filter(
+        db.or_(
+            (Gasto.fecha >= inicio) & (Gasto.fecha < fin),
+            (fecha_pago >= inicio) & (fecha_pago < fin)
+        )
+    ).one()
+    
+    total_efectivo = por_metodo.get('efectivo', 0)
+    total_tarjeta = por_metodo.get('tarjeta', 0)
+    total_transferencia = por_metodo.get('transferencia', 0)
+    total_recibido = sum(por_metodo.values())
+    
+    return {
+        'inicio': inicio,
+        'fin': fin,
+        'total_efectivo': total_efectivo,
+        'total_tarjeta': total_tarjeta,
+        'total_transferencia': total_transferencia,
+        'total_otros': total_recibido - total_efectivo - total_tarjeta - total_transferencia,
+        'total_recibido': total_recibido,
+        'num_facturas': num_facturas,
+        'total_facturado': float(total_facturado),
+        'propinas': float(propinas),
+        'costos_domicilio': float(costos_domicilio),
+        'consumo_interno': float(consumo_interno),
+        'gastos_total': float(gastos_total),
+        'gastos_efectivo': float(gastos_efectivo),
+        'efectivo_esperado': total_efectivo - float(gastos_efectivo)
+    }
 
-# ==========================================
-# RUTAS PARA GESTIÓN DE GASTOS
-# ==========================================
 
-@app.route("/gastos")
+@app.route("/cierre_caja", methods=["GET", "POST"])
 @login_required
-def lista_gastos():
+@idempotente
+def cierre_caja():
     """
-    RAZÓN: Vista principal de gastos con filtros por fecha y categoría.
-    Permite búsqueda rápida y visualización de totales.
+    RAZÓN: Cierre de caja del día o de un turno. GET muestra las cifras
+    (congeladas si ya se cerró); POST congela el cierre con el efectivo contado.
     """
-    # Obtener parámetros de filtro
-    fecha_inicio = request.args.get('fecha_inicio')
-    fecha_fin = request.args.get('fecha_fin')
-    categoria_id = request.args.get('categoria_id', type=int)
-    
-    # Query base
-    query = Gasto.query
-    
-    # Aplicar filtros
-    if fecha_inicio:
-        try:
-            # Empezamos el día a las 03:00 (cierre a partir de las 03:00)
-            fecha_inicio_obj = datetime.strptime(fecha_inicio, '%Y-%m-%d').replace(hour=3, minute=0, second=0)
-            query = query.filter(Gasto.fecha >= fecha_inicio_obj)
-        except ValueError:
-            flash('Fecha de inicio inválida', 'error')
-    
-    if fecha_fin:
-        try:
-            # La fecha de fin será el inicio del día siguiente a las 03:00 (end-exclusive)
-            fecha_fin_obj = datetime.strptime(fecha_fin, '%Y-%m-%d').replace(hour=3, minute=0, second=0) + timedelta(days=1)
-            query = query.filter(Gasto.fecha < fecha_fin_obj)
-        except ValueError:
-            flash('Fecha de fin inválida', 'error')
-    
-    if categoria_id:
-        query = query.filter(Gasto.categoria_id == categoria_id)
+    if current_user.rol != 'admin':
+        flash('Solo administradores pueden hacer el cierre de caja', 'error')
+        return redirect(url_for('dashboard'))
     
-    # Obtener gastos ordenados por fecha descendente
-    gastos = query.order_by(Gasto.fecha.desc()).all()
+    fecha_str = request.values.get('fecha')
+    hora_inicio = request.values.get('hora_inicio') or None
+    hora_fin = request.values.get('hora_fin') or None
     
-    # Calcular totales
-    total_gastos = sum(g.monto for g in gastos)
+    try:
+        fecha_negocio = datetime.strptime(fecha_str, '%Y-%m-%d').date() if fecha_str else dia_negocio_actual()
+        inicio, fin = rango_cierre(fecha_negocio, hora_inicio, hora_fin)
+    except ValueError as e:
+        flash(f'Fecha u hora inválida: {e}', 'error')
+        return redirect(url_for('cierre_caja'))
     
-    # Totales por categoría (para el dashboard)
-    totales_por_categoria = db.session.query(
-        CategoriaGasto.nombre,
-        CategoriaGasto.color,
-        db.func.sum(Gasto.monto).label('total')
-    ).join(Gasto).group_by(CategoriaGasto.id).all()
+    turno = f"{hora_inicio}-{hora_fin}" if hora_inicio and hora_fin else 'dia'
+    cierre = CierreCaja.query.filter_by(fecha_negocio=fecha_negocio, turno=turno).first()
     
-    # Obtener todas las categorías para el filtro
-    categorias = CategoriaGasto.query.filter_by(activa=True).order_by(CategoriaGasto.nombre).all()
+    # Un período que no ha terminado no se congela: lo vendido después quedaría fuera de los reportes
+    en_curso = fin > datetime.now()
     
-    return render_template("gastos/lista_gastos.html",
-                         gastos=gastos,
-                         total_gastos=total_gastos,
-                         totales_por_categoria=totales_por_categoria,
-                         categorias=categorias,
-                         fecha_inicio=fecha_inicio,
-                         fecha_fin=fecha_fin,
-                         categoria_id=categoria_id)
+    if request.method == "POST":
+        if cierre:
+            flash(f'La caja de {fecha_negocio.strftime("%d/%m/%Y")} ({turno}) ya está cerrada', 'error')
+        elif en_curso:
+            flash(f'El período termina el {fin.strftime("%d/%m/%Y %H:%M")}: la caja se puede cerrar desde entonces '
+                  f'(o cerrar un turno que ya terminó)', 'error')
+        else:
+            cifras = calcular_cierre_caja(inicio, fin)
+            efectivo_contado = request.form.get('efectivo_contado', type=float)
+            cierre = CierreCaja(
+                fecha_negocio=fecha_negocio,
+                turno=turno,
+                efectivo_contado=efectivo_contado,
+                diferencia=(efectivo_contado - cifras['efectivo_esperado']) if efectivo_contado is not None else None,
+                usuario_id=current_user.id,
+                notas=request.form.get('notas', ''),
+                **cifras
+            )
+            db.session.add(cierre)
+            try:
+                db.session.commit()
+                flash(f'Cierre de caja de {fecha_negocio.strftime("%d/%m/%Y")} guardado', 'success')
+            except IntegrityError:
+                db.session.rollback()
+                flash('Otro usuario acaba de cerrar esta caja', 'error')
+        return redirect(url_for('cierre_caja', fecha=fecha_negocio.isoformat(),
+                                hora_inicio=hora_inicio, hora_fin=hora_fin))
+    
+    # GET: cifras congeladas si ya existe el cierre, si no, calculadas en vivo
+    cifras = None if cierre else calcular_cierre_caja(inicio, fin)
+    cierres_recientes = CierreCaja.query.order_by(
+        CierreCaja.fecha_negocio.desc(), CierreCaja.inicio.desc()
+    ).limit(15).all()
+    
+    return render_template("reportes/cierre_caja.html",
+                         cierre=cierre,
+                         cifras=cifras or cierre,
+                         fecha_negocio=fecha_negocio,
+                         hora_inicio=hora_inicio,
+                         hora_fin=hora_fin,
+                         inicio=inicio,
+                         fin=fin,
+                         en_curso=en_curso,
+                         cierres_recientes=cierres_recientes)
 
 
-# ==========================================
-# ACTUALIZAR RUTA DE NUEVO GASTO
-# ==========================================
+# =========================
+# ANALÍTICA DE VENTAS
+# =========================
 
-# REEMPLAZA tu ruta actual de nuevo_gasto con esta versión mejorada:
+ANALITICA_VENTANA_DIAS = 31  # Días que se agregan por consulta al llenar la caché
+SIN_CATEGORIA = 'Sin categoría'
+DIAS_SEMANA = ['Lunes', 'Martes', 'Miércoles', 'Jueves', 'Viernes', 'Sábado', 'Domingo']
 
-@app.route("/gasto/nuevo", methods=["GET", "POST"])
-@login_required
-def nuevo_gasto():
+
+class VentaHoraria(db.Model):
     """
-    RAZÓN: Formulario para registrar un nuevo gasto.
-    Ahora incluye estado de pago y fecha de vencimiento.
+    RAZÓN: Ventas de un día de negocio cerrado por hora, producto y origen (mesa
+    o domicilio). Igual que CierreCaja, un día cerrado ya no cambia: se agrega
+    una vez y la analítica suma estas filas en lugar de recorrer los pedidos.
     """
-    if current_user.rol == 'cocina':
-        flash('No tienes permisos para registrar gastos', 'error')
-        return redirect(url_for('dashboard'))
-    
-    if request.method == "POST":
+    __tablename__ = 'venta_horaria'
+    id = db.Column(db.Integer, primary_key=True)
+    fecha_negocio = db.Column(db.Date, nullable=False)
+    hora = db.Column(db.Integer, nullable=False)  # Hora del reloj; de 00 a 02 cuenta para el día anterior
+    origen = db.Column(db.String(20), nullable=False)  # mesa, domicilio
+    producto = db.Column(db.String(200), nullable=False)
+    categoria = db.Column(db.String(100))
+    unidades = db.Column(db.Integer, default=0)
+    ingresos = db.Column(db.Float, default=0)
+
+    __table_args__ = (
+        db.Index('ix_venta_horaria_fecha_hora', 'fecha_negocio', 'hora'),
+    )
+
+
+class DiaVentas(db.Model):
+    """Días de negocio ya agregados en VentaHoraria (también los que no tuvieron ventas)"""
+    __tablename__ = 'dia_ventas'
+    fecha_negocio = db.Column(db.Date, primary_key=True)
+    unidades = db.Column(db.Integer, default=0)
+    ingresos = db.Column(db.Float, default=0)
+    calculado_en = db.Column(db.DateTime, default=datetime.now)
+
+
+def ventas_por_hora(inicio, fin):
+    """
+    Ventas de mesas y domicilios en [inicio, fin) agrupadas en SQL por día,
+    hora y producto (una consulta por origen). Devuelve dicts para VentaHoraria.
+    """
+    # Pedido guarda el nombre del producto: la categoría sale del menú por nombre
+    categorias = db.select(
+        ItemMenu.nombre.label('nombre'), db.func.min(CategoriaMenu.nombre).label('categoria')
+    ).join(CategoriaMenu, CategoriaMenu.id == ItemMenu.categoria_id).group_by(ItemMenu.nombre).subquery()
+
+    P = historico(Pedido, inicio)
+    dia, hora = db.func.date(P.fecha), db.extract('hour', P.fecha)
+    pedidos = db.session.query(
+        dia, hora, db.literal('mesa'), P.producto, categorias.c.categoria,
+        db.func.sum(P.cantidad), db.func.sum(P.cantidad * P.precio_unitario)
+    ).outerjoin(categorias, categorias.c.nombre == P.producto).filter(
+        P.fecha >= inicio, P.fecha < fin
+    ).group_by(dia, hora, P.producto, categorias.c.categoria)
+
+    D, I = historico(Domicilio, inicio), historico(ItemDomicilio, inicio)
+    dia, hora = db.func.date(D.fecha_pedido), db.extract('hour', D.fecha_pedido)
+    domicilios = db.session.query(
+        dia, hora, db.literal('domicilio'), I.producto_nombre, CategoriaMenu.nombre,
+        db.func.sum(I.cantidad), db.func.sum(I.cantidad * I.precio_unitario)
+    ).join(D, D.id == I.domicilio_id).outerjoin(
+        ItemMenu, ItemMenu.id == I.item_menu_id
+    ).outerjoin(CategoriaMenu, CategoriaMenu.id == ItemMenu.categoria_id).filter(
+        D.fecha_pedido >= inicio, D.fecha_pedido < fin,
+        D.estado != EstadoDomicilio.CANCELADO
+    ).group_by(dia, hora, I.producto_nombre, CategoriaMenu.nombre)
+
+    filas = []
+    for dia, hora, origen, producto, categoria, unidades, ingresos in pedidos.all() + domicilios.all():
+        dia = date.fromisoformat(dia) if isinstance(dia, str) else dia
+        hora = int(hora)
+        filas.append({
+            'fecha_negocio': dia - timedelta(days=1) if hora < 3 else dia,
+            'hora': hora,
+            'origen': origen,
+            'producto': producto,
+            'categoria': categoria or SIN_CATEGORIA,
+            'unidades': int(unidades or 0),
+            'ingresos': float(ingresos or 0),
+        })
+    return filas
+
+
+def preparar_ventas(desde, hasta):
+    """
+    Agrega en VentaHoraria los días cerrados entre desde y hasta (fechas de
+    negocio) que aún no estén, por tramos de ANALITICA_VENTANA_DIAS días.
+    Devuelve cuántos días se agregaron.
+    """
+    hasta = min(hasta, dia_negocio_actual() - timedelta(days=1))
+    if hasta < desde:
+        return 0
+    hechos = {d for (d,) in db.session.query(DiaVentas.fecha_negocio).filter(
+        DiaVentas.fecha_negocio >= desde, DiaVentas.fecha_negocio <= hasta)}
+    faltantes = [desde + timedelta(days=i) for i in range((hasta - desde).days + 1)
+                 if desde + timedelta(days=i) not in hechos]
+
+    # Tramos de días consecutivos, para no releer días que ya están
+    tramos = []
+    for dia in faltantes:
+        if tramos and dia - tramos[-1][-1] == timedelta(days=1) and len(tramos[-1]) < ANALITICA_VENTANA_DIAS:
+            tramos[-1].append(dia)
+        else:
+            tramos.append([dia])
+
+    agregados = 0
+    for tramo in tramos:
+        inicio = datetime.combine(tramo[0], datetime.min.time()).replace(hour=3)
+        fin = datetime.combine(tramo[-1], datetime.min.time()).replace(hour=3) + timedelta(days=1)
+        filas = ventas_por_hora(inicio, fin)
+        totales = {dia: [0, 0.0] for dia in tramo}
+        for fila in filas:
+            totales[fila['fecha_negocio']][0] += fila['unidades']
+            totales[fila['fecha_negocio']][1] += fila['ingresos']
         try:
-            # Obtener datos del formulario
-            fecha_str = request.form.get("fecha")
-            concepto = request.form.get("concepto")
-            monto = request.form.get("monto", type=float)
-            categoria_id = request.form.get("categoria_id", type=int)
-            proveedor_id = request.form.get("proveedor_id", type=int) or None
-            metodo_pago = request.form.get("metodo_pago", "efectivo")
-            numero_factura = request.form.get("numero_factura", "")
-            notas = request.form.get("notas", "")
-            
-            # NUEVOS CAMPOS
-            estado_pago = request.form.get("estado_pago", "pagado")
-            fecha_vencimiento_str = request.form.get("fecha_vencimiento")
-            
-            # Validaciones básicas
-            if not concepto or monto <= 0:
-                flash('Debes completar todos los campos requeridos', 'error')
-                return redirect(url_for('nuevo_gasto'))
-            
-            # Convertir fecha
-            if fecha_str:
-                fecha = datetime.strptime(fecha_str, '%Y-%m-%dT%H:%M')
-            else:
-                fecha = datetime.now()
-            
-            # Convertir fecha de vencimiento
-            fecha_vencimiento = None
-            if fecha_vencimiento_str and estado_pago == 'pendiente':
-                fecha_vencimiento = datetime.strptime(fecha_vencimiento_str, '%Y-%m-%d').date()
-            
-            # Si está pagado, la fecha de pago es ahora
-            fecha_pago_real = datetime.now() if estado_pago == 'pagado' else None
-            
-            # Crear gasto
-            gasto = Gasto(
-                fecha=fecha,
-                concepto=concepto,
-                monto=monto,
-                categoria_id=categoria_id,
-                proveedor_id=proveedor_id,
-                usuario_id=current_user.id,
-                metodo_pago=metodo_pago,
-                numero_factura=numero_factura,
-                notas=notas,
-                estado_pago=estado_pago,
-                fecha_vencimiento=fecha_vencimiento,
-                fecha_pago_real=fecha_pago_real
-            )
-            
-            db.session.add(gasto)
+            if filas:
+                db.session.execute(db.insert(VentaHoraria), filas)
+            db.session.add_all([DiaVentas(fecha_negocio=dia, unidades=u, ingresos=i)
+                                for dia, (u, i) in totales.items()])
             db.session.commit()
-            
-            # Verificar si se excedió el presupuesto
-            verificar_presupuesto(categoria_id)
-            
-            flash(f'Gasto de ${monto:,.2f} registrado exitosamente', 'success')
-            return redirect(url_for('lista_gastos'))
-            
-        except Exception as e:
+            agregados += len(tramo)
+        except IntegrityError:
+            # Otro worker agregó el mismo tramo al mismo tiempo
             db.session.rollback()
-            flash(f'Error al registrar el gasto: {str(e)}', 'error')
-            return redirect(url_for('nuevo_gasto'))
-    
-    # GET: Mostrar formulario
-    categorias = CategoriaGasto.query.filter_by(activa=True).order_by(CategoriaGasto.nombre).all()
-    proveedores = Proveedor.query.filter_by(activo=True).order_by(Proveedor.nombre).all()
-    
-    return render_template("gastos/nuevo_gasto.html",
-                         categorias=categorias,
-                         proveedores=proveedores,
-                         now=datetime.now())
+    return agregados
 
 
-# Función auxiliar para verificar presupuestos
-def verificar_presupuesto(categoria_id):
+def analitica_ventas(desde, hasta, origen=None, hora_desde=None, hora_hasta=None):
     """
-    RAZÓN: Verifica si se excedió el presupuesto de una categoría
-    y genera alertas en flash messages.
+    Mapa de calor (día de la semana × hora), productos más vendidos y mezcla
+    por categoría de los días cerrados entre desde y hasta, con GROUP BY sobre
+    VentaHoraria. El rango de horas [hora_desde, hora_hasta) filtra productos
+    y categorías; el mapa siempre muestra el día completo.
     """
-    from datetime import datetime
-    mes_actual = datetime.now().month
-    anio_actual = datetime.now().year
-    
-    presupuesto = Presupuesto.query.filter_by(
-        categoria_id=categoria_id,
-        mes=mes_actual,
-        anio=anio_actual,
-        activo=True
-    ).first()
-    
-    if presupuesto:
-        porcentaje = presupuesto.porcentaje_usado
-        categoria = presupuesto.categoria.nombre
-        
-        if porcentaje >= 100:
-            flash(f'⚠️ ALERTA: Presupuesto de "{categoria}" EXCEDIDO ({porcentaje:.1f}%)', 'error')
-        elif porcentaje >= presupuesto.alerta_porcentaje:
-            flash(f'⚠️ Advertencia: Presupuesto de "{categoria}" al {porcentaje:.1f}%', 'error')
+    preparar_ventas(desde, hasta)
+    V = VentaHoraria
+    filtro = [V.fecha_negocio >= desde, V.fecha_negocio <= hasta]
+    if origen:
+        filtro.append(V.origen == origen)
+    filtro_horas = list(filtro)
+    if hora_desde is not None:
+        filtro_horas.append(V.hora >= hora_desde)
+    if hora_hasta is not None:
+        filtro_horas.append(V.hora < hora_hasta)
+    unidades, ingresos = db.func.sum(V.unidades), db.func.sum(V.ingresos)
+
+    # strftime('%w') / EXTRACT(dow): 0 = domingo; se pasa a 0 = lunes
+    dia_semana = db.extract('dow', V.fecha_negocio)
+    celdas = db.session.query(dia_semana, V.hora, ingresos, unidades).filter(*filtro).group_by(dia_semana, V.hora).all()
+    # Cuántas veces aparece cada día de la semana en el rango, para promediar
+    veces = [0] * 7
+    for i in range((hasta - desde).days + 1):
+        veces[(desde + timedelta(days=i)).weekday()] += 1
+    mapa = [[0.0] * 24 for _ in range(7)]
+    for dow, hora, total, _ in celdas:
+        dia = (int(dow) + 6) % 7
+        mapa[dia][int(hora)] = float(total or 0) / (veces[dia] or 1)
+
+    productos = db.session.query(V.producto, V.categoria, unidades.label('unidades'), ingresos.label('ingresos')).filter(
+        *filtro_horas).group_by(V.producto, V.categoria)
+    por_unidades = productos.order_by(db.desc('unidades')).limit(15).all()
+    por_ingresos = productos.order_by(db.desc('ingresos')).limit(15).all()
+    categorias = db.session.query(V.categoria, unidades, ingresos).filter(
+        *filtro_horas).group_by(V.categoria).order_by(db.desc(ingresos)).all()
+    por_origen = dict(db.session.query(V.origen, ingresos).filter(*filtro_horas).group_by(V.origen).all())
+
+    total = sum(float(c[2] or 0) for c in categorias)
+    return {
+        'mapa': mapa,
+        'mapa_maximo': max(max(fila) for fila in mapa),
+        'por_unidades': por_unidades,
+        'por_ingresos': por_ingresos,
+        'categorias': [{'nombre': nombre, 'unidades': int(u or 0), 'ingresos': float(i or 0),
+                        'porcentaje': float(i or 0) / total * 100 if total else 0}
+                       for nombre, u, i in categorias],
+        'por_origen': {k: float(v or 0) for k, v in por_origen.items()},
+        'total': total,
+    }
+
+
+@app.route("/reportes/ventas")
+@login_required
+def reporte_ventas():
+    """
+    RAZÓN: Qué se vende, a qué hora y qué día, sin exportar pedidos a mano.
+    Solo cubre días cerrados (el día en curso aparece mañana).
+    """
+    if current_user.rol != 'admin':
+        flash('Solo administradores pueden ver la analítica de ventas', 'error')
+        return redirect(url_for('dashboard'))
+
+    ultimo_cerrado = dia_negocio_actual() - timedelta(days=1)
+    try:
+        hasta = datetime.strptime(request.args['hasta'], '%Y-%m-%d').date() if request.args.get('hasta') else ultimo_cerrado
+        desde = datetime.strptime(request.args['desde'], '%Y-%m-%d').date() if request.args.get('desde') else hasta - timedelta(days=27)
+    except ValueError:
+        flash('Fechas inválidas', 'error')
+        return redirect(url_for('reporte_ventas'))
+    hasta = min(hasta, ultimo_cerrado)
+    if desde > hasta:
+        desde = hasta
+    origen = request.args.get('origen') or None
+    hora_desde = request.args.get('hora_desde', type=int)
+    hora_hasta = request.args.get('hora_hasta', type=int)
+
+    datos = analitica_ventas(desde, hasta, origen, hora_desde, hora_hasta)
+    return render_template("reportes/ventas.html", datos=datos, desde=desde, hasta=hasta,
+                           origen=origen, hora_desde=hora_desde, hora_hasta=hora_hasta,
+                           dias_semana=DIAS_SEMANA)
+
+
+@app.cli.command("analitica")
+@click.option('--dias', type=int, default=60, help='Días cerrados hacia atrás que se agregan.')
+def comando_analitica(dias):
+    """Agrega las ventas por hora de los días cerrados (para programar después del cierre)."""
+    hasta = dia_negocio_actual() - timedelta(days=1)
+    agregados = preparar_ventas(hasta - timedelta(days=dias - 1), hasta)
+    print(f"✅ {agregados} días agregados en venta_horaria")
+
+
+# =========================
+# PRONÓSTICO DE DEMANDA
+# =========================
+
+# `flask --app app pronostico` (programarlo después de `analitica`) estima con
+# numpy, a partir de venta_horaria, las unidades por hora y producto de los
+# próximos días y las guarda. Los workers web solo leen lo guardado.
+PRONOSTICO_SEMANAS = int(os.environ.get('PRONOSTICO_SEMANAS', 8))  # Semanas de historia
+PRONOSTICO_DIAS = 7
+PRONOSTICO_ALFA = 0.3  # Cuánto pesa más cada semana sobre la anterior (suavizado exponencial)
+PRONOSTICO_MINIMO = 0.05  # Celdas hora/producto con menos unidades esperadas no se guardan
+# Regla para el personal sugerido: unidades por hora que despacha una persona (ajustar al local)
+PRONOSTICO_UNIDADES_POR_PERSONA = int(os.environ.get('PRONOSTICO_UNIDADES_POR_PERSONA', 30))
+
+
+class PronosticoDemanda(db.Model):
+    """Unidades esperadas de un producto en una hora de un día de negocio futuro"""
+    __tablename__ = 'pronostico_demanda'
+    id = db.Column(db.Integer, primary_key=True)
+    fecha_negocio = db.Column(db.Date, nullable=False)
+    hora = db.Column(db.Integer, nullable=False)
+    producto = db.Column(db.String(200), nullable=False)
+    categoria = db.Column(db.String(100))
+    unidades = db.Column(db.Float, default=0)
+    unidades_alto = db.Column(db.Float, default=0)  # Percentil ~90: para preparar sin quedarse corto
+    ingresos = db.Column(db.Float, default=0)
+
+    __table_args__ = (
+        db.Index('ix_pronostico_demanda_fecha_hora', 'fecha_negocio', 'hora'),
+    )
+
+
+class CorridaPronostico(db.Model):
+    """
+    Cada ejecución del pronóstico, con su error medido pronosticando la última
+    semana cerrada con las anteriores (WAPE: error absoluto / unidades reales).
+    """
+    __tablename__ = 'corrida_pronostico'
+    id = db.Column(db.Integer, primary_key=True)
+    generado_en = db.Column(db.DateTime, default=datetime.now, nullable=False)
+    desde = db.Column(db.Date, nullable=False)
+    hasta = db.Column(db.Date, nullable=False)
+    semanas = db.Column(db.Integer, nullable=False)
+    productos = db.Column(db.Integer, default=0)
+    error_dia = db.Column(db.Float)  # Totales por día
+    error_hora = db.Column(db.Float)  # Por hora y producto
+
+
+def serie_ventas(desde, dias):
+    """
+    Unidades e ingresos de venta_horaria en arreglos [día, hora, producto]
+    para `dias` días de negocio desde `desde`. Devuelve (unidades, ingresos, productos, categorias).
+    """
+    import numpy as np
+    V = VentaHoraria
+    filas = db.session.query(
+        V.fecha_negocio, V.hora, V.producto, V.categoria, db.func.sum(V.unidades), db.func.sum(V.ingresos)
+    ).filter(
+        V.fecha_negocio >= desde, V.fecha_negocio < desde + timedelta(days=dias)
+    ).group_by(V.fecha_negocio, V.hora, V.producto, V.categoria).all()
+
+    productos = sorted({fila[2] for fila in filas})
+    indice = {producto: i for i, producto in enumerate(productos)}
+    categorias = {fila[2]: fila[3] for fila in filas}
+    unidades = np.zeros((dias, 24, len(productos)))
+    ingresos = np.zeros_like(unidades)
+    if filas:
+        posiciones = (np.array([(fila[0] - desde).days for fila in filas]),
+                      np.array([fila[1] for fila in filas]),
+                      np.array([indice[fila[2]] for fila in filas]))
+        # add.at suma las filas repetidas (un producto con categoría distinta en mesa y domicilio)
+        np.add.at(unidades, posiciones, np.array([float(fila[4] or 0) for fila in filas]))
+        np.add.at(ingresos, posiciones, np.array([float(fila[5] or 0) for fila in filas]))
+    return unidades, ingresos, productos, categorias
+
+
+def pronosticar(historia, desplazamientos):
+    """
+    RAZÓN: Modelo estacional por día de la semana. El pronóstico de un martes a
+    cierta hora es el promedio de los martes anteriores a esa hora, con pesos que
+    crecen PRONOSTICO_ALFA por semana hacia la más reciente, por un factor de
+    tendencia (últimas dos semanas frente a todo el período, acotado a ±25%).
+    Todo se calcula sobre el arreglo [semana, día, hora, producto] sin ciclos.
+    historia: [semanas*7, 24, productos]; desplazamientos: días desde el inicio
+    de la historia a pronosticar. Devuelve (media, alto) [len(desplazamientos), 24, productos].
+    """
+    import numpy as np
+    semanas = historia.shape[0] // 7
+    por_semana = historia[-semanas * 7:].reshape(semanas, 7, 24, historia.shape[2])
+    pesos = (1 - PRONOSTICO_ALFA) ** np.arange(semanas - 1, -1, -1)
+    pesos /= pesos.sum()
+    media = np.tensordot(pesos, por_semana, axes=1)
+    desviacion = np.sqrt(np.tensordot(pesos, (por_semana - media) ** 2, axes=1))
+    por_total = por_semana.sum(axis=(1, 2, 3))
+    tendencia = float(np.clip(por_total[-2:].mean() / por_total.mean(), 0.75, 1.25)) if por_total.mean() else 1.0
+    dias = np.asarray(list(desplazamientos)) % 7
+    return media[dias] * tendencia, (media[dias] + 1.28 * desviacion[dias]) * tendencia
+
+
+def generar_pronostico(semanas=None, dias=None):
+    """
+    Mide el error del modelo con la última semana cerrada, pronostica desde el
+    día en curso y reemplaza los pronósticos guardados. Devuelve la CorridaPronostico.
+    """
+    import numpy as np
+    semanas = semanas or PRONOSTICO_SEMANAS
+    dias = dias or PRONOSTICO_DIAS
+    hoy = dia_negocio_actual()
+    # Una semana más que la historia del modelo: la última sirve para medir el error
+    inicio = hoy - timedelta(days=(semanas + 1) * 7)
+    preparar_ventas(inicio, hoy - timedelta(days=1))
+    con_ventas = DiaVentas.query.filter(
+        DiaVentas.fecha_negocio >= inicio, DiaVentas.fecha_negocio < hoy, DiaVentas.unidades > 0
+    ).count()
+    if con_ventas < 14:
+        raise ValueError('Hacen falta al menos dos semanas de ventas cerradas para pronosticar')
+
+    unidades, ingresos, productos, categorias = serie_ventas(inicio, (semanas + 1) * 7)
+    prueba, _ = pronosticar(unidades[:-7], range(semanas * 7, semanas * 7 + 7))
+    real = unidades[-7:]
+    total_real = real.sum()
+    error_hora = float(np.abs(prueba - real).sum() / total_real) if total_real else None
+    error_dia = float(np.abs(prueba.sum(axis=(1, 2)) - real.sum(axis=(1, 2))).sum() / total_real) if total_real else None
+
+    media, alto = pronosticar(unidades[7:], range(semanas * 7, semanas * 7 + dias))
+    vendidas = unidades.sum(axis=(0, 1))
+    precio = np.divide(ingresos.sum(axis=(0, 1)), vendidas, out=np.zeros(len(productos)), where=vendidas > 0)
+    fechas = [hoy + timedelta(days=i) for i in range(dias)]
+    filas = [{
+        'fecha_negocio': fechas[d],
+        'hora': int(h),
+        'producto': productos[p],
+        'categoria': categorias[productos[p]],
+        'unidades': round(float(media[d, h, p]), 2),
+        'unidades_alto': round(float(alto[d, h, p]), 2),
+        'ingresos': round(float(media[d, h, p] * precio[p]), 0),
+    } for d, h, p in zip(*np.nonzero(media >= PRONOSTICO_MINIMO))]
+
+    # Se reemplazan los pronósticos futuros; los pasados se guardan un mes para compararlos
+    PronosticoDemanda.query.filter(db.or_(
+        PronosticoDemanda.fecha_negocio >= hoy,
+        PronosticoDemanda.fecha_negocio < hoy - timedelta(days=30)
+    )).delete(synchronize_session=False)
+    if filas:
+        db.session.execute(db.insert(PronosticoDemanda), filas)
+    corrida = CorridaPronostico(desde=fechas[0], hasta=fechas[-1], semanas=semanas, productos=len(productos),
+                                error_dia=error_dia, error_hora=error_hora)
+    db.session.add(corrida)
+    db.session.commit()
+    return corrida
+
+
+@app.route("/reportes/pronostico")
+@login_required
+def reporte_pronostico():
+    """
+    RAZÓN: Lista de preparación y personal por hora para un día de la semana
+    próxima. Solo lee lo que dejó `flask --app app pronostico`.
+    """
+    if current_user.rol != 'admin':
+        flash('Solo administradores pueden ver el pronóstico', 'error')
+        return redirect(url_for('dashboard'))
+
+    corrida = CorridaPronostico.query.order_by(CorridaPronostico.generado_en.desc()).first()
+    P = PronosticoDemanda
+    hoy = dia_negocio_actual()
+    semana = db.session.query(
+        P.fecha_negocio, db.func.sum(P.unidades), db.func.sum(P.ingresos)
+    ).filter(P.fecha_negocio >= hoy).group_by(P.fecha_negocio).order_by(P.fecha_negocio).all()
+
+    try:
+        fecha = datetime.strptime(request.args['fecha'], '%Y-%m-%d').date() if request.args.get('fecha') else hoy
+    except ValueError:
+        fecha = hoy
+
+    por_hora = [{
+        'hora': hora,
+        'unidades': float(unidades),
+        'alto': float(alto),
+        'ingresos': float(ingresos),
+        'personal': max(1, -(-int(alto) // PRONOSTICO_UNIDADES_POR_PERSONA)),
+    } for hora, unidades, alto, ingresos in db.session.query(
+        P.hora, db.func.sum(P.unidades), db.func.sum(P.unidades_alto), db.func.sum(P.ingresos)
+    ).filter(P.fecha_negocio == fecha).group_by(P.hora).order_by(P.hora)]
+
+    # Lista de preparación: producto × hora (solo las horas con demanda)
+    preparacion = OrderedDict()
+    for producto, categoria, hora, unidades, alto in db.session.query(
+        P.producto, P.categoria, P.hora, P.unidades, P.unidades_alto
+    ).filter(P.fecha_negocio == fecha).order_by(P.producto, P.hora):
+        fila = preparacion.setdefault(producto, {'producto': producto, 'categoria': categoria,
+                                                 'unidades': 0, 'alto': 0, 'horas': {}})
+        fila['unidades'] += unidades
+        fila['alto'] += alto
+        fila['horas'][hora] = unidades
+    preparacion = sorted(preparacion.values(), key=lambda f: -f['unidades'])
+
+    return render_template("reportes/pronostico.html", corrida=corrida, semana=semana, fecha=fecha,
+                           por_hora=por_hora, preparacion=preparacion,
+                           horas=[h['hora'] for h in por_hora],
+                           unidades_por_persona=PRONOSTICO_UNIDADES_POR_PERSONA,
+                           dias_semana=DIAS_SEMANA)
+
+
+@app.cli.command("pronostico")
+@click.option('--semanas', type=int, default=None, help='Semanas de historia (por defecto PRONOSTICO_SEMANAS).')
+@click.option('--dias', type=int, default=None, help='Días a pronosticar desde hoy (por defecto 7).')
+def comando_pronostico(semanas, dias):
+    """Pronostica unidades por hora y producto para los próximos días (necesita numpy)."""
+    try:
+        corrida = generar_pronostico(semanas, dias)
+    except ImportError:
+        raise SystemExit("❌ El pronóstico necesita numpy (pip install numpy)")
+    except ValueError as e:
+        raise SystemExit(f"❌ {e}")
+    error = f"{corrida.error_dia:.0%} por día, {corrida.error_hora:.0%} por hora y producto" \
+        if corrida.error_dia is not None else "sin ventas la última semana para medirlo"
+    print(f"✅ Pronóstico {corrida.desde:%Y-%m-%d} → {corrida.hasta:%Y-%m-%d} de {corrida.productos} productos "
+          f"(error en la última semana: {error})")
+
+
+# =========================
+# IMPRESIÓN TÉRMICA (ESC/POS)
+# =========================
+
+# Impresoras de red por nombre: "host" o "host:puerto" (9100 por defecto).
+# Las usa el spooler (`flask --app app spooler`), que debe correr en la red del local.
+IMPRESORAS = {
+    'caja': os.environ.get('IMPRESORA_CAJA', ''),
+    'cocina': os.environ.get('IMPRESORA_COCINA', ''),
+}
+# Columnas por línea: 48 en papel de 80 mm, 32 en 58 mm
+IMPRESORA_ANCHO = int(os.environ.get('IMPRESORA_ANCHO', 48))
+# Encolar comandas de cocina al registrar pedidos y domicilios
+IMPRIMIR_COMANDAS = os.environ.get('IMPRIMIR_COMANDAS') == '1'
+IMPRESION_TIMEOUT_SEGUNDOS = 5
+IMPRESION_MAX_INTENTOS = 5
+# Un trabajo tomado por un spooler que murió vuelve a la cola después de esto
+IMPRESION_RESERVA = timedelta(minutes=2)
+
+ESC = b'\x1b'
+GS = b'\x1d'
+
+
+class TicketEscPos:
+    """
+    RAZÓN: Arma directamente los bytes ESC/POS de un ticket en lugar de imprimir
+    HTML desde el navegador. El texto va en la página de códigos PC850 (tildes y ñ).
+    """
+
+    def __init__(self, ancho=None):
+        self.ancho = ancho or IMPRESORA_ANCHO
+        self.datos = bytearray(ESC + b'@' + ESC + b't\x02')  # reiniciar + PC850
+
+    def texto(self, linea=''):
+        self.datos += linea.encode('cp850', errors='replace') + b'\n'
+        return self
+
+    def alinear(self, modo):
+        self.datos += ESC + b'a' + bytes([{'izquierda': 0, 'centro': 1, 'derecha': 2}[modo]])
+        return self
+
+    def negrita(self, activa=True):
+        self.datos += ESC + b'E' + bytes([1 if activa else 0])
+        return self
+
+    def grande(self, activa=True):
+        self.datos += GS + b'!' + bytes([0x11 if activa else 0x00])  # doble alto y ancho
+        return self
+
+    def separador(self, caracter='-'):
+        return self.texto(caracter * self.ancho)
+
+    def columnas(self, izquierda, derecha):
+        """Texto a la izquierda y valor alineado a la derecha en la misma línea"""
+        espacio = self.ancho - len(derecha) - 1
+        if len(izquierda) > espacio:
+            izquierda = izquierda[:espacio]
+        return self.texto(izquierda.ljust(espacio) + ' ' + derecha)
+
+    def abrir_cajon(self):
+        self.datos += ESC + b'p\x00\x19\xfa'
+        return self
+
+    def cortar(self):
+        self.datos += ESC + b'd\x04' + GS + b'V\x42\x00'  # avanzar y corte parcial
+        return self
+
+    def bytes(self):
+        return bytes(self.datos)
 
 
+def _dinero(valor):
+    return "${:,.0f}".format(valor or 0)
 
-@app.route("/gasto/editar/<int:gasto_id>", methods=["GET", "POST"])
-@login_required
-def editar_gasto(gasto_id):
+
+def escpos_factura(factura, config=None, abrir_cajon=False):
     """
-    RAZÓN: Permite corregir errores en gastos registrados.
-    Solo admin puede editar gastos de otros usuarios.
+    Factura de mesa o domicilio en bytes ESC/POS, con el mismo contenido que ver_factura.
+    abrir_cajon: solo para la impresión del cobro; las reimpresiones no abren el cajón.
     """
-    gasto = Gasto.query.get_or_404(gasto_id)
-    
-    # Verificar permisos
-    if current_user.rol != 'admin' and gasto.usuario_id != current_user.id:
-        flash('No tienes permisos para editar este gasto', 'error')
-        return redirect(url_for('lista_gastos'))
-    
-    if request.method == "POST":
-        try:
-            fecha_str = request.form.get("fecha")
-            gasto.concepto = request.form.get("concepto")
-            gasto.monto = request.form.get("monto", type=float)
-            gasto.categoria_id = request.form.get("categoria_id", type=int)
-            gasto.proveedor_id = request.form.get("proveedor_id", type=int) or None
-            gasto.metodo_pago = request.form.get("metodo_pago")
-            gasto.numero_factura = request.form.get("numero_factura", "")
-            gasto.notas = request.form.get("notas", "")
-            
-            if fecha_str:
-                gasto.fecha = datetime.strptime(fecha_str, '%Y-%m-%dT%H:%M')
-            
+    config = config or obtener_configuracion()
+    t = TicketEscPos()
+
+    t.alinear('centro').negrita().grande().texto(config.nombre).grande(False).negrita(False)
+    t.texto(f"NIT: {config.nit}").texto(config.direccion).texto(config.ciudad).texto(f"Tel: {config.telefono}")
+    for extra in (config.email, config.regimen, config.resolucion_dian, config.rango_facturacion):
+        if extra:
+            t.texto(extra)
+    t.separador()
+    t.negrita().texto("FACTURA DE VENTA").texto(f"No. {factura.numero_consecutivo}").negrita(False)
+    t.texto(factura.fecha_emision.strftime('%d/%m/%Y %I:%M %p'))
+    t.texto(f"Mesa: {factura.sesion.mesa.numero}" if factura.sesion else "DOMICILIO")
+    t.alinear('izquierda').separador()
+
+    if factura.cliente_nombre or factura.cliente_documento:
+        t.texto("CLIENTE:")
+        if factura.cliente_nombre:
+            t.texto(factura.cliente_nombre)
+        if factura.cliente_documento:
+            t.texto(f"CC/NIT: {factura.cliente_documento}")
+        t.separador()
+
+    if factura.sesion:
+        for pedido in (factura.pedidos or factura.sesion.pedidos):
+            t.columnas(f"{pedido.cantidad} {pedido.producto}", _dinero(pedido.total))
+            if pedido.notas:
+                t.texto(f"  * {pedido.notas}")
+    else:
+        domicilio = factura.domicilios.first()
+        if domicilio:
+            for item in domicilio.items:
+                t.columnas(f"{item.cantidad} {item.producto_nombre}", _dinero(item.subtotal))
+                if item.notas:
+                    t.texto(f"  * {item.notas}")
+            t.columnas("1 Domicilio", _dinero(domicilio.costo_domicilio))
+    t.separador()
+
+    if factura.division:
+        t.columnas("Cuenta dividida:", factura.division)
+    t.columnas("SUBTOTAL:", _dinero(factura.subtotal))
+    if factura.iva and factura.iva > 0:
+        t.columnas(f"IVA ({config.iva_porcentaje}%):", _dinero(factura.iva))
+    if factura.propina and factura.propina > 0:
+        t.columnas("Propina:", _dinero(factura.propina))
+    t.negrita().columnas("TOTAL:", _dinero(factura.total)).negrita(False)
+    t.separador()
+
+    t.texto(f"MÉTODO DE PAGO: {(factura.metodo_pago or '').upper()}")
+    desglose = desglose_de_pagos(factura.id) if factura.metodo_pago == 'mixto' else {}
+    for metodo, monto in desglose.items():
+        t.columnas(f"  {metodo.capitalize()}:", _dinero(monto))
+    abonos = [p for p in factura.pagos if p.tipo == 'abono']
+    if abonos:
+        t.texto("ABONOS:")
+        for abono in abonos:
+            t.columnas(f"  {abono.fecha.strftime('%d/%m/%Y')} {abono.metodo.capitalize()}", _dinero(abono.monto))
+    if factura.estado_pago == 'pendiente':
+        t.negrita().texto("CRÉDITO - PENDIENTE DE PAGO").negrita(False)
+        if factura.fecha_vencimiento:
+            t.texto(f"Vence: {factura.fecha_vencimiento.strftime('%d/%m/%Y')}")
+    elif factura.estado_pago == 'pagada':
+        t.negrita().texto("PAGADO").negrita(False)
+
+    if factura.notas:
+        t.separador().texto("NOTAS:").texto(factura.notas)
+
+    t.separador().alinear('centro').texto("¡GRACIAS POR SU COMPRA!").texto("Vuelva Pronto")
+    if abrir_cajon and factura.estado_pago == 'pagada' and (factura.metodo_pago == 'efectivo' or desglose.get('efectivo')):
+        t.abrir_cajon()
+    return t.cortar().bytes()
+
+
+def escpos_comanda(titulo, items, responsable=None, fecha=None):
+    """
+    Comanda de cocina en bytes ESC/POS.
+    items: [(cantidad, producto, notas)]
+    """
+    t = TicketEscPos()
+    t.alinear('centro').negrita().grande().texto(titulo).grande(False).negrita(False)
+    t.texto((fecha or datetime.now()).strftime('%d/%m/%Y %I:%M %p'))
+    if responsable:
+        t.texto(responsable)
+    t.alinear('izquierda').separador()
+    for cantidad, producto, notas in items:
+        t.grande().texto(f"{cantidad} x {producto}").grande(False)
+        if notas:
+            t.texto(f"  * {notas}")
+    t.separador()
+    return t.cortar().bytes()
+
+
+class TrabajoImpresion(db.Model):
+    """
+    RAZÓN: Cola de impresión. Las vistas solo insertan el trabajo (en la misma
+    transacción que la factura o el pedido) y el spooler lo envía a la impresora
+    con reintentos, así una impresora apagada nunca bloquea a un worker web.
+    """
+    __tablename__ = 'trabajo_impresion'
+    id = db.Column(db.Integer, primary_key=True)
+    impresora = db.Column(db.String(30), nullable=False)  # caja, cocina
+    # Sin llave foránea: el archivo histórico mueve facturas y la cola no debe impedirlo
+    factura_id = db.Column(db.Integer, index=True)
+    descripcion = db.Column(db.String(200))
+    datos = db.Column(db.LargeBinary, nullable=False)
+    estado = db.Column(db.String(20), default='pendiente')  # pendiente, imprimiendo, impreso, error
+    intentos = db.Column(db.Integer, default=0)
+    ultimo_error = db.Column(db.String(300))
+    creado_en = db.Column(db.DateTime, default=datetime.now)
+    proximo_intento = db.Column(db.DateTime, default=datetime.now)
+    impreso_en = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('ix_trabajo_impresion_cola', 'estado', 'proximo_intento'),
+    )
+
+
+def encolar_impresion(impresora, datos, descripcion=None, factura_id=None):
+    """Agrega un trabajo a la cola; lo confirma el commit de quien llama"""
+    trabajo = TrabajoImpresion(impresora=impresora, datos=datos, descripcion=descripcion,
+                               factura_id=factura_id, proximo_intento=datetime.now())
+    db.session.add(trabajo)
+    return trabajo
+
+
+def enviar_a_impresora(direccion, datos, timeout=IMPRESION_TIMEOUT_SEGUNDOS):
+    """Envía los bytes por TCP crudo (puerto 9100, JetDirect) y cierra la conexión"""
+    host, _, puerto = direccion.partition(':')
+    with socket.create_connection((host, int(puerto or 9100)), timeout=timeout) as conexion:
+        conexion.sendall(datos)
+
+
+def procesar_cola_impresion(limite=20):
+    """
+    Envía los trabajos pendientes cuyo turno ya llegó. Cada trabajo se reserva
+    con un UPDATE condicional para que dos spoolers no lo impriman dos veces.
+    Devuelve cuántos trabajos se intentaron.
+    """
+    ahora = datetime.now()
+    candidatos = [i for (i,) in db.session.query(TrabajoImpresion.id).filter(
+        TrabajoImpresion.estado.in_(['pendiente', 'imprimiendo']),
+        TrabajoImpresion.proximo_intento <= ahora
+    ).order_by(TrabajoImpresion.id).limit(limite)]
+    db.session.commit()
+
+    procesados = 0
+    for trabajo_id in candidatos:
+        reservado = TrabajoImpresion.query.filter(
+            TrabajoImpresion.id == trabajo_id,
+            TrabajoImpresion.estado.in_(['pendiente', 'imprimiendo']),
+            TrabajoImpresion.proximo_intento <= ahora
+        ).update({
+            TrabajoImpresion.estado: 'imprimiendo',
+            TrabajoImpresion.proximo_intento: datetime.now() + IMPRESION_RESERVA
+        }, synchronize_session=False)
+        db.session.commit()
+        if not reservado:
+            continue
+
+        trabajo = db.session.get(TrabajoImpresion, trabajo_id)
+        direccion = IMPRESORAS.get(trabajo.impresora)
+        procesados += 1
+        if not direccion:
+            trabajo.estado = 'error'
+            trabajo.ultimo_error = f"Impresora '{trabajo.impresora}' no configurada"
             db.session.commit()
-            flash('Gasto actualizado exitosamente', 'success')
-            return redirect(url_for('lista_gastos'))
-            
+            continue
+        try:
+            enviar_a_impresora(direccion, trabajo.datos)
+        except OSError as e:
+            trabajo.intentos = (trabajo.intentos or 0) + 1
+            trabajo.ultimo_error = str(e)[:300]
+            if trabajo.intentos >= IMPRESION_MAX_INTENTOS:
+                trabajo.estado = 'error'
+                logger.warning(f"Trabajo de impresión {trabajo.id} descartado tras {trabajo.intentos} intentos: {e}")
+            else:
+                trabajo.estado = 'pendiente'
+                trabajo.proximo_intento = datetime.now() + timedelta(seconds=min(60, 2 ** trabajo.intentos))
+        else:
+            trabajo.estado = 'impreso'
+            trabajo.impreso_en = datetime.now()
+        db.session.commit()
+    return procesados
+
+
+@app.cli.command("spooler")
+@click.option('--intervalo', type=float, default=1.0, help='Segundos entre revisiones de la cola.')
+@click.option('--una-vez', is_flag=True, help='Procesar la cola una sola vez y salir.')
+def comando_spooler(intervalo, una_vez):
+    """Envía la cola de impresión a las impresoras térmicas de red."""
+    destinos = ', '.join(f"{nombre}={direccion or '-'}" for nombre, direccion in IMPRESORAS.items())
+    print(f"🖨️  Spooler de impresión: {destinos}")
+    while True:
+        try:
+            procesar_cola_impresion()
         except Exception as e:
             db.session.rollback()
-            flash(f'Error al actualizar: {str(e)}', 'error')
-    
-    categorias = CategoriaGasto.query.filter_by(activa=True).order_by(CategoriaGasto.nombre).all()
-    proveedores = Proveedor.query.filter_by(activo=True).order_by(Proveedor.nombre).all()
-    
-    return render_template("gastos/editar_gasto.html",
-                         gasto=gasto,
-                         categorias=categorias,
-                         proveedores=proveedores)
+            logger.error(f"Error en el spooler de impresión: {e}")
+        if una_vez:
+            break
+        time.sleep(intervalo)
 
 
-@app.route("/gasto/eliminar/<int:gasto_id>", methods=["POST"])
+@app.route("/factura/<int:factura_id>/imprimir", methods=["POST"])
 @login_required
-def eliminar_gasto(gasto_id):
+def imprimir_factura(factura_id):
     """
-    RAZÓN: Solo admin puede eliminar gastos para mantener integridad.
-    Se elimina permanentemente (no soft delete).
+    Envía la factura a la impresora térmica de caja. Solo la primera impresión
+    (la del cobro) abre el cajón; las reimpresiones no.
     """
-    if current_user.rol != 'admin':
-        flash('Solo administradores pueden eliminar gastos', 'error')
-        return redirect(url_for('lista_gastos'))
-    
-    gasto = Gasto.query.get_or_404(gasto_id)
-    monto = gasto.monto
-    concepto = gasto.concepto
-    
-    db.session.delete(gasto)
+    # El candado evita que un doble toque cuente dos veces como primera impresión
+    factura = bloquear_factura(factura_id)
+    if not factura:
+        abort(404)
+    primera = not db.session.query(TrabajoImpresion.query.filter_by(factura_id=factura.id).exists()).scalar()
+    encolar_impresion('caja', escpos_factura(factura, abrir_cajon=primera),
+                      f"Factura {factura.numero_consecutivo}", factura_id=factura.id)
     db.session.commit()
-    
-    flash(f'Gasto eliminado: {concepto} (${monto:,.2f})', 'success')
-    return redirect(url_for('lista_gastos'))
+    flash('Factura enviada a la impresora', 'success')
+    return redirect(url_for('ver_factura', factura_id=factura.id))
 
-# ==========================================
-# RUTAS PARA CUENTAS POR PAGAR
-# ==========================================
 
-@app.route("/cuentas_por_pagar")
-@login_required
-def cuentas_por_pagar():
+
+# =========================
+# FACTURAS EN PDF
+# =========================
+
+# Carpeta donde quedan los PDF ya generados (uno por factura y contenido)
+FACTURAS_PDF_DIR = os.environ.get('FACTURAS_PDF_DIR', os.path.join(basedir, 'instance', 'facturas_pdf'))
+# Desde cuántas facturas sin PDF vale la pena repartir el trabajo en procesos (solo en el CLI)
+PDF_LOTE_MIN_PROCESOS = 8
+# Facturas por ZIP descargado desde la web y por página del CLI
+PDF_LOTE_MAX_FACTURAS = 1000
+# PDF que la descarga web puede renderizar en el propio worker; con más, hay que
+# generarlos antes con `flask --app app facturas-pdf` (p. ej. cada noche)
+PDF_WEB_MAX_GENERAR = int(os.environ.get('PDF_WEB_MAX_GENERAR', 50))
+
+
+def datos_pdf_factura(factura, config=None):
     """
-    RAZÓN: Vista principal de deudas con proveedores.
-    Muestra gastos pendientes de pago y vencidos.
+    RAZÓN: Todo lo que va impreso en la factura como valores simples. Sirve
+    para calcular el hash del contenido (caché) y para renderizar en otro
+    proceso sin acceso a la base de datos.
     """
-    # Obtener filtros
-    estado = request.args.get('estado', 'todos')
-    proveedor_id = request.args.get('proveedor_id', type=int)
-    
-    # Query base
-    query = Gasto.query
-    
-    # Aplicar filtros
-    if estado != 'todos':
-        query = query.filter(Gasto.estado_pago == estado)
-    
-    if proveedor_id:
-        query = query.filter(Gasto.proveedor_id == proveedor_id)
-    
-    # Ordenar por fecha de vencimiento
-    gastos = query.order_by(Gasto.fecha_vencimiento).all()
-    
-    # Actualizar estados de gastos vencidos automáticamente
-    from datetime import date
-    hoy = date.today()
-    
-    for gasto in gastos:
-        if gasto.estado_pago == 'pendiente' and gasto.fecha_vencimiento and gasto.fecha_vencimiento < hoy:
-            gasto.estado_pago = 'vencido'
-    
-    db.session.commit()
-    
-    # Calcular totales
-    total_pendiente = sum(g.monto for g in gastos if g.estado_pago == 'pendiente')
-    total_vencido = sum(g.monto for g in gastos if g.estado_pago == 'vencido')
-    total_general = total_pendiente + total_vencido
-    
-    # Agrupar por proveedor
-    gastos_por_proveedor = {}
-    for gasto in gastos:
-        if gasto.estado_pago in ['pendiente', 'vencido']:
-            if gasto.proveedor:
-                prov_id = gasto.proveedor.id
-                if prov_id not in gastos_por_proveedor:
-                    gastos_por_proveedor[prov_id] = {
-                        'proveedor': gasto.proveedor,
-                        'total': 0,
-                        'cantidad': 0
-                    }
-                gastos_por_proveedor[prov_id]['total'] += gasto.monto
-                gastos_por_proveedor[prov_id]['cantidad'] += 1
-    
-    # Obtener proveedores para filtro
-    proveedores = Proveedor.query.filter_by(activo=True).order_by(Proveedor.nombre).all()
-    
-    # ============================================
-    # SOLUCIÓN: AGREGAR datetime AL RETURN
-    # ============================================
-    return render_template("cuentas/cuentas_por_pagar.html",
-                         gastos=gastos,
-                         total_pendiente=total_pendiente,
-                         total_vencido=total_vencido,
-                         total_general=total_general,
-                         gastos_por_proveedor=gastos_por_proveedor.values(),
-                         proveedores=proveedores,
-                         estado_filtro=estado,
-                         proveedor_filtro=proveedor_id,
-                         datetime=datetime)  # ← AGREGAR ESTA LÍNEA
+    config = config or obtener_configuracion()
+    items = []
+    if factura.sesion:
+        tipo = f"Mesa {factura.sesion.mesa.numero}"
+        for pedido in (factura.pedidos or factura.sesion.pedidos):
+            items.append((pedido.cantidad, pedido.producto, pedido.total, pedido.notas or ''))
+    else:
+        tipo = "Domicilio"
+        domicilio = factura.domicilios.first()
+        if domicilio:
+            for item in domicilio.items:
+                items.append((item.cantidad, item.producto_nombre, item.subtotal, item.notas or ''))
+            items.append((1, 'Domicilio', domicilio.costo_domicilio or 0, ''))
+
+    return {
+        'config': {campo: getattr(config, campo) for campo in CAMPOS_CONFIGURACION},
+        'numero': factura.numero_consecutivo,
+        'fecha': factura.fecha_emision.strftime('%d/%m/%Y %I:%M %p'),
+        'tipo': tipo,
+        'cliente_nombre': factura.cliente_nombre or '',
+        'cliente_documento': factura.cliente_documento or '',
+        'items': items,
+        'division': factura.division or '',
+        'subtotal': factura.subtotal or 0,
+        'iva': factura.iva or 0,
+        'propina': factura.propina or 0,
+        'total': factura.total or 0,
+        'metodo_pago': factura.metodo_pago or '',
+        'desglose': desglose_de_pagos(factura.id) if factura.metodo_pago == 'mixto' else {},
+        'abonos': [(p.fecha.strftime('%d/%m/%Y'), p.metodo, p.monto) for p in factura.pagos if p.tipo == 'abono'],
+        'estado_pago': factura.estado_pago or '',
+        'fecha_vencimiento': factura.fecha_vencimiento.strftime('%d/%m/%Y') if factura.fecha_vencimiento else '',
+        'notas': factura.notas or '',
+    }
 
 
-@app.route("/marcar_gasto_pagado/<int:gasto_id>", methods=["POST"])
+def hash_datos_pdf(datos):
+    return hashlib.sha256(json.dumps(datos, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+class DocumentoPdf:
+    """
+    Escritor mínimo de PDF (texto y líneas, fuentes estándar del visor) para
+    no depender de una librería externa. El texto va en WinAnsi (tildes y ñ).
+    """
+    ANCHO, ALTO = 595, 842  # A4 en puntos
+    FUENTES = {'F1': 'Helvetica', 'F2': 'Helvetica-Bold', 'F3': 'Courier', 'F4': 'Courier-Bold'}
+
+    def __init__(self):
+        self.paginas = []
+        self.nueva_pagina()
+
+    def nueva_pagina(self):
+        self.paginas.append([])
+
+    def texto(self, x, y, contenido, fuente='F1', tam=10):
+        contenido = str(contenido).encode('cp1252', errors='replace')
+        contenido = contenido.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)')
+        self.paginas[-1].append(b'BT /%s %d Tf %.1f %.1f Td (%s) Tj ET' % (fuente.encode(), tam, x, y, contenido))
+
+    def linea(self, x1, y1, x2, y2):
+        self.paginas[-1].append(b'%.1f %.1f m %.1f %.1f l S' % (x1, y1, x2, y2))
+
+    def bytes(self):
+        objetos = []  # contenido de cada objeto; el número es la posición + 1
+
+        def agregar(contenido):
+            objetos.append(contenido)
+            return len(objetos)
+
+        catalogo = agregar(None)
+        raiz_paginas = agregar(None)
+        fuentes = {nombre: agregar(b'<< /Type /Font /Subtype /Type1 /BaseFont /%s /Encoding /WinAnsiEncoding >>'
+                                   % base.encode()) for nombre, base in self.FUENTES.items()}
+        recursos = b'<< /Font << %s >> >>' % b' '.join(b'/%s %d 0 R' % (n.encode(), i) for n, i in fuentes.items())
+        hojas = []
+        for operaciones in self.paginas:
+            flujo = zlib.compress(b'\n'.join(operaciones))
+            contenido = agregar(b'<< /Length %d /Filter /FlateDecode >>\nstream\n%s\nendstream' % (len(flujo), flujo))
+            hojas.append(agregar(b'<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %d %d] /Resources %s /Contents %d 0 R >>'
+                                 % (raiz_paginas, self.ANCHO, self.ALTO, recursos, contenido)))
+        objetos[catalogo - 1] = b'<< /Type /Catalog /Pages %d 0 R >>' % raiz_paginas
+        objetos[raiz_paginas - 1] = b'<< /Type /Pages /Kids [%s] /Count %d >>' % (
+            b' '.join(b'%d 0 R' % h for h in hojas), len(hojas))
+
+        salida = bytearray(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+        posiciones = []
+        for numero, contenido in enumerate(objetos, start=1):
+            posiciones.append(len(salida))
+            salida += b'%d 0 obj\n%s\nendobj\n' % (numero, contenido)
+        inicio_xref = len(salida)
+        salida += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objetos) + 1)
+        for posicion in posiciones:
+            salida += b'%010d 00000 n \n' % posicion
+        salida += b'trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (
+            len(objetos) + 1, catalogo, inicio_xref)
+        return bytes(salida)
+
+
+def renderizar_pdf_factura(datos):
+    """Factura en PDF (A4) a partir de datos_pdf_factura(). No toca la base de datos."""
+    doc = DocumentoPdf()
+    margen, columnas = 50, 88  # Courier 9 pt: 88 caracteres entre márgenes
+    config = datos['config']
+    y = 790
+
+    def renglon(texto='', fuente='F3', tam=9, salto=12):
+        nonlocal y
+        if y < 60:
+            doc.nueva_pagina()
+            y = 790
+        doc.texto(margen, y, texto, fuente, tam)
+        y -= salto
+
+    def columnas_texto(izquierda, derecha):
+        espacio = columnas - len(derecha) - 1
+        return izquierda[:espacio].ljust(espacio) + ' ' + derecha
+
+    doc.texto(margen, y, config['nombre'], 'F2', 16)
+    doc.texto(380, y, 'FACTURA DE VENTA', 'F2', 14)
+    doc.texto(380, y - 18, f"No. {datos['numero']}", 'F2', 11)
+    doc.texto(380, y - 32, datos['fecha'], 'F1', 9)
+    doc.texto(380, y - 44, datos['tipo'], 'F1', 9)
+    y -= 18
+    for dato in (f"NIT: {config['nit']}", config['direccion'], config['ciudad'], f"Tel: {config['telefono']}",
+                 config['email'], config['regimen'], config['resolucion_dian'], config['rango_facturacion']):
+        if dato:
+            renglon(dato, 'F1', 9, 11)
+    y -= 6
+    doc.linea(margen, y, DocumentoPdf.ANCHO - margen, y)
+    y -= 16
+
+    if datos['cliente_nombre'] or datos['cliente_documento']:
+        renglon('CLIENTE', 'F2', 10)
+        if datos['cliente_nombre']:
+            renglon(datos['cliente_nombre'], 'F1', 10)
+        if datos['cliente_documento']:
+            renglon(f"CC/NIT: {datos['cliente_documento']}", 'F1', 10)
+        y -= 6
+
+    renglon(columnas_texto('CANT  DESCRIPCIÓN', 'VALOR'), 'F4')
+    renglon('-' * columnas)
+    for cantidad, descripcion, valor, notas in datos['items']:
+        renglon(columnas_texto(f"{cantidad:>4}  {descripcion}", _dinero(valor)))
+        if notas:
+            renglon(f"      * {notas}"[:columnas])
+    renglon('-' * columnas)
+
+    if datos['division']:
+        renglon(columnas_texto('', f"Cuenta dividida: {datos['division']}"))
+    renglon(columnas_texto('', f"SUBTOTAL: {_dinero(datos['subtotal']):>14}"))
+    if datos['iva'] > 0:
+        renglon(columnas_texto('', f"IVA ({config['iva_porcentaje']}%): {_dinero(datos['iva']):>14}"))
+    if datos['propina'] > 0:
+        renglon(columnas_texto('', f"Propina: {_dinero(datos['propina']):>14}"))
+    renglon(columnas_texto('', f"TOTAL: {_dinero(datos['total']):>14}"), 'F4', 10, 18)
+
+    renglon(f"MÉTODO DE PAGO: {datos['metodo_pago'].upper()}", 'F1', 10)
+    for metodo, monto in sorted(datos['desglose'].items()):
+        renglon(f"  {metodo.capitalize()}: {_dinero(monto)}", 'F1', 9)
+    if datos['abonos']:
+        renglon('ABONOS:', 'F1', 9)
+        for fecha, metodo, monto in datos['abonos']:
+            renglon(f"  {fecha} {metodo.capitalize()}: {_dinero(monto)}", 'F1', 9)
+    if datos['estado_pago'] == 'pendiente':
+        renglon('CRÉDITO - PENDIENTE DE PAGO', 'F2', 10)
+        if datos['fecha_vencimiento']:
+            renglon(f"Vence: {datos['fecha_vencimiento']}", 'F1', 9)
+    elif datos['estado_pago'] == 'pagada':
+        renglon('PAGADO', 'F2', 10)
+
+    if datos['notas']:
+        y -= 6
+        renglon('NOTAS:', 'F2', 9)
+        for inicio in range(0, len(datos['notas']), 100):
+            renglon(datos['notas'][inicio:inicio + 100], 'F1', 9)
+
+    y -= 12
+    renglon('¡GRACIAS POR SU COMPRA!', 'F1', 9)
+    return doc.bytes()
+
+
+def _ruta_pdf_factura(factura_id, huella):
+    return os.path.join(FACTURAS_PDF_DIR, f"factura_{factura_id}_{huella}.pdf")
+
+
+def _guardar_pdf_factura(factura_id, huella, contenido):
+    """Escribe el PDF (atómicamente) y borra las versiones viejas de la misma factura"""
+    os.makedirs(FACTURAS_PDF_DIR, exist_ok=True)
+    ruta = _ruta_pdf_factura(factura_id, huella)
+    temporal = f"{ruta}.{os.getpid()}.tmp"
+    with open(temporal, 'wb') as archivo:
+        archivo.write(contenido)
+    os.replace(temporal, ruta)
+    prefijo = f"factura_{factura_id}_"
+    for nombre in os.listdir(FACTURAS_PDF_DIR):
+        if nombre.startswith(prefijo) and nombre.endswith('.pdf') and nombre != os.path.basename(ruta):
+            try:
+                os.remove(os.path.join(FACTURAS_PDF_DIR, nombre))
+            except OSError:
+                pass
+    return ruta
+
+
+def pdf_factura(factura):
+    """Ruta del PDF de la factura; solo lo genera si cambió el contenido"""
+    datos = datos_pdf_factura(factura)
+    huella = hash_datos_pdf(datos)
+    ruta = _ruta_pdf_factura(factura.id, huella)
+    if not os.path.exists(ruta):
+        _guardar_pdf_factura(factura.id, huella, renderizar_pdf_factura(datos))
+    return ruta
+
+
+def pdfs_en_cache(facturas):
+    """
+    Separa las facturas cuyo PDF vigente ya está en disco ({factura_id: ruta})
+    de las que hay que renderizar ([(factura_id, huella, datos)]).
+    """
+    config = obtener_configuracion()
+    rutas, pendientes = {}, []
+    for factura in facturas:
+        datos = datos_pdf_factura(factura, config)
+        huella = hash_datos_pdf(datos)
+        ruta = _ruta_pdf_factura(factura.id, huella)
+        if os.path.exists(ruta):
+            rutas[factura.id] = ruta
+        else:
+            pendientes.append((factura.id, huella, datos))
+    return rutas, pendientes
+
+
+def pdfs_facturas(facturas, procesos=None):
+    """
+    RAZÓN: Copias de fin de mes desde `flask --app app facturas-pdf`. Los datos
+    se leen en este proceso (una sola conexión a la BD) y solo las facturas sin
+    PDF en disco se renderizan, repartidas en un pool de procesos cuando son
+    suficientes. No usar desde una solicitud: el pool hace fork del worker.
+    Devuelve [(factura, ruta)].
+    """
+    rutas, pendientes = pdfs_en_cache(facturas)
+
+    if len(pendientes) >= PDF_LOTE_MIN_PROCESOS and procesos != 1:
+        with ProcessPoolExecutor(max_workers=procesos or min(4, os.cpu_count() or 1)) as pool:
+            contenidos = pool.map(renderizar_pdf_factura, [datos for _, _, datos in pendientes], chunksize=4)
+            for (factura_id, huella, _), contenido in zip(pendientes, contenidos):
+                rutas[factura_id] = _guardar_pdf_factura(factura_id, huella, contenido)
+    else:
+        for factura_id, huella, datos in pendientes:
+            rutas[factura_id] = _guardar_pdf_factura(factura_id, huella, renderizar_pdf_factura(datos))
+
+    logger.info(f"PDF de facturas: {len(pendientes)} generados, {len(rutas) - len(pendientes)} desde caché")
+    return [(factura, rutas[factura.id]) for factura in facturas]
+
+
+def _filtro_rango_pdf(desde, hasta):
+    return (Factura.fecha_emision >= datetime.combine(desde, datetime.min.time()),
+            Factura.fecha_emision < datetime.combine(hasta + timedelta(days=1), datetime.min.time()))
+
+
+def contar_facturas_pdf(desde, hasta):
+    return Factura.query.filter(*_filtro_rango_pdf(desde, hasta)).count()
+
+
+def facturas_para_pdf(desde, hasta, despues_de=0, limite=PDF_LOTE_MAX_FACTURAS):
+    """
+    Facturas emitidas entre dos fechas (inclusive) con sus pedidos y pagos
+    precargados, de a `limite` por id mayor a `despues_de` (para paginar el rango).
+    """
+    return Factura.query.options(
+        db.selectinload(Factura.sesion).selectinload(Sesion.pedidos),
+        db.selectinload(Factura.sesion).selectinload(Sesion.mesa),
+        db.selectinload(Factura.pedidos),
+        db.selectinload(Factura.pagos)
+    ).filter(
+        *_filtro_rango_pdf(desde, hasta), Factura.id > despues_de
+    ).order_by(Factura.id).limit(limite).all()
+
+
+@app.route("/factura/<int:factura_id>/pdf")
 @login_required
-def marcar_gasto_pagado(gasto_id):
+def descargar_factura_pdf(factura_id):
+    """Factura formal en PDF, servida desde disco si no cambió"""
+    factura = Factura.query.get_or_404(factura_id)
+    return send_file(pdf_factura(factura), mimetype='application/pdf',
+                     download_name=f"{factura.numero_consecutivo}.pdf")
+
+
+@app.route("/facturas/pdf_lote")
+@login_required
+def descargar_facturas_pdf_lote():
+    """ZIP con los PDF de las facturas de un rango de fechas"""
+    if current_user.rol != 'admin':
+        flash('Solo los administradores pueden descargar facturas por lote', 'error')
+        return redirect(url_for('lista_facturas'))
+
+    try:
+        desde = datetime.strptime(request.args.get('desde', ''), '%Y-%m-%d').date()
+        hasta = datetime.strptime(request.args.get('hasta', ''), '%Y-%m-%d').date()
+    except ValueError:
+        flash('Indica un rango de fechas válido', 'error')
+        return redirect(url_for('lista_facturas'))
+
+    cantidad = contar_facturas_pdf(desde, hasta)
+    if not cantidad:
+        flash('No hay facturas en ese rango', 'error')
+        return redirect(url_for('lista_facturas'))
+    if cantidad > PDF_LOTE_MAX_FACTURAS:
+        flash(f'El rango tiene {cantidad:,} facturas; el máximo por descarga es {PDF_LOTE_MAX_FACTURAS:,}. '
+              f'Elige un rango más corto.', 'error')
+        return redirect(url_for('lista_facturas'))
+
+    # El worker solo empaqueta lo que ya está en disco y renderiza unos pocos faltantes;
+    # los lotes grandes se generan con el CLI, que sí reparte en procesos
+    facturas = facturas_para_pdf(desde, hasta)
+    rutas, pendientes = pdfs_en_cache(facturas)
+    if len(pendientes) > PDF_WEB_MAX_GENERAR:
+        flash(f'{len(pendientes):,} facturas del rango aún no tienen PDF. Genéralos con '
+              f'`flask --app app facturas-pdf --desde {desde.isoformat()} --hasta {hasta.isoformat()}` '
+              f'y vuelve a descargar.', 'error')
+        return redirect(url_for('lista_facturas'))
+    for factura_id, huella, datos in pendientes:
+        rutas[factura_id] = _guardar_pdf_factura(factura_id, huella, renderizar_pdf_factura(datos))
+
+    archivo_zip = io.BytesIO()
+    with zipfile.ZipFile(archivo_zip, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for factura in facturas:
+            zf.write(rutas[factura.id], f"{factura.numero_consecutivo}.pdf")
+    archivo_zip.seek(0)
+    return send_file(archivo_zip, mimetype='application/zip',
+                     download_name=f"facturas_{desde.isoformat()}_{hasta.isoformat()}.zip")
+
+
+@app.cli.command("facturas-pdf")
+@click.option('--desde', required=True, type=click.DateTime(formats=['%Y-%m-%d']))
+@click.option('--hasta', required=True, type=click.DateTime(formats=['%Y-%m-%d']))
+@click.option('--procesos', type=int, default=None, help='Procesos del pool (por defecto hasta 4).')
+def comando_facturas_pdf(desde, hasta, procesos):
+    """Genera de antemano los PDF de las facturas de un rango de fechas."""
+    inicio = time.perf_counter()
+    total, ultimo_id = 0, 0
+    # Por páginas de PDF_LOTE_MAX_FACTURAS para no cargar un fin de mes entero en memoria
+    while True:
+        facturas = facturas_para_pdf(desde.date(), hasta.date(), despues_de=ultimo_id)
+        if not facturas:
+            break
+        pdfs_facturas(facturas, procesos)
+        total += len(facturas)
+        ultimo_id = facturas[-1].id
+        db.session.expire_all()
+    print(f"✅ {total} facturas en {FACTURAS_PDF_DIR} ({time.perf_counter() - inicio:.1f} s)")
+
+
+# =========================
+# ARCHIVO HISTÓRICO
+# =========================
+
+# Meses que se conservan en las tablas de operación; lo anterior pasa a *_archivo
+ARCHIVO_MESES = int(os.environ.get('ARCHIVO_MESES', 12))
+# Sesiones/domicilios por transacción al archivar
+ARCHIVO_LOTE = int(os.environ.get('ARCHIVO_LOTE', 500))
+
+
+def crear_tabla_archivo(modelo, *indices):
     """
-    RAZÓN: Marca un gasto como pagado cuando realmente se paga.
+    Copia de las columnas de un modelo en `<tabla>_archivo`, sin llaves foráneas
+    ni restricciones únicas (el archivo solo se lee para reportes).
     """
-    if current_user.rol not in ['admin', 'mesero']:
-        flash('No tienes permisos para esta acción', 'error')
-        return redirect(url_for('cuentas_por_pagar'))
-    
-    gasto = Gasto.query.get_or_404(gasto_id)
-    
-    gasto.estado_pago = 'pagado'
-    gasto.fecha_pago_real = datetime.now()
-    
-    db.session.commit()
-    
-    flash(f'Gasto marcado como pagado: {gasto.concepto}', 'success')
-    return redirect(request.referrer or url_for('cuentas_por_pagar'))
+    columnas = [db.Column(c.name, c.type, primary_key=c.primary_key, autoincrement=False)
+                for c in modelo.__table__.columns]
+    nombre = f"{modelo.__tablename__}_archivo"
+    return db.Table(nombre, *columnas, *[db.Index(f"ix_{nombre}_{c}", c) for c in indices])
+
+
+# Mismo orden en que se crean en la operación (padres antes que hijos)
+TABLAS_ARCHIVO = {
+    Sesion: crear_tabla_archivo(Sesion, 'fecha_inicio'),
+    Pedido: crear_tabla_archivo(Pedido, 'sesion_id', 'fecha'),
+    Domicilio: crear_tabla_archivo(Domicilio, 'fecha_pedido', 'factura_id'),
+    ItemDomicilio: crear_tabla_archivo(ItemDomicilio, 'domicilio_id'),
+    Factura: crear_tabla_archivo(Factura, 'fecha_emision'),
+    Pago: crear_tabla_archivo(Pago, 'fecha'),
+}
+
+
+class CorridaArchivo(db.Model):
+    """
+    RAZÓN: Registro de cada corrida de archivo. Se crea antes de mover la primera
+    fila, así los reportes ya leen el archivo mientras la corrida avanza; si se
+    corta (terminada_en NULL), la siguiente corrida la retoma con el mismo corte.
+    """
+    __tablename__ = 'corrida_archivo'
+    id = db.Column(db.Integer, primary_key=True)
+    corte = db.Column(db.DateTime, nullable=False)  # Se archiva lo anterior a esta fecha
+    iniciada_en = db.Column(db.DateTime, default=datetime.now)
+    terminada_en = db.Column(db.DateTime, nullable=True)
+    sesiones = db.Column(db.Integer, default=0)
+    domicilios = db.Column(db.Integer, default=0)
+
+
+def corte_archivo():
+    """Fecha más reciente hasta la que hay datos archivados (None si nunca se archivó)"""
+    return db.session.query(db.func.max(CorridaArchivo.corte)).scalar()
+
+
+def historico(modelo, desde):
+    """
+    RAZÓN: Los reportes consultan el modelo que devuelve esta función en lugar del
+    modelo directo. Si el rango empieza después del último corte, todo está en la
+    tabla de operación y se usa tal cual; si no, se usa un alias sobre
+    `tabla UNION ALL tabla_archivo` con los mismos atributos que el modelo.
+    """
+    corte = corte_archivo()
+    if corte is None or desde >= corte:
+        return modelo
+    tabla, archivo = modelo.__table__, TABLAS_ARCHIVO[modelo]
+    columnas = [c.name for c in tabla.columns]
+    union = db.union_all(
+        db.select(*[tabla.c[c] for c in columnas]),
+        db.select(*[archivo.c[c] for c in columnas])
+    ).subquery(f"{tabla.name}_historico")
+    return db.aliased(modelo, union, adapt_on_names=True)
+
+
+def preparar_tablas_archivo():
+    """Crea las tablas de archivo y les agrega las columnas nuevas de sus modelos"""
+    for archivo in TABLAS_ARCHIVO.values():
+        archivo.create(db.engine, checkfirst=True)
+        agregar_columnas_faltantes(archivo.name, {
+            c.name: c.type.compile(db.engine.dialect) for c in archivo.columns
+        })
+
+
+def mover_a_archivo(modelo, condicion):
+    """Copia al archivo las filas que cumplen la condición y las borra de la tabla (misma transacción)"""
+    tabla, archivo = modelo.__table__, TABLAS_ARCHIVO[modelo]
+    columnas = [c.name for c in tabla.columns]
+    db.session.execute(archivo.insert().from_select(
+        columnas, db.select(*[tabla.c[c] for c in columnas]).where(condicion)
+    ))
+    return db.session.execute(tabla.delete().where(condicion)).rowcount
+
+
+def ultimos_ids():
+    """
+    Id más alto de cada tabla archivable. Esas filas nunca se archivan: en SQLite
+    borrar la última fila haría que su id se reutilizara, y la última factura es
+    la que da el siguiente número consecutivo.
+    """
+    return {modelo: db.session.query(db.func.max(modelo.id)).scalar() or 0 for modelo in TABLAS_ARCHIVO}
+
+
+def lote_sesiones_archivables(corte, lote):
+    """
+    Sesiones cerradas antes del corte con todas sus facturas pagadas, y sin
+    facturas ni pagos posteriores al corte (así ningún rango de reporte que
+    empiece después del corte necesita el archivo).
+    """
+    ultimos = ultimos_ids()
+    facturas_abiertas = db.session.query(Factura.id).filter(
+        Factura.sesion_id == Sesion.id,
+        db.or_(Factura.estado_pago != 'pagada', Factura.fecha_emision >= corte,
+               Factura.id >= ultimos[Factura])
+    ).exists()
+    pagos_recientes = db.session.query(Pago.id).join(Factura, Pago.factura_id == Factura.id).filter(
+        Factura.sesion_id == Sesion.id,
+        db.or_(Pago.fecha >= corte, Pago.id >= ultimos[Pago])
+    ).exists()
+    pedidos_recientes = db.session.query(Pedido.id).filter(
+        Pedido.sesion_id == Sesion.id,
+        Pedido.id >= ultimos[Pedido]
+    ).exists()
+    return [i for (i,) in db.session.query(Sesion.id).filter(
+        Sesion.activa == False,
+        db.func.coalesce(Sesion.fecha_fin, Sesion.fecha_inicio) < corte,
+        Sesion.id < ultimos[Sesion],
+        ~facturas_abiertas,
+        ~pagos_recientes,
+        ~pedidos_recientes
+    ).order_by(Sesion.id).limit(lote)]
+
+
+def lote_domicilios_archivables(corte, lote):
+    """Domicilios entregados o cancelados antes del corte, con la factura (si tienen) pagada"""
+    ultimos = ultimos_ids()
+    factura_abierta = db.session.query(Factura.id).filter(
+        Factura.id == Domicilio.factura_id,
+        db.or_(Factura.estado_pago != 'pagada', Factura.fecha_emision >= corte,
+               Factura.id >= ultimos[Factura])
+    ).exists()
+    pagos_recientes = db.session.query(Pago.id).filter(
+        Pago.factura_id == Domicilio.factura_id,
+        db.or_(Pago.fecha >= corte, Pago.id >= ultimos[Pago])
+    ).exists()
+    items_recientes = db.session.query(ItemDomicilio.id).filter(
+        ItemDomicilio.domicilio_id == Domicilio.id,
+        ItemDomicilio.id >= ultimos[ItemDomicilio]
+    ).exists()
+    return db.session.query(Domicilio.id, Domicilio.factura_id).filter(
+        Domicilio.estado.in_([EstadoDomicilio.ENTREGADO, EstadoDomicilio.CANCELADO]),
+        Domicilio.fecha_pedido < corte,
+        Domicilio.id < ultimos[Domicilio],
+        ~factura_abierta,
+        ~pagos_recientes,
+        ~items_recientes
+    ).order_by(Domicilio.id).limit(lote).all()
+
+
+def archivar_historico(meses=None, lote=None):
+    """
+    RAZÓN: Saca de las tablas de operación las sesiones (con pedidos, facturas y
+    pagos) y los domicilios (con items, factura y pagos) anteriores al horizonte,
+    para que las consultas del día a día recorran tablas pequeñas. Cada lote es
+    una transacción (copiar al archivo + borrar), y los lotes se vuelven a
+    seleccionar por criterio, así que cortar y repetir la corrida es seguro.
+    Devuelve la CorridaArchivo.
+    """
+    from dateutil.relativedelta import relativedelta
+    lote = lote or ARCHIVO_LOTE
+    preparar_tablas_archivo()
+
+    corrida = CorridaArchivo.query.filter(CorridaArchivo.terminada_en.is_(None)).order_by(
+        CorridaArchivo.id.desc()
+    ).first()
+    if corrida:
+        logger.info(f"Retomando corrida de archivo {corrida.id} (corte {corrida.corte:%Y-%m-%d})")
+    else:
+        meses = ARCHIVO_MESES if meses is None else meses
+        corte = datetime.combine((datetime.now() - relativedelta(months=meses)).date(), datetime.min.time())
+        corrida = CorridaArchivo(corte=corte)
+        db.session.add(corrida)
+        db.session.commit()
+
+    while True:
+        sesion_ids = lote_sesiones_archivables(corrida.corte, lote)
+        if not sesion_ids:
+            break
+        facturas = db.session.query(Factura.id).filter(Factura.sesion_id.in_(sesion_ids)).scalar_subquery()
+        # Hijos antes que padres, por las llaves foráneas
+        mover_a_archivo(Pago, Pago.factura_id.in_(facturas))
+        mover_a_archivo(Pedido, Pedido.sesion_id.in_(sesion_ids))
+        mover_a_archivo(Factura, Factura.sesion_id.in_(sesion_ids))
+        corrida.sesiones += mover_a_archivo(Sesion, Sesion.id.in_(sesion_ids))
+        db.session.commit()
+        logger.info(f"  Sesiones archivadas: {corrida.sesiones}")
+
+    while True:
+        filas = lote_domicilios_archivables(corrida.corte, lote)
+        if not filas:
+            break
+        domicilio_ids = [d for d, _ in filas]
+        factura_ids = [f for _, f in filas if f]
+        mover_a_archivo(ItemDomicilio, ItemDomicilio.domicilio_id.in_(domicilio_ids))
+        mover_a_archivo(Pago, Pago.factura_id.in_(factura_ids))
+        corrida.domicilios += mover_a_archivo(Domicilio, Domicilio.id.in_(domicilio_ids))
+        mover_a_archivo(Factura, Factura.id.in_(factura_ids))
+        db.session.commit()
+        logger.info(f"  Domicilios archivados: {corrida.domicilios}")
 
+    corrida.terminada_en = datetime.now()
+    db.session.commit()
+    return corrida
 
-@app.route("/gasto/editar_vencimiento/<int:gasto_id>", methods=["POST"])
-@login_required
-def editar_vencimiento_gasto(gasto_id):
+
+@app.cli.command("archivar")
+@click.option('--meses', type=int, default=None, help='Meses que se conservan en operación (por defecto ARCHIVO_MESES).')
+@click.option('--lote', type=int, default=None, help='Sesiones/domicilios por transacción.')
+def comando_archivar(meses, lote):
+    """Mueve sesiones y domicilios antiguos a las tablas de archivo."""
+    corrida = archivar_historico(meses, lote)
+    print(f"✅ Archivado hasta {corrida.corte:%Y-%m-%d}: "
+          f"{corrida.sesiones} sesiones y {corrida.domicilios} domicilios")
+
+
+# =========================
+# RESPALDOS
+# =========================
+
+# `flask --app app respaldo` (programarlo después del cierre de las 03:00) deja en
+# RESPALDO_DIR un .zip con la base y un manifiesto con sha256 y conteos por tabla,
+# sin detener el servicio. `flask --app app restaurar` lo carga en una base nueva.
+RESPALDO_DIR = os.environ.get('RESPALDO_DIR', os.path.join(app.instance_path, 'respaldos'))
+RESPALDO_CONSERVAR = int(os.environ.get('RESPALDO_CONSERVAR', 14))  # Respaldos que se guardan
+RESPALDO_PAGINAS = 1024  # Páginas de SQLite por paso: entre pasos la base queda libre para escribir
+RESPALDO_REINICIOS = 3  # Reinicios por escrituras antes de copiar en un solo paso
+RESPALDO_BLOQUE = 1024 * 1024
+MANIFIESTO_RESPALDO = 'manifiesto.json'
+
+
+class EscritorConHash:
+    """Archivo de salida que va calculando el sha256, los bytes y las líneas de lo escrito (sin archivo solo calcula)"""
+
+    def __init__(self, archivo=None):
+        self.archivo = archivo
+        self.hash = hashlib.sha256()
+        self.bytes = 0
+        self.lineas = 0
+
+    def write(self, datos):
+        if isinstance(datos, str):
+            datos = datos.encode('utf-8')
+        self.hash.update(datos)
+        self.bytes += len(datos)
+        self.lineas += datos.count(b'\n')
+        if self.archivo is not None:
+            self.archivo.write(datos)
+        return len(datos)
+
+    def copiar_desde(self, origen):
+        while True:
+            bloque = origen.read(RESPALDO_BLOQUE)
+            if not bloque:
+                break
+            self.write(bloque)
+
+    def resumen(self):
+        return {'sha256': self.hash.hexdigest(), 'bytes': self.bytes}
+
+
+def version_esquema_actual():
+    return db.session.query(db.func.max(VersionEsquema.version)).filter(
+        VersionEsquema.aplicada_en.isnot(None)).scalar()
+
+
+def tablas_respaldo(engine):
+    """Tablas del modelo que existen en la base, con sus columnas existentes, padres primero"""
+    inspector = inspect(engine)
+    existentes = set(inspector.get_table_names())
+    tablas = []
+    for tabla in db.metadata.sorted_tables:
+        if tabla.name in existentes:
+            columnas = {c['name'] for c in inspector.get_columns(tabla.name)}
+            tablas.append((tabla.name, [c.name for c in tabla.columns if c.name in columnas]))
+    return tablas
+
+
+def respaldar_sqlite(zf, manifiesto):
     """
-    RAZÓN: Permite cambiar la fecha de vencimiento de un gasto pendiente.
+    RAZÓN: La API de backup de SQLite copia la base por páginas y suelta el
+    bloqueo entre pasos, así los workers siguen escribiendo. Si alguien escribe
+    a mitad de la copia, SQLite la reinicia (el resultado siempre es una foto
+    consistente); con escrituras continuas eso puede no terminar nunca, así que
+    después de RESPALDO_REINICIOS se copia en un solo paso, que solo hace
+    esperar a los que escriben lo que dura la lectura.
     """
-    if current_user.rol != 'admin':
-        flash('Solo administradores pueden modificar vencimientos', 'error')
-        return redirect(url_for('cuentas_por_pagar'))
-    
-    gasto = Gasto.query.get_or_404(gasto_id)
-    
-    nueva_fecha = request.form.get('fecha_vencimiento')
-    if nueva_fecha:
-        gasto.fecha_vencimiento = datetime.strptime(nueva_fecha, '%Y-%m-%d').date()
-        db.session.commit()
-        flash('Fecha de vencimiento actualizada', 'success')
-    
-    return redirect(url_for('cuentas_por_pagar'))
+    import sqlite3
 
+    class Reiniciado(Exception):
+        pass
 
+    restantes_antes = [None]
+    reinicios = [0]
 
+    def progreso(estado, restantes, total):
+        if restantes_antes[0] is not None and restantes > restantes_antes[0]:
+            reinicios[0] += 1
+            if reinicios[0] >= RESPALDO_REINICIOS:
+                raise Reiniciado()
+        restantes_antes[0] = restantes
 
-# ==========================================
-# RUTAS PARA PROVEEDORES
-# ==========================================
+    with tempfile.TemporaryDirectory() as carpeta:
+        copia = os.path.join(carpeta, 'restaurante.db')
+        origen = sqlite3.connect(db.engine.url.database, timeout=30)
+        destino = sqlite3.connect(copia)
+        try:
+            try:
+                origen.backup(destino, pages=RESPALDO_PAGINAS, progress=progreso, sleep=0.05)
+            except Reiniciado:
+                logger.info(f"Respaldo reiniciado {reinicios[0]} veces por escrituras; copiando en un solo paso")
+                origen.backup(destino)
+            manifiesto['reinicios'] = reinicios[0]
+            if destino.execute('PRAGMA integrity_check').fetchone()[0] != 'ok':
+                raise ValueError('La copia no pasó PRAGMA integrity_check')
+            tablas = [nombre for (nombre,) in destino.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name")]
+            manifiesto['filas'] = {tabla: destino.execute(f'SELECT COUNT(*) FROM "{tabla}"').fetchone()[0]
+                                   for tabla in tablas}
+        finally:
+            origen.close()
+            destino.close()
+        with open(copia, 'rb') as archivo, zf.open('restaurante.db', 'w', force_zip64=True) as miembro:
+            escritor = EscritorConHash(miembro)
+            escritor.copiar_desde(archivo)
+        manifiesto['archivos'] = {'restaurante.db': escritor.resumen()}
+
+
+def respaldar_postgres(zf, manifiesto):
+    """
+    Un COPY TO STDOUT por tabla, todas dentro de una transacción REPEATABLE READ
+    de solo lectura: la misma foto para todas las tablas y sin bloquear escrituras.
+    """
+    tablas = tablas_respaldo(db.engine)
+    conexion = db.engine.raw_connection()
+    try:
+        cursor = conexion.cursor()
+        cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY')
+        manifiesto['tablas'], manifiesto['filas'], manifiesto['archivos'] = [], {}, {}
+        for tabla, columnas in tablas:
+            lista = ', '.join(f'"{c}"' for c in columnas)
+            with zf.open(f'{tabla}.copy', 'w', force_zip64=True) as miembro:
+                escritor = EscritorConHash(miembro)
+                cursor.copy_expert(f'COPY "{tabla}" ({lista}) TO STDOUT', escritor)
+            # En formato texto de COPY cada fila es una línea (los saltos dentro de un valor van escapados)
+            manifiesto['tablas'].append({'nombre': tabla, 'columnas': columnas})
+            manifiesto['filas'][tabla] = escritor.lineas
+            manifiesto['archivos'][f'{tabla}.copy'] = escritor.resumen()
+        conexion.rollback()
+    finally:
+        conexion.close()
+
+
+def verificar_respaldo(ruta):
+    """Relee el .zip (CRC de cada miembro) y compara el sha256 con el manifiesto; devuelve el manifiesto"""
+    with zipfile.ZipFile(ruta) as zf:
+        manifiesto = json.loads(zf.read(MANIFIESTO_RESPALDO))
+        for nombre, esperado in manifiesto['archivos'].items():
+            comprobador = EscritorConHash()
+            with zf.open(nombre) as miembro:
+                comprobador.copiar_desde(miembro)
+            if comprobador.resumen() != esperado:
+                raise ValueError(f'{nombre} no coincide con el manifiesto (respaldo dañado)')
+    return manifiesto
+
+
+def crear_respaldo(carpeta=None, conservar=None):
+    """Crea, verifica y rota los respaldos; devuelve (ruta, manifiesto)"""
+    carpeta = carpeta or RESPALDO_DIR
+    conservar = RESPALDO_CONSERVAR if conservar is None else conservar
+    os.makedirs(carpeta, exist_ok=True)
+    formato = db.engine.dialect.name
+    if formato not in ('sqlite', 'postgresql'):
+        raise ValueError(f'No hay respaldo para {formato}')
+
+    ahora = datetime.now()
+    manifiesto = {
+        'formato': formato,
+        'creado': ahora.isoformat(timespec='seconds'),
+        'dia_negocio': (dia_negocio_actual() - timedelta(days=1)).isoformat(),  # Último día cerrado
+        'version_esquema': version_esquema_actual(),
+    }
+    ruta = os.path.join(carpeta, f"respaldo_{ahora:%Y%m%d_%H%M%S}.zip")
+    # Se escribe con otro nombre y se renombra al final: un respaldo a medias nunca parece completo
+    try:
+        with zipfile.ZipFile(ruta + '.tmp', 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=6) as zf:
+            if formato == 'sqlite':
+                respaldar_sqlite(zf, manifiesto)
+            else:
+                respaldar_postgres(zf, manifiesto)
+            zf.writestr(MANIFIESTO_RESPALDO, json.dumps(manifiesto, indent=2, ensure_ascii=False))
+        verificar_respaldo(ruta + '.tmp')
+        os.replace(ruta + '.tmp', ruta)
+    finally:
+        if os.path.exists(ruta + '.tmp'):
+            os.remove(ruta + '.tmp')
 
-@app.route("/proveedores")
-@login_required
-def lista_proveedores():
-    """RAZÓN: Gestionar base de datos de proveedores"""
-    proveedores = Proveedor.query.order_by(Proveedor.nombre).all()
-    return render_template("gastos/lista_proveedores.html", proveedores=proveedores)
+    respaldos = sorted(glob.glob(os.path.join(carpeta, 'respaldo_*.zip')))
+    for viejo in respaldos[:-conservar] if conservar > 0 else []:
+        os.remove(viejo)
+    return ruta, manifiesto
 
 
-@app.route("/proveedor/nuevo", methods=["GET", "POST"])
-@login_required
-def nuevo_proveedor():
-    """RAZÓN: Agregar nuevos proveedores al sistema"""
-    if request.method == "POST":
-        proveedor = Proveedor(
-            nombre=request.form.get("nombre"),
-            nit=request.form.get("nit", ""),
-            telefono=request.form.get("telefono", ""),
-            email=request.form.get("email", ""),
-            direccion=request.form.get("direccion", ""),
-            notas=request.form.get("notas", "")
-        )
-        
-        db.session.add(proveedor)
-        db.session.commit()
-        
-        flash(f'Proveedor {proveedor.nombre} agregado', 'success')
-        return redirect(url_for('lista_proveedores'))
-    
-    return render_template("gastos/nuevo_proveedor.html")
+def restaurar_respaldo(ruta, destino_url, forzar=False):
+    """
+    Carga un respaldo en una base nueva (nunca sobre la de DATABASE_URL) y
+    compara los conteos con el manifiesto. Devuelve {tabla: filas}.
+    """
+    from sqlalchemy import create_engine
+    manifiesto = verificar_respaldo(ruta)
+    destino_url = destino_url.replace('postgres://', 'postgresql://')
+    if destino_url == db.engine.url.render_as_string(hide_password=False):
+        raise ValueError('El destino es la base en uso; restaurar en una base nueva y cambiar DATABASE_URL')
+    engine = create_engine(destino_url)
+    try:
+        if engine.dialect.name != manifiesto['formato']:
+            raise ValueError(f"El respaldo es de {manifiesto['formato']} y el destino es {engine.dialect.name}")
+        if manifiesto['formato'] == 'sqlite':
+            filas = _restaurar_sqlite(ruta, engine.url.database, forzar)
+        else:
+            filas = _restaurar_postgres(ruta, manifiesto, engine, forzar)
+    finally:
+        engine.dispose()
+    distintas = {t: (n, filas.get(t)) for t, n in manifiesto['filas'].items() if filas.get(t) != n}
+    if distintas:
+        raise ValueError(f'Conteos distintos al manifiesto: {distintas}')
+    return filas
+
+
+def _restaurar_sqlite(ruta, destino, forzar):
+    import sqlite3
+    if os.path.exists(destino) and not forzar:
+        raise ValueError(f'{destino} ya existe (usar --forzar para reemplazarlo)')
+    with zipfile.ZipFile(ruta) as zf, zf.open('restaurante.db') as miembro, open(destino + '.tmp', 'wb') as archivo:
+        shutil.copyfileobj(miembro, archivo, RESPALDO_BLOQUE)
+    conexion = sqlite3.connect(destino + '.tmp')
+    try:
+        if conexion.execute('PRAGMA integrity_check').fetchone()[0] != 'ok':
+            raise ValueError('La base restaurada no pasó PRAGMA integrity_check')
+        tablas = [nombre for (nombre,) in conexion.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")]
+        filas = {tabla: conexion.execute(f'SELECT COUNT(*) FROM "{tabla}"').fetchone()[0] for tabla in tablas}
+    finally:
+        conexion.close()
+    os.replace(destino + '.tmp', destino)
+    return filas
+
+
+def _restaurar_postgres(ruta, manifiesto, engine, forzar):
+    if inspect(engine).get_table_names() and not forzar:
+        raise ValueError('La base destino no está vacía (crear una nueva con createdb)')
+    db.metadata.create_all(engine)
+    conexion = engine.raw_connection()
+    try:
+        cursor = conexion.cursor()
+        filas = {}
+        with zipfile.ZipFile(ruta) as zf:
+            for tabla in manifiesto['tablas']:
+                nombre, columnas = tabla['nombre'], tabla['columnas']
+                lista = ', '.join(f'"{c}"' for c in columnas)
+                with zf.open(f'{nombre}.copy') as miembro:
+                    cursor.copy_expert(f'COPY "{nombre}" ({lista}) FROM STDIN', miembro, size=RESPALDO_BLOQUE)
+                filas[nombre] = cursor.rowcount
+                if 'id' in columnas:
+                    cursor.execute(f"SELECT setval(pg_get_serial_sequence('{nombre}', 'id'), "
+                                   f"COALESCE((SELECT MAX(id) FROM \"{nombre}\"), 1)) "
+                                   f"WHERE pg_get_serial_sequence('{nombre}', 'id') IS NOT NULL")
+        conexion.commit()
+    except Exception:
+        conexion.rollback()
+        raise
+    finally:
+        conexion.close()
+    return filas
+
+
+@app.cli.command("respaldo")
+@click.option('--carpeta', default=None, help='Carpeta de destino (por defecto RESPALDO_DIR).')
+@click.option('--conservar', type=int, default=None, help='Respaldos que se conservan (por defecto RESPALDO_CONSERVAR).')
+def comando_respaldo(carpeta, conservar):
+    """Respaldo en caliente de la base (SQLite backup API o COPY en Postgres)."""
+    inicio = time.perf_counter()
+    try:
+        ruta, manifiesto = crear_respaldo(carpeta, conservar)
+    except ValueError as e:
+        raise SystemExit(f"❌ {e}")
+    print(f"✅ {ruta} ({os.path.getsize(ruta) / 1048576:.1f} MB, "
+          f"{sum(manifiesto['filas'].values()):,} filas, {time.perf_counter() - inicio:.1f} s)")
 
 
-@app.route("/proveedor/editar/<int:proveedor_id>", methods=["GET", "POST"])
-@login_required
-def editar_proveedor(proveedor_id):
-    """RAZÓN: Actualizar información de proveedores"""
-    proveedor = Proveedor.query.get_or_404(proveedor_id)
-    
-    if request.method == "POST":
-        proveedor.nombre = request.form.get("nombre")
-        proveedor.nit = request.form.get("nit", "")
-        proveedor.telefono = request.form.get("telefono", "")
-        proveedor.email = request.form.get("email", "")
-        proveedor.direccion = request.form.get("direccion", "")
-        proveedor.notas = request.form.get("notas", "")
-        
-        db.session.commit()
-        flash('Proveedor actualizado', 'success')
-        return redirect(url_for('lista_proveedores'))
-    
-    return render_template("gastos/editar_proveedor.html", proveedor=proveedor)
+@app.cli.command("verificar-respaldo")
+@click.argument('archivo')
+def comando_verificar_respaldo(archivo):
+    """Comprueba el sha256 de cada parte de un respaldo contra su manifiesto."""
+    try:
+        manifiesto = verificar_respaldo(archivo)
+    except (ValueError, zipfile.BadZipFile, KeyError) as e:
+        raise SystemExit(f"❌ {e}")
+    print(f"✅ Respaldo íntegro: {manifiesto['formato']}, creado {manifiesto['creado']}, "
+          f"{sum(manifiesto['filas'].values()):,} filas")
+
+
+@app.cli.command("restaurar")
+@click.argument('archivo')
+@click.argument('destino')
+@click.option('--forzar', is_flag=True, help='Reemplazar el archivo SQLite o cargar en una base Postgres con tablas.')
+def comando_restaurar(archivo, destino, forzar):
+    """Restaura un respaldo en la base DESTINO (URL de SQLAlchemy, nunca la base en uso)."""
+    try:
+        filas = restaurar_respaldo(archivo, destino, forzar)
+    except (ValueError, zipfile.BadZipFile, KeyError) as e:
+        raise SystemExit(f"❌ {e}")
+    print(f"✅ Restaurado en {destino}: {len(filas)} tablas, {sum(filas.values()):,} filas (conteos verificados)")
 
 
-@app.route("/proveedor/toggle/<int:proveedor_id>")
-@login_required
-def toggle_proveedor(proveedor_id):
-    """RAZÓN: Activar/desactivar proveedores sin eliminarlos"""
-    if current_user.rol != 'admin':
-        flash('Solo administradores pueden modificar proveedores', 'error')
-        return redirect(url_for('lista_proveedores'))
-    
-    proveedor = Proveedor.query.get_or_404(proveedor_id)
-    proveedor.activo = not proveedor.activo
-    db.session.commit()
-    
-    estado = "activado" if proveedor.activo else "desactivado"
-    flash(f'Proveedor {proveedor.nombre} {estado}', 'success')
-    return redirect(url_for('lista_proveedores'))
+# =========================
+# INICIALIZACIÓN
+# =========================
 
+def migrar_esquema(lote=None):
+    """
+    RAZÓN: Crea las tablas nuevas y aplica las migraciones versionadas pendientes
+    (columnas, índices, rellenos por lotes). Es seguro de repetir.
+    """
+    db.create_all()
+    aplicadas = aplicar_migraciones(lote)
+    print(f"✅ Tablas creadas/verificadas ({aplicadas} migraciones aplicadas)")
 
-# ==========================================
-# REPORTES FINANCIEROS
-# ==========================================
 
-@app.route("/reportes/financiero")
-@login_required
-def reporte_financiero():
+def sembrar_datos():
     """
-    RAZÓN: Vista consolidada de ingresos vs gastos.
-    El reporte más importante para tomar decisiones.
+    RAZÓN: Datos por defecto (usuarios, mesas, categorías de gasto, configuración).
+    Solo crea lo que falta, así que se puede correr en cada despliegue.
     """
-    # Obtener rango de fechas (por defecto, mes actual)
-    fecha_inicio = request.args.get('fecha_inicio')
-    fecha_fin = request.args.get('fecha_fin')
-    
-    if not fecha_inicio:
-        # Primer día del mes actual
-        hoy = datetime.now()
-        fecha_inicio = hoy.replace(day=1).strftime('%Y-%m-%d')
-    
-    if not fecha_fin:
-        # Hoy
-        fecha_fin = datetime.now().strftime('%Y-%m-%d')
-    
-    # Convertir a objetos datetime
-    # IMPORTANTE: Definimos el inicio del día a las 03:00 (cierre a partir de las 03:00)
-    fecha_inicio_obj = datetime.strptime(fecha_inicio, '%Y-%m-%d').replace(hour=3, minute=0, second=0)
-    # Fecha fin es el inicio del día siguiente a las 03:00 (end-exclusive)
-    fecha_fin_obj = datetime.strptime(fecha_fin, '%Y-%m-%d').replace(hour=3, minute=0, second=0) + timedelta(days=1)
-
-    # INGRESOS: Sumar facturas del período (end-exclusive: >= inicio, < fin)
-    ingresos = db.session.query(
-        db.func.sum(Factura.total)
-    ).filter(
-        Factura.fecha_emision >= fecha_inicio_obj,
-        Factura.fecha_emision < fecha_fin_obj
-    ).scalar() or 0
-    
-    # GASTOS: Sumar gastos del período (end-exclusive)
-    gastos_total = db.session.query(
-        db.func.sum(Gasto.monto)
-    ).filter(
-        Gasto.fecha >= fecha_inicio_obj,
-        Gasto.fecha < fecha_fin_obj
-    ).scalar() or 0
-    
-    # UTILIDAD = INGRESOS - GASTOS
-    utilidad = ingresos - gastos_total
-    margen = (utilidad / ingresos * 100) if ingresos > 0 else 0
-    
-    # Gastos por categoría - CONVERTIR A LISTA DE TUPLAS
-    gastos_por_categoria_raw = db.session.query(
-        CategoriaGasto.nombre,
-        CategoriaGasto.color,
-        db.func.sum(Gasto.monto).label('total'),
-        db.func.count(Gasto.id).label('cantidad')
-    ).join(Gasto).filter(
-        Gasto.fecha >= fecha_inicio_obj,
-        Gasto.fecha < fecha_fin_obj
-    ).group_by(CategoriaGasto.id).order_by(db.desc('total')).all()
-    
-    # SOLUCIÓN: Convertir Row objects a lista de listas para JSON
-    gastos_por_categoria = []
-    gastos_por_categoria_tabla = []
-    
-    for row in gastos_por_categoria_raw:
-        # Para el gráfico (formato JSON)
-        gastos_por_categoria.append([
-            row[0],  # nombre
-            row[1],  # color
-            float(row[2])  # total
-        ])
-        
-        # Para la tabla HTML (objeto completo)
-        gastos_por_categoria_tabla.append({
-            'nombre': row[0],
-            'color': row[1],
-            'total': float(row[2]),
-            'cantidad': row[3]
-        })
-    
-    # Evolución diaria de ingresos y gastos (para gráfico)
-    # Cada "día" va desde 03:00 del día hasta 03:00 del día siguiente
-    dias_rango = (fecha_fin_obj - fecha_inicio_obj).days
-    evolucion_diaria = []
+    usuarios_default = [
+        ('admin', 'Administrador', 'admin', 'admin123'),
+        ('mesero1', 'Mesero 1', 'mesero', 'mesero123'),
+        ('cocina', 'Cocina', 'cocina', 'cocina123'),
+    ]
+    existentes = {u for (u,) in db.session.query(Usuario.username).filter(
+        Usuario.username.in_([u[0] for u in usuarios_default])
+    )}
+    for username, nombre, rol, password in usuarios_default:
+        if username not in existentes:
+            usuario = Usuario(username=username, nombre=nombre, rol=rol)
+            usuario.set_password(password)
+            db.session.add(usuario)
     
-    for i in range(dias_rango):
-        dia_inicio = fecha_inicio_obj + timedelta(days=i)
-        dia_fin = dia_inicio + timedelta(days=1)
-        
-        ingresos_dia = db.session.query(
-            db.func.sum(Factura.total)
-        ).filter(
-            Factura.fecha_emision >= dia_inicio,
-            Factura.fecha_emision < dia_fin
-        ).scalar() or 0
-        
-        gastos_dia = db.session.query(
-            db.func.sum(Gasto.monto)
-        ).filter(
-            Gasto.fecha >= dia_inicio,
-            Gasto.fecha < dia_fin
-        ).scalar() or 0
+    # Crear mesas si no existen
+    if Mesa.query.count() == 0:
+        for i in range(1, 11):
+            mesa = Mesa(numero=i, capacidad=4)
+            db.session.add(mesa)
+
+    if CategoriaGasto.query.count() == 0:
+        categorias_default = [
+            {'nombre': 'Ingredientes y Materia Prima', 'descripcion': 'Compras de alimentos, bebidas y suministros de cocina', 'color': '#28a745'},
+            {'nombre': 'Salarios y Nómina', 'descripcion': 'Pagos a empleados, prestaciones y seguridad social', 'color': '#007bff'},
+            {'nombre': 'Servicios Públicos', 'descripcion': 'Agua, luz, gas, internet, teléfono', 'color': '#ffc107'},
+            {'nombre': 'Arriendo', 'descripcion': 'Pago de arriendo del local', 'color': '#dc3545'},
+            {'nombre': 'Mantenimiento', 'descripcion': 'Reparaciones, limpieza, mantenimiento de equipos', 'color': '#6c757d'},
+            {'nombre': 'Marketing', 'descripcion': 'Publicidad, redes sociales, volantes', 'color': '#e83e8c'},
+            {'nombre': 'Impuestos', 'descripcion': 'Impuestos, declaraciones, trámites legales', 'color': '#fd7e14'},
+            {'nombre': 'Otros Gastos', 'descripcion': 'Gastos misceláneos', 'color': '#6610f2'}
+        ]
         
-        evolucion_diaria.append({
-            'fecha': dia_inicio.strftime('%Y-%m-%d'),
-            'ingresos': float(ingresos_dia),
-            'gastos': float(gastos_dia),
-            'utilidad': float(ingresos_dia - gastos_dia)
-        })
+        for cat_data in categorias_default:
+            categoria = CategoriaGasto(**cat_data)
+            db.session.add(categoria)
     
-    return render_template("reportes/financiero.html",
-                         fecha_inicio=fecha_inicio,
-                         fecha_fin=fecha_fin,
-                         ingresos=float(ingresos),
-                         gastos_total=float(gastos_total),
-                         utilidad=float(utilidad),
-                         margen=float(margen),
-                         gastos_por_categoria=gastos_por_categoria,  # Para JSON/gráficos
-                         gastos_por_categoria_tabla=gastos_por_categoria_tabla,  # Para tabla HTML
-                         evolucion_diaria=evolucion_diaria,
-                         now=datetime.now())
-# =========================
-# INICIALIZACIÓN
-# =========================
+    db.session.commit()
+    init_db_facturacion()
+    print("✅ Datos por defecto verificados")
+
 
 def init_db():
     with app.app_context():
-        db.create_all()
-        
-        # Crear usuario admin si no existe
-        if not Usuario.query.filter_by(username='admin').first():
-            admin = Usuario(username='admin', nombre='Administrador', rol='admin')
-            admin.set_password('admin123')
-            db.session.add(admin)
-        
-        # Crear usuario mesero de prueba
-        if not Usuario.query.filter_by(username='mesero1').first():
-            mesero = Usuario(username='mesero1', nombre='Mesero 1', rol='mesero')
-            mesero.set_password('mesero123')
-            db.session.add(mesero)
-        
-        # Crear usuario cocina
-        if not Usuario.query.filter_by(username='cocina').first():
-            cocina = Usuario(username='cocina', nombre='Cocina', rol='cocina')
-            cocina.set_password('cocina123')
-            db.session.add(cocina)
-        
-        # Crear mesas si no existen
-        if Mesa.query.count() == 0:
-            for i in range(1, 11):
-                mesa = Mesa(numero=i, capacidad=4)
-                db.session.add(mesa)
-        
-        db.session.commit()
+        migrar_esquema()
+        sembrar_datos()
         print("Base de datos inicializada correctamente")
 
-        if CategoriaGasto.query.count() == 0:
-            categorias_default = [
-                {'nombre': 'Ingredientes y Materia Prima', 'descripcion': 'Compras de alimentos, bebidas y suministros de cocina', 'color': '#28a745'},
-                {'nombre': 'Salarios y Nómina', 'descripcion': 'Pagos a empleados, prestaciones y seguridad social', 'color': '#007bff'},
-                {'nombre': 'Servicios Públicos', 'descripcion': 'Agua, luz, gas, internet, teléfono', 'color': '#ffc107'},
-                {'nombre': 'Arriendo', 'descripcion': 'Pago de arriendo del local', 'color': '#dc3545'},
-                {'nombre': 'Mantenimiento', 'descripcion': 'Reparaciones, limpieza, mantenimiento de equipos', 'color': '#6c757d'},
-                {'nombre': 'Marketing', 'descripcion': 'Publicidad, redes sociales, volantes', 'color': '#e83e8c'},
-                {'nombre': 'Impuestos', 'descripcion': 'Impuestos, declaraciones, trámites legales', 'color': '#fd7e14'},
-                {'nombre': 'Otros Gastos', 'descripcion': 'Gastos misceláneos', 'color': '#6610f2'}
-            ]
-            
-            for cat_data in categorias_default:
-                categoria = CategoriaGasto(**cat_data)
-                db.session.add(categoria)
-        
-        db.session.commit()
-        print("Categorías de gastos inicializadas correctamente")
+
+# Comandos de despliegue: se corren una vez por release (ver Procfile / railway.toml),
+# no en cada worker de gunicorn.
+#   flask --app app init      -> migrate + seed (base nueva o existente)
+#   flask --app app migrate   -> solo esquema
+#   flask --app app seed      -> solo datos por defecto
+
+@app.cli.command("init")
+def comando_init():
+    """Crea/actualiza el esquema y los datos por defecto."""
+    init_db()
+
+
+@app.cli.command("migrate")
+@click.option('--lote', type=int, default=None, help='Filas por transacción en los rellenos.')
+@click.option('--estado', is_flag=True, help='Solo mostrar qué migraciones están aplicadas.')
+def comando_migrate(lote, estado):
+    """Crea tablas nuevas y aplica las migraciones pendientes."""
+    if estado:
+        for version, nombre, situacion in estado_migraciones():
+            print(f"{version:>4}  {situacion:<20} {nombre}")
+        return
+    migrar_esquema(lote)
+
+
+@app.cli.command("seed")
+def comando_seed():
+    """Crea usuarios, mesas, categorías y configuración por defecto si faltan."""
+    sembrar_datos()
 
 # ==========================================
 # RUTAS PARA PRESUPUESTOS
@@ -2846,6 +6605,12 @@ def nuevo_domicilio():
                 )
                 db.session.add(item)
             
+            if IMPRIMIR_COMANDAS:
+                encolar_impresion('cocina', escpos_comanda(
+                    f"DOMICILIO #{domicilio.id}",
+                    [(i['cantidad'], i['nombre'], i.get('notas', '')) for i in items_data],
+                    current_user.nombre
+                ), f"Comanda domicilio #{domicilio.id}")
             db.session.commit()
             
             flash(f'Domicilio #{domicilio.id} creado exitosamente - Total: ${total:,.0f}', 'success')
@@ -3027,18 +6792,14 @@ def cancelar_domicilio(domicilio_id):
 
 @app.route("/domicilio/<int:domicilio_id>/facturar", methods=["GET", "POST"])
 @login_required
+@idempotente
 def facturar_domicilio(domicilio_id):
     """
     RAZÓN: Generar factura para un domicilio entregado.
     Similar a facturar_sesion pero para domicilios.
     """
     domicilio = Domicilio.query.get_or_404(domicilio_id)
-    config = ConfiguracionRestaurante.query.first()
-    
-    if not config:
-        config = ConfiguracionRestaurante()
-        db.session.add(config)
-        db.session.commit()
+    config = obtener_configuracion()
     
     if domicilio.factura_id:
         flash('Este domicilio ya tiene una factura generada', 'error')
@@ -3058,14 +6819,7 @@ def facturar_domicilio(domicilio_id):
             total = subtotal + propina
             
             # Generar número consecutivo
-            ultima_factura = Factura.query.order_by(Factura.id.desc()).first()
-            if ultima_factura:
-                ultimo_num = int(ultima_factura.numero_consecutivo.split('-')[1])
-                nuevo_num = ultimo_num + 1
-            else:
-                nuevo_num = 1
-            
-            numero_consecutivo = f"FACT-{nuevo_num:06d}"
+            numero_consecutivo = f"FACT-{siguiente_numero_factura():06d}"
             
             # Convertir fecha de vencimiento
             fecha_vencimiento = None
@@ -3091,6 +6845,8 @@ def facturar_domicilio(domicilio_id):
             )
             
             db.session.add(factura)
+            if estado_pago == 'pagada':
+                registrar_pagos_factura(factura, fecha=factura.fecha_pago_real)
             db.session.flush()
             
             # Asociar factura al domicilio
@@ -3341,33 +7097,13 @@ if __name__ == "__main__":
     init_db()
     port = int(os.environ.get('PORT', 5000))
     app.run(debug=False, host='0.0.0.0', port=port)
-else:
-    # En producción (Railway), inicializar automáticamente
+elif os.environ.get('INICIALIZAR_BD_AL_IMPORTAR') == '1':
+    # Modo anterior: cada worker migra y siembra al importar. Solo para despliegues
+    # que aún no corren `flask --app app init` como release command.
     with app.app_context():
         try:
-            db.create_all()
-            print("✅ Tablas creadas/verificadas")
-            
-            # Crear admin si no existe
-            if not Usuario.query.filter_by(username='admin').first():
-                admin = Usuario(username='admin', nombre='Administrador', rol='admin')
-                admin.set_password('admin123')
-                db.session.add(admin)
-                
-                # Crear otros usuarios por defecto
-                mesero = Usuario(username='mesero1', nombre='Mesero 1', rol='mesero')
-                mesero.set_password('mesero123')
-                db.session.add(mesero)
-                
-                cocina = Usuario(username='cocina', nombre='Cocina', rol='cocina')
-                cocina.set_password('cocina123')
-                db.session.add(cocina)
-                
-                db.session.commit()
-                print("✅ Usuarios por defecto creados")
-            else:
-                print("ℹ️ Usuarios ya existen")
-                
+            migrar_esquema()
+            sembrar_datos()
         except Exception as e:
             print(f"⚠️ Error en inicialización: {e}")
-            # No hacer rollback aquí, dejar que la app arranque de todos modos
\ No newline at end of file
+            # No hacer rollback aquí, dejar que la app arranque de todos modos
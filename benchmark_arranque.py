@@ -0,0 +1,73 @@
+"""
+Script para medir el arranque en frío de un worker (importar app.py en un
+proceso nuevo, como hace gunicorn), antes y después de sacar la
+inicialización de la base de datos del import.
+Ejecutar: python benchmark_arranque.py [repeticiones]
+
+- antes:   INICIALIZAR_BD_AL_IMPORTAR=1 (create_all + migraciones + usuarios en cada worker)
+- después: import sin I/O de base de datos (el esquema lo prepara `flask --app app init`)
+
+Usa DATABASE_URL si está definida; si no, una base SQLite temporal.
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import statistics
+
+DIRECTORIO = os.path.dirname(os.path.abspath(__file__))
+
+
+def medir_import(entorno, repeticiones):
+    """Tiempo (segundos) de `import app` en un intérprete nuevo, una vez por repetición"""
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        subprocess.run([sys.executable, '-c', 'import app'], cwd=DIRECTORIO, env=entorno,
+                       check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        tiempos.append(time.perf_counter() - inicio)
+    return tiempos
+
+
+def resumen(nombre, tiempos):
+    ordenados = sorted(tiempos)
+    p95 = ordenados[min(len(ordenados) - 1, int(round(0.95 * (len(ordenados) - 1))))]
+    print(f"{nombre:<10} mediana {statistics.median(tiempos) * 1000:8.1f} ms   "
+          f"p95 {p95 * 1000:8.1f} ms   mín {ordenados[0] * 1000:8.1f} ms")
+
+
+def benchmark_arranque(repeticiones=10):
+    entorno = dict(os.environ)
+    temporal = None
+    if not entorno.get('DATABASE_URL'):
+        temporal = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+        temporal.close()
+        entorno['DATABASE_URL'] = 'sqlite:///' + temporal.name
+
+    try:
+        print("\n" + "="*60)
+        print("  ARRANQUE EN FRÍO DE UN WORKER")
+        print("="*60 + "\n")
+
+        # Preparar el esquema una vez, como lo haría el release command
+        subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', 'init'], cwd=DIRECTORIO,
+                       env=entorno, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        antes = medir_import(dict(entorno, INICIALIZAR_BD_AL_IMPORTAR='1'), repeticiones)
+        despues = medir_import({k: v for k, v in entorno.items() if k != 'INICIALIZAR_BD_AL_IMPORTAR'},
+                               repeticiones)
+
+        resumen('antes', antes)
+        resumen('después', despues)
+        ahorro = statistics.median(antes) - statistics.median(despues)
+        print(f"\n📊 Ahorro por worker: {ahorro * 1000:.1f} ms (mediana, {repeticiones} repeticiones)")
+    finally:
+        if temporal:
+            os.unlink(temporal.name)
+
+
+if __name__ == "__main__":
+    repeticiones = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    benchmark_arranque(repeticiones)
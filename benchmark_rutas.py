@@ -0,0 +1,341 @@
+"""
+Script para medir las rutas más usadas: latencia p50/p95/p99, solicitudes por
+segundo y consultas SQL por solicitud. Guarda los resultados en JSON para
+comparar corridas entre commits.
+Ejecutar: python benchmark_rutas.py [--modo cliente|gunicorn|ambos] [--repeticiones 50]
+                                    [--salida resultados.json] [--comparar anterior.json]
+
+- cliente:  Flask test client en este proceso (cuenta las consultas SQL de cada solicitud)
+- gunicorn: un gunicorn real en un puerto local, con --concurrencia hilos cliente
+            (latencia y rendimiento extremo a extremo; las consultas vienen del modo cliente)
+
+Usa DATABASE_URL; para resultados representativos llenarla antes con
+`python generar_datos.py`. Las rutas POST agregan pedidos a una mesa abierta.
+"""
+
+import argparse
+import http.cookiejar
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+import urllib.request
+from datetime import datetime, timedelta
+
+DIRECTORIO = os.path.dirname(os.path.abspath(__file__))
+
+USUARIOS = {
+    'admin': 'admin123',
+    'mesero1': 'mesero123',
+    'cocina': 'cocina123',
+}
+
+
+def rutas_a_medir(contexto):
+    """
+    (nombre, usuario, método, url, datos). Los ids salen de la base: una mesa
+    con sesión abierta, para que ver_mesa y facturar_sesion tengan pedidos.
+    """
+    mesa_id, sesion_id = contexto['mesa_id'], contexto['sesion_id']
+    hace_un_minuto = (datetime.now() - timedelta(minutes=1)).isoformat()
+    hace_un_mes = (datetime.now() - timedelta(days=30)).strftime('%Y-%m-%d')
+    hoy = datetime.now().strftime('%Y-%m-%d')
+    return [
+        ('dashboard', 'admin', 'GET', '/dashboard', None),
+        ('ver_mesa', 'admin', 'GET', f'/mesa/{mesa_id}', None),
+        ('nuevo_pedido', 'mesero1', 'GET', f'/nuevo_pedido/{mesa_id}', None),
+        ('nuevo_pedido (POST)', 'mesero1', 'POST', f'/nuevo_pedido/{mesa_id}',
+         {'producto': 'Limonada natural', 'cantidad': '1', 'precio_unitario': '6000'}),
+        ('cocina', 'cocina', 'GET', '/cocina', None),
+        ('api_cocina_verificar_nuevos', 'cocina', 'GET', '/api/cocina/verificar_nuevos', None),
+        ('notificaciones_pendientes', 'mesero1', 'GET',
+         '/notificaciones/pendientes?' + urllib.parse.urlencode({'since': hace_un_minuto}), None),
+        ('api_domicilios_activos', 'admin', 'GET', '/api/domicilios/activos', None),
+        ('facturar_sesion', 'admin', 'GET', f'/facturar_sesion/{sesion_id}', None),
+        ('reporte_financiero', 'admin', 'GET',
+         '/reportes/financiero?' + urllib.parse.urlencode({'fecha_inicio': hace_un_mes, 'fecha_fin': hoy}), None),
+        ('cuentas_por_cobrar', 'admin', 'GET', '/cuentas_por_cobrar', None),
+    ]
+
+
+def percentil(valores, p):
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))]
+
+
+def resumen(tiempos, errores, segundos, consultas=None):
+    """Cifras de una ruta (tiempos en segundos → milisegundos)"""
+    datos = {
+        'solicitudes': len(tiempos),
+        'errores': errores,
+        'p50_ms': round(percentil(tiempos, 50) * 1000, 2),
+        'p95_ms': round(percentil(tiempos, 95) * 1000, 2),
+        'p99_ms': round(percentil(tiempos, 99) * 1000, 2),
+        'media_ms': round(statistics.mean(tiempos) * 1000, 2),
+        'por_segundo': round(len(tiempos) / segundos, 1) if segundos else None,
+    }
+    if consultas is not None:
+        datos['consultas'] = consultas
+    return datos
+
+
+def contexto_base():
+    """Mesa con sesión abierta (la crea si no hay) y tamaño de las tablas principales"""
+    from app import app, db, Mesa, Sesion, Pedido, Factura, Domicilio, Usuario
+    with app.app_context():
+        sesion = Sesion.query.filter_by(activa=True).order_by(Sesion.id).first()
+        if sesion is None:
+            mesa = Mesa.query.order_by(Mesa.numero).first()
+            mesero = Usuario.query.filter_by(username='mesero1').first()
+            sesion = Sesion(mesa_id=mesa.id, activa=True)
+            db.session.add(sesion)
+            db.session.flush()
+            db.session.add(Pedido(mesa_id=mesa.id, sesion_id=sesion.id, mesero_id=mesero.id,
+                                  producto='Bandeja paisa', cantidad=1, precio_unitario=32000))
+            db.session.commit()
+        return {
+            'mesa_id': sesion.mesa_id,
+            'sesion_id': sesion.id,
+            'motor': db.engine.dialect.name,
+            'filas': {modelo.__tablename__: modelo.query.count()
+                      for modelo in (Sesion, Pedido, Factura, Domicilio)},
+        }
+
+
+# =========================
+# Modo cliente (in-process)
+# =========================
+
+def medir_cliente(rutas, repeticiones, calentamiento):
+    from sqlalchemy import event
+    from app import app, db
+
+    contador = {'consultas': 0}
+
+    def contar(*args):
+        contador['consultas'] += 1
+
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', contar)
+    clientes = {}
+    for usuario, clave in USUARIOS.items():
+        cliente = app.test_client()
+        cliente.post('/', data={'username': usuario, 'password': clave})
+        clientes[usuario] = cliente
+
+    resultados = {}
+    for nombre, usuario, metodo, url, datos in rutas:
+        cliente = clientes[usuario]
+        for _ in range(calentamiento):
+            cliente.open(url, method=metodo, data=datos)
+
+        tiempos, errores, consultas = [], 0, []
+        inicio_ruta = time.perf_counter()
+        for _ in range(repeticiones):
+            contador['consultas'] = 0
+            inicio = time.perf_counter()
+            respuesta = cliente.open(url, method=metodo, data=datos)
+            tiempos.append(time.perf_counter() - inicio)
+            consultas.append(contador['consultas'])
+            if respuesta.status_code >= 400:
+                errores += 1
+        resultados[nombre] = resumen(tiempos, errores, time.perf_counter() - inicio_ruta,
+                                     consultas=round(statistics.median(consultas)))
+        imprimir_fila(nombre, resultados[nombre])
+
+    with app.app_context():
+        event.remove(db.engine, 'before_cursor_execute', contar)
+    return resultados
+
+
+# =========================
+# Modo gunicorn (HTTP real)
+# =========================
+
+def puerto_libre():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def esperar_puerto(puerto, limite=30):
+    fin = time.time() + limite
+    while time.time() < fin:
+        try:
+            with socket.create_connection(('127.0.0.1', puerto), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"gunicorn no abrió el puerto {puerto} en {limite} s")
+
+
+class ClienteHttp:
+    """Sesión HTTP con cookies (login de Flask-Login) sin seguir redirecciones"""
+
+    class _SinRedirecciones(urllib.request.HTTPRedirectHandler):
+        def redirect_request(self, *args, **kwargs):
+            return None
+
+    def __init__(self, base):
+        self.base = base
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), self._SinRedirecciones)
+
+    def abrir(self, url, metodo='GET', datos=None):
+        return self.abrir_con_cuerpo(url, metodo, datos)[0]
+
+    def abrir_con_cuerpo(self, url, metodo='GET', datos=None, timeout=60):
+        """(código, cuerpo) de la respuesta"""
+        cuerpo = urllib.parse.urlencode(datos).encode() if datos else None
+        solicitud = urllib.request.Request(self.base + url, data=cuerpo, method=metodo)
+        try:
+            with self.opener.open(solicitud, timeout=timeout) as respuesta:
+                return respuesta.status, respuesta.read()
+        except urllib.error.HTTPError as e:
+            return e.code, b''
+        except OSError:
+            return 599, b''  # Tiempo agotado o conexión rechazada: cuenta como error
+
+
+def medir_gunicorn(rutas, repeticiones, calentamiento, workers, concurrencia):
+    puerto = puerto_libre()
+    proceso = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--workers', str(workers), '--threads', '2',
+         '--worker-class', 'gthread', '--bind', f'127.0.0.1:{puerto}', '--log-level', 'warning', 'app:app'],
+        cwd=DIRECTORIO, env=dict(os.environ))
+    try:
+        esperar_puerto(puerto)
+        base = f'http://127.0.0.1:{puerto}'
+
+        def cliente_de(usuario):
+            cliente = ClienteHttp(base)
+            cliente.abrir('/', 'POST', {'username': usuario, 'password': USUARIOS[usuario]})
+            return cliente
+
+        resultados = {}
+        for nombre, usuario, metodo, url, datos in rutas:
+            clientes = [cliente_de(usuario) for _ in range(concurrencia)]
+            for _ in range(calentamiento):
+                clientes[0].abrir(url, metodo, datos)
+
+            tiempos, errores = [], [0]
+            candado = threading.Lock()
+            por_hilo = max(1, repeticiones // concurrencia)
+
+            def trabajar(cliente):
+                for _ in range(por_hilo):
+                    inicio = time.perf_counter()
+                    estado = cliente.abrir(url, metodo, datos)
+                    duracion = time.perf_counter() - inicio
+                    with candado:
+                        tiempos.append(duracion)
+                        if estado >= 400:
+                            errores[0] += 1
+
+            hilos = [threading.Thread(target=trabajar, args=(c,)) for c in clientes]
+            inicio_ruta = time.perf_counter()
+            for hilo in hilos:
+                hilo.start()
+            for hilo in hilos:
+                hilo.join()
+            resultados[nombre] = resumen(tiempos, errores[0], time.perf_counter() - inicio_ruta)
+            imprimir_fila(nombre, resultados[nombre])
+        return resultados
+    finally:
+        proceso.terminate()
+        proceso.wait(timeout=10)
+
+
+# =========================
+# Reporte
+# =========================
+
+def imprimir_encabezado(titulo):
+    print("\n" + "="*60)
+    print(f"  {titulo}")
+    print("="*60)
+    print(f"{'ruta':<30}{'p50':>9}{'p95':>9}{'p99':>9}{'req/s':>9}{'SQL':>6}{'err':>5}")
+
+
+def imprimir_fila(nombre, datos):
+    consultas = datos.get('consultas', '-')
+    print(f"{nombre:<30}{datos['p50_ms']:>9.1f}{datos['p95_ms']:>9.1f}{datos['p99_ms']:>9.1f}"
+          f"{datos['por_segundo'] or 0:>9.1f}{consultas:>6}{datos['errores']:>5}")
+
+
+def comparar(actual, anterior):
+    """Diferencia de p50 y de consultas contra una corrida anterior (mismo modo y ruta)"""
+    print("\n" + "="*60)
+    print(f"  COMPARACIÓN CON {anterior.get('commit', '?')[:10]} ({anterior.get('fecha', '?')})")
+    print("="*60)
+    for modo, rutas in actual['modos'].items():
+        previas = anterior.get('modos', {}).get(modo, {})
+        for nombre, datos in rutas.items():
+            previo = previas.get(nombre)
+            if not previo:
+                continue
+            cambio = (datos['p50_ms'] - previo['p50_ms']) / previo['p50_ms'] * 100 if previo['p50_ms'] else 0
+            marca = '🔴' if cambio > 10 else ('🟢' if cambio < -10 else '  ')
+            linea = f"{marca} {modo:<9}{nombre:<30} p50 {previo['p50_ms']:>8.1f} → {datos['p50_ms']:>8.1f} ms ({cambio:+.0f}%)"
+            if 'consultas' in datos and 'consultas' in previo and datos['consultas'] != previo['consultas']:
+                linea += f"   SQL {previo['consultas']} → {datos['consultas']}"
+            print(linea)
+
+
+def commit_actual():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=DIRECTORIO, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def benchmark_rutas(modo='cliente', repeticiones=50, calentamiento=3, workers=2, concurrencia=4,
+                    salida=None, anterior=None, solo=None):
+    contexto = contexto_base()
+    rutas = [r for r in rutas_a_medir(contexto) if not solo or r[0] in solo]
+    resultado = {
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'commit': commit_actual(),
+        'motor': contexto['motor'],
+        'filas': contexto['filas'],
+        'repeticiones': repeticiones,
+        'modos': {},
+    }
+    print(f"\n📦 Base {contexto['motor']}: " + ', '.join(f"{t} {n:,}" for t, n in contexto['filas'].items()))
+
+    if modo in ('cliente', 'ambos'):
+        imprimir_encabezado("FLASK TEST CLIENT (ms)")
+        resultado['modos']['cliente'] = medir_cliente(rutas, repeticiones, calentamiento)
+    if modo in ('gunicorn', 'ambos'):
+        imprimir_encabezado(f"GUNICORN {workers} WORKERS, {concurrencia} CLIENTES (ms)")
+        resultado['modos']['gunicorn'] = medir_gunicorn(rutas, repeticiones, calentamiento, workers, concurrencia)
+
+    if anterior:
+        with open(anterior, encoding='utf-8') as archivo:
+            comparar(resultado, json.load(archivo))
+    if salida:
+        with open(salida, 'w', encoding='utf-8') as archivo:
+            json.dump(resultado, archivo, indent=2, ensure_ascii=False)
+        print(f"\n💾 Resultados guardados en {salida}")
+    return resultado
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark de las rutas principales")
+    parser.add_argument('--modo', choices=['cliente', 'gunicorn', 'ambos'], default='cliente')
+    parser.add_argument('--repeticiones', type=int, default=50, help='Solicitudes medidas por ruta')
+    parser.add_argument('--calentamiento', type=int, default=3, help='Solicitudes sin medir antes de cada ruta')
+    parser.add_argument('--workers', type=int, default=2, help='Workers de gunicorn')
+    parser.add_argument('--concurrencia', type=int, default=4, help='Clientes simultáneos en modo gunicorn')
+    parser.add_argument('--salida', help='Archivo JSON donde guardar los resultados')
+    parser.add_argument('--comparar', help='JSON de una corrida anterior para comparar')
+    parser.add_argument('--rutas', nargs='+', help='Medir solo estas rutas (por nombre)')
+    args = parser.parse_args()
+    benchmark_rutas(args.modo, args.repeticiones, args.calentamiento, args.workers, args.concurrencia,
+                    args.salida, args.comparar, args.rutas)
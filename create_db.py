@@ -1,5 +1,4 @@
-from app import app, db
+from app import init_db
 
-with app.app_context():
-    db.create_all()
-    print("Base de datos creada correctamente")
+# Equivale a `flask --app app init`
+init_db()
@@ -0,0 +1,423 @@
+"""
+Script para generar datos sintéticos de restaurante y medir rendimiento con
+volúmenes reales: días completos de mesas, pedidos, facturas (con su libro de
+pagos), domicilios, gastos, presupuestos y consumo interno.
+Ejecutar: python generar_datos.py [--dias 90] [--sesiones-dia 60] [--semilla 1]
+
+- Picos de almuerzo y cena, más movimiento el fin de semana, y el día de
+  negocio de 03:00 a 03:00 (las cuentas de la madrugada van al día anterior).
+- Pagos en efectivo, tarjeta, transferencia y mixtos; cuentas por cobrar
+  pagadas tarde, pendientes y vencidas.
+- Con --abiertas N deja N mesas con la cuenta abierta y pedidos en cocina, y
+  algunos domicilios en curso, para que dashboard y cocina tengan trabajo.
+
+Las filas se insertan por lotes con executemany (sin pasar por el ORM) e ids
+asignados aquí, así que varios millones de filas tardan minutos en SQLite o
+Postgres. Usa DATABASE_URL; preparar antes el esquema con
+`flask --app app init`. Los datos se agregan a los que ya existan.
+"""
+
+import argparse
+import math
+import random
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+from werkzeug.security import generate_password_hash
+
+from app import (app, db, Usuario, Mesa, Sesion, Pedido, CategoriaMenu, ItemMenu, Factura, Pago,
+                 Domicilio, ItemDomicilio, EstadoDomicilio, CategoriaGasto, Gasto, Presupuesto,
+                 ConsumoInterno, siguiente_numero_factura, repartir_monto)
+
+# Orden de inserción: padres antes que hijos (Postgres valida las llaves foráneas)
+ORDEN_TABLAS = [Sesion, Factura, Pedido, Pago, Domicilio, ItemDomicilio, Gasto, Presupuesto, ConsumoInterno]
+
+# Lunes → domingo
+FACTOR_DIA_SEMANA = [0.7, 0.75, 0.8, 0.95, 1.3, 1.45, 1.1]
+
+METODOS_PAGO = [('efectivo', 0.48), ('tarjeta', 0.30), ('transferencia', 0.14), ('mixto', 0.08)]
+
+MENU_BASE = {
+    'Entradas': [('Empanadas x3', 9000), ('Patacones con hogao', 12000), ('Ceviche', 18000), ('Sopa del día', 10000)],
+    'Platos fuertes': [('Bandeja paisa', 32000), ('Churrasco', 38000), ('Pechuga a la plancha', 28000),
+                       ('Mojarra frita', 34000), ('Ajiaco', 26000), ('Arroz con pollo', 24000),
+                       ('Hamburguesa de la casa', 27000), ('Pasta boloñesa', 25000)],
+    'Bebidas': [('Limonada natural', 6000), ('Jugo de lulo', 7000), ('Gaseosa', 5000), ('Cerveza', 8000),
+                ('Agua', 4000), ('Café', 3500)],
+    'Postres': [('Tres leches', 9000), ('Brownie con helado', 11000), ('Flan de caramelo', 8000)],
+}
+
+BARRIOS = [('Centro', 3000), ('La Floresta', 4000), ('El Poblado', 5000), ('Laureles', 4500),
+           ('Belén', 5500), ('Envigado', 7000)]
+NOMBRES = ['Ana', 'Luis', 'Carlos', 'María', 'Jorge', 'Paula', 'Andrés', 'Camila', 'Diego', 'Laura',
+           'Felipe', 'Valentina', 'Santiago', 'Daniela', 'Juan', 'Sofía']
+APELLIDOS = ['Gómez', 'Rodríguez', 'López', 'Martínez', 'García', 'Pérez', 'Restrepo', 'Castro', 'Vargas', 'Ríos']
+
+# (nombre de la categoría de gasto, conceptos, monto base diario)
+GASTOS_DIARIOS = [
+    ('Ingredientes y Materia Prima', ['Carnes', 'Verduras y frutas', 'Lácteos', 'Abarrotes', 'Bebidas'], 350000),
+    ('Mantenimiento y Reparaciones', ['Gas', 'Artículos de aseo', 'Desechables'], 40000),
+]
+GASTOS_MENSUALES = [
+    ('Salarios y Nómina', 'Nómina del mes', 9000000, 1),
+    ('Arriendo', 'Arriendo del local', 4500000, 1),
+    ('Servicios Públicos', 'Agua, luz y gas', 1600000, 10),
+    ('Servicios Públicos', 'Internet y teléfono', 180000, 15),
+]
+
+
+class Insertador:
+    """Acumula filas por tabla y las inserta por lotes, siempre en ORDEN_TABLAS"""
+
+    def __init__(self, lote):
+        self.lote = lote
+        self.filas = {modelo: [] for modelo in ORDEN_TABLAS}
+        self.total = {modelo: 0 for modelo in ORDEN_TABLAS}
+        self.siguiente = {modelo: (db.session.query(db.func.max(modelo.id)).scalar() or 0) + 1
+                          for modelo in ORDEN_TABLAS}
+
+    def agregar(self, modelo, **fila):
+        """Guarda la fila con un id nuevo y lo devuelve"""
+        fila['id'] = self.siguiente[modelo]
+        self.siguiente[modelo] += 1
+        self.filas[modelo].append(fila)
+        return fila['id']
+
+    def revisar(self):
+        """Inserta si alguna tabla llenó su lote (llamar entre entidades completas, no a mitad de una)"""
+        if any(len(filas) >= self.lote for filas in self.filas.values()):
+            self.vaciar()
+
+    def vaciar(self):
+        db.session.commit()  # Soltar la transacción de lectura del ORM (en SQLite bloquearía la escritura)
+        with db.engine.begin() as conexion:
+            for modelo in ORDEN_TABLAS:
+                if self.filas[modelo]:
+                    conexion.execute(modelo.__table__.insert(), self.filas[modelo])
+                    self.total[modelo] += len(self.filas[modelo])
+                    self.filas[modelo] = []
+
+    def ajustar_secuencias(self):
+        """En Postgres las secuencias de id no se enteran de los ids explícitos"""
+        if db.engine.dialect.name != 'postgresql':
+            return
+        with db.engine.begin() as conexion:
+            for modelo in ORDEN_TABLAS:
+                tabla = modelo.__tablename__
+                conexion.execute(text(
+                    f"SELECT setval(pg_get_serial_sequence('{tabla}', 'id'), "
+                    f"COALESCE((SELECT MAX(id) FROM {tabla}), 1))"
+                ))
+
+
+def minuto_llegada(rng):
+    """Minutos desde la medianoche del día de negocio: picos de almuerzo y cena, algo de madrugada"""
+    r = rng.random()
+    if r < 0.42:
+        minuto = rng.gauss(12.75 * 60, 50)
+    elif r < 0.9:
+        minuto = rng.gauss(19.75 * 60, 80)
+    else:
+        minuto = rng.uniform(22 * 60, 26.8 * 60)  # Hasta las 02:48 del día siguiente
+    return min(max(minuto, 11 * 60), 26.9 * 60)
+
+
+def cantidad_del_dia(rng, promedio):
+    """Cantidad aproximadamente Poisson alrededor del promedio"""
+    return max(0, int(round(rng.gauss(promedio, math.sqrt(promedio))))) if promedio > 0 else 0
+
+
+def preparar_catalogos(num_mesas, num_meseros):
+    """Menú, mesas y meseros mínimos (con el ORM: son pocas filas)"""
+    if ItemMenu.query.count() == 0:
+        for orden, (categoria_nombre, items) in enumerate(MENU_BASE.items()):
+            categoria = CategoriaMenu(nombre=categoria_nombre, orden=orden)
+            db.session.add(categoria)
+            for i, (nombre, precio) in enumerate(items):
+                db.session.add(ItemMenu(nombre=nombre, precio=precio, categoria=categoria, orden=i))
+
+    numeros = {n for (n,) in db.session.query(Mesa.numero)}
+    for numero in range(1, num_mesas + 1):
+        if numero not in numeros:
+            db.session.add(Mesa(numero=numero, capacidad=4))
+
+    meseros = Usuario.query.filter_by(rol='mesero').count()
+    if meseros < num_meseros:
+        clave = generate_password_hash('mesero123')  # Un solo hash: es lo más lento de crear usuarios
+        existentes = {u for (u,) in db.session.query(Usuario.username)}
+        n = 1
+        while meseros < num_meseros:
+            username = f'mesero_gen{n}'
+            n += 1
+            if username in existentes:
+                continue
+            db.session.add(Usuario(username=username, nombre=f'Mesero {username[6:]}', rol='mesero',
+                                   password_hash=clave))
+            meseros += 1
+    db.session.commit()
+
+
+class GeneradorDatos:
+    def __init__(self, rng, insertador, sesiones_dia, hoy):
+        self.rng = rng
+        self.ins = insertador
+        self.sesiones_dia = sesiones_dia
+        self.hoy = hoy
+        self.numero_factura = siguiente_numero_factura()
+        self.menu = [(i.id, i.nombre, i.precio) for i in ItemMenu.query.order_by(ItemMenu.id)]
+        # Popularidad tipo Zipf: unos pocos platos concentran la mayoría de pedidos
+        self.pesos_menu = [1 / (k + 1) ** 0.8 for k in range(len(self.menu))]
+        rng.shuffle(self.pesos_menu)
+        self.mesas = [(m.id, m.numero) for m in Mesa.query.order_by(Mesa.numero)]
+        self.meseros = [u for (u,) in db.session.query(Usuario.id).filter(Usuario.rol.in_(['mesero', 'admin']))]
+        self.admin_id = db.session.query(Usuario.id).filter_by(rol='admin').order_by(Usuario.id).scalar() \
+            or self.meseros[0]
+        self.categorias_gasto = {c.nombre: c.id for c in CategoriaGasto.query}
+
+    # ------------------------------------------------------------------
+    # Facturas y pagos
+    # ------------------------------------------------------------------
+
+    def metodo_pago(self):
+        r, acumulado = self.rng.random(), 0
+        for metodo, peso in METODOS_PAGO:
+            acumulado += peso
+            if r < acumulado:
+                return metodo
+        return 'efectivo'
+
+    def facturar(self, total_base, fecha, sesion_id=None, cliente='Cliente General', permite_credito=True):
+        """Factura + filas de Pago. Devuelve (factura_id, total)"""
+        propina = round(total_base * 0.1) if self.rng.random() < 0.4 else 0
+        total = total_base + propina
+        metodo = self.metodo_pago()
+        estado, fecha_pago, vencimiento, saldo = 'pagada', fecha, None, 0
+        pagos = []
+
+        if permite_credito and self.rng.random() < 0.04:
+            # Cuenta por cobrar: vence en 15-30 días; si ya venció, casi siempre se pagó tarde
+            vencimiento = (fecha + timedelta(days=self.rng.choice([15, 30]))).date()
+            if vencimiento < self.hoy.date() and self.rng.random() < 0.75:
+                fecha_pago = fecha + timedelta(days=self.rng.randint(5, 45), hours=self.rng.randint(0, 8))
+                fecha_pago = min(fecha_pago, self.hoy - timedelta(hours=1))
+                pagos.append((metodo if metodo != 'mixto' else 'transferencia', total, 'abono', fecha_pago))
+            else:
+                estado = 'vencida' if vencimiento < self.hoy.date() else 'pendiente'
+                fecha_pago = None
+                saldo = total
+                if self.rng.random() < 0.3:
+                    abono = round(total * self.rng.uniform(0.3, 0.6))
+                    pagos.append(('transferencia', abono, 'abono', fecha + timedelta(days=self.rng.randint(1, 10))))
+                    saldo = total - abono
+        elif metodo == 'mixto':
+            efectivo, tarjeta = repartir_monto(total, [self.rng.randint(3, 7), 10])
+            pagos += [('efectivo', efectivo, 'pago', fecha), ('tarjeta', tarjeta, 'pago', fecha)]
+        else:
+            pagos.append((metodo, total, 'pago', fecha))
+
+        factura_id = self.ins.agregar(
+            Factura, numero_consecutivo=f"FACT-{self.numero_factura:06d}", sesion_id=sesion_id,
+            subtotal=total_base, iva=0, propina=propina, total=total, metodo_pago=metodo, desglose_pago=None,
+            cliente_nombre=cliente, cliente_documento='', notas=None, estado_pago=estado,
+            fecha_vencimiento=vencimiento, fecha_pago_real=fecha_pago, saldo_pendiente=saldo,
+            fecha_emision=fecha, division=None
+        )
+        self.numero_factura += 1
+        for metodo_pago, monto, tipo, fecha_abono in pagos:
+            self.ins.agregar(Pago, factura_id=factura_id, metodo=metodo_pago, monto=monto, tipo=tipo,
+                             fecha=fecha_abono, usuario_id=self.admin_id)
+        return factura_id, total
+
+    def platos(self, cantidad):
+        return self.rng.choices(self.menu, weights=self.pesos_menu, k=cantidad)
+
+    # ------------------------------------------------------------------
+    # Mesas
+    # ------------------------------------------------------------------
+
+    def sesion(self, inicio, abierta=False, mesa=None):
+        mesa_id = mesa or self.rng.choice(self.mesas)[0]
+        mesero_id = self.rng.choice(self.meseros)
+        duracion = timedelta(minutes=self.rng.randint(35, 120))
+        sesion_id = self.ins.siguiente[Sesion]
+        pedidos = []
+        for item_id, nombre, precio in self.platos(self.rng.choice([1, 2, 2, 3, 3, 4, 5, 6, 8])):
+            fecha = inicio + timedelta(minutes=self.rng.uniform(0, duracion.total_seconds() / 60 * 0.6))
+            pedidos.append((fecha, nombre, self.rng.choice([1, 1, 1, 2, 2, 3, 4]), precio))
+        subtotal = sum(cantidad * precio for _, _, cantidad, precio in pedidos)
+
+        total = 0
+        if not abierta:
+            _, total = self.facturar(subtotal, inicio + duracion, sesion_id=sesion_id)
+        self.ins.agregar(Sesion, mesa_id=mesa_id, fecha_inicio=inicio,
+                         fecha_fin=None if abierta else inicio + duracion, total=total, activa=abierta,
+                         subtotal=subtotal, pagado=0 if abierta else subtotal, pendiente=subtotal if abierta else 0)
+
+        for fecha, nombre, cantidad, precio in pedidos:
+            if abierta:
+                estado = self.rng.choice(['pendiente', 'pendiente', 'preparando', 'listo', 'entregado'])
+            else:
+                estado = 'entregado'
+            self.ins.agregar(Pedido, fecha=fecha, mesa_id=mesa_id, sesion_id=sesion_id, mesero_id=mesero_id,
+                             producto=nombre, cantidad=cantidad, precio_unitario=precio,
+                             notas='Sin cebolla' if self.rng.random() < 0.05 else None, estado=estado,
+                             pagado=not abierta, factura_id=None,
+                             estado_actualizado=fecha + timedelta(minutes=self.rng.randint(5, 25)))
+
+    # ------------------------------------------------------------------
+    # Domicilios
+    # ------------------------------------------------------------------
+
+    def domicilio(self, fecha, estado=None):
+        barrio, costo_envio = self.rng.choice(BARRIOS)
+        cliente = f"{self.rng.choice(NOMBRES)} {self.rng.choice(APELLIDOS)}"
+        items = [(item_id, nombre, self.rng.choice([1, 1, 2, 3]), precio)
+                 for item_id, nombre, precio in self.platos(self.rng.choice([1, 2, 2, 3, 4]))]
+        subtotal = sum(cantidad * precio for _, _, cantidad, precio in items)
+        if estado is None:
+            estado = EstadoDomicilio.CANCELADO if self.rng.random() < 0.06 else EstadoDomicilio.ENTREGADO
+        entregado = estado == EstadoDomicilio.ENTREGADO
+
+        factura_id, total = None, subtotal + costo_envio
+        if entregado:
+            factura_id, total = self.facturar(subtotal + costo_envio, fecha + timedelta(minutes=45),
+                                              cliente=cliente, permite_credito=False)
+        domicilio_id = self.ins.agregar(
+            Domicilio, cliente_nombre=cliente, cliente_telefono=f"3{self.rng.randint(100000000, 199999999)}",
+            cliente_direccion=f"Calle {self.rng.randint(1, 120)} #{self.rng.randint(1, 90)}-{self.rng.randint(1, 99)}",
+            cliente_barrio=barrio, cliente_referencias=None, fecha_pedido=fecha,
+            fecha_entrega_estimada=fecha + timedelta(minutes=40),
+            fecha_entrega_real=fecha + timedelta(minutes=self.rng.randint(25, 75)) if entregado else None,
+            estado=estado, subtotal=subtotal, costo_domicilio=costo_envio, propina=total - subtotal - costo_envio,
+            total=total, metodo_pago='efectivo', pagado=entregado, tomado_por_id=self.rng.choice(self.meseros),
+            repartidor_id=self.rng.choice(self.meseros) if estado in (EstadoDomicilio.ENTREGADO,
+                                                                      EstadoDomicilio.EN_CAMINO) else None,
+            factura_id=factura_id, notas=None,
+            notas_cancelacion='Cliente canceló' if estado == EstadoDomicilio.CANCELADO else None,
+            estado_actualizado=fecha + timedelta(minutes=30)
+        )
+        for item_id, nombre, cantidad, precio in items:
+            self.ins.agregar(ItemDomicilio, domicilio_id=domicilio_id, item_menu_id=item_id,
+                             producto_nombre=nombre, cantidad=cantidad, precio_unitario=precio, notas=None,
+                             estado_cocina='listo' if estado not in (EstadoDomicilio.PENDIENTE,
+                                                                     EstadoDomicilio.PREPARANDO) else 'pendiente')
+
+    # ------------------------------------------------------------------
+    # Gastos, presupuestos y consumo interno
+    # ------------------------------------------------------------------
+
+    def gasto(self, categoria, concepto, monto, fecha):
+        categoria_id = self.categorias_gasto.get(categoria) or next(iter(self.categorias_gasto.values()))
+        estado, vencimiento, fecha_pago = 'pagado', None, fecha
+        if self.rng.random() < 0.12:
+            # A crédito con el proveedor
+            vencimiento = (fecha + timedelta(days=30)).date()
+            if vencimiento >= self.hoy.date():
+                estado, fecha_pago = 'pendiente', None
+            elif self.rng.random() < 0.1:
+                estado, fecha_pago = 'vencido', None
+            else:
+                fecha_pago = fecha + timedelta(days=self.rng.randint(20, 35))
+        self.ins.agregar(Gasto, fecha=fecha, concepto=concepto, monto=round(monto, -2), categoria_id=categoria_id,
+                         proveedor_id=None, usuario_id=self.admin_id,
+                         metodo_pago=self.rng.choice(['efectivo', 'efectivo', 'transferencia']),
+                         numero_factura=None, notas=None, archivo_adjunto=None, aprobado=True,
+                         fecha_aprobacion=fecha, aprobado_por_id=self.admin_id, estado_pago=estado,
+                         fecha_vencimiento=vencimiento, fecha_pago_real=fecha_pago)
+
+    def gastos_del_dia(self, dia, factor):
+        for categoria, conceptos, base in GASTOS_DIARIOS:
+            for _ in range(self.rng.randint(1, 3)):
+                self.gasto(categoria, self.rng.choice(conceptos), base * factor * self.rng.uniform(0.3, 0.8),
+                           dia.replace(hour=self.rng.randint(7, 11), minute=self.rng.randint(0, 59)))
+        for categoria, concepto, monto, dia_mes in GASTOS_MENSUALES:
+            if dia.day == dia_mes:
+                self.gasto(categoria, concepto, monto * self.rng.uniform(0.95, 1.05), dia.replace(hour=9))
+
+        if dia.day == 1:
+            for categoria, monto in [('Ingredientes y Materia Prima', 9000000), ('Servicios Públicos', 1900000),
+                                     ('Mantenimiento y Reparaciones', 1200000)]:
+                if categoria in self.categorias_gasto:
+                    self.ins.agregar(Presupuesto, categoria_id=self.categorias_gasto[categoria],
+                                     monto_limite=monto * self.sesiones_dia / 60, periodo='mensual', mes=dia.month,
+                                     anio=dia.year, activo=True, fecha_creacion=dia, alerta_porcentaje=80)
+
+        for _ in range(self.rng.choice([0, 0, 1, 1, 2, 3])):
+            item_id, nombre, precio = self.rng.choice(self.menu)
+            self.ins.agregar(ConsumoInterno, item_id=item_id, cantidad=self.rng.randint(1, 3),
+                             costo=round(precio * 0.35, -2),
+                             fecha=dia.replace(hour=self.rng.randint(11, 22), minute=self.rng.randint(0, 59)),
+                             usuario_id=self.admin_id, notas='Almuerzo de personal')
+
+    # ------------------------------------------------------------------
+    # Días completos
+    # ------------------------------------------------------------------
+
+    def dia(self, dia, crecimiento):
+        """Un día de negocio cerrado (dia a medianoche; el día corre de 03:00 a 03:00)"""
+        factor = FACTOR_DIA_SEMANA[dia.weekday()] * crecimiento
+        for _ in range(cantidad_del_dia(self.rng, self.sesiones_dia * factor)):
+            self.sesion(dia + timedelta(minutes=minuto_llegada(self.rng)))
+            self.ins.revisar()
+        for _ in range(cantidad_del_dia(self.rng, self.sesiones_dia * 0.35 * factor)):
+            self.domicilio(dia + timedelta(minutes=minuto_llegada(self.rng)))
+            self.ins.revisar()
+        self.gastos_del_dia(dia, factor)
+        self.ins.revisar()
+
+    def turno_en_curso(self, abiertas):
+        """Mesas con la cuenta abierta y domicilios en curso en este momento"""
+        ocupadas = {m for (m,) in db.session.query(Sesion.mesa_id).filter(Sesion.activa == True)}
+        libres = [mesa_id for mesa_id, _ in self.mesas if mesa_id not in ocupadas]
+        for mesa_id in self.rng.sample(libres, min(abiertas, len(libres))):
+            self.sesion(self.hoy - timedelta(minutes=self.rng.randint(5, 90)), abierta=True, mesa=mesa_id)
+        estados = [EstadoDomicilio.PENDIENTE, EstadoDomicilio.PREPARANDO, EstadoDomicilio.LISTO,
+                   EstadoDomicilio.EN_CAMINO]
+        for _ in range(max(1, abiertas // 2)):
+            self.domicilio(self.hoy - timedelta(minutes=self.rng.randint(5, 50)), estado=self.rng.choice(estados))
+
+
+def generar_datos(dias=90, sesiones_dia=60, abiertas=6, mesas=20, meseros=6, semilla=1, lote=5000):
+    with app.app_context():
+        print("\n" + "="*60)
+        print("  GENERADOR DE DATOS SINTÉTICOS")
+        print("="*60 + "\n")
+        inicio_reloj = time.perf_counter()
+
+        preparar_catalogos(mesas, meseros)
+        rng = random.Random(semilla)
+        insertador = Insertador(lote)
+        hoy = datetime.now().replace(microsecond=0)
+        generador = GeneradorDatos(rng, insertador, sesiones_dia, hoy)
+
+        # Días de negocio ya cerrados: desde hace `dias` hasta ayer (el de hoy sigue abierto)
+        hoy_negocio = (hoy - timedelta(hours=3)).replace(hour=0, minute=0, second=0)
+        for n in range(dias, 0, -1):
+            dia = hoy_negocio - timedelta(days=n)
+            generador.dia(dia, crecimiento=1 + 0.15 * (dias - n) / max(dias, 1))  # El negocio crece con el tiempo
+            if n % 30 == 0:
+                print(f"  ... {dia:%Y-%m-%d} ({dias - n}/{dias} días)")
+        if abiertas:
+            generador.turno_en_curso(abiertas)
+        insertador.vaciar()
+        insertador.ajustar_secuencias()
+
+        total = sum(insertador.total.values())
+        for modelo in ORDEN_TABLAS:
+            print(f"  {modelo.__tablename__:<16} {insertador.total[modelo]:>10,}")
+        segundos = time.perf_counter() - inicio_reloj
+        print(f"\n✅ {total:,} filas en {segundos:.1f} s ({total / max(segundos, 0.001):,.0f} filas/s)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Genera días de restaurante sintéticos para benchmarks")
+    parser.add_argument('--dias', type=int, default=90, help='Días de historia hacia atrás (1095 = tres años)')
+    parser.add_argument('--sesiones-dia', type=float, default=60, help='Mesas atendidas en un día promedio')
+    parser.add_argument('--abiertas', type=int, default=6, help='Mesas con cuenta abierta ahora mismo')
+    parser.add_argument('--mesas', type=int, default=20)
+    parser.add_argument('--meseros', type=int, default=6)
+    parser.add_argument('--semilla', type=int, default=1)
+    parser.add_argument('--lote', type=int, default=5000, help='Filas por executemany')
+    args = parser.parse_args()
+    generar_datos(args.dias, args.sesiones_dia, args.abiertas, args.mesas, args.meseros, args.semilla, args.lote)
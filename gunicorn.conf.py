@@ -0,0 +1,27 @@
+"""
+Configuración de gunicorn (la lee solo desde la raíz del proyecto; las
+opciones de la línea de comandos del Procfile tienen prioridad).
+
+Reciclado de workers: con GUNICORN_MAX_REQUESTS cada worker se reinicia
+después de ese número de solicitudes (más un jitter aleatorio para que no se
+reinicien todos a la vez). Si no está definido se usa la recomendación que
+`flask --app app memoria` calcula con el crecimiento medido (MEMORIA=1, ver
+/admin/memoria); sin ninguna de las dos los workers no se reciclan.
+"""
+
+import json
+import os
+
+_recomendacion = {}
+_archivo = os.path.join(os.environ.get('MEMORIA_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                   'instance', 'memoria')), 'recomendacion.json')
+if os.path.exists(_archivo):
+    try:
+        with open(_archivo, encoding='utf-8') as archivo:
+            _recomendacion = json.load(archivo)
+    except (OSError, ValueError):
+        pass
+
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', _recomendacion.get('max_requests', 0)))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER',
+                                         _recomendacion.get('max_requests_jitter', max_requests // 10)))
@@ -0,0 +1,81 @@
+"""
+Impresora térmica falsa para probar el spooler sin hardware: escucha en
+TCP (9100 por defecto), guarda cada trabajo recibido como .bin y muestra
+una vista previa en texto sin los comandos ESC/POS.
+Ejecutar: python impresora_falsa.py [--puerto 9100] [--carpeta impresiones] [--apagada 10]
+
+Con --apagada N no acepta conexiones durante los primeros N segundos
+(como una impresora apagada), para ver los reintentos del spooler.
+Luego apuntar el spooler a ella:
+    IMPRESORA_CAJA=127.0.0.1:9100 flask --app app spooler
+"""
+
+import argparse
+import os
+import re
+import socket
+import time
+from datetime import datetime
+
+# ESC/GS + comando + parámetros usados por TicketEscPos (ver app.py)
+COMANDOS_ESCPOS = re.compile(rb'\x1b[@]|\x1b[taEd].|\x1bp...|\x1d!.|\x1dV..', re.DOTALL)
+
+
+def vista_previa(datos):
+    """Texto legible del ticket, sin los bytes de control"""
+    texto = COMANDOS_ESCPOS.sub(b'', datos).decode('cp850', errors='replace')
+    marcas = []
+    if b'\x1bp' in datos:
+        marcas.append('[abre cajón]')
+    if b'\x1dV' in datos:
+        marcas.append('[corte]')
+    return texto.rstrip() + ('\n' + ' '.join(marcas) if marcas else '')
+
+
+def impresora_falsa(host='127.0.0.1', puerto=9100, carpeta='impresiones', apagada=0):
+    os.makedirs(carpeta, exist_ok=True)
+    if apagada:
+        print(f"💤 Impresora apagada durante {apagada} s")
+        time.sleep(apagada)
+
+    servidor = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    servidor.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    servidor.bind((host, puerto))
+    servidor.listen()
+    print(f"🖨️  Impresora falsa escuchando en {host}:{puerto} (guardando en {carpeta}/)")
+
+    recibidos = 0
+    try:
+        while True:
+            conexion, _ = servidor.accept()
+            with conexion:
+                partes = []
+                while True:
+                    bloque = conexion.recv(65536)
+                    if not bloque:
+                        break
+                    partes.append(bloque)
+            datos = b''.join(partes)
+            recibidos += 1
+            nombre = os.path.join(carpeta, f"{datetime.now():%Y%m%d_%H%M%S}_{recibidos:04d}.bin")
+            with open(nombre, 'wb') as archivo:
+                archivo.write(datos)
+
+            print("\n" + "="*60)
+            print(f"  TRABAJO #{recibidos} ({len(datos)} bytes) → {nombre}")
+            print("="*60)
+            print(vista_previa(datos))
+    except KeyboardInterrupt:
+        print(f"\n📊 Trabajos recibidos: {recibidos}")
+    finally:
+        servidor.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Impresora ESC/POS falsa por TCP")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--puerto', type=int, default=9100)
+    parser.add_argument('--carpeta', default='impresiones')
+    parser.add_argument('--apagada', type=float, default=0, help='Segundos sin aceptar conexiones al iniciar')
+    args = parser.parse_args()
+    impresora_falsa(args.host, args.puerto, args.carpeta, args.apagada)
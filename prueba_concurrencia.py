@@ -0,0 +1,245 @@
+"""
+Prueba de estrés de los candados de mesa y de la numeración de facturas:
+varios meseros y cajeros golpean la app a la vez (gunicorn con varios
+workers e hilos) y al final se revisa en la base que todo cuadre.
+Ejecutar: python prueba_concurrencia.py [--workers 3] [--meseros 8] [--rondas 5]
+                                        [--database-url postgresql://.../prueba]
+
+Escenarios:
+- mesa_nueva:    --meseros clientes agregan un pedido a la misma mesa libre
+                 en el mismo instante → una sola sesión activa con todos los pedidos.
+- facturar:      mientras los meseros siguen agregando pedidos, un cajero factura
+                 la sesión → la factura cobra exactamente los pedidos de su
+                 sesión; los que llegan después abren una sesión nueva.
+- numeracion:    un cajero por mesa factura todas las mesas a la vez →
+                 consecutivos únicos y ningún error 500.
+
+Al final se verifican los totales acumulados de cada sesión contra sus pedidos.
+Sin --database-url crea una base SQLite temporal; con Postgres usar una base
+de pruebas recién creada (`createdb prueba`): la prueba la llena con datos.
+Termina con código 1 si encuentra alguna inconsistencia.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+from collections import Counter
+
+from benchmark_rutas import ClienteHttp, DIRECTORIO, USUARIOS, esperar_puerto, puerto_libre
+
+TOLERANCIA = 0.01
+
+
+class Servidor:
+    """Base de pruebas migrada y sembrada + gunicorn local sobre ella"""
+
+    def __init__(self, database_url=None, workers=3):
+        self.temporal = None
+        if not database_url:
+            self.temporal = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+            self.temporal.close()
+            database_url = 'sqlite:///' + self.temporal.name
+        self.database_url = database_url
+        self.workers = workers
+        self.proceso = None
+        self.base = None
+
+    def __enter__(self):
+        entorno = dict(os.environ, DATABASE_URL=self.database_url)
+        entorno.pop('GRABAR_TRAFICO', None)
+        for comando in ('migrate', 'seed'):
+            subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', comando], cwd=DIRECTORIO, env=entorno,
+                           check=True, stdout=subprocess.DEVNULL)
+        puerto = puerto_libre()
+        self.proceso = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '--workers', str(self.workers), '--threads', '4',
+             '--worker-class', 'gthread', '--bind', f'127.0.0.1:{puerto}', '--log-level', 'warning', 'app:app'],
+            cwd=DIRECTORIO, env=entorno)
+        esperar_puerto(puerto)
+        self.base = f'http://127.0.0.1:{puerto}'
+        return self
+
+    def __exit__(self, *args):
+        if self.proceso:
+            self.proceso.terminate()
+            self.proceso.wait(timeout=10)
+        if self.temporal:
+            os.unlink(self.temporal.name)
+
+    def cliente(self, usuario):
+        cliente = ClienteHttp(self.base)
+        cliente.abrir('/', 'POST', {'username': usuario, 'password': USUARIOS[usuario]})
+        return cliente
+
+
+def a_la_vez(tareas):
+    """Ejecuta las funciones en hilos que arrancan juntos (barrera) y devuelve sus resultados"""
+    barrera = threading.Barrier(len(tareas))
+    resultados = [None] * len(tareas)
+
+    def correr(i, tarea):
+        barrera.wait()
+        resultados[i] = tarea()
+
+    hilos = [threading.Thread(target=correr, args=(i, tarea)) for i, tarea in enumerate(tareas)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    return resultados
+
+
+def abrir_app(database_url):
+    """Importa app.py apuntando a la base de la prueba (para revisar los datos)"""
+    os.environ['DATABASE_URL'] = database_url
+    sys.path.insert(0, DIRECTORIO)
+    import app as modulo
+    return modulo
+
+
+class Prueba:
+    def __init__(self, servidor, modulo, meseros, rondas):
+        self.servidor = servidor
+        self.m = modulo
+        self.meseros = [servidor.cliente('mesero1') for _ in range(meseros)]
+        self.cajero = servidor.cliente('admin')
+        self.rondas = rondas
+        self.fallas = []
+        self.errores_http = Counter()
+
+    def fallar(self, mensaje):
+        self.fallas.append(mensaje)
+        print(f"   ❌ {mensaje}")
+
+    def post(self, cliente, url, datos):
+        estado = cliente.abrir(url, 'POST', datos)
+        if estado >= 500:
+            self.errores_http[url.split('/')[1]] += 1
+        return estado
+
+    def pedido(self, cliente, mesa_id, producto='Prueba', precio=1000):
+        return lambda: self.post(cliente, f'/nuevo_pedido/{mesa_id}',
+                                 {'producto': producto, 'cantidad': 1, 'precio_unitario': precio})
+
+    def facturar(self, cliente, sesion_id):
+        return lambda: self.post(cliente, f'/facturar_sesion/{sesion_id}',
+                                 {'metodo_pago': 'efectivo', 'estado_pago': 'pagada'})
+
+    def mesas(self):
+        m = self.m
+        with m.app.app_context():
+            return [mesa.id for mesa in m.Mesa.query.order_by(m.Mesa.numero)]
+
+    def sesiones_activas(self, mesa_id):
+        m = self.m
+        with m.app.app_context():
+            return [s.id for s in m.Sesion.query.filter_by(mesa_id=mesa_id, activa=True)]
+
+    def mesa_nueva(self, mesa_id):
+        """Todos los meseros piden a la vez en una mesa sin sesión"""
+        a_la_vez([self.pedido(cliente, mesa_id) for cliente in self.meseros])
+        activas = self.sesiones_activas(mesa_id)
+        if len(activas) != 1:
+            self.fallar(f"mesa {mesa_id}: {len(activas)} sesiones activas tras pedidos simultáneos")
+            return None
+        m = self.m
+        with m.app.app_context():
+            pedidos = m.Pedido.query.filter_by(sesion_id=activas[0]).count()
+        if pedidos != len(self.meseros):
+            self.fallar(f"mesa {mesa_id}: la sesión tiene {pedidos} pedidos de {len(self.meseros)}")
+        return activas[0]
+
+    def facturar_con_pedidos(self, mesa_id, sesion_id):
+        """El cajero factura mientras los meseros siguen pidiendo en la misma mesa"""
+        tareas = [self.pedido(cliente, mesa_id) for cliente in self.meseros]
+        tareas.insert(len(tareas) // 2, self.facturar(self.cajero, sesion_id))
+        a_la_vez(tareas)
+
+    def numeracion(self, sesiones):
+        """Un cajero por mesa, todos facturando en el mismo instante"""
+        cajeros = [self.servidor.cliente('admin') for _ in sesiones]
+        a_la_vez([self.facturar(cajero, sesion_id) for cajero, sesion_id in zip(cajeros, sesiones)])
+
+    def revisar(self):
+        """Invariantes sobre todo lo que quedó en la base"""
+        m = self.m
+        with m.app.app_context():
+            monto = m.Pedido.cantidad * m.Pedido.precio_unitario
+            numeros = Counter(n for (n,) in m.db.session.query(m.Factura.numero_consecutivo))
+            for numero, veces in numeros.items():
+                if veces > 1:
+                    self.fallar(f"consecutivo {numero} repetido {veces} veces")
+
+            for (mesa_id, activas) in m.db.session.query(m.Sesion.mesa_id, m.db.func.count(m.Sesion.id)).filter(
+                    m.Sesion.activa == True).group_by(m.Sesion.mesa_id).having(m.db.func.count(m.Sesion.id) > 1):
+                self.fallar(f"mesa {mesa_id}: {activas} sesiones activas")
+
+            for factura in m.Factura.query.filter(m.Factura.sesion_id.isnot(None)):
+                cobrado = m.db.session.query(m.db.func.coalesce(m.db.func.sum(monto), 0)).filter(
+                    m.Pedido.sesion_id == factura.sesion_id).scalar()
+                sin_pagar = m.Pedido.query.filter_by(sesion_id=factura.sesion_id, pagado=False).count()
+                if abs(cobrado - (factura.subtotal or 0)) > TOLERANCIA or sin_pagar:
+                    self.fallar(f"{factura.numero_consecutivo}: cobra ${factura.subtotal:,.0f} pero la sesión "
+                                f"{factura.sesion_id} suma ${cobrado:,.0f} ({sin_pagar} pedidos sin pagar)")
+                if m.Factura.query.filter_by(sesion_id=factura.sesion_id).count() > 1:
+                    self.fallar(f"sesión {factura.sesion_id} facturada más de una vez")
+
+            for sesion in m.Sesion.query:
+                subtotal = m.db.session.query(m.db.func.coalesce(m.db.func.sum(monto), 0)).filter(
+                    m.Pedido.sesion_id == sesion.id).scalar()
+                if abs(subtotal - (sesion.subtotal or 0)) > TOLERANCIA:
+                    self.fallar(f"sesión {sesion.id}: subtotal acumulado ${sesion.subtotal or 0:,.0f}, "
+                                f"pedidos ${subtotal:,.0f}")
+            return m.Factura.query.count(), m.Pedido.query.count()
+
+    def correr(self):
+        mesas = self.mesas()
+        for ronda in range(1, self.rondas + 1):
+            print(f"🔁 Ronda {ronda}/{self.rondas}")
+            sesiones = []
+            for mesa_id in mesas:
+                sesion_id = self.mesa_nueva(mesa_id)
+                if sesion_id:
+                    sesiones.append((mesa_id, sesion_id))
+            # La mitad de las mesas se factura con pedidos entrando; el resto, todas a la vez
+            mitad = len(sesiones) // 2
+            for mesa_id, sesion_id in sesiones[:mitad]:
+                self.facturar_con_pedidos(mesa_id, sesion_id)
+            restantes = [s for _, s in sesiones[mitad:]]
+            restantes += [s for mesa_id, _ in sesiones[:mitad] for s in self.sesiones_activas(mesa_id)]
+            self.numeracion(restantes)
+        facturas, pedidos = self.revisar()
+        for ruta, veces in self.errores_http.items():
+            self.fallar(f"{veces} respuestas 5xx en /{ruta}")
+        return facturas, pedidos
+
+
+def prueba_concurrencia(database_url=None, workers=3, meseros=8, rondas=5):
+    print("\n" + "="*60)
+    print("  PRUEBA DE CONCURRENCIA: MESAS Y FACTURACIÓN")
+    print("="*60 + "\n")
+    with Servidor(database_url, workers) as servidor:
+        print(f"🚀 gunicorn con {workers} workers sobre {servidor.database_url.split('@')[-1]}")
+        prueba = Prueba(servidor, abrir_app(servidor.database_url), meseros, rondas)
+        facturas, pedidos = prueba.correr()
+
+    print("\n" + "="*60)
+    if prueba.fallas:
+        print(f"❌ {len(prueba.fallas)} inconsistencias ({facturas} facturas, {pedidos} pedidos)")
+    else:
+        print(f"✅ Sin inconsistencias: {facturas} facturas y {pedidos} pedidos")
+    print("="*60 + "\n")
+    return len(prueba.fallas)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prueba de estrés de candados de mesa y numeración de facturas")
+    parser.add_argument('--database-url', help='Base de pruebas (por defecto una SQLite temporal)')
+    parser.add_argument('--workers', type=int, default=3, help='Workers de gunicorn')
+    parser.add_argument('--meseros', type=int, default=8, help='Clientes que piden a la vez en cada mesa')
+    parser.add_argument('--rondas', type=int, default=5, help='Veces que se repiten los escenarios')
+    args = parser.parse_args()
+    sys.exit(1 if prueba_concurrencia(args.database_url, args.workers, args.meseros, args.rondas) else 0)
@@ -0,0 +1,138 @@
+"""
+Prueba de las claves de idempotencia con envíos duplicados simultáneos
+(doble toque, reintentos de celulares lentos) contra un gunicorn real.
+Ejecutar: python prueba_idempotencia.py [--workers 3] [--duplicados 8] [--rondas 3]
+                                        [--database-url postgresql://.../prueba]
+
+En cada ronda:
+- facturar_sesion:        --duplicados POST simultáneos con la misma clave →
+                          una sola factura y la misma respuesta para todos.
+- marcar_factura_pagada:  --duplicados abonos simultáneos con la misma clave
+                          sobre una factura pendiente → un solo abono y el
+                          saldo rebajado una vez.
+Sin --database-url crea una base SQLite temporal (ver prueba_concurrencia.py).
+Termina con código 1 si encuentra algún duplicado o respuestas distintas.
+"""
+
+import argparse
+import sys
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+
+from prueba_concurrencia import Servidor, a_la_vez, abrir_app
+
+ABONO = 5000
+PRECIO = 12000
+
+
+def post_con_ubicacion(cliente, url, datos):
+    """(código, Location) de un POST sin seguir la redirección"""
+    solicitud = urllib.request.Request(cliente.base + url, data=urllib.parse.urlencode(datos).encode(),
+                                       method='POST')
+    try:
+        with cliente.opener.open(solicitud, timeout=60) as respuesta:
+            return respuesta.status, respuesta.headers.get('Location')
+    except urllib.error.HTTPError as e:
+        return e.code, e.headers.get('Location')
+    except OSError:
+        return 599, None
+
+
+class Prueba:
+    def __init__(self, servidor, modulo, duplicados):
+        self.servidor = servidor
+        self.m = modulo
+        self.mesero = servidor.cliente('mesero1')
+        self.cajeros = [servidor.cliente('admin') for _ in range(duplicados)]
+        self.fallas = []
+
+    def fallar(self, mensaje):
+        self.fallas.append(mensaje)
+        print(f"   ❌ {mensaje}")
+
+    def duplicar(self, url, datos):
+        """Mismo POST y misma clave desde todos los cajeros a la vez; devuelve las respuestas"""
+        datos = dict(datos, idempotency_key=uuid.uuid4().hex)
+        return a_la_vez([lambda c=cajero: post_con_ubicacion(c, url, datos) for cajero in self.cajeros])
+
+    def revisar_respuestas(self, nombre, respuestas):
+        distintas = set(respuestas)
+        if len(distintas) != 1:
+            self.fallar(f"{nombre}: respuestas distintas {sorted(distintas, key=str)}")
+        elif respuestas[0][0] >= 400:
+            self.fallar(f"{nombre}: todas las respuestas fallaron con {respuestas[0][0]}")
+
+    def sesion_con_pedidos(self, mesa_id):
+        for _ in range(2):
+            self.mesero.abrir(f'/nuevo_pedido/{mesa_id}', 'POST',
+                              {'producto': 'Prueba', 'cantidad': 1, 'precio_unitario': PRECIO})
+        m = self.m
+        with m.app.app_context():
+            return m.Sesion.query.filter_by(mesa_id=mesa_id, activa=True).one().id
+
+    def facturar_sesion(self, mesa_id):
+        m = self.m
+        sesion_id = self.sesion_con_pedidos(mesa_id)
+        respuestas = self.duplicar(f'/facturar_sesion/{sesion_id}', {'metodo_pago': 'efectivo', 'estado_pago': 'pagada'})
+        self.revisar_respuestas('facturar_sesion', respuestas)
+        with m.app.app_context():
+            facturas = m.Factura.query.filter_by(sesion_id=sesion_id).count()
+        if facturas != 1:
+            self.fallar(f"facturar_sesion: la sesión {sesion_id} quedó con {facturas} facturas")
+
+    def abonar(self, mesa_id):
+        m = self.m
+        sesion_id = self.sesion_con_pedidos(mesa_id)
+        self.cajeros[0].abrir(f'/facturar_sesion/{sesion_id}', 'POST',
+                              {'metodo_pago': 'efectivo', 'estado_pago': 'pendiente'})
+        with m.app.app_context():
+            factura = m.Factura.query.filter_by(sesion_id=sesion_id).one()
+            factura_id, saldo = factura.id, factura.saldo_pendiente
+        respuestas = self.duplicar(f'/marcar_factura_pagada/{factura_id}',
+                                   {'monto_pago': ABONO, 'metodo_pago': 'efectivo'})
+        self.revisar_respuestas('marcar_factura_pagada', respuestas)
+        with m.app.app_context():
+            abonos = m.Pago.query.filter_by(factura_id=factura_id, tipo='abono').count()
+            nuevo_saldo = m.db.session.get(m.Factura, factura_id).saldo_pendiente
+        if abonos != 1 or abs(nuevo_saldo - (saldo - ABONO)) > 0.01:
+            self.fallar(f"marcar_factura_pagada: factura {factura_id} con {abonos} abonos, "
+                        f"saldo ${saldo:,.0f} → ${nuevo_saldo:,.0f}")
+
+    def correr(self, rondas):
+        m = self.m
+        with m.app.app_context():
+            mesas = [mesa.id for mesa in m.Mesa.query.order_by(m.Mesa.numero).limit(2)]
+        for ronda in range(1, rondas + 1):
+            print(f"🔁 Ronda {ronda}/{rondas}")
+            self.facturar_sesion(mesas[0])
+            self.abonar(mesas[1])
+
+
+def prueba_idempotencia(database_url=None, workers=3, duplicados=8, rondas=3):
+    print("\n" + "="*60)
+    print("  PRUEBA DE IDEMPOTENCIA: ENVÍOS DUPLICADOS SIMULTÁNEOS")
+    print("="*60 + "\n")
+    with Servidor(database_url, workers) as servidor:
+        print(f"🚀 gunicorn con {workers} workers, {duplicados} envíos por operación")
+        prueba = Prueba(servidor, abrir_app(servidor.database_url), duplicados)
+        prueba.correr(rondas)
+
+    print("\n" + "="*60)
+    if prueba.fallas:
+        print(f"❌ {len(prueba.fallas)} fallas")
+    else:
+        print(f"✅ {rondas * 2} operaciones duplicadas x{duplicados}: un solo efecto y la misma respuesta")
+    print("="*60 + "\n")
+    return len(prueba.fallas)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prueba de idempotencia con envíos duplicados simultáneos")
+    parser.add_argument('--database-url', help='Base de pruebas (por defecto una SQLite temporal)')
+    parser.add_argument('--workers', type=int, default=3, help='Workers de gunicorn')
+    parser.add_argument('--duplicados', type=int, default=8, help='Envíos simultáneos con la misma clave')
+    parser.add_argument('--rondas', type=int, default=3)
+    args = parser.parse_args()
+    sys.exit(1 if prueba_idempotencia(args.database_url, args.workers, args.duplicados, args.rondas) else 0)
@@ -0,0 +1,202 @@
+"""
+Prueba automática del spooler de impresión contra impresora_falsa.py
+(sin hardware): arranca la impresora falsa en un puerto libre, encola
+trabajos en una base SQLite temporal y revisa los bytes que llegaron.
+Ejecutar: python prueba_impresora.py [--limite 30]
+
+Escenarios:
+- entrega:     se imprime dos veces una factura pagada en efectivo → la
+               impresora recibe exactamente los bytes de cada trabajo, en orden;
+               solo la primera impresión abre el cajón.
+- reintentos:  la impresora arranca con --apagada → el primer envío falla,
+               el trabajo vuelve a la cola y se entrega cuando la impresora enciende.
+Termina con código 1 si alguna verificación falla.
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmark_rutas import DIRECTORIO, USUARIOS, puerto_libre
+from prueba_concurrencia import abrir_app
+
+CAJON = b'\x1bp'
+PRECIO = 15000
+
+
+class ImpresoraFalsa:
+    """impresora_falsa.py en un subproceso, guardando en una carpeta temporal"""
+
+    def __init__(self, apagada=0):
+        self.apagada = apagada
+        self.puerto = puerto_libre()
+        self.carpeta = tempfile.mkdtemp(prefix='impresora_')
+        self.salida = os.path.join(self.carpeta, 'salida.log')
+        self.proceso = None
+
+    def __enter__(self):
+        with open(self.salida, 'w') as salida:
+            self.proceso = subprocess.Popen(
+                [sys.executable, '-u', os.path.join(DIRECTORIO, 'impresora_falsa.py'), '--puerto', str(self.puerto),
+                 '--carpeta', os.path.join(self.carpeta, 'trabajos'), '--apagada', str(self.apagada)],
+                stdout=salida, stderr=subprocess.STDOUT)
+        return self
+
+    def __exit__(self, *args):
+        self.proceso.terminate()
+        self.proceso.wait(timeout=10)
+        shutil.rmtree(self.carpeta, ignore_errors=True)
+
+    @property
+    def direccion(self):
+        return f'127.0.0.1:{self.puerto}'
+
+    def esperar_encendida(self, limite=30):
+        """Espera el aviso de escucha sin conectarse (una conexión sería un trabajo vacío)"""
+        fin = time.time() + limite
+        while time.time() < fin:
+            with open(self.salida) as salida:
+                if 'escuchando' in salida.read():
+                    return
+            time.sleep(0.1)
+        raise RuntimeError(f"la impresora falsa no abrió el puerto {self.puerto} en {limite} s")
+
+    def recibidos(self):
+        carpeta = os.path.join(self.carpeta, 'trabajos')
+        if not os.path.isdir(carpeta):
+            return []
+        # Los nombres terminan en el número de trabajo (_0001.bin): ordenar por ese número
+        nombres = sorted(os.listdir(carpeta), key=lambda n: n.rsplit('_', 1)[-1])
+        datos = []
+        for nombre in nombres:
+            with open(os.path.join(carpeta, nombre), 'rb') as archivo:
+                datos.append(archivo.read())
+        return datos
+
+
+class Prueba:
+    def __init__(self, modulo, limite):
+        self.m = modulo
+        self.limite = limite
+        self.fallas = []
+
+    def fallar(self, mensaje):
+        self.fallas.append(mensaje)
+        print(f"   ❌ {mensaje}")
+
+    def vaciar_cola(self, trabajos):
+        """Corre el spooler hasta que los trabajos dejen de estar pendientes o se acabe el tiempo"""
+        m = self.m
+        fin = time.time() + self.limite
+        while time.time() < fin:
+            with m.app.app_context():
+                m.procesar_cola_impresion()
+                estados = [m.db.session.get(m.TrabajoImpresion, t).estado for t in trabajos]
+            if all(estado in ('impreso', 'error') for estado in estados):
+                break
+            time.sleep(0.5)
+        with m.app.app_context():
+            return [(t.estado, t.intentos or 0, t.datos) for t in
+                    (m.db.session.get(m.TrabajoImpresion, i) for i in trabajos)]
+
+    def factura_pagada_en_efectivo(self):
+        """Factura de mesa cobrada en efectivo, creada por las mismas rutas que usa el cajero"""
+        m = self.m
+        cliente = m.app.test_client()
+        cliente.post('/', data={'username': 'admin', 'password': USUARIOS['admin']})
+        with m.app.app_context():
+            mesa_id = m.Mesa.query.order_by(m.Mesa.numero).first().id
+        cliente.post(f'/nuevo_pedido/{mesa_id}', data={'producto': 'Prueba', 'cantidad': 2, 'precio_unitario': PRECIO})
+        with m.app.app_context():
+            sesion_id = m.Sesion.query.filter_by(mesa_id=mesa_id, activa=True).one().id
+        cliente.post(f'/facturar_sesion/{sesion_id}', data={'metodo_pago': 'efectivo', 'estado_pago': 'pagada'})
+        with m.app.app_context():
+            return cliente, m.Factura.query.filter_by(sesion_id=sesion_id).one().id
+
+    def entrega(self):
+        m = self.m
+        print("🖨️  Entrega: factura impresa y reimpresa")
+        cliente, factura_id = self.factura_pagada_en_efectivo()
+        with ImpresoraFalsa() as impresora:
+            m.IMPRESORAS['caja'] = impresora.direccion
+            impresora.esperar_encendida()
+            for _ in range(2):
+                cliente.post(f'/factura/{factura_id}/imprimir')
+            with m.app.app_context():
+                trabajos = [t.id for t in m.TrabajoImpresion.query.filter_by(factura_id=factura_id)
+                            .order_by(m.TrabajoImpresion.id)]
+            if len(trabajos) != 2:
+                self.fallar(f"se esperaban 2 trabajos de la factura {factura_id}, hay {len(trabajos)}")
+                return
+            resultado = self.vaciar_cola(trabajos)
+            recibidos = impresora.recibidos()
+
+        if [estado for estado, _, _ in resultado] != ['impreso', 'impreso']:
+            self.fallar(f"estados de los trabajos: {[estado for estado, _, _ in resultado]}")
+        if recibidos != [datos for _, _, datos in resultado]:
+            self.fallar(f"la impresora recibió {[len(d) for d in recibidos]} bytes, "
+                        f"los trabajos tenían {[len(d) for _, _, d in resultado]}")
+        elif CAJON not in recibidos[0] or CAJON in recibidos[1]:
+            self.fallar("el cajón debe abrirse solo en la primera impresión de la factura")
+        else:
+            print(f"   ✅ {len(recibidos)} trabajos recibidos byte a byte; cajón solo en el primero")
+
+    def reintentos(self, apagada=3):
+        m = self.m
+        print(f"💤 Reintentos: impresora apagada {apagada} s")
+        datos = m.escpos_comanda("MESA 1", [(1, 'Prueba de reintento', 'sin cebolla')])
+        with ImpresoraFalsa(apagada=apagada) as impresora:
+            m.IMPRESORAS['cocina'] = impresora.direccion
+            with m.app.app_context():
+                trabajo = m.encolar_impresion('cocina', datos, 'Prueba de reintento')
+                m.db.session.commit()
+                trabajo_id = trabajo.id
+            [(estado, intentos, _)] = self.vaciar_cola([trabajo_id])
+            recibidos = impresora.recibidos()
+
+        if estado != 'impreso':
+            self.fallar(f"el trabajo quedó '{estado}' tras {intentos} intentos fallidos")
+        elif intentos < 1:
+            self.fallar("el primer envío debía fallar con la impresora apagada")
+        elif recibidos != [datos]:
+            self.fallar(f"la impresora recibió {[len(d) for d in recibidos]} bytes, se enviaron {len(datos)}")
+        else:
+            print(f"   ✅ Entregado después de {intentos} intentos fallidos, bytes idénticos")
+
+
+def prueba_impresora(limite=30):
+    print("\n" + "="*60)
+    print("  PRUEBA DEL SPOOLER CONTRA LA IMPRESORA FALSA")
+    print("="*60 + "\n")
+    temporal = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+    temporal.close()
+    database_url = 'sqlite:///' + temporal.name
+    try:
+        entorno = dict(os.environ, DATABASE_URL=database_url)
+        for comando in ('migrate', 'seed'):
+            subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', comando], cwd=DIRECTORIO, env=entorno,
+                           check=True, stdout=subprocess.DEVNULL)
+        prueba = Prueba(abrir_app(database_url), limite)
+        prueba.entrega()
+        prueba.reintentos()
+    finally:
+        os.unlink(temporal.name)
+
+    print("\n" + "="*60)
+    if prueba.fallas:
+        print(f"❌ {len(prueba.fallas)} fallas")
+    else:
+        print("✅ El spooler entrega los bytes exactos y reintenta con la impresora apagada")
+    print("="*60 + "\n")
+    return len(prueba.fallas)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prueba del spooler de impresión con la impresora falsa")
+    parser.add_argument('--limite', type=float, default=30, help='Segundos máximos para vaciar la cola')
+    args = parser.parse_args()
+    sys.exit(1 if prueba_impresora(args.limite) else 0)
@@ -0,0 +1,261 @@
+"""
+Script para reproducir un día de tráfico grabado (GRABAR_TRAFICO=1, ver
+app.py) contra una copia de la base y comparar la latencia con la original
+o con la reproducción de otro build.
+Ejecutar: python reproducir_trafico.py --dia 2026-10-18 [--velocidad 10] [--copiar-bd]
+                                       [--salida build_nuevo.json] [--comparar build_anterior.json]
+
+- --velocidad 1 respeta los tiempos originales, 10 los comprime diez veces
+  y 0 envía todo lo más rápido posible (con --concurrencia hilos).
+- Sin --url arranca gunicorn (--workers) sobre DATABASE_URL. La reproducción
+  repite también los POST: usar una copia de la base (--copiar-bd la hace
+  para SQLite; en Postgres, `createdb -T produccion copia`).
+- Cada rol se autentica con el usuario de --usuario rol=usuario:clave
+  (por defecto los usuarios sembrados por `flask --app app seed`).
+
+La latencia "original" es la medida dentro del worker al grabar; la
+reproducida se mide en el cliente (incluye cola y red). Para comparar builds,
+reproducir el mismo día con cada uno y usar --comparar.
+"""
+
+import argparse
+import glob
+import json
+import os
+import queue
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import urlencode
+
+from benchmark_rutas import ClienteHttp, DIRECTORIO, commit_actual, esperar_puerto, percentil, puerto_libre
+
+CREDENCIALES = {
+    'admin': ('admin', 'admin123'),
+    'mesero': ('mesero1', 'mesero123'),
+    'cocina': ('cocina', 'cocina123'),
+}
+# El replayer inicia sesión por su cuenta
+ENDPOINTS_OMITIDOS = ('login', 'logout')
+
+
+def cargar_trazas(carpeta, dia):
+    """Trazas de todos los workers de un día, en orden de llegada"""
+    trazas = []
+    for ruta in sorted(glob.glob(os.path.join(carpeta, f"trafico_{dia:%Y%m%d}_*.jsonl"))):
+        with open(ruta, encoding='utf-8') as archivo:
+            for linea in archivo:
+                if linea.strip():
+                    traza = json.loads(linea)
+                    if traza.get('endpoint') not in ENDPOINTS_OMITIDOS:
+                        trazas.append(traza)
+    trazas.sort(key=lambda t: t['t'])
+    return trazas
+
+
+class ClientesPorRol:
+    """Clientes autenticados por rol, repartidos entre los hilos que reproducen"""
+
+    def __init__(self, base, credenciales, por_rol):
+        self.base = base
+        self.credenciales = credenciales
+        self.por_rol = por_rol
+        self.colas = {}
+        self.candado = threading.Lock()
+
+    def _cola(self, rol):
+        with self.candado:
+            if rol not in self.colas:
+                cola = queue.Queue()
+                for _ in range(self.por_rol):
+                    cliente = ClienteHttp(self.base)
+                    if rol in self.credenciales:
+                        usuario, clave = self.credenciales[rol]
+                        cliente.abrir('/', 'POST', {'username': usuario, 'password': clave})
+                    cola.put(cliente)
+                self.colas[rol] = cola
+            return self.colas[rol]
+
+    def usar(self, rol, url, metodo, datos):
+        cola = self._cola(rol)
+        cliente = cola.get()
+        try:
+            inicio = time.perf_counter()
+            estado = cliente.abrir(url, metodo, datos)
+            return estado, time.perf_counter() - inicio
+        finally:
+            cola.put(cliente)
+
+
+def url_de(traza):
+    args = traza.get('args') or {}
+    return traza['ruta'] + ('?' + urlencode(args) if args else '')
+
+
+def reproducir(base, trazas, velocidad, concurrencia, credenciales):
+    """Lanza cada traza en su momento (relativo a la primera) y devuelve [(traza, estado, segundos)]"""
+    clientes = ClientesPorRol(base, credenciales, por_rol=max(2, concurrencia // 2))
+    for rol in {traza.get('rol') for traza in trazas}:
+        clientes.usar(rol, '/dashboard' if rol else '/', 'GET', None)  # Iniciar sesión y calentar los workers
+    resultados = []
+    candado = threading.Lock()
+
+    def ejecutar(traza):
+        estado, segundos = clientes.usar(traza.get('rol'), url_de(traza), traza['metodo'], traza.get('form') or None)
+        with candado:
+            resultados.append((traza, estado, segundos))
+
+    inicio_original = trazas[0]['t']
+    inicio = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrencia) as pool:
+        for n, traza in enumerate(trazas, start=1):
+            if velocidad:
+                espera = (traza['t'] - inicio_original) / velocidad - (time.monotonic() - inicio)
+                if espera > 0:
+                    time.sleep(espera)
+            pool.submit(ejecutar, traza)
+            if n % 1000 == 0:
+                print(f"  ... {n}/{len(trazas)} solicitudes")
+    return resultados
+
+
+def resumir(resultados):
+    """Por endpoint: latencia original vs reproducida y cambios de código de estado"""
+    por_endpoint = {}
+    for traza, estado, segundos in resultados:
+        datos = por_endpoint.setdefault(traza['endpoint'], {'original': [], 'reproducida': [],
+                                                            'errores': 0, 'estado_distinto': 0})
+        datos['original'].append(traza['ms'])
+        datos['reproducida'].append(segundos * 1000)
+        if estado >= 500:
+            datos['errores'] += 1
+        if estado != traza.get('estado'):
+            datos['estado_distinto'] += 1
+
+    resumen = {}
+    for endpoint, datos in sorted(por_endpoint.items(), key=lambda e: -sum(e[1]['reproducida'])):
+        resumen[endpoint] = {
+            'solicitudes': len(datos['original']),
+            'original_p50_ms': round(percentil(datos['original'], 50), 1),
+            'original_p95_ms': round(percentil(datos['original'], 95), 1),
+            'p50_ms': round(percentil(datos['reproducida'], 50), 1),
+            'p95_ms': round(percentil(datos['reproducida'], 95), 1),
+            'errores': datos['errores'],
+            'estado_distinto': datos['estado_distinto'],
+        }
+    return resumen
+
+
+def imprimir(resumen, anterior=None):
+    referencia = 'anterior' if anterior else 'original'
+    print(f"\n{'endpoint':<32}{'n':>7}{referencia + ' p95':>15}{'p95':>9}{'cambio':>9}{'5xx':>6}{'≠estado':>9}")
+    previos = (anterior or {}).get('endpoints', {})
+    for endpoint, datos in resumen.items():
+        if anterior:
+            base = previos.get(endpoint, {}).get('p95_ms')
+        else:
+            base = datos['original_p95_ms']
+        cambio = f"{(datos['p95_ms'] - base) / base * 100:+.0f}%" if base else '-'
+        print(f"{endpoint:<32}{datos['solicitudes']:>7}{base if base is not None else '-':>15}"
+              f"{datos['p95_ms']:>9.1f}{cambio:>9}{datos['errores']:>6}{datos['estado_distinto']:>9}")
+
+
+def copiar_sqlite(entorno):
+    """Copia la base SQLite de DATABASE_URL a un archivo temporal y apunta el entorno a la copia"""
+    url = entorno.get('DATABASE_URL', '')
+    if not url.startswith('sqlite:///'):
+        raise SystemExit("--copiar-bd solo funciona con SQLite; en Postgres crear la copia con createdb -T")
+    temporal = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+    temporal.close()
+    shutil.copyfile(url[len('sqlite:///'):], temporal.name)
+    entorno['DATABASE_URL'] = 'sqlite:///' + temporal.name
+    return temporal.name
+
+
+def reproducir_trafico(dia, carpeta, velocidad=1.0, concurrencia=16, url=None, workers=2, copiar_bd=False,
+                       credenciales=None, salida=None, comparar=None):
+    print("\n" + "="*60)
+    print(f"  REPRODUCCIÓN DE TRÁFICO DEL {dia:%Y-%m-%d}")
+    print("="*60 + "\n")
+    trazas = cargar_trazas(carpeta, dia)
+    if not trazas:
+        print(f"❌ No hay trazas de ese día en {carpeta}")
+        return None
+    duracion = trazas[-1]['t'] - trazas[0]['t']
+    print(f"📼 {len(trazas):,} solicitudes en {duracion / 60:.0f} min "
+          f"(velocidad {velocidad or 'máxima'}x, {concurrencia} hilos)")
+
+    entorno = dict(os.environ)
+    copia = copiar_sqlite(entorno) if copiar_bd else None
+    proceso = None
+    try:
+        if url is None:
+            puerto = puerto_libre()
+            proceso = subprocess.Popen(
+                [sys.executable, '-m', 'gunicorn', '--workers', str(workers), '--threads', '2',
+                 '--worker-class', 'gthread', '--bind', f'127.0.0.1:{puerto}', '--log-level', 'warning',
+                 'app:app'],
+                cwd=DIRECTORIO, env={k: v for k, v in entorno.items() if k != 'GRABAR_TRAFICO'})
+            url = f'http://127.0.0.1:{puerto}'
+            esperar_puerto(puerto)
+
+        inicio = time.perf_counter()
+        resultados = reproducir(url.rstrip('/'), trazas, velocidad, concurrencia,
+                                credenciales or CREDENCIALES)
+        segundos = time.perf_counter() - inicio
+    finally:
+        if proceso:
+            proceso.terminate()
+            proceso.wait(timeout=10)
+        if copia:
+            os.unlink(copia)
+
+    anterior = None
+    if comparar:
+        with open(comparar, encoding='utf-8') as archivo:
+            anterior = json.load(archivo)
+        print(f"\n📊 Comparado con {(anterior.get('commit') or '?')[:10]} ({anterior.get('fecha', '?')})")
+    resumen = resumir(resultados)
+    imprimir(resumen, anterior)
+    print(f"\n✅ {len(resultados):,} solicitudes reproducidas en {segundos:.0f} s")
+
+    resultado = {
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'commit': commit_actual(),
+        'dia': dia.strftime('%Y-%m-%d'),
+        'velocidad': velocidad,
+        'endpoints': resumen,
+    }
+    if salida:
+        with open(salida, 'w', encoding='utf-8') as archivo:
+            json.dump(resultado, archivo, indent=2, ensure_ascii=False)
+        print(f"💾 Resultados guardados en {salida}")
+    return resultado
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reproduce un día de tráfico grabado")
+    parser.add_argument('--dia', required=True, type=lambda s: datetime.strptime(s, '%Y-%m-%d'))
+    parser.add_argument('--carpeta', default=os.environ.get('TRAFICO_DIR', os.path.join(DIRECTORIO, 'instance', 'trafico')))
+    parser.add_argument('--velocidad', type=float, default=1.0, help='1 = tiempo real, 10 = diez veces más rápido, 0 = sin esperas')
+    parser.add_argument('--concurrencia', type=int, default=16, help='Solicitudes simultáneas como máximo')
+    parser.add_argument('--url', help='Usar una app ya corriendo en lugar de arrancar gunicorn')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--copiar-bd', action='store_true', help='Reproducir sobre una copia temporal de la base SQLite')
+    parser.add_argument('--usuario', action='append', default=[], metavar='ROL=USUARIO:CLAVE')
+    parser.add_argument('--salida', help='Archivo JSON donde guardar los resultados')
+    parser.add_argument('--comparar', help='JSON de la reproducción con otro build')
+    args = parser.parse_args()
+
+    credenciales = dict(CREDENCIALES)
+    for valor in args.usuario:
+        rol, _, cuenta = valor.partition('=')
+        usuario, _, clave = cuenta.partition(':')
+        credenciales[rol] = (usuario, clave)
+    reproducir_trafico(args.dia, args.carpeta, args.velocidad, args.concurrencia, args.url, args.workers,
+                       args.copiar_bd, credenciales, args.salida, args.comparar)
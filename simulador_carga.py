@@ -0,0 +1,327 @@
+"""
+Simulador de hora pico: cuántos meseros, pantallas de cocina, cajeros y
+despachadores aguanta la app antes de que el sondeo se vuelva lento.
+Ejecutar: python simulador_carga.py [--workers 2] [--escalones 1,2,4,8,16] [--duracion 30]
+                                    [--umbral-ms 500] [--url http://host:puerto]
+
+Cada "unidad" de carga son 5 meseros, 1 pantalla de cocina, 1 cajero y 1
+despachador de domicilios, con los mismos intervalos que usan las páginas:
+- mesero:      /notificaciones/pendientes cada 5 s, dashboard cada 30 s,
+               un pedido nuevo cada ~40 s en su mesa
+- cocina:      /api/cocina/verificar_nuevos cada 3 s y avanza pedidos (preparando → listo)
+- cajero:      factura cada ~60 s una de las mesas con cuenta abierta
+- despachador: /api/domicilios/activos cada 10 s
+
+La carga sube por escalones (los actores se suman) y en cada uno se mide el
+p95 del sondeo y la tasa de errores. El punto de saturación es el primer
+escalón con p95 de sondeo sobre --umbral-ms o más de 1% de errores.
+
+Sin --url arranca gunicorn local con --workers sobre DATABASE_URL (llenarla
+antes con `python generar_datos.py`); la simulación agrega pedidos y facturas.
+"""
+
+import argparse
+import json
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+from datetime import datetime
+
+from benchmark_rutas import ClienteHttp, DIRECTORIO, USUARIOS, esperar_puerto, percentil, puerto_libre
+
+MESEROS_POR_UNIDAD = 5
+UMBRAL_ERRORES = 0.01
+
+
+class Registro:
+    """Mediciones (escalón, tipo, duración, ok) compartidas por todos los hilos"""
+
+    def __init__(self):
+        self.candado = threading.Lock()
+        self.filas = []
+        self.escalon = 0
+
+    def medir(self, cliente, tipo, url, metodo='GET', datos=None):
+        inicio = time.perf_counter()
+        estado, cuerpo = cliente.abrir_con_cuerpo(url, metodo, datos, timeout=30)
+        duracion = time.perf_counter() - inicio
+        with self.candado:
+            self.filas.append((self.escalon, tipo, duracion, estado < 400))
+        return estado, cuerpo
+
+
+class Actor(threading.Thread):
+    """Hilo que repite acciones en sus intervalos hasta que se detiene la simulación"""
+
+    usuario = 'admin'
+
+    def __init__(self, base, registro, detener, semilla):
+        super().__init__(daemon=True)
+        self.registro = registro
+        self.detener = detener
+        self.rng = random.Random(semilla)
+        self.cliente = ClienteHttp(base)
+        self.cliente.abrir_con_cuerpo('/', 'POST', {'username': self.usuario, 'password': USUARIOS[self.usuario]})
+
+    def acciones(self):
+        """[(intervalo en segundos, función)]"""
+        return []
+
+    def run(self):
+        # Arranques escalonados: las pantallas no abren todas en el mismo segundo
+        proxima = [(time.monotonic() + self.rng.uniform(0, intervalo), intervalo, accion)
+                   for intervalo, accion in self.acciones()]
+        while not self.detener.is_set():
+            proxima.sort(key=lambda p: p[0])
+            momento, intervalo, accion = proxima[0]
+            if self.detener.wait(max(0, momento - time.monotonic())):
+                break
+            accion()
+            proxima[0] = (momento + intervalo * self.rng.uniform(0.8, 1.2), intervalo, accion)
+
+    def medir(self, tipo, url, metodo='GET', datos=None):
+        return self.registro.medir(self.cliente, tipo, url, metodo, datos)
+
+
+class Mesero(Actor):
+    usuario = 'mesero1'
+
+    def __init__(self, base, registro, detener, semilla, mesa_id, mesas_abiertas, menu):
+        super().__init__(base, registro, detener, semilla)
+        self.mesa_id = mesa_id
+        self.mesas_abiertas = mesas_abiertas
+        self.menu = menu
+        self.desde = datetime.now().isoformat()
+
+    def acciones(self):
+        return [(5, self.sondear), (30, self.dashboard), (40, self.pedir)]
+
+    def sondear(self):
+        estado, cuerpo = self.medir('sondeo', '/notificaciones/pendientes?' +
+                                    urllib.parse.urlencode({'since': self.desde}))
+        if estado == 200 and cuerpo:
+            listos = json.loads(cuerpo)
+            if listos:
+                self.desde = listos[-1]['estado_actualizado'] or self.desde
+
+    def dashboard(self):
+        self.medir('pagina', '/dashboard')
+
+    def pedir(self):
+        for _ in range(self.rng.randint(1, 3)):
+            nombre, precio = self.rng.choice(self.menu)
+            self.medir('escritura', f'/nuevo_pedido/{self.mesa_id}', 'POST',
+                       {'producto': nombre, 'cantidad': self.rng.randint(1, 2), 'precio_unitario': precio})
+        self.medir('pagina', f'/mesa/{self.mesa_id}')
+        self.mesas_abiertas.add(self.mesa_id)
+
+
+class PantallaCocina(Actor):
+    usuario = 'cocina'
+
+    def acciones(self):
+        return [(3, self.sondear)]
+
+    def sondear(self):
+        estado, cuerpo = self.medir('sondeo', '/api/cocina/verificar_nuevos')
+        if estado != 200 or not cuerpo:
+            return
+        pedidos = json.loads(cuerpo)['pedidos']
+        # Avanzar uno o dos pedidos por revisión (el más antiguo primero)
+        for pedido in sorted(pedidos, key=lambda p: p['timestamp'])[:self.rng.randint(0, 2)]:
+            siguiente = 'preparando' if pedido['estado'] == 'pendiente' else 'listo'
+            self.medir('escritura', f"/actualizar_estado/{pedido['id']}/{siguiente}")
+
+
+class Cajero(Actor):
+    def __init__(self, base, registro, detener, semilla, mesas_abiertas):
+        super().__init__(base, registro, detener, semilla)
+        self.mesas_abiertas = mesas_abiertas
+
+    def acciones(self):
+        return [(60, self.facturar)]
+
+    def facturar(self):
+        try:
+            mesa_id = self.mesas_abiertas.pop()
+        except KeyError:
+            return
+        estado, cuerpo = self.medir('pagina', f'/mesa/{mesa_id}')
+        encontrado = re.search(rb'/facturar_sesion/(\d+)', cuerpo or b'')
+        if not encontrado:
+            return
+        sesion_id = int(encontrado.group(1))
+        self.medir('pagina', f'/facturar_sesion/{sesion_id}')
+        self.medir('escritura', f'/facturar_sesion/{sesion_id}', 'POST', {
+            'metodo_pago': self.rng.choice(['efectivo', 'tarjeta', 'transferencia']),
+            'cliente_nombre': 'Cliente General', 'propina': 0, 'estado_pago': 'pagada'
+        })
+
+
+class Despachador(Actor):
+    def acciones(self):
+        return [(10, self.sondear)]
+
+    def sondear(self):
+        self.medir('sondeo', '/api/domicilios/activos')
+
+
+class MesasAbiertas:
+    """Conjunto de mesas con pedidos sin facturar, compartido entre meseros y cajeros"""
+
+    def __init__(self):
+        self.candado = threading.Lock()
+        self.mesas = set()
+
+    def add(self, mesa_id):
+        with self.candado:
+            self.mesas.add(mesa_id)
+
+    def pop(self):
+        with self.candado:
+            return self.mesas.pop()
+
+
+def preparar_mesas(cantidad):
+    """Mesas suficientes para un mesero por mesa y el menú para los pedidos"""
+    from app import app, db, Mesa, ItemMenu
+    with app.app_context():
+        numeros = {n for (n,) in db.session.query(Mesa.numero)}
+        siguiente = max(numeros, default=0) + 1
+        while len(numeros) < cantidad:
+            db.session.add(Mesa(numero=siguiente, capacidad=4))
+            numeros.add(siguiente)
+            siguiente += 1
+        db.session.commit()
+        mesas = [m for (m,) in db.session.query(Mesa.id).order_by(Mesa.numero).limit(cantidad)]
+        menu = [(i.nombre, i.precio) for i in ItemMenu.query.filter_by(disponible=True).limit(50)]
+        return mesas, menu or [('Bandeja paisa', 32000), ('Limonada natural', 6000)]
+
+
+def resumen_escalon(filas):
+    """Cifras por tipo de solicitud de un escalón"""
+    resultado = {}
+    for tipo in ('sondeo', 'pagina', 'escritura'):
+        tiempos = [d for t, d, _ in filas if t == tipo]
+        if not tiempos:
+            continue
+        errores = sum(1 for t, _, ok in filas if t == tipo and not ok)
+        resultado[tipo] = {
+            'solicitudes': len(tiempos),
+            'p50_ms': round(percentil(tiempos, 50) * 1000, 1),
+            'p95_ms': round(percentil(tiempos, 95) * 1000, 1),
+            'p99_ms': round(percentil(tiempos, 99) * 1000, 1),
+            'errores': round(errores / len(tiempos), 4),
+        }
+    return resultado
+
+
+def simular(base, escalones, duracion, umbral_ms, semilla=1):
+    mesas, menu = preparar_mesas(max(escalones) * MESEROS_POR_UNIDAD)
+    registro = Registro()
+    detener = threading.Event()
+    mesas_abiertas = MesasAbiertas()
+    actores = []
+    rng = random.Random(semilla)
+    resultados = []
+    saturacion = None
+
+    print(f"{'unidades':>8}{'actores':>9}{'req/s':>8}{'sondeo p50':>12}{'p95':>9}{'p99':>9}"
+          f"{'escritura p95':>15}{'errores':>9}")
+    try:
+        for numero, unidades in enumerate(escalones, start=1):
+            registro.escalon = numero
+            # Sumar los actores que faltan para este escalón
+            while len([a for a in actores if isinstance(a, Mesero)]) < unidades * MESEROS_POR_UNIDAD:
+                i = len([a for a in actores if isinstance(a, Mesero)])
+                actores.append(Mesero(base, registro, detener, rng.random(), mesas[i], mesas_abiertas, menu))
+            for clase in (PantallaCocina, Despachador):
+                while len([a for a in actores if type(a) is clase]) < unidades:
+                    actores.append(clase(base, registro, detener, rng.random()))
+            while len([a for a in actores if isinstance(a, Cajero)]) < unidades:
+                actores.append(Cajero(base, registro, detener, rng.random(), mesas_abiertas))
+            for actor in actores:
+                if not actor.is_alive():
+                    actor.start()
+
+            time.sleep(duracion)
+            with registro.candado:
+                filas = [(t, d, ok) for e, t, d, ok in registro.filas if e == numero]
+            cifras = resumen_escalon(filas)
+            errores = sum(1 for _, _, ok in filas if not ok) / len(filas) if filas else 0
+            sondeo = cifras.get('sondeo', {})
+            escritura = cifras.get('escritura', {})
+            resultados.append({'unidades': unidades, 'actores': len(actores),
+                               'por_segundo': round(len(filas) / duracion, 1),
+                               'errores': round(errores, 4), 'tipos': cifras})
+            print(f"{unidades:>8}{len(actores):>9}{len(filas) / duracion:>8.1f}"
+                  f"{sondeo.get('p50_ms', 0):>12.1f}{sondeo.get('p95_ms', 0):>9.1f}{sondeo.get('p99_ms', 0):>9.1f}"
+                  f"{escritura.get('p95_ms', 0):>15.1f}{errores:>8.1%}")
+
+            if sondeo.get('p95_ms', 0) > umbral_ms or errores > UMBRAL_ERRORES:
+                saturacion = unidades
+                break
+    finally:
+        detener.set()
+        for actor in actores:
+            actor.join(timeout=35)
+
+    print()
+    sanos = [r for r in resultados if r['unidades'] != saturacion]
+    if saturacion is None:
+        print(f"✅ Sin saturación hasta {escalones[-1]} unidades "
+              f"({escalones[-1] * MESEROS_POR_UNIDAD} meseros); subir --escalones para encontrar el límite")
+    else:
+        print(f"🔴 Saturación en {saturacion} unidades ({saturacion * MESEROS_POR_UNIDAD} meseros, "
+              f"{saturacion} pantallas de cocina, {saturacion} cajeros, {saturacion} despachadores)")
+        if sanos:
+            ultimo = sanos[-1]['unidades']
+            print(f"✅ Último escalón sano: {ultimo} unidades ({ultimo * MESEROS_POR_UNIDAD} meseros)")
+    return {'escalones': resultados, 'saturacion': saturacion, 'umbral_ms': umbral_ms}
+
+
+def simulador_carga(workers=2, escalones=(1, 2, 4, 8, 16), duracion=30, umbral_ms=500, url=None, salida=None):
+    print("\n" + "="*60)
+    print("  SIMULACIÓN DE HORA PICO")
+    print("="*60 + "\n")
+    proceso = None
+    if url is None:
+        puerto = puerto_libre()
+        proceso = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '--workers', str(workers), '--threads', '2',
+             '--worker-class', 'gthread', '--bind', f'127.0.0.1:{puerto}', '--log-level', 'warning', 'app:app'],
+            cwd=DIRECTORIO)
+        url = f'http://127.0.0.1:{puerto}'
+        esperar_puerto(puerto)
+        print(f"🚀 gunicorn con {workers} workers en {url}\n")
+    try:
+        resultado = simular(url.rstrip('/'), list(escalones), duracion, umbral_ms)
+    finally:
+        if proceso:
+            proceso.terminate()
+            proceso.wait(timeout=10)
+
+    resultado.update(fecha=datetime.now().isoformat(timespec='seconds'), workers=workers, duracion=duracion)
+    if salida:
+        with open(salida, 'w', encoding='utf-8') as archivo:
+            json.dump(resultado, archivo, indent=2, ensure_ascii=False)
+        print(f"💾 Resultados guardados en {salida}")
+    return resultado
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulación de carga de hora pico")
+    parser.add_argument('--workers', type=int, default=2, help='Workers de gunicorn (sin --url)')
+    parser.add_argument('--escalones', default='1,2,4,8,16',
+                        help=f'Unidades por escalón (1 unidad = {MESEROS_POR_UNIDAD} meseros + cocina + cajero + despachador)')
+    parser.add_argument('--duracion', type=float, default=30, help='Segundos por escalón')
+    parser.add_argument('--umbral-ms', type=float, default=500, help='p95 de sondeo que se considera saturado')
+    parser.add_argument('--url', help='Usar una app ya corriendo en lugar de arrancar gunicorn')
+    parser.add_argument('--salida', help='Archivo JSON donde guardar los resultados')
+    args = parser.parse_args()
+    simulador_carga(args.workers, [int(e) for e in args.escalones.split(',')], args.duracion,
+                    args.umbral_ms, args.url, args.salida)
@@ -0,0 +1,19 @@
+// Auto-hide alerts after 5 seconds
+document.addEventListener('DOMContentLoaded', function() {
+    const alerts = document.querySelectorAll('.alert');
+    alerts.forEach(alert => {
+        setTimeout(() => {
+            alert.style.opacity = '0';
+            alert.style.transform = 'translateY(-10px)';
+            setTimeout(() => alert.remove(), 300);
+        }, 5000);
+    });
+});
+
+// Refresh automático para actualizar estado de mesas (la plantilla indica cada cuánto en data-autorefresh)
+const autorefresh = parseInt(document.body.dataset.autorefresh || '0', 10);
+if (autorefresh > 0) {
+    setTimeout(function() {
+        location.reload();
+    }, autorefresh);
+}
@@ -0,0 +1,99 @@
+let selectedItem = null;
+let currentQuantity = 1;
+let currentMode = 'menu';
+
+function switchMode(mode) {
+    currentMode = mode;
+
+    // Actualizar botones
+    document.querySelectorAll('.mode-btn').forEach(btn => btn.classList.remove('active'));
+    event.target.classList.add('active');
+
+    // Actualizar vistas
+    document.getElementById('menuView').classList.toggle('active', mode === 'menu');
+    document.getElementById('manualView').classList.toggle('active', mode === 'manual');
+}
+
+function selectItem(nombre, precio, descripcion, element) {
+    // Remover selección anterior
+    document.querySelectorAll('.item-card').forEach(card => card.classList.remove('selected'));
+    element.classList.add('selected');
+
+    // Guardar item seleccionado
+    selectedItem = { nombre, precio, descripcion };
+    currentQuantity = 1;
+
+    // Mostrar info
+    document.getElementById('selectedName').textContent = nombre;
+    document.getElementById('selectedDesc').textContent = descripcion || '';
+    document.getElementById('selectedPrice').textContent = precio.toFixed(2);
+    document.getElementById('selectedInfo').classList.add('show');
+
+    // Mostrar panel de detalles
+    document.getElementById('orderDetails').classList.add('show');
+    document.getElementById('quantityDisplay').textContent = '1';
+
+    // Calcular total
+    updateTotal();
+
+    // Scroll al panel de detalles
+    document.getElementById('orderDetails').scrollIntoView({ behavior: 'smooth', block: 'nearest' });
+}
+
+function changeQuantity(delta) {
+    currentQuantity = Math.max(1, currentQuantity + delta);
+    document.getElementById('quantityDisplay').textContent = currentQuantity;
+    updateTotal();
+}
+
+function updateTotal() {
+    if (selectedItem) {
+        const total = selectedItem.precio * currentQuantity;
+        document.getElementById('totalAmount').textContent = total.toFixed(2);
+    }
+}
+
+// Calcular total en modo manual
+document.getElementById('cantidad_manual')?.addEventListener('input', calcularTotalManual);
+document.getElementById('precio_manual')?.addEventListener('input', calcularTotalManual);
+
+function calcularTotalManual() {
+    const cantidad = parseInt(document.getElementById('cantidad_manual').value) || 0;
+    const precio = parseFloat(document.getElementById('precio_manual').value) || 0;
+    const total = cantidad * precio;
+
+    document.getElementById('totalManual').textContent = total.toFixed(2);
+    document.getElementById('totalPreviewManual').style.display = total > 0 ? 'block' : 'none';
+}
+
+// Enviar formulario
+document.getElementById('orderForm').addEventListener('submit', function(e) {
+    if (currentMode === 'menu') {
+        // Modo menú
+        if (!selectedItem) {
+            e.preventDefault();
+            alert('Por favor selecciona un producto del menú');
+            return;
+        }
+
+        document.getElementById('producto').value = selectedItem.nombre;
+        document.getElementById('cantidad').value = currentQuantity;
+        document.getElementById('precio_unitario').value = selectedItem.precio;
+    } else {
+        // Modo manual
+        const productoManual = document.getElementById('producto_manual').value;
+        const cantidadManual = document.getElementById('cantidad_manual').value;
+        const precioManual = document.getElementById('precio_manual').value;
+
+        if (!productoManual || !cantidadManual || !precioManual) {
+            e.preventDefault();
+            alert('Por favor completa todos los campos obligatorios');
+            return;
+        }
+
+        document.getElementById('producto').value = productoManual;
+        document.getElementById('cantidad').value = cantidadManual;
+        document.getElementById('precio_unitario').value = precioManual;
+        document.getElementById('notas').value = document.getElementById('notas_manual').value;
+    }
+});
@@ -0,0 +1,24 @@
+function abrirModalCuenta(idSesion) {
+    const modal = document.getElementById('modal_' + idSesion);
+    modal.classList.add('show');
+}
+
+function cerrarModal(idSesion) {
+    const modal = document.getElementById('modal_' + idSesion);
+    modal.classList.remove('show');
+}
+
+// Cerrar modal al hacer clic fuera de él
+window.onclick = function(event) {
+    if (event.target.classList.contains('modal')) {
+        event.target.classList.remove('show');
+    }
+}
+
+// Cerrar modal con tecla ESC
+document.addEventListener('keydown', function(event) {
+    if (event.key === 'Escape') {
+        const modals = document.querySelectorAll('.modal.show');
+        modals.forEach(modal => modal.classList.remove('show'));
+    }
+});
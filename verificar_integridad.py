@@ -0,0 +1,244 @@
+"""
+Script para verificar la integridad de los datos con consultas por conjuntos
+(una consulta por chequeo, sin importar cuántas filas haya) y, si se pide,
+repararlos por lotes. Reemplaza a verify_relationships.py.
+Ejecutar: python verificar_integridad.py [--reparar] [--lote 500] [--detalle 20]
+                                         [--solo facturas_sin_origen sesiones_activas_antiguas]
+
+Chequeos:
+- facturas_sin_origen: facturas de mesa cuya sesión no existe y facturas sin
+  sesión que ningún domicilio referencia. Solo se reportan.
+- sesiones_facturadas_dos_veces: más de una factura completa, una completa
+  junto con divisiones o divisiones repetidas. Solo se reportan (hay que
+  eliminar la factura sobrante desde la app para revertir pagos y pedidos).
+- sesiones_activas_antiguas: sesiones abiertas hace más de un día. Se
+  reparan cerrando las que no tienen pedidos.
+- domicilios_descuadrados: subtotal distinto de la suma de sus ítems o total
+  distinto de subtotal + envío + propina. Se recalculan.
+- total_sesion: sesiones cerradas cuyo total no es la suma de sus facturas.
+  Se recalcula.
+Los totales de subtotal/pagado/pendiente contra los pedidos los revisa
+verificar_totales_sesion.py.
+"""
+
+import argparse
+import sys
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+
+from app import app, db, Sesion, Mesa, Pedido, Factura, Domicilio, ItemDomicilio
+
+TOLERANCIA = 0.01
+
+# consulta: select cuya primera columna es el id de la fila con problema
+# detalle: texto de una fila; reparar: función(ids) -> filas corregidas (None = solo se reporta)
+Chequeo = namedtuple('Chequeo', 'nombre descripcion consulta detalle reparar')
+
+
+def facturas_sin_origen():
+    # Anti-join contra los ids facturados (un NOT EXISTS correlacionado recorre domicilio por cada factura)
+    facturadas = db.select(Domicilio.factura_id.label('factura_id')).where(
+        Domicilio.factura_id.isnot(None)).distinct().subquery()
+    return db.select(
+        Factura.id, Factura.numero_consecutivo, Factura.sesion_id, Factura.total
+    ).outerjoin(Sesion, Sesion.id == Factura.sesion_id).outerjoin(
+        facturadas, facturadas.c.factura_id == Factura.id
+    ).where(db.or_(
+        db.and_(Factura.sesion_id.isnot(None), Sesion.id.is_(None)),
+        db.and_(Factura.sesion_id.is_(None), facturadas.c.factura_id.is_(None)),
+    )).order_by(Factura.id)
+
+
+def detalle_factura_sin_origen(fila):
+    _, numero, sesion_id, total = fila
+    origen = f"sesión {sesion_id} inexistente" if sesion_id else "sin sesión ni domicilio"
+    return f"Factura {numero} (${total or 0:,.0f}): {origen}"
+
+
+def sesiones_facturadas_dos_veces():
+    completas = db.func.sum(db.case((Factura.division.is_(None), 1), else_=0))
+    return db.select(
+        Factura.sesion_id, db.func.count(Factura.id), completas
+    ).where(Factura.sesion_id.isnot(None)).group_by(Factura.sesion_id).having(db.or_(
+        completas > 1,
+        db.and_(completas >= 1, db.func.count(Factura.id) > completas),
+        db.func.count(Factura.division) > db.func.count(db.distinct(Factura.division)),
+    )).order_by(Factura.sesion_id)
+
+
+def detalle_sesion_facturada(fila):
+    sesion_id, facturas, completas = fila
+    return f"Sesión {sesion_id}: {facturas} facturas ({completas} completas)"
+
+
+def sesiones_activas_antiguas():
+    pedidos = db.select(db.func.count(Pedido.id)).where(Pedido.sesion_id == Sesion.id).scalar_subquery()
+    return db.select(
+        Sesion.id, Mesa.numero, Sesion.fecha_inicio, pedidos
+    ).join(Mesa, Mesa.id == Sesion.mesa_id).where(
+        Sesion.activa == True,
+        Sesion.fecha_inicio < datetime.now() - timedelta(days=1),
+    ).order_by(Sesion.id)
+
+
+def detalle_sesion_antigua(fila):
+    sesion_id, mesa, inicio, pedidos = fila
+    return f"Sesión {sesion_id} (mesa {mesa}) abierta desde {inicio:%Y-%m-%d %H:%M} con {pedidos} pedidos"
+
+
+def cerrar_sesiones_vacias(ids):
+    """Cierra las sesiones sin pedidos; las que tienen pedidos hay que facturarlas o revisarlas a mano"""
+    resultado = db.session.execute(db.update(Sesion).where(
+        Sesion.id.in_(ids),
+        ~db.exists().where(Pedido.sesion_id == Sesion.id),
+    ).values(activa=False, fecha_fin=datetime.now(), total=0), execution_options={'synchronize_session': False})
+    return resultado.rowcount
+
+
+def _subtotal_items():
+    return db.select(
+        db.func.coalesce(db.func.sum(ItemDomicilio.cantidad * ItemDomicilio.precio_unitario), 0)
+    ).where(ItemDomicilio.domicilio_id == Domicilio.id).scalar_subquery()
+
+
+def domicilios_descuadrados():
+    items = db.select(
+        ItemDomicilio.domicilio_id.label('domicilio_id'),
+        db.func.sum(ItemDomicilio.cantidad * ItemDomicilio.precio_unitario).label('subtotal'),
+    ).group_by(ItemDomicilio.domicilio_id).subquery()
+    subtotal_real = db.func.coalesce(items.c.subtotal, 0)
+    total_real = (subtotal_real + db.func.coalesce(Domicilio.costo_domicilio, 0)
+                  + db.func.coalesce(Domicilio.propina, 0))
+    return db.select(
+        Domicilio.id, Domicilio.subtotal, Domicilio.total, subtotal_real, total_real
+    ).outerjoin(items, items.c.domicilio_id == Domicilio.id).where(db.or_(
+        db.func.abs(db.func.coalesce(Domicilio.subtotal, 0) - subtotal_real) > TOLERANCIA,
+        db.func.abs(db.func.coalesce(Domicilio.total, 0) - total_real) > TOLERANCIA,
+    )).order_by(Domicilio.id)
+
+
+def detalle_domicilio(fila):
+    domicilio_id, subtotal, total, subtotal_real, total_real = fila
+    return (f"Domicilio {domicilio_id}: guardado {subtotal or 0:,.0f}/{total or 0:,.0f} "
+            f"→ real {subtotal_real:,.0f}/{total_real:,.0f}")
+
+
+def recalcular_domicilios(ids):
+    subtotal = _subtotal_items()
+    resultado = db.session.execute(db.update(Domicilio).where(Domicilio.id.in_(ids)).values(
+        subtotal=subtotal,
+        total=subtotal + db.func.coalesce(Domicilio.costo_domicilio, 0) + db.func.coalesce(Domicilio.propina, 0),
+    ), execution_options={'synchronize_session': False})
+    return resultado.rowcount
+
+
+def total_sesion():
+    facturado = db.select(
+        Factura.sesion_id.label('sesion_id'), db.func.sum(Factura.total).label('total')
+    ).where(Factura.sesion_id.isnot(None)).group_by(Factura.sesion_id).subquery()
+    return db.select(
+        Sesion.id, Sesion.total, facturado.c.total
+    ).join(facturado, facturado.c.sesion_id == Sesion.id).where(
+        Sesion.activa == False,
+        db.func.abs(db.func.coalesce(Sesion.total, 0) - facturado.c.total) > TOLERANCIA,
+    ).order_by(Sesion.id)
+
+
+def detalle_total_sesion(fila):
+    sesion_id, total, facturado = fila
+    return f"Sesión {sesion_id}: total {total or 0:,.0f} pero sus facturas suman {facturado:,.0f}"
+
+
+def recalcular_total_sesion(ids):
+    facturado = db.select(db.func.sum(Factura.total)).where(Factura.sesion_id == Sesion.id).scalar_subquery()
+    resultado = db.session.execute(db.update(Sesion).where(Sesion.id.in_(ids)).values(total=facturado),
+                                   execution_options={'synchronize_session': False})
+    return resultado.rowcount
+
+
+CHEQUEOS = [
+    Chequeo('facturas_sin_origen', 'Facturas sin sesión ni domicilio',
+            facturas_sin_origen, detalle_factura_sin_origen, None),
+    Chequeo('sesiones_facturadas_dos_veces', 'Sesiones facturadas más de una vez',
+            sesiones_facturadas_dos_veces, detalle_sesion_facturada, None),
+    Chequeo('sesiones_activas_antiguas', 'Sesiones activas de hace más de un día',
+            sesiones_activas_antiguas, detalle_sesion_antigua, cerrar_sesiones_vacias),
+    Chequeo('domicilios_descuadrados', 'Domicilios cuyo total no cuadra con sus ítems',
+            domicilios_descuadrados, detalle_domicilio, recalcular_domicilios),
+    Chequeo('total_sesion', 'Sesiones cuyo total no es la suma de sus facturas',
+            total_sesion, detalle_total_sesion, recalcular_total_sesion),
+]
+
+
+def ejecutar_chequeo(chequeo, detalle):
+    """Recorre el resultado en streaming: imprime las primeras filas y guarda solo los ids"""
+    ids = []
+    resultado = db.session.execute(chequeo.consulta().execution_options(yield_per=1000))
+    for fila in resultado:
+        ids.append(fila[0])
+        if len(ids) <= detalle:
+            print(f"   ⚠️  {chequeo.detalle(fila)}")
+    if len(ids) > detalle:
+        print(f"   ... y {len(ids) - detalle:,} más")
+    return ids
+
+
+def reparar_por_lotes(chequeo, ids, lote):
+    corregidas = 0
+    for inicio in range(0, len(ids), lote):
+        corregidas += chequeo.reparar(ids[inicio:inicio + lote])
+        db.session.commit()
+    return corregidas
+
+
+def verificar_integridad(reparar=False, lote=500, detalle=20, solo=None):
+    with app.app_context():
+        print("\n" + "="*60)
+        print("  VERIFICACIÓN DE INTEGRIDAD")
+        print("="*60 + "\n")
+
+        consultas = [0]
+
+        def contar(*args):
+            consultas[0] += 1
+
+        event.listen(db.engine, 'before_cursor_execute', contar)
+        pendientes = 0
+        try:
+            for chequeo in CHEQUEOS:
+                if solo and chequeo.nombre not in solo:
+                    continue
+                print(f"🔎 {chequeo.descripcion} ({chequeo.nombre})")
+                ids = ejecutar_chequeo(chequeo, detalle)
+                if not ids:
+                    print("   ✅ Sin problemas\n")
+                    continue
+                print(f"   📊 {len(ids):,} con problemas")
+                if reparar and chequeo.reparar:
+                    corregidas = reparar_por_lotes(chequeo, ids, lote)
+                    print(f"   🔧 {corregidas:,} corregidas")
+                    pendientes += len(ids) - corregidas
+                else:
+                    pendientes += len(ids)
+                    if reparar:
+                        print("   ✋ Se revisa a mano (no se repara automáticamente)")
+                print()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', contar)
+
+        print("="*60)
+        print(f"{'✅' if not pendientes else '⚠️ '} {pendientes:,} problemas pendientes ({consultas[0]} consultas)")
+        print("="*60 + "\n")
+        return pendientes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Verifica la integridad de facturas, sesiones y domicilios")
+    parser.add_argument('--reparar', action='store_true', help='Corregir lo que se puede corregir automáticamente')
+    parser.add_argument('--lote', type=int, default=500, help='Filas por transacción al reparar')
+    parser.add_argument('--detalle', type=int, default=20, help='Filas que se muestran por chequeo')
+    parser.add_argument('--solo', nargs='+', choices=[c.nombre for c in CHEQUEOS], help='Correr solo estos chequeos')
+    args = parser.parse_args()
+    sys.exit(1 if verificar_integridad(args.reparar, args.lote, args.detalle, args.solo) else 0)
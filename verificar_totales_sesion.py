@@ -0,0 +1,62 @@
+"""
+Script para verificar que los totales acumulados de cada sesión
+(subtotal, pagado, pendiente) coincidan con la suma de sus pedidos
+Ejecutar: python verificar_totales_sesion.py [--reparar]
+"""
+
+import sys
+from app import app, db, Sesion, Pedido, recalcular_totales_sesion
+
+TOLERANCIA = 0.01
+
+
+def verificar_totales_sesion(reparar=False):
+    """Compara los totales guardados con una sola consulta agregada sobre pedido"""
+
+    with app.app_context():
+        print("\n" + "="*60)
+        print("  VERIFICACIÓN DE TOTALES DE SESIÓN")
+        print("="*60 + "\n")
+
+        monto = Pedido.cantidad * Pedido.precio_unitario
+        agregados = db.session.query(
+            Pedido.sesion_id.label('sesion_id'),
+            db.func.sum(monto).label('subtotal'),
+            db.func.sum(db.case((Pedido.pagado == True, monto), else_=0)).label('pagado')
+        ).filter(Pedido.sesion_id.isnot(None)).group_by(Pedido.sesion_id).subquery()
+
+        subtotal_real = db.func.coalesce(agregados.c.subtotal, 0)
+        pagado_real = db.func.coalesce(agregados.c.pagado, 0)
+
+        inconsistentes = db.session.query(
+            Sesion.id, Sesion.subtotal, Sesion.pagado, Sesion.pendiente,
+            subtotal_real, pagado_real
+        ).outerjoin(agregados, agregados.c.sesion_id == Sesion.id).filter(
+            db.or_(
+                db.func.abs(db.func.coalesce(Sesion.subtotal, 0) - subtotal_real) > TOLERANCIA,
+                db.func.abs(db.func.coalesce(Sesion.pagado, 0) - pagado_real) > TOLERANCIA,
+                db.func.abs(db.func.coalesce(Sesion.pendiente, 0) - (subtotal_real - pagado_real)) > TOLERANCIA
+            )
+        ).order_by(Sesion.id).all()
+
+        for sesion_id, subtotal, pagado, pendiente, subtotal_ok, pagado_ok in inconsistentes:
+            print(f"⚠️  Sesión {sesion_id}: guardado {subtotal}/{pagado}/{pendiente} "
+                  f"→ real {subtotal_ok}/{pagado_ok}/{subtotal_ok - pagado_ok}")
+
+        print(f"\n📊 Sesiones inconsistentes: {len(inconsistentes)}")
+
+        if inconsistentes and reparar:
+            recalcular_totales_sesion([fila[0] for fila in inconsistentes])
+            db.session.commit()
+            print(f"🔧 {len(inconsistentes)} sesiones recalculadas")
+
+        print("\n" + "="*60)
+        print("✅ Verificación completada")
+        print("="*60 + "\n")
+
+        return len(inconsistentes)
+
+
+if __name__ == "__main__":
+    inconsistentes = verificar_totales_sesion(reparar='--reparar' in sys.argv)
+    sys.exit(1 if inconsistentes and '--reparar' not in sys.argv else 0)